@@ -25,7 +25,6 @@ from builtins import map
 from builtins import object
 import datetime
 import functools
-import glob
 import os
 import re
 import time
@@ -352,12 +351,7 @@ class FrameMonitorTree(cuegui.AbstractTreeWidget.AbstractTreeWidget):
         @param col: Column number single clicked on"""
         del col
         current_log_file = cuegui.Utils.getFrameLogFile(self.__job, item.rpcObject)
-        try:
-            old_log_files = sorted(glob.glob('%s.*' % current_log_file),
-                                   key=lambda l: int(l.split('rqlog.')[-1]),
-                                   reverse=True)
-        except ValueError:
-            old_log_files = []
+        old_log_files = cuegui.Utils.getRotatedLogFiles(current_log_file)
 
         self.app.display_log_file_content.emit([current_log_file] + old_log_files)
         self.app.select_frame.emit(self.__job, item.rpcObject)
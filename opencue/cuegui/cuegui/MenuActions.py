@@ -26,7 +26,6 @@ from builtins import filter
 from builtins import str
 from builtins import object
 import getpass
-import glob
 import subprocess
 import time
 
@@ -1202,10 +1201,9 @@ class FrameActions(AbstractActions):
         if frames:
             job = self._getSource()
             path = cuegui.Utils.getFrameLogFile(job, frames[0])
-            files = dict(
-                (int(j.split(".")[-1]), j) for j in glob.glob("%s.*" % path) if j[-1].isdigit())
+            files = cuegui.Utils.getRotatedLogFiles(path)
             if files:
-                cuegui.Utils.popupView(files[sorted(files.keys())[-1]])
+                cuegui.Utils.popupView(cuegui.Utils.getViewableLogFile(files[0]))
             else:
                 cuegui.Utils.popupView(path)
 
@@ -23,11 +23,15 @@ from __future__ import division
 from builtins import str
 from builtins import map
 import getpass
+import glob
+import gzip
 import os
 import platform
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
 import traceback
 import webbrowser
@@ -481,6 +485,75 @@ def getLastLine(path):
         return ""
 
 
+# Suffixes of the rotated frame logs rqd compressed once the frame completed
+COMPRESSED_LOG_SUFFIXES = (".gz", ".zst")
+
+
+def __parseLogNumber(path):
+    """Returns the attempt number of a rotated log, None for the current log."""
+    name = os.path.basename(path)
+    for suffix in COMPRESSED_LOG_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    number = name.split(".")[-1]
+    return int(number) if number.isdigit() else None
+
+
+def getRotatedLogFiles(path):
+    """Returns the logs of the previous attempts of a frame log, compressed or
+    not, from the most recent to the oldest."""
+    files = {}
+    for rotated in glob.glob("%s.*" % path):
+        number = __parseLogNumber(rotated)
+        # A log being compressed shows up twice, the uncompressed one is complete
+        if number is not None and (number not in files or rotated == "%s.%d" % (path, number)):
+            files[number] = rotated
+    return [files[number] for number in sorted(files, reverse=True)]
+
+
+def findLogFile(path):
+    """Returns the path of a log, or of its compressed version when rqd
+    compressed it. Returns the given path when neither exists."""
+    if not os.path.exists(path):
+        for suffix in COMPRESSED_LOG_SUFFIXES:
+            if os.path.exists(path + suffix):
+                return path + suffix
+    return path
+
+
+def openLogFile(path):
+    """Opens a log for reading in binary mode, decompressing it when rqd
+    compressed it."""
+    path = findLogFile(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        # pylint: disable=import-outside-toplevel
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def readLogFile(path):
+    """Returns the text of a log, compressed or not."""
+    with openLogFile(path) as fp:
+        return fp.read().decode("utf-8", errors="replace")
+
+
+def getViewableLogFile(path):
+    """Returns a path external viewers can open. Compressed logs are decompressed
+    to a temporary file."""
+    path = findLogFile(path)
+    if not path.endswith(COMPRESSED_LOG_SUFFIXES):
+        return path
+    name = os.path.basename(path).rsplit(".", 1)[0]
+    fd, viewable = tempfile.mkstemp(prefix="%s." % name, suffix=".txt")
+    with openLogFile(path) as src, os.fdopen(fd, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    return viewable
+
+
 def popupTail(file, facility=None):
     """Opens an xterm window showing the tail of the given file."""
     if file and not popupWeb(file, facility):
@@ -527,7 +600,7 @@ def popupFrameTail(job, frame, logNumber=0):
     """Opens a tail of a frame log."""
     path = getFrameLogFile(job, frame)
     if logNumber:
-        path += ".%s" % logNumber
+        path = getViewableLogFile("%s.%s" % (path, logNumber))
     popupTail(path, job.data.facility)
 
 
@@ -535,7 +608,7 @@ def popupFrameView(job, frame, logNumber=0):
     """Opens a frame."""
     path = getFrameLogFile(job, frame)
     if logNumber:
-        path += ".%s" % logNumber
+        path = getViewableLogFile("%s.%s" % (path, logNumber))
     popupView(path, job.data.facility)
 
 
@@ -35,6 +35,7 @@ from qtpy import QtWidgets
 
 import cuegui.Constants
 import cuegui.AbstractDockWidget
+import cuegui.Utils
 
 
 PLUGIN_NAME = 'LogView'
@@ -60,22 +61,21 @@ class LogReader(object):
 
     def size(self):
         """Return the size of the file"""
-        return int(os.stat(self.filepath).st_size)
+        return int(os.stat(cuegui.Utils.findLogFile(self.filepath)).st_size)
 
     def getMtime(self):
         """Return modification time of the file"""
-        return os.path.getmtime(self.filepath)
+        return os.path.getmtime(cuegui.Utils.findLogFile(self.filepath))
 
     def exists(self):
-        """Check if the file exists"""
-        return os.path.exists(self.filepath)
+        """Check if the file exists, or its version compressed by rqd"""
+        return os.path.exists(cuegui.Utils.findLogFile(self.filepath))
 
     def read(self):
-        """Read the data from the backend"""
+        """Read the data from the backend, decompressing it if needed"""
         content = None
         if self.exists() is True:
-            with open(self.filepath, "r", encoding='utf-8') as fp:
-                content = fp.read()
+            content = cuegui.Utils.readLogFile(self.filepath)
 
         return content
 
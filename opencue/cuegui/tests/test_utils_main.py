@@ -16,9 +16,11 @@
 """Tests for cuegui.Utils."""
 
 
+import gzip
 import unittest
 
 import mock
+import pyfakefs.fake_filesystem_unittest
 
 import opencue_proto.job_pb2
 import opencue.wrappers.job
@@ -146,5 +148,36 @@ class UtilsViewerTests(unittest.TestCase):
         self.assertEqual('echo /test/something_1 /test/something_2', out)
 
 
+class UtilsLogFileTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.create_file('/logs/frame.rqlog', contents='attempt 4\n')
+        self.fs.create_file('/logs/frame.rqlog.3', contents='attempt 3\n')
+        self.fs.create_file('/logs/frame.rqlog.10', contents='attempt 10\n')
+        with gzip.open('/logs/frame.rqlog.1.gz', 'wb') as fp:
+            fp.write(b'attempt 1\n')
+        with gzip.open('/logs/frame.rqlog.2.gz', 'wb') as fp:
+            fp.write(b'attempt 2\n')
+
+    def test_shouldListCompressedRotatedLogs(self):
+        self.assertEqual(
+            ['/logs/frame.rqlog.10', '/logs/frame.rqlog.3', '/logs/frame.rqlog.2.gz',
+             '/logs/frame.rqlog.1.gz'],
+            cuegui.Utils.getRotatedLogFiles('/logs/frame.rqlog'))
+
+    def test_shouldReadCompressedLog(self):
+        self.assertEqual('attempt 1\n', cuegui.Utils.readLogFile('/logs/frame.rqlog.1'))
+        self.assertEqual('attempt 3\n', cuegui.Utils.readLogFile('/logs/frame.rqlog.3'))
+
+    def test_shouldDecompressLogForViewers(self):
+        self.assertEqual('/logs/frame.rqlog.3',
+                         cuegui.Utils.getViewableLogFile('/logs/frame.rqlog.3'))
+
+        viewable = cuegui.Utils.getViewableLogFile('/logs/frame.rqlog.2')
+
+        with open(viewable, encoding='utf-8') as fp:
+            self.assertEqual('attempt 2\n', fp.read())
+
+
 if __name__ == '__main__':
     unittest.main()
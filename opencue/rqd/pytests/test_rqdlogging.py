@@ -18,10 +18,17 @@
 """Pytests for rqd.rqdlogging"""
 
 
+import gzip
+import http.server
+import json
+import socket
+import threading
+
 import mock
 import pytest
 import opencue_proto.rqd_pb2
-from rqd.rqlogging import LokiLogger
+import rqd.rqconstants
+from rqd.rqlogging import LokiLogger, LokiShipper
 
 @pytest.fixture
 @mock.patch('opencue_proto.rqd_pb2_grpc.RunningFrameStub')
@@ -45,3 +52,130 @@ def test_LokiLogger_invalid_runFrame():
     with pytest.raises(AttributeError) as excinfo:
         LokiLogger("http://localhost:3100", rf)
     assert excinfo.type == AttributeError
+
+
+class _LokiStandIn(object):
+    """Minimal http server recording the push requests sent to it"""
+
+    def __init__(self):
+        self.requests = []
+        standIn = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Accepts loki push requests"""
+            # pylint: disable=invalid-name
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                standIn.requests.append((dict(self.headers), body))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def lines(self):
+        """Returns every line received, in order"""
+        received = []
+        for _, body in self.requests:
+            for stream in json.loads(gzip.decompress(body))["streams"]:
+                received.extend(value[1] for value in stream["values"])
+        return received
+
+    def close(self):
+        """Stops the server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def lokiStandIn():
+    standIn = _LokiStandIn()
+    yield standIn
+    standIn.close()
+
+
+@pytest.fixture
+def lokiSettings(monkeypatch):
+    monkeypatch.setattr(rqd.rqconstants, "LOKI_BATCH_MAX_LINES", 20)
+    monkeypatch.setattr(rqd.rqconstants, "LOKI_BATCH_MAX_WAIT_SEC", 0.05)
+    monkeypatch.setattr(rqd.rqconstants, "LOKI_PUSH_RETRIES", 0)
+    monkeypatch.setattr(rqd.rqconstants, "LOKI_PUSH_TIMEOUT_SEC", 1)
+    monkeypatch.setattr(rqd.rqconstants, "LOKI_ENQUEUE_TIMEOUT_SEC", 0)
+
+
+def _unusedPort():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+# pylint: disable=redefined-outer-name,unused-argument
+def test_LokiLogger_ships_gzip_batches(runFrame, lokiStandIn, lokiSettings):
+    ll = LokiLogger(lokiStandIn.url, runFrame)
+    for i in range(50):
+        ll.write("line %d\n" % i)
+    ll.write("   \n")
+    ll.close()
+
+    assert lokiStandIn.lines() == ["line %d" % i for i in range(50)]
+    # 50 lines with a max of 20 lines per push
+    assert 3 <= len(lokiStandIn.requests) < 50
+    for headers, _ in lokiStandIn.requests:
+        assert headers["Content-Encoding"] == "gzip"
+    stream = json.loads(gzip.decompress(lokiStandIn.requests[0][1]))["streams"][0]
+    assert stream["stream"]["frame_id"] == runFrame.frame_id
+
+
+def test_LokiLogger_spills_when_unreachable(runFrame, lokiSettings, tmp_path):
+    runFrame.log_dir_file = str(tmp_path / "logs" / "job.frame.rqlog")
+    ll = LokiLogger("http://127.0.0.1:%d" % _unusedPort(), runFrame)
+    for i in range(5):
+        ll.write(b"line %d\n" % i)
+    ll.close()
+
+    with open(runFrame.log_dir_file, encoding="utf-8") as spilled:
+        assert spilled.read().splitlines() == ["line %d" % i for i in range(5)]
+    assert ll.stream.spilled == 5
+    assert ll.shipper.getStats()["push_failures"] >= 1
+
+
+def _fillStoppedShipper(monkeypatch, url, policy):
+    monkeypatch.setattr(rqd.rqconstants, "LOKI_QUEUE_MAX_LINES", 3)
+    monkeypatch.setattr(rqd.rqconstants, "LOKI_DROP_POLICY", policy)
+    shipper = LokiShipper(url)
+    stream = shipper.register({"frame_id": "frame"})
+    results = [shipper.enqueue(stream, "line %d" % i) for i in range(5)]
+    return shipper, stream, results
+
+
+def test_LokiShipper_drop_oldest(monkeypatch, lokiStandIn, lokiSettings):
+    shipper, stream, results = _fillStoppedShipper(
+        monkeypatch, lokiStandIn.url, LokiShipper.DROP_OLDEST)
+    assert results == [True] * 5
+    assert shipper.getStats()["dropped"] == 2
+    assert shipper.getStats()["blocked"] == 2
+
+    shipper.start()
+    assert shipper.flush(stream, 5)
+    shipper.stop()
+    assert lokiStandIn.lines() == ["line 2", "line 3", "line 4"]
+    assert shipper.getStats()["sent"] == 3
+
+
+def test_LokiShipper_drop_newest(monkeypatch, lokiStandIn, lokiSettings):
+    shipper, stream, results = _fillStoppedShipper(
+        monkeypatch, lokiStandIn.url, LokiShipper.DROP_NEWEST)
+    assert results == [True, True, True, False, False]
+    assert stream.dropped == 2
+
+    shipper.start()
+    assert shipper.flush(stream, 5)
+    shipper.stop()
+    assert lokiStandIn.lines() == ["line 0", "line 1", "line 2"]
@@ -0,0 +1,195 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Admission control of frame launches on the memory of the host.
+
+The cuebot books frames from the memory it was last told about. By the time a
+frame launches, the running frames may have grown into the memory they reserved
+or the host may already be swapping, and starting one more frame ends up with
+the oom killer taking out several of them. A launch is refused when:
+ - the kernel reports tasks stalled on memory (pressure stall information),
+ - the host pages out faster than RQD_ADMISSION_MAX_SWAPOUT,
+ - the available memory, minus what the running frames reserved but don't use
+   yet, can't fit the reservation of the frame."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import logging
+import threading
+import time
+
+import rqd.rqconstants
+import rqd.rqexceptions
+import rqd.rqmetrics
+
+
+log = logging.getLogger(__name__)
+
+MEMORY_PRESSURE = "memory_pressure"
+SWAPPING = "swapping"
+INSUFFICIENT_MEMORY = "insufficient_memory"
+
+# Seconds a launched frame counts as pending until it shows in the running frames
+PENDING_TIMEOUT_SEC = 60
+# Seconds between two checks of a deferred launch
+DEFER_POLL_SEC = 0.5
+
+
+class MemoryState(object):
+    """Memory of the host when a launch is checked, sizes in kB"""
+
+    def __init__(self, total=0, available=0, outstanding=0, pressureSome=0.0,
+                 pressureFull=0.0, swapoutRate=0.0):
+        self.total = total
+        self.available = available
+        # Memory the running frames reserved and didn't use yet
+        self.outstanding = outstanding
+        # Percent of the last 10 seconds tasks stalled on memory
+        self.pressureSome = pressureSome
+        self.pressureFull = pressureFull
+        self.swapoutRate = swapoutRate
+
+    def __repr__(self):
+        return ("MemoryState(total=%d, available=%d, outstanding=%d, pressureSome=%.2f, "
+                "pressureFull=%.2f, swapoutRate=%.1f)" % (
+                    self.total, self.available, self.outstanding, self.pressureSome,
+                    self.pressureFull, self.swapoutRate))
+
+
+class AdmissionController(object):
+    """Admits or refuses frame launches depending on the memory of the host"""
+
+    def __init__(self, machine):
+        """AdmissionController class initialization
+        @type  machine: rqd.rqmachine.Machine
+        @param machine: Provides the swap out rate of the host"""
+        self.__machine = machine
+        self.__lock = threading.Lock()
+        # Admissions are serialized so concurrent launches see each other's reservations
+        self.__admitLock = threading.Lock()
+        # { <frame_id> : (<reservation in kB>, <time admitted>) }
+        self.__pending = {}
+
+    def readMeminfo(self):
+        """Returns the total and available memory of the host in kB"""
+        meminfo = {}
+        with open(rqd.rqconstants.PATH_MEMINFO, "r", encoding='utf-8') as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) >= 2:
+                    meminfo[fields[0].rstrip(":")] = int(fields[1])
+        total = meminfo.get("MemTotal", 0)
+        if "MemAvailable" in meminfo:
+            return total, meminfo["MemAvailable"]
+        # Kernels older than 3.14
+        return total, meminfo.get("MemFree", 0) + meminfo.get("Cached", 0)
+
+    def readMemoryPressure(self):
+        """Returns the percent of the last 10 seconds some and all tasks stalled on
+        memory, zeros on kernels without pressure stall information"""
+        pressure = {"some": 0.0, "full": 0.0}
+        try:
+            with open(rqd.rqconstants.PATH_PRESSURE.format("memory"), "r",
+                      encoding='utf-8') as fp:
+                for line in fp:
+                    fields = line.split()
+                    if fields and fields[0] in pressure:
+                        values = dict(field.split("=", 1) for field in fields[1:])
+                        pressure[fields[0]] = float(values.get("avg10", 0))
+        except (OSError, IOError, ValueError):
+            pass
+        return pressure["some"], pressure["full"]
+
+    def readState(self, frames):
+        """Reads the memory state of the host
+        @type  frames: dict
+        @param frames: { <frame_id> : RunningFrame }
+        @rtype:  MemoryState"""
+        total, available = self.readMeminfo()
+        pressureSome, pressureFull = self.readMemoryPressure()
+        outstanding = 0
+        for frame in frames.values():
+            outstanding += max(frame.runFrame.soft_memory_limit - frame.rss, 0)
+        now = time.time()
+        with self.__lock:
+            for frameId, (reservation, admitted) in list(self.__pending.items()):
+                if frameId in frames or now - admitted > PENDING_TIMEOUT_SEC:
+                    del self.__pending[frameId]
+                else:
+                    outstanding += reservation
+        return MemoryState(total=total, available=available, outstanding=outstanding,
+                           pressureSome=pressureSome, pressureFull=pressureFull,
+                           swapoutRate=self.__machine.getSwapoutRate())
+
+    @staticmethod
+    def check(runFrame, state):
+        """Raises if the frame can't be launched in the given memory state
+        @type  runFrame: RunFrame
+        @param runFrame: rqd_pb2.RunFrame
+        @type  state: MemoryState
+        @param state: Memory of the host
+        @raise InsufficientMemoryException: With the reason of the refusal"""
+        maxPressure = rqd.rqconstants.RQD_ADMISSION_MAX_MEMORY_PRESSURE
+        if maxPressure and state.pressureFull >= maxPressure:
+            raise rqd.rqexceptions.InsufficientMemoryException(
+                "Not launching, tasks stalled on memory %.1f%% of the last 10s" %
+                state.pressureFull, MEMORY_PRESSURE)
+
+        maxSwapout = rqd.rqconstants.RQD_ADMISSION_MAX_SWAPOUT
+        if maxSwapout and state.swapoutRate >= maxSwapout:
+            raise rqd.rqexceptions.InsufficientMemoryException(
+                "Not launching, the host is swapping out at %.1f" % state.swapoutRate,
+                SWAPPING)
+
+        free = state.available - state.outstanding - rqd.rqconstants.RQD_ADMISSION_MIN_FREE_KB
+        if free < runFrame.soft_memory_limit:
+            raise rqd.rqexceptions.InsufficientMemoryException(
+                "Not launching, %dkB of memory is free after the reservations of the "
+                "running frames, the frame reserved %dkB" % (
+                    max(free, 0), runFrame.soft_memory_limit), INSUFFICIENT_MEMORY)
+
+    def admit(self, runFrame, getFrames):
+        """Checks a launch, waiting up to RQD_ADMISSION_DEFER_SEC for the memory of
+        the host to recover. The reservation of an admitted frame counts against
+        the next launches until the frame runs.
+        @type  runFrame: RunFrame
+        @param runFrame: rqd_pb2.RunFrame
+        @type  getFrames: callable
+        @param getFrames: Returns { <frame_id> : RunningFrame }
+        @raise InsufficientMemoryException: With the reason of the refusal"""
+        deadline = time.time() + rqd.rqconstants.RQD_ADMISSION_DEFER_SEC
+        while True:
+            try:
+                with self.__admitLock:
+                    state = self.readState(getFrames())
+                    self.check(runFrame, state)
+                    with self.__lock:
+                        self.__pending[runFrame.frame_id] = (
+                            runFrame.soft_memory_limit, time.time())
+                return
+            except rqd.rqexceptions.InsufficientMemoryException as e:
+                if time.time() + DEFER_POLL_SEC > deadline:
+                    rqd.rqmetrics.ADMISSION_REJECTIONS.inc(reason=e.reason)
+                    log.warning("%s (frame %s, %r)", e, runFrame.frame_id, state)
+                    raise
+            time.sleep(DEFER_POLL_SEC)
+
+    def release(self, frameId):
+        """Stops counting the reservation of a frame that won't launch"""
+        with self.__lock:
+            self.__pending.pop(frameId, None)
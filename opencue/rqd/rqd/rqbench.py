@@ -0,0 +1,573 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Load test of RQD against a stand-in cuebot.
+
+Runs RQD in a subprocess reporting to a cuebot stand-in served from this process,
+fires bursts of LaunchFrame calls with synthetic frames and reports:
+ - the launch latency, from the LaunchFrame call to the start of the frame command,
+ - the reporting lag, from the exit of the frame command to its completion report,
+ - the cpu and the rss of the RQD process, without its frames,
+ - the throughput of the frame logs.
+
+The frames are python commands printing the time they start and exit, so it
+only needs a Linux host with /usr/bin/time, no cuebot and no render software:
+
+  python -m rqd.rqbench --frames 40 --burst 8 --workloads sleep,cpu,memory,logspam
+"""
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+from concurrent import futures
+import getpass
+import json
+import logging
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import grpc
+import psutil
+
+import opencue_proto.report_pb2
+import opencue_proto.report_pb2_grpc
+import opencue_proto.rqd_pb2
+import opencue_proto.rqd_pb2_grpc
+
+
+log = logging.getLogger(__name__)
+
+START_MARKER = "RQBENCH_START"
+EXIT_MARKER = "RQBENCH_EXIT"
+
+# Bodies of the synthetic frames, formatted with the seconds they run for and the
+# megabytes of memory they ramp up to
+WORKLOADS = {
+    "sleep": "time.sleep({seconds})",
+    "cpu": (
+        "end = time.time() + {seconds}\n"
+        "while time.time() < end:\n"
+        "    pass"),
+    "memory": (
+        "chunks = []\n"
+        "for _ in range(10):\n"
+        "    chunks.append(bytearray({megabytes} * 1024 * 1024 // 10))\n"
+        "    time.sleep({seconds} / 10)"),
+    "logspam": (
+        "line = 'x' * 199\n"
+        "end = time.time() + {seconds}\n"
+        "while time.time() < end:\n"
+        "    for _ in range(100):\n"
+        "        print(line)"),
+}
+
+# Seconds to wait for RQD to report its startup
+STARTUP_TIMEOUT_SEC = 60
+# Seconds between two samples of the RQD process
+SAMPLE_INTERVAL_SEC = 0.2
+
+
+def makeCommand(workload, seconds, megabytes):
+    """Returns the shell command of a synthetic frame
+    @type  workload: str
+    @param workload: One of WORKLOADS
+    @type  seconds: float
+    @param seconds: Time the frame runs for
+    @type  megabytes: int
+    @param megabytes: Memory the memory workload ramps up to
+    @rtype:  str"""
+    script = "\n".join([
+        "import sys, time",
+        "print('%s %%f' %% time.time(), flush=True)" % START_MARKER,
+        WORKLOADS[workload].format(seconds=seconds, megabytes=megabytes),
+        "print('%s %%f' %% time.time(), flush=True)" % EXIT_MARKER,
+    ])
+    return "%s -c %s" % (shlex.quote(sys.executable), shlex.quote(script))
+
+
+def getFreePort():
+    """Returns a local tcp port nothing listens on"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, ratio):
+    """Returns the value under which the given ratio of the values are, None when
+    there are no values"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(ratio * len(values)), len(values) - 1)]
+
+
+class ReportRecorder(opencue_proto.report_pb2_grpc.RqdReportInterfaceServicer):
+    """Cuebot stand-in recording the reports of RQD with the time they came in"""
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.startups = []
+        self.statuses = []
+        # { <frame_id> : (<time received>, FrameCompleteReport) }
+        self.completions = {}
+
+    def ReportRqdStartup(self, request, context):
+        with self.__condition:
+            self.startups.append((time.time(), request.boot_report))
+            self.__condition.notify_all()
+        return opencue_proto.report_pb2.RqdReportRqdStartupResponse()
+
+    def ReportStatus(self, request, context):
+        with self.__condition:
+            self.statuses.append((time.time(), request.host_report))
+        return opencue_proto.report_pb2.RqdReportStatusResponse()
+
+    def ReportRunningFrameCompletion(self, request, context):
+        with self.__condition:
+            self.completions[request.frame_complete_report.frame.frame_id] = (
+                time.time(), request.frame_complete_report)
+            self.__condition.notify_all()
+        return opencue_proto.report_pb2.RqdReportRunningFrameCompletionResponse()
+
+    def waitForStartup(self, timeout):
+        """Waits for RQD to report its startup
+        @rtype:  bool
+        @return: Whether RQD reported its startup in time"""
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.startups, timeout)
+
+    def waitForCompletions(self, frameIds, timeout):
+        """Waits for the completion reports of frames
+        @rtype:  bool
+        @return: Whether all the frames reported their completion in time"""
+        with self.__condition:
+            return self.__condition.wait_for(
+                lambda: all(frameId in self.completions for frameId in frameIds), timeout)
+
+
+class StandInCuebot(object):
+    """Serves a ReportRecorder on a local port"""
+
+    def __init__(self):
+        self.recorder = ReportRecorder()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        opencue_proto.report_pb2_grpc.add_RqdReportInterfaceServicer_to_server(
+            self.recorder, self.server)
+        self.port = self.server.add_insecure_port("127.0.0.1:0")
+
+    def start(self):
+        """Starts serving the reports"""
+        self.server.start()
+
+    def stop(self):
+        """Stops serving the reports"""
+        self.server.stop(0).wait()
+
+
+class RqdProcess(object):
+    """RQD running in a subprocess, configured to report to the stand-in cuebot"""
+
+    def __init__(self, workDir, cuebotPort, cores, overrides=None):
+        """RqdProcess class initialization
+        @type  workDir: str
+        @param workDir: Directory of the config file and of the output of RQD
+        @type  cuebotPort: int
+        @param cuebotPort: Port of the stand-in cuebot
+        @type  cores: int
+        @param cores: Cores RQD books frames on
+        @type  overrides: dict
+        @param overrides: Additional options of the Override section"""
+        self.workDir = workDir
+        self.port = getFreePort()
+        self.configFile = os.path.join(workDir, "rqd.conf")
+        self.outputFile = os.path.join(workDir, "rqd.out")
+        self.process = None
+        options = {
+            "OVERRIDE_CUEBOT": "127.0.0.1",
+            "CUEBOT_GRPC_PORT": cuebotPort,
+            "RQD_GRPC_PORT": self.port,
+            "OVERRIDE_CORES": cores,
+            "OVERRIDE_NIMBY": False,
+            "RQD_BECOME_JOB_USER": False,
+        }
+        options.update(overrides or {})
+        with open(self.configFile, "w", encoding='utf-8') as fp:
+            fp.write("[Override]\n")
+            for key, value in options.items():
+                fp.write("%s = %s\n" % (key, value))
+
+    def start(self):
+        """Starts RQD from the same sources as this module"""
+        env = dict(os.environ)
+        sourceDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in (sourceDir, env.get("PYTHONPATH")) if path)
+        with open(self.outputFile, "wb") as output:
+            # pylint: disable=consider-using-with
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "rqd", "-c", self.configFile, "--nimbyoff"],
+                stdout=output, stderr=subprocess.STDOUT, cwd=self.workDir, env=env)
+
+    def stop(self):
+        """Stops RQD, killing it when it doesn't exit in time"""
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def isRunning(self):
+        """Returns whether the RQD process is running"""
+        return self.process is not None and self.process.poll() is None
+
+    def getStub(self):
+        """Returns a stub of the RqdInterface of the process"""
+        channel = grpc.insecure_channel("127.0.0.1:%d" % self.port)
+        return opencue_proto.rqd_pb2_grpc.RqdInterfaceStub(channel)
+
+
+class ProcessSampler(threading.Thread):
+    """Samples the cpu time and the rss of a process, its children excluded"""
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL_SEC):
+        threading.Thread.__init__(self, name="RqdBenchSampler")
+        self.daemon = True
+        self.__process = psutil.Process(pid)
+        self.__interval = interval
+        self.__stop = threading.Event()
+        self.startTime = None
+        self.startCpu = None
+        self.endTime = None
+        self.endCpu = None
+        self.rssSamples = []
+
+    def readCpu(self):
+        """Returns the cpu seconds the process spent itself"""
+        times = self.__process.cpu_times()
+        return times.user + times.system
+
+    def run(self):
+        self.startTime = time.time()
+        self.startCpu = self.endCpu = self.readCpu()
+        while not self.__stop.is_set():
+            try:
+                self.rssSamples.append(self.__process.memory_info().rss // 1024)
+                self.endCpu = self.readCpu()
+            except psutil.Error:
+                break
+            self.endTime = time.time()
+            self.__stop.wait(self.__interval)
+
+    def stop(self):
+        """Stops sampling"""
+        self.__stop.set()
+        self.join()
+
+    def getCpuRatio(self):
+        """Returns the share of one core the process used while sampled"""
+        if not self.endTime or self.endTime <= self.startTime:
+            return 0.0
+        return (self.endCpu - self.startCpu) / (self.endTime - self.startTime)
+
+
+class FrameResult(object):
+    """Timings of a synthetic frame"""
+
+    def __init__(self, frameId, workload):
+        self.frameId = frameId
+        self.workload = workload
+        self.sendTime = None
+        self.callSeconds = None
+        self.error = None
+        self.startTime = None
+        self.exitTime = None
+        self.completionTime = None
+        self.exitStatus = None
+        self.logBytes = 0
+        self.logFile = None
+
+    def getLaunchLatency(self):
+        """Returns the seconds from the LaunchFrame call to the start of the command"""
+        if self.startTime is None:
+            return None
+        return self.startTime - self.sendTime
+
+    def getReportLag(self):
+        """Returns the seconds from the exit of the command to its completion report"""
+        if self.exitTime is None or self.completionTime is None:
+            return None
+        return self.completionTime - self.exitTime
+
+    def readLog(self):
+        """Reads the start and the exit of the command from the frame log"""
+        try:
+            self.logBytes = os.path.getsize(self.logFile)
+            with open(self.logFile, "r", encoding='utf-8', errors='replace') as fp:
+                for line in fp:
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[-2] == START_MARKER:
+                        self.startTime = float(fields[-1])
+                    elif len(fields) >= 2 and fields[-2] == EXIT_MARKER:
+                        self.exitTime = float(fields[-1])
+        except (OSError, IOError, ValueError) as e:
+            log.warning("Failed to read the log of %s: %s", self.frameId, e)
+
+
+class Benchmark(object):
+    """Launches bursts of synthetic frames on RQD and measures how it copes"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, frames=20, burst=5, workloads=("sleep",), seconds=2.0, megabytes=64,
+                 timeout=120, workDir=None, overrides=None):
+        """Benchmark class initialization
+        @type  frames: int
+        @param frames: Number of frames to launch
+        @type  burst: int
+        @param burst: Number of frames launched at once, RQD gets as many cores
+        @type  workloads: sequence
+        @param workloads: WORKLOADS the frames cycle through
+        @type  seconds: float
+        @param seconds: Time each frame runs for
+        @type  megabytes: int
+        @param megabytes: Memory the memory frames ramp up to
+        @type  timeout: float
+        @param timeout: Seconds to wait for the frames of a burst to complete
+        @type  workDir: str
+        @param workDir: Directory of RQD and of the frame logs, a temporary one
+                        removed at the end when None
+        @type  overrides: dict
+        @param overrides: Additional options of the Override section of RQD"""
+        for workload in workloads:
+            if workload not in WORKLOADS:
+                raise ValueError("Unknown workload %s, pick from %s" % (
+                    workload, ", ".join(sorted(WORKLOADS))))
+        self.frames = frames
+        self.burst = max(burst, 1)
+        self.workloads = list(workloads)
+        self.seconds = seconds
+        self.megabytes = megabytes
+        self.timeout = timeout
+        self.workDir = workDir
+        self.overrides = overrides
+        self.results = []
+
+    def run(self):
+        """Runs the benchmark
+        @rtype:  dict
+        @return: The report, see makeReport"""
+        workDir = self.workDir or tempfile.mkdtemp(prefix="rqbench-")
+        logDir = os.path.join(workDir, "logs")
+        os.makedirs(logDir, exist_ok=True)
+        cuebot = StandInCuebot()
+        cuebot.start()
+        rqdProcess = RqdProcess(workDir, cuebot.port, self.burst, self.overrides)
+        sampler = None
+        try:
+            startTime = time.time()
+            rqdProcess.start()
+            if not cuebot.recorder.waitForStartup(STARTUP_TIMEOUT_SEC):
+                raise RuntimeError("RQD didn't report its startup, see %s" %
+                                   rqdProcess.outputFile)
+            startupSeconds = time.time() - startTime
+            sampler = ProcessSampler(rqdProcess.process.pid)
+            sampler.start()
+
+            stub = rqdProcess.getStub()
+            with futures.ThreadPoolExecutor(max_workers=self.burst) as executor:
+                for first in range(0, self.frames, self.burst):
+                    burst = [self.__makeFrame(index, logDir)
+                             for index in range(first, min(first + self.burst, self.frames))]
+                    list(executor.map(lambda frame: self.__launch(stub, *frame), burst))
+                    launched = [result.frameId for _, result in burst if result.error is None]
+                    if not cuebot.recorder.waitForCompletions(launched, self.timeout):
+                        log.warning("Frames of the burst starting at %d didn't complete in "
+                                    "%ds", first, self.timeout)
+            sampler.stop()
+        finally:
+            if sampler is not None and sampler.is_alive():
+                sampler.stop()
+            rqdProcess.stop()
+            cuebot.stop()
+
+        for result in self.results:
+            completion = cuebot.recorder.completions.get(result.frameId)
+            if completion is not None:
+                result.completionTime = completion[0]
+                result.exitStatus = completion[1].exit_status
+            result.readLog()
+        report = self.makeReport(sampler, startupSeconds, cuebot.recorder)
+        if self.workDir is None:
+            shutil.rmtree(workDir, ignore_errors=True)
+        return report
+
+    def __makeFrame(self, index, logDir):
+        """Returns the RunFrame and the FrameResult of the index-th frame"""
+        workload = self.workloads[index % len(self.workloads)]
+        runFrame = opencue_proto.rqd_pb2.RunFrame(
+            resource_id="rqbench-resource-%04d" % index,
+            job_id="rqbench-job",
+            job_name="rqbench",
+            frame_id="rqbench-frame-%04d" % index,
+            frame_name="%04d-%s" % (index, workload),
+            layer_id="rqbench-layer",
+            command=makeCommand(workload, self.seconds, self.megabytes),
+            user_name=getpass.getuser(),
+            log_dir=logDir,
+            show="rqbench",
+            shot="rqbench",
+            num_cores=100,
+            ignore_nimby=True)
+        result = FrameResult(runFrame.frame_id, workload)
+        result.logFile = os.path.join(
+            logDir, "%s.%s.rqlog" % (runFrame.job_name, runFrame.frame_name))
+        self.results.append(result)
+        return runFrame, result
+
+    @staticmethod
+    def __launch(stub, runFrame, result):
+        """Sends a LaunchFrame call, recording its duration or its error"""
+        result.sendTime = time.time()
+        try:
+            stub.LaunchFrame(
+                opencue_proto.rqd_pb2.RqdStaticLaunchFrameRequest(run_frame=runFrame),
+                timeout=30)
+        except grpc.RpcError as e:
+            # pylint: disable=no-member
+            result.error = "%s: %s" % (e.code().name, e.details())
+        result.callSeconds = time.time() - result.sendTime
+
+    def makeReport(self, sampler, startupSeconds, recorder):
+        """Summarizes the results of the frames and the samples of the RQD process
+        @rtype:  dict"""
+        def summarize(values):
+            values = [value for value in values if value is not None]
+            return {
+                "count": len(values),
+                "mean": sum(values) / len(values) if values else None,
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "max": max(values) if values else None,
+            }
+
+        ran = [result for result in self.results if result.startTime and result.exitTime]
+        logBytes = sum(result.logBytes for result in ran)
+        # Bytes written to the frame logs per second while frames were running
+        logSeconds = (max(result.exitTime for result in ran) -
+                      min(result.startTime for result in ran)) if ran else 0
+        rssSamples = sampler.rssSamples if sampler else []
+        return {
+            "frames": len(self.results),
+            "burst": self.burst,
+            "workloads": self.workloads,
+            "launch_errors": sorted(set(
+                result.error for result in self.results if result.error)),
+            "failed_launches": len([result for result in self.results if result.error]),
+            "completed": len([result for result in self.results
+                              if result.completionTime is not None]),
+            "nonzero_exits": len([result for result in self.results
+                                  if result.exitStatus not in (None, 0)]),
+            "startup_sec": startupSeconds,
+            "launch_call_sec": summarize(result.callSeconds for result in self.results),
+            "launch_latency_sec": summarize(
+                result.getLaunchLatency() for result in self.results),
+            "report_lag_sec": summarize(result.getReportLag() for result in self.results),
+            "status_reports": len(recorder.statuses),
+            "rqd_cpu_ratio": sampler.getCpuRatio() if sampler else None,
+            "rqd_rss_kb": {
+                "mean": sum(rssSamples) // len(rssSamples) if rssSamples else None,
+                "max": max(rssSamples) if rssSamples else None,
+            },
+            "log_bytes": logBytes,
+            "log_bytes_per_sec": logBytes / logSeconds if logSeconds else None,
+        }
+
+
+def formatReport(report):
+    """Returns the report as text"""
+    def seconds(summary):
+        if not summary["count"]:
+            return "n/a"
+        return "mean %.3fs  p50 %.3fs  p95 %.3fs  max %.3fs  (%d)" % (
+            summary["mean"], summary["p50"], summary["p95"], summary["max"], summary["count"])
+
+    lines = [
+        "frames            %d in bursts of %d (%s)" % (
+            report["frames"], report["burst"], ", ".join(report["workloads"])),
+        "completed         %d, %d failed launches, %d non zero exits" % (
+            report["completed"], report["failed_launches"], report["nonzero_exits"]),
+        "rqd startup       %.2fs" % report["startup_sec"],
+        "LaunchFrame call  %s" % seconds(report["launch_call_sec"]),
+        "launch latency    %s" % seconds(report["launch_latency_sec"]),
+        "reporting lag     %s" % seconds(report["report_lag_sec"]),
+        "status reports    %d" % report["status_reports"],
+        "rqd cpu           %.1f%% of a core" % (100 * (report["rqd_cpu_ratio"] or 0)),
+        "rqd rss           mean %s kB  max %s kB" % (
+            report["rqd_rss_kb"]["mean"], report["rqd_rss_kb"]["max"]),
+        "frame logs        %d bytes, %s" % (
+            report["log_bytes"],
+            "%.1f kB/s" % (report["log_bytes_per_sec"] / 1024)
+            if report["log_bytes_per_sec"] else "n/a"),
+    ]
+    for error in report["launch_errors"]:
+        lines.append("launch error      %s" % error)
+    return "\n".join(lines)
+
+
+def main():
+    """Entrypoint of the benchmark"""
+    parser = argparse.ArgumentParser(
+        description="Load test of RQD against a stand-in cuebot")
+    parser.add_argument("--frames", type=int, default=20, help="Frames to launch")
+    parser.add_argument("--burst", type=int, default=5, help="Frames launched at once")
+    parser.add_argument("--workloads", default="sleep,cpu,memory,logspam",
+                        help="Comma separated workloads of the frames, among %s" %
+                        ", ".join(sorted(WORKLOADS)))
+    parser.add_argument("--seconds", type=float, default=2.0, help="Run time of each frame")
+    parser.add_argument("--megabytes", type=int, default=64,
+                        help="Memory the memory frames ramp up to")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="Seconds to wait for the frames of a burst")
+    parser.add_argument("--work-dir", help="Keeps the output of RQD and the frame logs there")
+    parser.add_argument("--set", action="append", default=[], metavar="OPTION=VALUE",
+                        help="Override option of RQD, can be repeated")
+    parser.add_argument("--json", action="store_true", help="Prints the report as json")
+    args = parser.parse_args()
+
+    benchmark = Benchmark(
+        frames=args.frames, burst=args.burst,
+        workloads=[workload.strip() for workload in args.workloads.split(",") if workload],
+        seconds=args.seconds, megabytes=args.megabytes, timeout=args.timeout,
+        workDir=args.work_dir,
+        overrides=dict(option.split("=", 1) for option in args.set))
+    report = benchmark.run()
+    print(json.dumps(report, indent=2) if args.json else formatReport(report))
+    return 1 if report["failed_launches"] or report["completed"] < report["frames"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
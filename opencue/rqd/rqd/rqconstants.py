@@ -41,6 +41,10 @@ else:
     CUEBOT_HOSTNAME = 'localhost'
 
 RQD_TIMEOUT = 10000
+# A cuebot that failed is skipped for CUEBOT_FAILOVER_RETRY_MIN_SEC, doubling on each
+# failure up to CUEBOT_FAILOVER_RETRY_MAX_SEC, while reports fail over to the others
+CUEBOT_FAILOVER_RETRY_MIN_SEC = 5
+CUEBOT_FAILOVER_RETRY_MAX_SEC = 300
 DEFAULT_FACILITY = 'cloud'
 
 # GRPC VALUES
@@ -49,12 +53,53 @@ RQD_GRPC_PORT = 8444
 RQD_GRPC_SLEEP_SEC = 60 * 60 * 24
 RQD_GRPC_CONNECTION_ATTEMPT_SLEEP_SEC = 15
 RQD_GRPC_RETRY_CONNECTION = True
+# Serves the rqd interface on grpc.aio. Calls reading the state of rqd are answered
+# on the event loop, the others run on RQD_GRPC_MAX_WORKERS threads with at most
+# RQD_GRPC_METHOD_CONCURRENCY calls of a method at once. RQD_GRPC_METHOD_LIMITS sets
+# the limits of single methods, ex: "ReportStatus:2 KillRunningFrame:8". LaunchFrame
+# runs on its own RQD_GRPC_LAUNCH_WORKERS threads so the other calls can't starve it
+RQD_GRPC_ASYNC = False
+RQD_GRPC_METHOD_CONCURRENCY = 4
+RQD_GRPC_METHOD_LIMITS = {}
+RQD_GRPC_LAUNCH_WORKERS = 4
 CUEBOT_GRPC_PORT = 8443
+# Probes the gpus and pulls the docker images while the gRPC server comes up, instead
+# of before it
+RQD_DEFER_PROBES = True
+# Port of the prometheus metrics endpoint, None disables it
+RQD_METRICS_PORT = None
+RQD_METRICS_ADDRESS = "0.0.0.0"
+# Running frames exposed with their own labels, the others are summed up
+RQD_METRICS_MAX_FRAMES = 64
+# Number of recent frame launches summarized in host reports
+RQD_LAUNCH_TRACE_WINDOW = 200
 
 # RQD behavior:
 RSS_UPDATE_INTERVAL = 10
+# Frames growing fast or close to their memory limit are sampled on their own in
+# between the rss updates, down to this interval
+RSS_SAMPLE_MIN_INTERVAL_SEC = 1
+# Samples taken at least before a frame reaches its memory limit at its current growth
+RSS_SAMPLE_SAFETY = 4
+# Frames with less headroom than this share of their rss get the shortest interval
+RSS_SAMPLE_HEADROOM_RATIO = 0.1
+# Share of one core the rss updates and samples may use, 0 disables the samples
+RSS_SAMPLE_CPU_BUDGET = 0.01
 RQD_MIN_PING_INTERVAL_SEC = 5
 RQD_MAX_PING_INTERVAL_SEC = 30
+# How often nimby is started again when it failed to start
+RQD_NIMBY_RETRY_INTERVAL_SEC = 90
+# Refuse frame launches when the host is short on memory, see rqd.rqadmission
+RQD_ADMISSION_CONTROL = False
+# Percent of the last 10 seconds all tasks stalled on memory above which launches are refused
+RQD_ADMISSION_MAX_MEMORY_PRESSURE = 10.0
+# Page out rate, in the unit of the swapout host attribute, above which launches are
+# refused. 0 disables the check: the rate includes the writeback of files.
+RQD_ADMISSION_MAX_SWAPOUT = 0
+# Memory kept free for the system on top of the frame reservations, in kB
+RQD_ADMISSION_MIN_FREE_KB = 524288
+# Seconds a launch waits for the memory of the host to recover before being refused
+RQD_ADMISSION_DEFER_SEC = 0
 MAX_LOG_FILES = 15
 CORE_VALUE = 100
 LAUNCH_FRAME_USER_GID = 20
@@ -92,6 +137,26 @@ SENTRY_DSN_PATH = None
 RQD_TAGS = ''
 RQD_PREPEND_TIMESTAMP = False
 
+# Loki log shipping. Frame output is queued and pushed to Loki by a background
+# thread in gzip-compressed batches instead of one request per line.
+# A stream is flushed when it reaches LOKI_BATCH_MAX_LINES lines,
+# LOKI_BATCH_MAX_BYTES bytes or has been waiting for LOKI_BATCH_MAX_WAIT_SEC.
+LOKI_BATCH_MAX_LINES = 1000
+LOKI_BATCH_MAX_BYTES = 1024 * 1024
+LOKI_BATCH_MAX_WAIT_SEC = 1.0
+# Maximum number of lines waiting to be shipped. Writers block for up to
+# LOKI_ENQUEUE_TIMEOUT_SEC when the queue is full before LOKI_DROP_POLICY
+# is applied ("drop_oldest" or "drop_newest").
+LOKI_QUEUE_MAX_LINES = 20000
+LOKI_ENQUEUE_TIMEOUT_SEC = 0.1
+LOKI_DROP_POLICY = "drop_oldest"
+# Push requests are retried LOKI_PUSH_RETRIES times before the batch is spilled
+# to the frame's local log file.
+LOKI_PUSH_TIMEOUT_SEC = 5
+LOKI_PUSH_RETRIES = 2
+# Time a frame waits on completion for its pending lines to be shipped.
+LOKI_CLOSE_TIMEOUT_SEC = 10
+
 KILL_SIGNAL = 9
 if platform.system() == 'Linux':
     RQD_UID = pwd.getpwnam("daemon")[2]
@@ -111,6 +176,16 @@ CHECK_INTERVAL_LOCKED = 60
 # Seconds of idle time required before nimby unlocks the host for rendering.
 # Machines lock immediately on first user interaction, then unlock after this idle period.
 MINIMUM_IDLE = 900
+# How nimby detects user activity:
+#  - pynput: listens to every mouse and keyboard event
+#  - x11: polls the idle time of the X server (XScreenSaverQueryInfo, needs libXss)
+#  - logind: polls the IdleHint systemd-logind aggregates from the sessions
+#  - devinput: reads and drains the evdev events of /dev/input/event*, the
+#    timestamp of the latest event is the last activity (needs read access)
+NIMBY_IDLE_BACKEND = "pynput"
+# Seconds between two polls of the idle time, the longest a user can be active
+# before a polling backend locks the host
+NIMBY_IDLE_POLL_INTERVAL_SEC = 5
 # Default display configuration in case the environment variable DISPLAY is not set
 DEFAULT_DISPLAY = ":0"
 RQD_DISPLAY_PATH = None
@@ -131,6 +206,7 @@ PATH_INIT_TARGET = '/lib/systemd/system/default.target' # rhel7
 PATH_LOADAVG = "/proc/loadavg"
 PATH_STAT = "/proc/stat"
 PATH_MEMINFO = "/proc/meminfo"
+PATH_SYS_DEVICES_SYSTEM = "/sys/devices/system"
 # stat and statm are inaccurate because of kernel internal scability optimation
 # stat/statm/status are inaccurate values, true values are in smaps
 # but RQD user can't read smaps get:
@@ -138,6 +214,11 @@ PATH_MEMINFO = "/proc/meminfo"
 PATH_PROC_PID_STAT = "/proc/{0}/stat"
 PATH_PROC_PID_STATM = "/proc/{0}/statm"
 PATH_PROC_PID_CMDLINE = "/proc/{0}/cmdline"
+PATH_PROC_PID_IO = "/proc/{0}/io"
+# Pressure stall information of cpu, memory and io
+PATH_PRESSURE = "/proc/pressure/{0}"
+PATH_DEV_INPUT = "/dev/input"
+PATH_MOUNTS = "/proc/mounts"
 
 if platform.system() == 'Linux':
     SYS_HERTZ = os.sysconf('SC_CLK_TCK')
@@ -163,6 +244,21 @@ OVERRIDE_NIMBY = None # True to turn on, False to turn off
 USE_NIMBY_PYNPUT = True # True pynput, False select
 OVERRIDE_HOSTNAME = None # Force to use this hostname
 ALLOW_GPU = False
+# Bind the memory of threadable frames to the NUMA nodes of their cores with numactl
+NUMA_MEMBIND = False
+# Launch linux frames through a spawn helper process instead of forking rqd. Frames
+# are forked by rqd when the helper doesn't answer in RQD_SPAWN_HELPER_TIMEOUT_SEC.
+RQD_SPAWN_HELPER = False
+RQD_SPAWN_HELPER_TIMEOUT_SEC = 10
+# Directory, preferably on a tmpfs, holding a directory per linux frame for its
+# command and stat files, instead of the temp directory. The directories of completed
+# frames are removed RQD_STAGING_CLEANUP_BATCH at a time every
+# RQD_STAGING_CLEANUP_INTERVAL_SEC.
+RQD_STAGING_PATH = ""
+RQD_STAGING_CLEANUP_INTERVAL_SEC = 10
+RQD_STAGING_CLEANUP_BATCH = 100
+# Where GPU telemetry comes from: auto, nvml or nvidia-smi
+GPU_TELEMETRY_BACKEND = "auto"
 LOAD_MODIFIER = 0 # amount to add/subtract from load
 
 LOG_FORMAT = '%(levelname)-9s openrqd-%(module)-10s: %(message)s'
@@ -179,12 +275,53 @@ SP_OS = platform.system()
 
 # Docker mode config
 DOCKER_AGENT = None
+# Seconds between two checks of the frame images on the host
+DOCKER_IMAGE_CHECK_INTERVAL_SEC = 60
 DOCKER_GPU_MODE = False
 
 # Backup running frames cache. Backup cache is turned off if this path is set to
 # None or ""
 BACKUP_CACHE_PATH = ""
 BACKUP_CACHE_TIME_TO_LIVE_SECONDS = 60
+# The backup is an append-only journal. Records are fsynced once
+# BACKUP_CACHE_FSYNC_BATCH of them are pending or BACKUP_CACHE_FSYNC_INTERVAL_SEC
+# elapsed, and the journal is compacted after BACKUP_CACHE_COMPACT_RECORDS records.
+BACKUP_CACHE_FSYNC_BATCH = 16
+BACKUP_CACHE_FSYNC_INTERVAL_SEC = 5
+BACKUP_CACHE_COMPACT_RECORDS = 1000
+# Frame complete reports cuebot didn't receive are journaled to RQD_OUTBOX_PATH,
+# "<BACKUP_CACHE_PATH>.outbox" by default or only kept in memory without a backup cache,
+# and replayed by batches of RQD_OUTBOX_BATCH_SIZE with an exponential backoff.
+RQD_OUTBOX_PATH = ""
+RQD_OUTBOX_MAX_REPORTS = 1000
+RQD_OUTBOX_BATCH_SIZE = 50
+RQD_OUTBOX_RETRY_MIN_SEC = 1
+RQD_OUTBOX_RETRY_MAX_SEC = 300
+# Frame complete reports are held in the outbox and sent from a background thread,
+# tried RQD_REPORT_SEND_ATTEMPTS times RQD_REPORT_RETRY_SEC apart, doubling, before
+# being left to the replays. On shutdown, rqd waits RQD_REPORT_SHUTDOWN_SEC for the
+# report being sent. They carry the host info of the last host report as long as
+# it is at most RQD_HOST_INFO_MAX_AGE_SEC old.
+RQD_REPORT_SEND_ATTEMPTS = 3
+RQD_REPORT_RETRY_SEC = 0.5
+RQD_REPORT_SHUTDOWN_SEC = 2
+RQD_HOST_INFO_MAX_AGE_SEC = 30
+# The last RQD_LOG_TAIL_BUFFER_BYTES of each frame log are kept in memory for
+# StreamFrameLog, sent by chunks of RQD_LOG_STREAM_CHUNK_BYTES. Followed streams hold
+# a gRPC worker each, at most RQD_LOG_STREAM_MAX_FOLLOWERS of them run at once.
+RQD_LOG_TAIL_BUFFER_BYTES = 256 * 1024
+RQD_LOG_STREAM_CHUNK_BYTES = 64 * 1024
+RQD_LOG_STREAM_MAX_FOLLOWERS = 4
+RQD_LOG_STREAM_POLL_SEC = 1
+# Once a frame completes, the logs of its previous attempts (<log>.rqlog.N) are
+# compressed in the background with "gzip" or "zstd" (needs the zstandard package,
+# gzip is used without it). The current log of a frame stays uncompressed. Empty
+# disables the compression.
+RQD_LOG_COMPRESSION = ""
+# Rotated logs kept per job log directory, by count and total bytes, the oldest are
+# removed first. 0 disables the limit.
+RQD_LOG_RETENTION_COUNT = 0
+RQD_LOG_RETENTION_BYTES = 0
 
 try:
     if os.path.isfile(CONFIG_FILE):
@@ -204,6 +341,32 @@ try:
 
         if config.has_option(__override_section, "RQD_GRPC_PORT"):
             RQD_GRPC_PORT = config.getint(__override_section, "RQD_GRPC_PORT")
+        if config.has_option(__override_section, "RQD_GRPC_MAX_WORKERS"):
+            RQD_GRPC_MAX_WORKERS = config.getint(__override_section, "RQD_GRPC_MAX_WORKERS")
+        if config.has_option(__override_section, "RQD_GRPC_ASYNC"):
+            RQD_GRPC_ASYNC = config.getboolean(__override_section, "RQD_GRPC_ASYNC")
+        if config.has_option(__override_section, "RQD_GRPC_METHOD_CONCURRENCY"):
+            RQD_GRPC_METHOD_CONCURRENCY = config.getint(
+                __override_section, "RQD_GRPC_METHOD_CONCURRENCY")
+        if config.has_option(__override_section, "RQD_GRPC_LAUNCH_WORKERS"):
+            RQD_GRPC_LAUNCH_WORKERS = config.getint(
+                __override_section, "RQD_GRPC_LAUNCH_WORKERS")
+        if config.has_option(__override_section, "RQD_GRPC_METHOD_LIMITS"):
+            RQD_GRPC_METHOD_LIMITS = dict(
+                (method, int(limit)) for method, limit in (
+                    item.split(":", 1) for item in
+                    config.get(__override_section, "RQD_GRPC_METHOD_LIMITS").split()))
+        if config.has_option(__override_section, "RQD_DEFER_PROBES"):
+            RQD_DEFER_PROBES = config.getboolean(__override_section, "RQD_DEFER_PROBES")
+        if config.has_option(__override_section, "RQD_METRICS_PORT"):
+            RQD_METRICS_PORT = config.getint(__override_section, "RQD_METRICS_PORT")
+        if config.has_option(__override_section, "RQD_METRICS_ADDRESS"):
+            RQD_METRICS_ADDRESS = config.get(__override_section, "RQD_METRICS_ADDRESS")
+        if config.has_option(__override_section, "RQD_METRICS_MAX_FRAMES"):
+            RQD_METRICS_MAX_FRAMES = config.getint(__override_section, "RQD_METRICS_MAX_FRAMES")
+        if config.has_option(__override_section, "RQD_LAUNCH_TRACE_WINDOW"):
+            RQD_LAUNCH_TRACE_WINDOW = config.getint(__override_section,
+                                                    "RQD_LAUNCH_TRACE_WINDOW")
         if config.has_option(__override_section, "CUEBOT_GRPC_PORT"):
             CUEBOT_GRPC_PORT = config.getint(__override_section, "CUEBOT_GRPC_PORT")
         if config.has_option(__override_section, "OVERRIDE_CORES"):
@@ -214,6 +377,12 @@ try:
             OVERRIDE_MEMORY = config.getint(__override_section, "OVERRIDE_MEMORY")
         if config.has_option(__override_section, "OVERRIDE_CUEBOT"):
             CUEBOT_HOSTNAME = config.get(__override_section, "OVERRIDE_CUEBOT")
+        if config.has_option(__override_section, "CUEBOT_FAILOVER_RETRY_MIN_SEC"):
+            CUEBOT_FAILOVER_RETRY_MIN_SEC = config.getfloat(
+                __override_section, "CUEBOT_FAILOVER_RETRY_MIN_SEC")
+        if config.has_option(__override_section, "CUEBOT_FAILOVER_RETRY_MAX_SEC"):
+            CUEBOT_FAILOVER_RETRY_MAX_SEC = config.getfloat(
+                __override_section, "CUEBOT_FAILOVER_RETRY_MAX_SEC")
         if config.has_option(__override_section, "OVERRIDE_NIMBY"):
             OVERRIDE_NIMBY = config.getboolean(__override_section, "OVERRIDE_NIMBY")
         if config.has_option(__override_section, "USE_NIMBY_PYNPUT"):
@@ -224,6 +393,23 @@ try:
             OVERRIDE_HOSTNAME = config.get(__override_section, "OVERRIDE_HOSTNAME")
         if config.has_option(__override_section, "GPU"):
             ALLOW_GPU = config.getboolean(__override_section, "GPU")
+        if config.has_option(__override_section, "NUMA_MEMBIND"):
+            NUMA_MEMBIND = config.getboolean(__override_section, "NUMA_MEMBIND")
+        if config.has_option(__override_section, "RQD_SPAWN_HELPER"):
+            RQD_SPAWN_HELPER = config.getboolean(__override_section, "RQD_SPAWN_HELPER")
+        if config.has_option(__override_section, "RQD_SPAWN_HELPER_TIMEOUT_SEC"):
+            RQD_SPAWN_HELPER_TIMEOUT_SEC = config.getfloat(
+                __override_section, "RQD_SPAWN_HELPER_TIMEOUT_SEC")
+        if config.has_option(__override_section, "RQD_STAGING_PATH"):
+            RQD_STAGING_PATH = config.get(__override_section, "RQD_STAGING_PATH")
+        if config.has_option(__override_section, "RQD_STAGING_CLEANUP_INTERVAL_SEC"):
+            RQD_STAGING_CLEANUP_INTERVAL_SEC = config.getfloat(
+                __override_section, "RQD_STAGING_CLEANUP_INTERVAL_SEC")
+        if config.has_option(__override_section, "RQD_STAGING_CLEANUP_BATCH"):
+            RQD_STAGING_CLEANUP_BATCH = config.getint(
+                __override_section, "RQD_STAGING_CLEANUP_BATCH")
+        if config.has_option(__override_section, "GPU_TELEMETRY_BACKEND"):
+            GPU_TELEMETRY_BACKEND = config.get(__override_section, "GPU_TELEMETRY_BACKEND")
         if config.has_option(__override_section, "LOAD_MODIFIER"):
             LOAD_MODIFIER = config.getint(__override_section, "LOAD_MODIFIER")
         if config.has_option(__override_section, "RQD_USE_IP_AS_HOSTNAME"):
@@ -254,6 +440,26 @@ try:
             FILE_LOG_LEVEL = logging.getLevelName(level)
         if config.has_option(__override_section, "RQD_PREPEND_TIMESTAMP"):
             RQD_PREPEND_TIMESTAMP = config.getboolean(__override_section, "RQD_PREPEND_TIMESTAMP")
+        if config.has_option(__override_section, "LOKI_BATCH_MAX_LINES"):
+            LOKI_BATCH_MAX_LINES = config.getint(__override_section, "LOKI_BATCH_MAX_LINES")
+        if config.has_option(__override_section, "LOKI_BATCH_MAX_BYTES"):
+            LOKI_BATCH_MAX_BYTES = config.getint(__override_section, "LOKI_BATCH_MAX_BYTES")
+        if config.has_option(__override_section, "LOKI_BATCH_MAX_WAIT_SEC"):
+            LOKI_BATCH_MAX_WAIT_SEC = config.getfloat(__override_section,
+                "LOKI_BATCH_MAX_WAIT_SEC")
+        if config.has_option(__override_section, "LOKI_QUEUE_MAX_LINES"):
+            LOKI_QUEUE_MAX_LINES = config.getint(__override_section, "LOKI_QUEUE_MAX_LINES")
+        if config.has_option(__override_section, "LOKI_ENQUEUE_TIMEOUT_SEC"):
+            LOKI_ENQUEUE_TIMEOUT_SEC = config.getfloat(__override_section,
+                "LOKI_ENQUEUE_TIMEOUT_SEC")
+        if config.has_option(__override_section, "LOKI_DROP_POLICY"):
+            LOKI_DROP_POLICY = config.get(__override_section, "LOKI_DROP_POLICY")
+        if config.has_option(__override_section, "LOKI_PUSH_TIMEOUT_SEC"):
+            LOKI_PUSH_TIMEOUT_SEC = config.getint(__override_section, "LOKI_PUSH_TIMEOUT_SEC")
+        if config.has_option(__override_section, "LOKI_PUSH_RETRIES"):
+            LOKI_PUSH_RETRIES = config.getint(__override_section, "LOKI_PUSH_RETRIES")
+        if config.has_option(__override_section, "LOKI_CLOSE_TIMEOUT_SEC"):
+            LOKI_CLOSE_TIMEOUT_SEC = config.getint(__override_section, "LOKI_CLOSE_TIMEOUT_SEC")
         if config.has_option(__override_section, "JOB_LOG_MAX_SIZE_IN_BYTES"):
             JOB_LOG_MAX_SIZE_IN_BYTES = config.getint(__override_section,
                 "JOB_LOG_MAX_SIZE_IN_BYTES")
@@ -261,6 +467,12 @@ try:
             CHECK_INTERVAL_LOCKED = config.getint(__override_section, "CHECK_INTERVAL_LOCKED")
         if config.has_option(__override_section, "MINIMUM_IDLE"):
             MINIMUM_IDLE = config.getint(__override_section, "MINIMUM_IDLE")
+        if config.has_option(__override_section, "NIMBY_IDLE_BACKEND"):
+            NIMBY_IDLE_BACKEND = config.get(
+                __override_section, "NIMBY_IDLE_BACKEND").strip().lower()
+        if config.has_option(__override_section, "NIMBY_IDLE_POLL_INTERVAL_SEC"):
+            NIMBY_IDLE_POLL_INTERVAL_SEC = config.getfloat(
+                __override_section, "NIMBY_IDLE_POLL_INTERVAL_SEC")
         if config.has_option(__override_section, "SENTRY_DSN_PATH"):
             SENTRY_DSN_PATH = config.getint(__override_section, "SENTRY_DSN_PATH")
         if config.has_option(__override_section, "SP_OS"):
@@ -278,6 +490,77 @@ try:
         if config.has_option(__override_section, "BACKUP_CACHE_TIME_TO_LIVE_SECONDS"):
             BACKUP_CACHE_TIME_TO_LIVE_SECONDS = config.getint(
                 __override_section, "BACKUP_CACHE_TIME_TO_LIVE_SECONDS")
+        if config.has_option(__override_section, "BACKUP_CACHE_FSYNC_BATCH"):
+            BACKUP_CACHE_FSYNC_BATCH = config.getint(
+                __override_section, "BACKUP_CACHE_FSYNC_BATCH")
+        if config.has_option(__override_section, "BACKUP_CACHE_FSYNC_INTERVAL_SEC"):
+            BACKUP_CACHE_FSYNC_INTERVAL_SEC = config.getint(
+                __override_section, "BACKUP_CACHE_FSYNC_INTERVAL_SEC")
+        if config.has_option(__override_section, "BACKUP_CACHE_COMPACT_RECORDS"):
+            BACKUP_CACHE_COMPACT_RECORDS = config.getint(
+                __override_section, "BACKUP_CACHE_COMPACT_RECORDS")
+        if config.has_option(__override_section, "RQD_OUTBOX_PATH"):
+            RQD_OUTBOX_PATH = config.get(__override_section, "RQD_OUTBOX_PATH")
+        if config.has_option(__override_section, "RQD_OUTBOX_MAX_REPORTS"):
+            RQD_OUTBOX_MAX_REPORTS = config.getint(__override_section, "RQD_OUTBOX_MAX_REPORTS")
+        if config.has_option(__override_section, "RQD_OUTBOX_BATCH_SIZE"):
+            RQD_OUTBOX_BATCH_SIZE = config.getint(__override_section, "RQD_OUTBOX_BATCH_SIZE")
+        if config.has_option(__override_section, "RQD_OUTBOX_RETRY_MIN_SEC"):
+            RQD_OUTBOX_RETRY_MIN_SEC = config.getfloat(
+                __override_section, "RQD_OUTBOX_RETRY_MIN_SEC")
+        if config.has_option(__override_section, "RQD_OUTBOX_RETRY_MAX_SEC"):
+            RQD_OUTBOX_RETRY_MAX_SEC = config.getfloat(
+                __override_section, "RQD_OUTBOX_RETRY_MAX_SEC")
+        if config.has_option(__override_section, "RQD_REPORT_SEND_ATTEMPTS"):
+            RQD_REPORT_SEND_ATTEMPTS = config.getint(
+                __override_section, "RQD_REPORT_SEND_ATTEMPTS")
+        if config.has_option(__override_section, "RQD_REPORT_RETRY_SEC"):
+            RQD_REPORT_RETRY_SEC = config.getfloat(__override_section, "RQD_REPORT_RETRY_SEC")
+        if config.has_option(__override_section, "RQD_REPORT_SHUTDOWN_SEC"):
+            RQD_REPORT_SHUTDOWN_SEC = config.getfloat(
+                __override_section, "RQD_REPORT_SHUTDOWN_SEC")
+        if config.has_option(__override_section, "RQD_HOST_INFO_MAX_AGE_SEC"):
+            RQD_HOST_INFO_MAX_AGE_SEC = config.getfloat(
+                __override_section, "RQD_HOST_INFO_MAX_AGE_SEC")
+        if config.has_option(__override_section, "RQD_LOG_TAIL_BUFFER_BYTES"):
+            RQD_LOG_TAIL_BUFFER_BYTES = config.getint(
+                __override_section, "RQD_LOG_TAIL_BUFFER_BYTES")
+        if config.has_option(__override_section, "RQD_LOG_STREAM_CHUNK_BYTES"):
+            RQD_LOG_STREAM_CHUNK_BYTES = config.getint(
+                __override_section, "RQD_LOG_STREAM_CHUNK_BYTES")
+        if config.has_option(__override_section, "RQD_LOG_COMPRESSION"):
+            RQD_LOG_COMPRESSION = config.get(__override_section, "RQD_LOG_COMPRESSION")
+        if config.has_option(__override_section, "RQD_LOG_RETENTION_COUNT"):
+            RQD_LOG_RETENTION_COUNT = config.getint(
+                __override_section, "RQD_LOG_RETENTION_COUNT")
+        if config.has_option(__override_section, "RQD_LOG_RETENTION_BYTES"):
+            RQD_LOG_RETENTION_BYTES = config.getint(
+                __override_section, "RQD_LOG_RETENTION_BYTES")
+        if config.has_option(__override_section, "RQD_LOG_STREAM_MAX_FOLLOWERS"):
+            RQD_LOG_STREAM_MAX_FOLLOWERS = config.getint(
+                __override_section, "RQD_LOG_STREAM_MAX_FOLLOWERS")
+        if config.has_option(__override_section, "RSS_SAMPLE_MIN_INTERVAL_SEC"):
+            RSS_SAMPLE_MIN_INTERVAL_SEC = config.getfloat(
+                __override_section, "RSS_SAMPLE_MIN_INTERVAL_SEC")
+        if config.has_option(__override_section, "RSS_SAMPLE_CPU_BUDGET"):
+            RSS_SAMPLE_CPU_BUDGET = config.getfloat(__override_section, "RSS_SAMPLE_CPU_BUDGET")
+        if config.has_option(__override_section, "RQD_ADMISSION_CONTROL"):
+            RQD_ADMISSION_CONTROL = config.getboolean(__override_section, "RQD_ADMISSION_CONTROL")
+        if config.has_option(__override_section, "RQD_ADMISSION_MAX_MEMORY_PRESSURE"):
+            RQD_ADMISSION_MAX_MEMORY_PRESSURE = config.getfloat(
+                __override_section, "RQD_ADMISSION_MAX_MEMORY_PRESSURE")
+        if config.has_option(__override_section, "RQD_ADMISSION_MAX_SWAPOUT"):
+            RQD_ADMISSION_MAX_SWAPOUT = config.getfloat(
+                __override_section, "RQD_ADMISSION_MAX_SWAPOUT")
+        if config.has_option(__override_section, "RQD_ADMISSION_MIN_FREE_KB"):
+            RQD_ADMISSION_MIN_FREE_KB = config.getint(
+                __override_section, "RQD_ADMISSION_MIN_FREE_KB")
+        if config.has_option(__override_section, "RQD_ADMISSION_DEFER_SEC"):
+            RQD_ADMISSION_DEFER_SEC = config.getfloat(
+                __override_section, "RQD_ADMISSION_DEFER_SEC")
+        if config.has_option(__override_section, "RQD_NIMBY_RETRY_INTERVAL_SEC"):
+            RQD_NIMBY_RETRY_INTERVAL_SEC = config.getint(
+                __override_section, "RQD_NIMBY_RETRY_INTERVAL_SEC")
 
         if config.has_option(__override_section, "RQD_DISPLAY_PATH"):
             RQD_DISPLAY_PATH = config.get(__override_section, "RQD_DISPLAY_PATH")
@@ -35,17 +35,28 @@ import threading
 import time
 import traceback
 import select
+import shutil
 import uuid
 
+import psutil
+
 import opencue_proto.host_pb2
 import opencue_proto.report_pb2
 import opencue_proto.rqd_pb2
+import rqd.rqadmission
 import rqd.rqconstants
 from rqd.rqconstants import DOCKER_AGENT
 import rqd.rqexceptions
+import rqd.rqjournal
 import rqd.rqmachine
+import rqd.rqmetrics
 import rqd.rqnetwork
 from rqd.rqnimby import Nimby
+import rqd.rqoutbox
+import rqd.rqsampler
+import rqd.rqscheduler
+import rqd.rqspawn
+import rqd.rqstaging
 import rqd.rqutil
 import rqd.rqlogging
 
@@ -61,6 +72,14 @@ class RqCore(object):
 
     def __init__(self, optNimbyoff=False):
         """RqCore class initialization"""
+        # Timed from the start of the process, the first phase covers the imports
+        try:
+            processStartTime = psutil.Process().create_time()
+        except (psutil.Error, OSError):
+            processStartTime = None
+        self.startup = rqd.rqmetrics.StartupTrace(processStartTime)
+        self.startup.mark("imports")
+
         self.__whenIdle = False
         self.__reboot = False
 
@@ -76,38 +95,65 @@ class RqCore(object):
 
         nimbyNoOp = not self.shouldStartNimby()
         self.nimby = Nimby(self, nimbyNoOp)
+        self.startup.mark("nimby")
 
-        self.machine = rqd.rqmachine.Machine(self, self.cores)
+        # Runs the periodic work: rss updates, status pings, cache backups...
+        self.scheduler = rqd.rqscheduler.Scheduler()
+        self.rssSampler = rqd.rqsampler.RssSampler()
+
+        self.machine = rqd.rqmachine.Machine(
+            self, self.cores, deferProbes=rqd.rqconstants.RQD_DEFER_PROBES)
+        self.startup.mark("machine")
         self.network = rqd.rqnetwork.Network(self)
+        self.admission = None
+        if rqd.rqconstants.RQD_ADMISSION_CONTROL and platform.system() == "Linux":
+            self.admission = rqd.rqadmission.AdmissionController(self.machine)
         self.__threadLock = threading.Lock()
         self.__cache = {}
-        self.updateRssThread = None
-        self.onIntervalThread = None
-        self.intervalStartTime = 0
-        self.intervalSleepTime = rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC
+        self.spawnHelper = None
 
         #  pylint: disable=unused-private-member
         self.__cluster = None
         self.__session = None
         self.__stmt = None
-        self._heartbeat_counter = 0
 
         self.docker_agent = None
 
         if DOCKER_AGENT:
             self.docker_agent = DOCKER_AGENT
-            self.docker_agent.refreshFrameImages()
+            if not rqd.rqconstants.RQD_DEFER_PROBES:
+                self.docker_agent.refreshFrameImages()
+                self.startup.mark("docker_images")
+
+        self.staging = rqd.rqstaging.StagingArea()
+        self.staging.setup()
 
         self.backup_cache_path = None
+        self.__journal = None
+        self.metricsServer = None
+        recoveredFrameIds = []
         if rqd.rqconstants.BACKUP_CACHE_PATH:
-            if not rqd.rqconstants.DOCKER_AGENT:
+            if not rqd.rqconstants.DOCKER_AGENT and platform.system() != "Linux":
                 log.warning("Cache backup is currently only available "
-                    "when RUN_ON_DOCKER mode")
+                    "on Linux or when RUN_ON_DOCKER mode")
             else:
                 self.backup_cache_path = rqd.rqconstants.BACKUP_CACHE_PATH
                 if not os.path.exists(os.path.dirname(self.backup_cache_path)):
                     os.makedirs(os.path.dirname(self.backup_cache_path))
-                self.recoverCache()
+
+        # Recovered frames that already exited report their completion right away
+        outboxPath = rqd.rqconstants.RQD_OUTBOX_PATH
+        if not outboxPath and self.backup_cache_path:
+            outboxPath = "%s.outbox" % self.backup_cache_path
+        self.outbox = rqd.rqoutbox.ReportOutbox(outboxPath)
+        self.reportSender = rqd.rqoutbox.ReportSender(
+            lambda report: self.network.reportRunningFrameCompletion(report), self.outbox)
+
+        if self.backup_cache_path:
+            recoveredFrameIds = self.recoverCache()
+        self.staging.sweep(recoveredFrameIds)
+
+        self.startup.mark("cache")
 
         signal.signal(signal.SIGINT, self.handleExit)
         signal.signal(signal.SIGTERM, self.handleExit)
@@ -116,41 +162,104 @@ class RqCore(object):
         """Called by main to start the rqd service"""
         if self.shouldStartNimby():
             self.nimbyOn()
+        if rqd.rqconstants.RQD_METRICS_PORT:
+            try:
+                self.metricsServer = rqd.rqmetrics.MetricsServer(self)
+                self.metricsServer.start()
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to start the metrics endpoint")
+            self.startup.mark("metrics")
+        if rqd.rqconstants.RQD_SPAWN_HELPER and platform.system() == "Linux":
+            # Started before gRPC so it is up for the first frame launches
+            self.spawnHelper = rqd.rqspawn.SpawnHelper()
+            rqd.rqutil.permissionsHigh()
+            try:
+                self.spawnHelper.start()
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to start the spawn helper, frames will be forked")
+                self.spawnHelper = None
+            finally:
+                rqd.rqutil.permissionsLow()
+            self.startup.mark("spawn_helper")
+        if rqd.rqconstants.RQD_DEFER_PROBES:
+            self.startProbes()
+        elif self.docker_agent is not None:
+            self.startContainerPool()
+            self.startup.mark("container_pool")
         self.network.start_grpc()
 
-    def grpcConnected(self):
-        """After gRPC connects to the cuebot, this function is called"""
-        self.network.reportRqdStartup(self.machine.getBootReport())
+    def startProbes(self):
+        """Probes the host in background threads while the gRPC server comes up, the
+        boot report waits for them"""
+        self.startup.runInBackground("gpu_probe", self.machine.setupGpu)
+        if self.docker_agent is not None:
+            def prepareDocker():
+                self.docker_agent.refreshFrameImages()
+                self.startContainerPool()
+            self.startup.runInBackground("docker_images", prepareDocker)
 
-        self.updateRssThread = threading.Timer(rqd.rqconstants.RSS_UPDATE_INTERVAL, self.updateRss)
-        self.updateRssThread.start()
+    def startContainerPool(self):
+        """Starts the pool of idle containers of the docker agent"""
+        try:
+            self.docker_agent.startPool(self.machine.getHostname())
+        # pylint: disable=broad-except
+        except Exception:
+            log.exception("Failed to start the container pool, frames will get their "
+                          "own containers")
 
-        self.onIntervalThread = threading.Timer(self.intervalSleepTime, self.onInterval)
-        self.intervalStartTime = time.time()
-        self.onIntervalThread.start()
+    def grpcConnected(self):
+        """After gRPC connects to the cuebot, this function is called"""
+        self.startup.mark("grpc_server")
+        self.startup.wait()
+        self.startup.mark("probes_wait")
+        self.startup.finish()
+        bootReport = self.machine.getBootReport()
+        # pylint: disable=no-member
+        bootReport.host.attributes["startup_timing_sec"] = self.startup.format()
+        # pylint: enable=no-member
+        self.network.reportRqdStartup(bootReport)
+        self.outbox.start(self.network.reportRunningFrameCompletion)
+
+        self.scheduler.schedule("rss", self.updateRss, rqd.rqconstants.RSS_UPDATE_INTERVAL)
+        if platform.system() == "Linux" and rqd.rqconstants.RSS_SAMPLE_CPU_BUDGET > 0:
+            self.scheduler.schedule("rss_sample", self.sampleRss,
+                                    rqd.rqconstants.RSS_SAMPLE_MIN_INTERVAL_SEC)
+        self.scheduler.schedule("ping", self.onInterval, self.getPingInterval,
+                                delay=rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC, blocking=True)
+        if self.backup_cache_path:
+            self.scheduler.schedule("backup", self.backupCache,
+                                    rqd.rqconstants.RSS_UPDATE_INTERVAL)
+        self.scheduler.schedule("nimby_retry", self.retryNimby,
+                                rqd.rqconstants.RQD_NIMBY_RETRY_INTERVAL_SEC, jitter=0.1)
+        if self.docker_agent is not None:
+            self.scheduler.schedule("docker_images", self.docker_agent.image_cache.maintain,
+                                    rqd.rqconstants.DOCKER_IMAGE_CHECK_INTERVAL_SEC,
+                                    blocking=True)
+        if self.staging.enabled:
+            self.scheduler.schedule("staging_cleanup", self.staging.purge,
+                                    rqd.rqconstants.RQD_STAGING_CLEANUP_INTERVAL_SEC)
+        self.scheduler.start()
 
         log.warning('RQD Started')
 
-    def onInterval(self, sleepTime=None):
-
-        """This is called by self.grpcConnected as a timer thread to execute
-           every interval"""
-        if sleepTime is None:
-            self.intervalSleepTime = random.randint(
-                rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC,
-                rqd.rqconstants.RQD_MAX_PING_INTERVAL_SEC)
-        else:
-            self.intervalSleepTime = sleepTime
-        try:
-            self.onIntervalThread = threading.Timer(self.intervalSleepTime, self.onInterval)
-            self.intervalStartTime = time.time()
-            self.onIntervalThread.start()
-        # pylint: disable=broad-except
-        except Exception as e:
-            log.critical(
-                'Unable to schedule a ping due to %s at %s',
-                e, traceback.extract_tb(sys.exc_info()[2]))
-
+    @staticmethod
+    def getPingInterval():
+        """Returns a random time until the next status ping, to spread the pings of the
+        hosts over time"""
+        return random.randint(rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC,
+                              rqd.rqconstants.RQD_MAX_PING_INTERVAL_SEC)
+
+    def requestStatusReport(self):
+        """Sends a status report soon, ex: after a frame completed, unless one is due
+        shortly anyway"""
+        timeUntil = self.scheduler.timeUntil("ping")
+        if timeUntil is not None and timeUntil > 2 * rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC:
+            self.scheduler.runSoon("ping")
+
+    def onInterval(self):
+        """Sends a status report, run by the scheduler every ping interval"""
         try:
             if self.__whenIdle and not self.__cache:
                 if not self.machine.isUserLoggedIn():
@@ -162,19 +271,6 @@ class RqCore(object):
             log.warning(
                 'Unable to shutdown due to %s at %s', e, traceback.extract_tb(sys.exc_info()[2]))
 
-        # Count number of times this function is being executed to allow
-        # executing action on different heartbeat counts
-        if self._heartbeat_counter >= sys.maxsize:
-            self._heartbeat_counter = 0
-        self._heartbeat_counter += 1
-
-        # Periodically attempt to start nimby if it failed previously
-        try:
-            self.retryNimby()
-        # pylint: disable=broad-except
-        except Exception as e:
-            log.warning("Failed to initialize Nimby. %s", e)
-
         try:
             self.sendStatusReport()
         # pylint: disable=broad-except
@@ -183,74 +279,101 @@ class RqCore(object):
 
     def retryNimby(self):
         """Ensure nimby is active if required"""
-        if self.shouldStartNimby() and not self.nimby.is_ready and self._heartbeat_counter % 5 == 0:
+        if self.shouldStartNimby() and not self.nimby.is_ready:
             log.warning("Retrying to initialize Nimby")
-            self.nimby = Nimby(self)
-            self.nimbyOn()
+            try:
+                self.nimby = Nimby(self)
+                self.nimbyOn()
+            # pylint: disable=broad-except
+            except Exception as e:
+                log.warning("Failed to initialize Nimby. %s", e)
 
     def updateRss(self):
-        """Triggers and schedules the updating of rss information"""
+        """Updates the rss information of the running frames"""
         if self.__cache:
-            try:
-                self.machine.rssUpdate(self.__cache)
-                if self.backup_cache_path:
-                    self.backupCache()
-            finally:
-                self.updateRssThread = threading.Timer(
-                    rqd.rqconstants.RSS_UPDATE_INTERVAL, self.updateRss)
-                self.updateRssThread.start()
+            startTime = time.time()
+            startCpu = time.thread_time()
+            self.machine.rssUpdate(self.__cache)
+            self.rssSampler.recordUpdate(dict(self.__cache), time.thread_time() - startCpu)
+            rqd.rqmetrics.RSS_UPDATE_SECONDS.observe(time.time() - startTime)
+
+    def sampleRss(self):
+        """Samples the rss of the frames growing fast or close to their memory limit
+        in between the rss updates"""
+        if self.__cache:
+            self.rssSampler.sample(dict(self.__cache))
 
-    def backupCache(self):
-        """Backs up a copy of the running frames cache for a possible recovery.
-        each backup is destructive and erases the last known state"""
+    def getJournal(self):
+        """Returns the running frames journal, None if cache backup is disabled
+        @rtype:  rqd.rqjournal.FrameJournal"""
         if not self.backup_cache_path:
+            return None
+        if self.__journal is None or self.__journal.path != self.backup_cache_path:
+            self.__journal = rqd.rqjournal.FrameJournal(self.backup_cache_path)
+        return self.__journal
+
+    def backupCache(self):
+        """Journals the state of the running frames that changed since the last backup
+        and flushes the journal to disk when its fsync batch is due"""
+        journal = self.getJournal()
+        if journal is None:
+            return
+        for item in list(self.__cache.values()):
+            journal.recordUpdate(item.runFrame)
+        journal.sync()
+
+    def backupFrame(self, runFrame):
+        """Journals the state of a single frame, ex: once its pid is known
+        @type  runFrame: RunFrame
+        @param runFrame: rqd_pb2.RunFrame"""
+        journal = self.getJournal()
+        if journal is None:
             return
-        with open(self.backup_cache_path, "wb") as f:
-            for item in list(self.__cache.values()):
-                serialized = item.runFrame.SerializeToString()
-                f.write(len(serialized).to_bytes(4, byteorder="big"))
-                f.write(serialized)
+        try:
+            journal.recordUpdate(runFrame)
+        # pylint: disable=broad-except
+        except Exception:
+            log.exception("Failed to backup frame %s", runFrame.frame_id)
 
     def recoverCache(self):
-        """Reload the running frames from the latest backup. The backup file
+        """Reload the running frames from the backup journal. The journal
         will be rejected if it hasn't been updated recently
         (rqconstants.BACKUP_CACHE_TIME_TO_LIVE_SECONDS)
+        @rtype:  list
+        @return: Ids of the recovered frames
         """
         if not self.backup_cache_path or \
             not os.path.exists(self.backup_cache_path) or \
             (time.time() - os.path.getmtime(self.backup_cache_path) > \
                 rqd.rqconstants.BACKUP_CACHE_TIME_TO_LIVE_SECONDS):
-            return
-        with open(self.backup_cache_path, "rb") as f:
-            while True:
-                # Read length (4 bytes)
-                length_bytes = f.read(4)
-                if not length_bytes:
-                    break  # End of file
-
-                length = int.from_bytes(length_bytes, byteorder='big')
-                # Read the message data
-                message_data = f.read(length)
-
-                run_frame = opencue_proto.rqd_pb2.RunFrame()
-                # Ignore frames that failed to be parsed
-                try:
-                    run_frame.ParseFromString(message_data)
-                    log.warning("Recovered frame %s.%s", run_frame.job_name, run_frame.frame_name)
-                    running_frame = rqd.rqnetwork.RunningFrame(self, run_frame)
-                    running_frame.frameAttendantThread = FrameAttendantThread(
-                        self, run_frame, running_frame, recovery_mode=True)
-                    # Make sure cores are accounted for
-                    # pylint: disable=no-member
-                    self.cores.idle_cores -= run_frame.num_cores
-                    self.cores.booked_cores += run_frame.num_cores
-                    # pylint: enable=no-member
-
-                    running_frame.frameAttendantThread.start()
-                # pylint: disable=broad-except
-                except Exception:
-                    pass
-                    # Ignore frames that got corrupted
+            return []
+        try:
+            recovered = self.getJournal().replay()
+        # pylint: disable=broad-except
+        except Exception:
+            log.exception("Failed to replay the frame journal %s", self.backup_cache_path)
+            return []
+        for run_frame in recovered:
+            try:
+                log.warning("Recovered frame %s.%s", run_frame.job_name, run_frame.frame_name)
+                running_frame = rqd.rqnetwork.RunningFrame(self, run_frame)
+                running_frame.frameAttendantThread = FrameAttendantThread(
+                    self, run_frame, running_frame, recovery_mode=True)
+                # Make sure cores are accounted for
+                # pylint: disable=no-member
+                self.cores.idle_cores -= run_frame.num_cores
+                self.cores.booked_cores += run_frame.num_cores
+                # pylint: enable=no-member
+                if 'CPU_LIST' in run_frame.attributes:
+                    # Keeps new frames off the cores the recovered frame runs on
+                    with self.__threadLock:
+                        self.machine.reserveRecoveredHT(run_frame.attributes['CPU_LIST'])
+
+                running_frame.frameAttendantThread.start()
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to recover frame %s", run_frame.frame_id)
+        return [run_frame.frame_id for run_frame in recovered]
 
     def getFrame(self, frameId):
         """Gets a frame from the cache based on frameId
@@ -278,6 +401,14 @@ class RqCore(object):
                     "frameId " + frameId + " is already running on this machine")
             self.__cache[frameId] = runningFrame
 
+        journal = self.getJournal()
+        if journal is not None:
+            try:
+                journal.recordLaunch(runningFrame.runFrame)
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to backup frame %s", frameId)
+
     def deleteFrame(self, frameId):
         """Deletes a frame from the cache
         @type  frameId: string
@@ -291,12 +422,19 @@ class RqCore(object):
                     log.error(
                         'No running frames but reserved_cores is not empty: %s',
                         self.cores.reserved_cores)
-                    # pylint: disable=no-member
-                    self.cores.reserved_cores.clear()
+                    self.machine.setupTaskset()
                 log.info("Successfully delete frame with Id: %s", frameId)
             else:
                 log.info("Frame with Id: %s not found in cache", frameId)
 
+        journal = self.getJournal()
+        if journal is not None:
+            try:
+                journal.recordComplete(frameId)
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to backup completion of frame %s", frameId)
+
     def killAllFrame(self, reason):
         """Will execute .kill() on every frame in cache until no frames remain
         @type  reason: string
@@ -358,15 +496,15 @@ class RqCore(object):
     def shutdown(self):
         """Shuts down all rqd systems"""
         self.nimbyOff()
-        if self.onIntervalThread is not None:
-            self.onIntervalThread.cancel()
-        if self.updateRssThread is not None:
-            self.updateRssThread.cancel()
-        elif self.__reboot:
+        self.scheduler.stop()
+        if self.docker_agent is not None:
+            self.docker_agent.stopPool()
+        if self.__reboot:
             log.warning("Rebooting machine by request")
             self.machine.reboot()
         else:
             log.warning("Shutting down RQD by request. pid(%s)", os.getpid())
+        self.reportSender.stop(rqd.rqconstants.RQD_REPORT_SHUTDOWN_SEC)
         self.network.stopGrpc()
         # Using sys.exit would raise SystemExit, giving exception handlers a chance
         # to block this
@@ -386,6 +524,7 @@ class RqCore(object):
         @param  runFrame: rqd_pb2.RunFrame"""
         log.info("Running command %s for %s", runFrame.command, runFrame.frame_id)
         log.debug(runFrame)
+        launchTrace = rqd.rqmetrics.LaunchTrace(runFrame.frame_id)
 
         #
         # Check for reasons to abort launch
@@ -421,34 +560,50 @@ class RqCore(object):
             log.warning(err)
             raise rqd.rqexceptions.CoreReservationFailureException(err)
 
-        # See if all requested cores are available
-        with self.__threadLock:
-            # pylint: disable=no-member
-            if self.cores.idle_cores < runFrame.num_cores:
-                err = "Not launching, insufficient idle cores"
-                log.critical(err)
-                raise rqd.rqexceptions.CoreReservationFailureException(err)
-            # pylint: enable=no-member
-
-            if runFrame.environment.get('CUE_THREADABLE') == '1':
-                reserveHT = self.machine.reserveHT(runFrame.num_cores)
-                if reserveHT:
-                    runFrame.attributes['CPU_LIST'] = reserveHT
-
-            if runFrame.num_gpus:
-                reserveGpus = self.machine.reserveGpus(runFrame.num_gpus)
-                if reserveGpus:
-                    runFrame.attributes['GPU_LIST'] = reserveGpus
+        if self.admission is not None:
+            self.admission.admit(runFrame, lambda: dict(self.__cache))
 
-            # They must be available at this point, reserve them
-            # pylint: disable=no-member
-            self.cores.idle_cores -= runFrame.num_cores
-            self.cores.booked_cores += runFrame.num_cores
-            # pylint: enable=no-member
+        try:
+            launchTrace.mark("checks")
 
-        runningFrame = rqd.rqnetwork.RunningFrame(self, runFrame)
-        runningFrame.frameAttendantThread = FrameAttendantThread(self, runFrame, runningFrame)
-        runningFrame.frameAttendantThread.start()
+            # See if all requested cores are available
+            with self.__threadLock:
+                # pylint: disable=no-member
+                if self.cores.idle_cores < runFrame.num_cores:
+                    err = "Not launching, insufficient idle cores"
+                    log.critical(err)
+                    raise rqd.rqexceptions.CoreReservationFailureException(err)
+                # pylint: enable=no-member
+
+                if runFrame.environment.get('CUE_THREADABLE') == '1':
+                    reserveHT = self.machine.reserveHT(runFrame.num_cores)
+                    if reserveHT:
+                        runFrame.attributes['CPU_LIST'] = reserveHT
+                        numaNodes = self.machine.getNumaNodes(reserveHT)
+                        if numaNodes:
+                            runFrame.attributes['NUMA_NODES'] = numaNodes
+
+                if runFrame.num_gpus:
+                    reserveGpus = self.machine.reserveGpus(runFrame.num_gpus)
+                    if reserveGpus:
+                        runFrame.attributes['GPU_LIST'] = reserveGpus
+
+                # They must be available at this point, reserve them
+                # pylint: disable=no-member
+                self.cores.idle_cores -= runFrame.num_cores
+                self.cores.booked_cores += runFrame.num_cores
+                # pylint: enable=no-member
+            launchTrace.mark("reserve")
+
+            runningFrame = rqd.rqnetwork.RunningFrame(self, runFrame)
+            runningFrame.launchTrace = launchTrace
+            runningFrame.frameAttendantThread = FrameAttendantThread(self, runFrame, runningFrame)
+            runningFrame.frameAttendantThread.start()
+        except Exception:
+            # The frame won't launch, stop counting its memory
+            if self.admission is not None:
+                self.admission.release(runFrame.frame_id)
+            raise
 
     def getRunningFrame(self, frameId):
         """Gets the currently running frame."""
@@ -458,6 +613,19 @@ class RqCore(object):
             log.info("frameId %s is not running on this machine", frameId)
             return None
 
+    def getFrameLog(self, frameId):
+        """Gets the log of a running frame.
+        @rtype:  tuple
+        @return: (rqd.rqlogging.LogTail, <log file or None>), None if the frame isn't
+                 running or didn't open its log yet"""
+        frame = self.getRunningFrame(frameId)
+        if frame is None or frame.frameAttendantThread is None:
+            return None
+        rqlog = frame.frameAttendantThread.rqlog
+        if rqlog is None or rqlog.tail is None:
+            return None
+        return rqlog.tail, getattr(rqlog, "filepath", None)
+
     def getCoreInfo(self):
         """Gets the core info report."""
         return self.cores
@@ -666,11 +834,13 @@ class RqCore(object):
         return self.__whenIdle
 
     def sendFrameCompleteReport(self, runningFrame):
-        """Send a frameCompleteReport to Cuebot"""
+        """Hands a frameCompleteReport to the report sender, which holds it in the
+        outbox and sends it to Cuebot in the background, or leaves it to the replays
+        of the outbox when Cuebot can't be reached"""
         if not runningFrame.completeReportSent:
             report = opencue_proto.report_pb2.FrameCompleteReport()
             # pylint: disable=no-member
-            report.host.CopyFrom(self.machine.getHostInfo())
+            report.host.CopyFrom(self.machine.getCachedHostInfo())
             report.frame.CopyFrom(runningFrame.runningFrameInfo())
             # pylint: enable=no-member
 
@@ -687,7 +857,7 @@ class RqCore(object):
             if self.nimby.locked and not runningFrame.ignoreNimby:
                 report.exit_status = rqd.rqconstants.EXITSTATUS_FOR_NIMBY_KILL
 
-            self.network.reportRunningFrameCompletion(report)
+            self.reportSender.submit(report, runningFrame.exitTime)
             runningFrame.completeReportSent = True
 
     def sanitizeFrames(self):
@@ -738,10 +908,41 @@ class FrameAttendantThread(threading.Thread):
         self.endTime = 0
         self.frameInfo = frameInfo
         self._tempLocations = []
+        # Staging directory of the command and stat files of the frame, if it has one
+        self._stagingDir = None
         self.rqlog = None
         self.recovery_mode = recovery_mode
         # To suppress duplicate "log size exceeded" messages across loops
         self._log_limit_triggered = False
+        self._resourcesReleased = False
+
+    def _releaseResources(self):
+        """Gives the cores and gpus of the frame back for booking, once"""
+        if self._resourcesReleased:
+            return
+        self._resourcesReleased = True
+        self.rqCore.releaseCores(self.runFrame.num_cores,
+            self.runFrame.attributes.get('CPU_LIST'),
+            self.runFrame.attributes.get('GPU_LIST')
+                if 'GPU_LIST' in self.runFrame.attributes else None)
+
+    def _frameExited(self):
+        """Records the exit of the frame process and releases its cores before the
+        logs, stat file and report are dealt with"""
+        self.frameInfo.exitTime = time.time()
+        self._releaseResources()
+
+    def _launchMark(self, phase):
+        """Ends a phase of the frame's launch trace, if it is being traced"""
+        launchTrace = getattr(self.frameInfo, "launchTrace", None)
+        if launchTrace is not None:
+            launchTrace.mark(phase)
+
+    def _launchFinish(self):
+        """Ends the frame's launch trace once its process started"""
+        launchTrace = getattr(self.frameInfo, "launchTrace", None)
+        if launchTrace is not None:
+            launchTrace.finish(self.runFrame)
 
     def __createEnvVariables(self):
         """Define the environmental variables for the frame"""
@@ -823,10 +1024,12 @@ class FrameAttendantThread(threading.Thread):
             self.frameEnv['CUE_GPU_CORES'] = self.runFrame.attributes['GPU_LIST']
 
     # pylint: disable=inconsistent-return-statements
-    def _createCommandFile(self, command):
+    def _createCommandFile(self, command, directory=None):
         """Creates a file that subprocess. Popen then executes.
         @type  command: string
         @param command: The command specified in the runFrame request
+        @type  directory: string
+        @param directory: Directory of the file, the temp directory by default
         @rtype:  string
         @return: Command file location"""
         commandFile = ""
@@ -847,7 +1050,7 @@ class FrameAttendantThread(threading.Thread):
                     rqd_tmp_dir,
                     'cmd-%s-%s.bat' % (self.runFrame.frame_id, time.time()))
             else:
-                commandFile = os.path.join(tempfile.gettempdir(),
+                commandFile = os.path.join(directory or tempfile.gettempdir(),
                                            'rqd-cmd-%s-%s' % (self.runFrame.frame_id, time.time()))
             with open(commandFile, "w", encoding='utf-8') as rqexe:
                 self._tempLocations.append(commandFile)
@@ -937,6 +1140,21 @@ class FrameAttendantThread(threading.Thread):
                 "Unable to write footer: %s due to %s at %s",
                 self.runFrame.log_dir_file, e, traceback.extract_tb(sys.exc_info()[2]))
 
+    def __drainOutput(self, process):
+        """Writes the output left in the pipes of a command that exited. The pipes
+        are read without blocking, as processes left behind by the command may
+        keep them open."""
+        for pipe in (process.stdout, process.stderr):
+            try:
+                os.set_blocking(pipe.fileno(), False)
+                while True:
+                    line = pipe.readline()
+                    if not line:
+                        break
+                    self.rqlog.write(line, prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
+            except (OSError, ValueError):
+                pass
+
     def __log_size_limit_exceeded(self):
         """Returns (bool, message) indicating whether the job log size limit is exceeded."""
         try:
@@ -984,19 +1202,26 @@ class FrameAttendantThread(threading.Thread):
 
     def __cleanup(self):
         """Cleans up temporary files"""
-        rqd.rqutil.permissionsHigh()
-        try:
-            for location in self._tempLocations:
-                if os.path.isfile(location):
-                    try:
-                        os.remove(location)
-                    # pylint: disable=broad-except
-                    except Exception as e:
-                        log.warning(
-                            "Unable to delete file: %s due to %s at %s",
-                            location, e, traceback.extract_tb(sys.exc_info()[2]))
-        finally:
-            rqd.rqutil.permissionsLow()
+        locations = self._tempLocations
+        if self._stagingDir is not None:
+            # The staging cleanup removes the frame directory along with its files
+            self.rqCore.staging.release(self._stagingDir)
+            locations = [location for location in locations
+                         if os.path.dirname(location) != self._stagingDir]
+        if locations:
+            rqd.rqutil.permissionsHigh()
+            try:
+                for location in locations:
+                    if os.path.isfile(location):
+                        try:
+                            os.remove(location)
+                        # pylint: disable=broad-except
+                        except Exception as e:
+                            log.warning(
+                                "Unable to delete file: %s due to %s at %s",
+                                location, e, traceback.extract_tb(sys.exc_info()[2]))
+            finally:
+                rqd.rqutil.permissionsLow()
 
         # Close log file
         try:
@@ -1006,6 +1231,9 @@ class FrameAttendantThread(threading.Thread):
             log.warning(
                 "Unable to close file: %s due to %s at %s",
                 self.runFrame.log_file, e, traceback.extract_tb(sys.exc_info()[2]))
+        if isinstance(self.rqlog, rqd.rqlogging.RqdLogger):
+            # Compresses the logs of the previous attempts in the background
+            rqd.rqlogging.submitCompletedLog(self.rqlog.filepath)
 
     def runLinux(self):
         """The steps required to handle a frame under linux"""
@@ -1013,46 +1241,74 @@ class FrameAttendantThread(threading.Thread):
         runFrame = self.runFrame
 
         self.__createEnvVariables()
+        self._launchMark("env")
         self.__writeHeader()
+        self._launchMark("header")
 
-        tempStatFile = "%srqd-stat-%s-%s" % (self.rqCore.machine.getTempPath(),
-                                             frameInfo.frameId,
-                                             time.time())
+        self._stagingDir = self.rqCore.staging.createFrameDir(frameInfo.frameId)
+        if self._stagingDir is not None:
+            tempStatFile = os.path.join(
+                self._stagingDir, "rqd-stat-%s-%s" % (frameInfo.frameId, time.time()))
+        else:
+            tempStatFile = "%srqd-stat-%s-%s" % (self.rqCore.machine.getTempPath(),
+                                                 frameInfo.frameId,
+                                                 time.time())
         self._tempLocations.append(tempStatFile)
+        # Keep track of the stat file in case this frame needs to be restored from the backup
+        runFrame.attributes["stat_file"] = tempStatFile
         tempCommand = []
         if self.rqCore.machine.isDesktop():
             tempCommand += ["/bin/nice"]
         tempCommand += ["/usr/bin/time", "-p", "-o", tempStatFile]
 
         if 'CPU_LIST' in runFrame.attributes:
-            tempCommand += ['taskset', '-c', runFrame.attributes['CPU_LIST']]
+            if rqd.rqconstants.NUMA_MEMBIND and 'NUMA_NODES' in runFrame.attributes \
+                    and shutil.which('numactl'):
+                # Keep the frame's memory on the NUMA nodes of its cores
+                tempCommand += ['numactl',
+                                '--physcpubind=%s' % runFrame.attributes['CPU_LIST'],
+                                '--membind=%s' % runFrame.attributes['NUMA_NODES']]
+            else:
+                tempCommand += ['taskset', '-c', runFrame.attributes['CPU_LIST']]
 
         rqd.rqutil.permissionsHigh()
         try:
+            commandFile = self._createCommandFile(runFrame.command, self._stagingDir)
             if rqd.rqconstants.RQD_BECOME_JOB_USER:
                 tempCommand += ["/bin/su", runFrame.user_name, rqd.rqconstants.SU_ARGUMENT,
-                                '"' + self._createCommandFile(runFrame.command) + '"']
+                                '"' + commandFile + '"']
             else:
-                tempCommand += [self._createCommandFile(runFrame.command)]
+                tempCommand += [commandFile]
+            self._launchMark("command_file")
 
-            # pylint: disable=subprocess-popen-preexec-fn,consider-using-with
-            frameInfo.forkedCommand = subprocess.Popen(tempCommand,
-                                                       env=self.frameEnv,
-                                                       cwd=self.rqCore.machine.getTempPath(),
-                                                       stdin=subprocess.PIPE,
-                                                       stdout=subprocess.PIPE,
-                                                       stderr=subprocess.PIPE,
-                                                       close_fds=True,
-                                                       preexec_fn=os.setsid)
+            frameInfo.forkedCommand = None
+            spawnHelper = self.rqCore.spawnHelper
+            if spawnHelper is not None and spawnHelper.isAlive():
+                try:
+                    frameInfo.forkedCommand = spawnHelper.spawn(
+                        tempCommand,
+                        env=self.frameEnv,
+                        cwd=self.rqCore.machine.getTempPath(),
+                        timeout=rqd.rqconstants.RQD_SPAWN_HELPER_TIMEOUT_SEC)
+                except rqd.rqspawn.SpawnHelperError as e:
+                    log.warning("Forking %s, the spawn helper failed: %s", frameInfo.frameId, e)
+            if frameInfo.forkedCommand is None:
+                # pylint: disable=subprocess-popen-preexec-fn,consider-using-with
+                frameInfo.forkedCommand = subprocess.Popen(tempCommand,
+                                                           env=self.frameEnv,
+                                                           cwd=self.rqCore.machine.getTempPath(),
+                                                           stdin=subprocess.PIPE,
+                                                           stdout=subprocess.PIPE,
+                                                           stderr=subprocess.PIPE,
+                                                           close_fds=True,
+                                                           preexec_fn=os.setsid)
         finally:
             rqd.rqutil.permissionsLow()
 
         frameInfo.pid = runFrame.pid = frameInfo.forkedCommand.pid
-
-        if not self.rqCore.updateRssThread.is_alive():
-            self.rqCore.updateRssThread = threading.Timer(rqd.rqconstants.RSS_UPDATE_INTERVAL,
-                                                          self.rqCore.updateRss)
-            self.rqCore.updateRssThread.start()
+        self._launchMark("spawn")
+        self._launchFinish()
+        self.rqCore.backupFrame(runFrame)
 
         poller = select.poll()
         poller.register(frameInfo.forkedCommand.stdout, select.POLLIN)
@@ -1088,6 +1344,9 @@ class FrameAttendantThread(threading.Thread):
                 break
 
         returncode = frameInfo.forkedCommand.wait()
+        self._frameExited()
+        if not self._log_limit_triggered:
+            self.__drainOutput(frameInfo.forkedCommand)
 
         # Find exitStatus and exitSignal
         if returncode < 0:
@@ -1120,7 +1379,7 @@ class FrameAttendantThread(threading.Thread):
         # pylint: disable=import-outside-toplevel
         # pylint: disable=import-error
         from docker.errors import APIError
-        from rqd.rqdocker import InvalidFrameOsError
+        from rqd.rqdocker import ContainerExec, InvalidFrameOsError
 
         frameInfo = self.frameInfo
         runFrame = self.runFrame
@@ -1132,7 +1391,9 @@ class FrameAttendantThread(threading.Thread):
             raise RuntimeError("Invalid state: docker_agent must have been initialized.")
 
         self.__createEnvVariables()
+        self._launchMark("env")
         self.__writeHeader()
+        self._launchMark("header")
 
         tempStatFile = "%srqd-stat-%s-%s" % (self.rqCore.machine.getTempPath(),
                                              frameInfo.frameId,
@@ -1211,22 +1472,29 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
                             "minimum required. Running with 2MB", hard_memory_limit)
             hard_memory_limit = "2GB"
 
+        # Keep the frame's memory on the NUMA nodes of its cores
+        numaArgs = {}
+        if rqd.rqconstants.NUMA_MEMBIND and runFrame.attributes.get('NUMA_NODES'):
+            numaArgs['cpuset_mems'] = runFrame.attributes['NUMA_NODES']
+
         # Write command to a file on the job tmpdir to simplify replaying a frame
         command = self._createCommandFile(command)
+        self._launchMark("command_file")
         container = None
-        docker_client = None
         container_id = "00000000"
         frameInfo.pid = -1
         try:
             log_stream = None
-            docker_client, container = self.docker_agent.runContainer(
+            _, container = self.docker_agent.runContainer(
                 image_key=runFrame.os,
                 environment=self.frameEnv,
                 working_dir=self.rqCore.machine.getTempPath(),
                 hostname=self.frameEnv["jobhost"],
                 mem_reservation=soft_memory_limit,
                 mem_limit=hard_memory_limit,
-                entrypoint=command)
+                entrypoint=command,
+                **numaArgs)
+            self._launchMark("spawn")
 
             log_stream = container.logs(stream=True)
 
@@ -1258,15 +1526,14 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
 
             log.info(msg)
             self.rqlog.write(msg, prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
-
-            # Ping rss thread on rqCore
-            if self.rqCore.updateRssThread and not self.rqCore.updateRssThread.is_alive():
-                self.rqCore.updateRssThread = threading.Timer(rqd.rqconstants.RSS_UPDATE_INTERVAL,
-                                                            self.rqCore.updateRss)
-                self.rqCore.updateRssThread.start()
+            self._launchFinish()
 
             # Store container id in case this frame needs to be restored from the backup
             runFrame.attributes["container_id"] = container.short_id
+            if isinstance(container, ContainerExec):
+                # The frame runs in a pooled container
+                runFrame.attributes["container_exec_id"] = container.exec_id
+            self.rqCore.backupFrame(runFrame)
             # Atatch to the job and follow the logs
             for line in log_stream:
                 self.rqlog.write(line, prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
@@ -1310,12 +1577,11 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             self.rqlog.write("%s - %s" % (msg, e),
                                 prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
         finally:
+            self._frameExited()
             # Clear up container after if finishes
             if container:
                 container_id = container.short_id
                 container.remove()
-            if docker_client:
-                docker_client.close()
 
         # Find exitStatus and exitSignal
         if returncode < 0:
@@ -1374,11 +1640,8 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
                 ''.join(traceback.format_exception(*sys.exc_info())))
 
         frameInfo.pid = runFrame.pid = frameInfo.forkedCommand.pid
-
-        if not self.rqCore.updateRssThread.is_alive():
-            self.rqCore.updateRssThread = threading.Timer(rqd.rqconstants.RSS_UPDATE_INTERVAL,
-                                                          self.rqCore.updateRss)
-            self.rqCore.updateRssThread.start()
+        self._launchMark("spawn")
+        self._launchFinish()
 
         while True:
             output = frameInfo.forkedCommand.stdout.readline()
@@ -1392,6 +1655,7 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
                     break
 
         frameInfo.forkedCommand.wait()
+        self._frameExited()
 
         # Find exitStatus and exitSignal
         returncode = frameInfo.forkedCommand.returncode
@@ -1437,11 +1701,8 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             rqd.rqutil.permissionsLow()
 
         frameInfo.pid = frameInfo.forkedCommand.pid
-
-        if not self.rqCore.updateRssThread.is_alive():
-            self.rqCore.updateRssThread = threading.Timer(rqd.rqconstants.RSS_UPDATE_INTERVAL,
-                                                          self.rqCore.updateRss)
-            self.rqCore.updateRssThread.start()
+        self._launchMark("spawn")
+        self._launchFinish()
 
         while True:
             output = frameInfo.forkedCommand.stdout.readline()
@@ -1465,6 +1726,7 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
                     break
 
         frameInfo.forkedCommand.wait()
+        self._frameExited()
 
         # Find exitStatus and exitSignal
         returncode = frameInfo.forkedCommand.returncode
@@ -1506,6 +1768,7 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
                     # Do everything as launching user:
                     runFrame.gid = rqd.rqconstants.LAUNCH_FRAME_USER_GID
                     rqd.rqutil.permissionsUser(runFrame.uid, runFrame.gid)
+            self._launchMark("user")
 
             # Setup frame logging
             if self.runFrame.loki_url:
@@ -1514,6 +1777,7 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             else:
                 self.rqlog = rqd.rqlogging.RqdLogger(runFrame.log_dir_file)
             self.rqlog.waitForFile()
+            self._launchMark("log")
         # pylint: disable=broad-except
         except Exception as e:
             err = "Unable to write to %s due to %s" % (runFrame.log_dir_file, e)
@@ -1548,6 +1812,7 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             return
 
         log.info("Monitor frame started for frameId=%s", self.frameId)
+        self._launchMark("thread_start")
 
         runFrame = self.runFrame
         run_on_docker = self.rqCore.docker_agent is not None
@@ -1570,7 +1835,8 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
                 self.runUnknown()
 
         # pylint: disable=broad-except
-        except Exception:
+        except Exception as e:
+            rqd.rqmetrics.LAUNCH_FAILURES.inc(reason=type(e).__name__)
             log.critical(
                 "Failed launchFrame: For %s due to: \n%s",
                 runFrame.frame_id, ''.join(traceback.format_exception(*sys.exc_info())))
@@ -1583,19 +1849,17 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
 
     def postFrameAction(self):
         """Action to be executed after a frame completes its execution"""
-        self.rqCore.releaseCores(self.runFrame.num_cores,
-            self.runFrame.attributes.get('CPU_LIST'),
-            self.runFrame.attributes.get('GPU_LIST')
-                if 'GPU_LIST' in self.runFrame.attributes else None)
+        self._releaseResources()
 
+        # The report is in the outbox before the journal records the completion,
+        # a crash in between replays it instead of losing it
+        self.rqCore.sendFrameCompleteReport(self.frameInfo)
         self.rqCore.deleteFrame(self.runFrame.frame_id)
+        if self.rqCore.admission is not None:
+            # In case the launch failed before the frame was stored
+            self.rqCore.admission.release(self.runFrame.frame_id)
 
-        self.rqCore.sendFrameCompleteReport(self.frameInfo)
-        time_till_next = (
-                (self.rqCore.intervalStartTime + self.rqCore.intervalSleepTime) - time.time())
-        if time_till_next > (2 * rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC):
-            self.rqCore.onIntervalThread.cancel()
-            self.rqCore.onInterval(rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC)
+        self.rqCore.requestStatusReport()
 
         log.info("Monitor frame ended for frameId=%s",
                     self.runFrame.frame_id)
@@ -1615,7 +1879,7 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             raise RuntimeError("Invalid state: recovered frame does't contain a container id")
         container_id = runFrame.attributes.get("container_id")
 
-        docker_client = self.rqCore.docker_agent.new_client()
+        docker_client = self.rqCore.docker_agent.getClient()
         # The recovered frame will stream back the logs into a new file,
         # therefore, write a new header
         self.__createEnvVariables()
@@ -1628,7 +1892,10 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
 
         try:
             log_stream = None
-            with self.rqCore.docker_agent.docker_lock:
+            if runFrame.attributes.get("container_exec_id"):
+                container = self.rqCore.docker_agent.attachExec(
+                    container_id, runFrame.attributes["container_exec_id"])
+            else:
                 container = docker_client.containers.get(container_id)
             log_stream = container.logs(stream=True)
 
@@ -1649,12 +1916,6 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             log.info(msg)
             self.rqlog.write(msg, prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
 
-            # Ping rss thread on rqCore
-            if self.rqCore.updateRssThread and not self.rqCore.updateRssThread.is_alive():
-                self.rqCore.updateRssThread = threading.Timer(rqd.rqconstants.RSS_UPDATE_INTERVAL,
-                                                            self.rqCore.updateRss)
-                self.rqCore.updateRssThread.start()
-
             # Attach to the job and follow the logs
             for line in log_stream:
                 self.rqlog.write(line, prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
@@ -1694,11 +1955,11 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
                 "- %s" % (msg, e),
                 prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
         finally:
+            self._frameExited()
             # Clear up container after if finishes
             if container:
                 container_id = container.short_id
                 container.remove()
-            docker_client.close()
 
         if container:
             # Find exitStatus and exitSignal
@@ -1734,6 +1995,78 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             self.__writeFooter()
         self.__cleanup()
 
+    def recoverLinux(self):
+        """Monitors a frame launched by a previous rqd instance until it exits.
+        The frame's output pipes went away with that instance, so only its exit
+        status and timing are recovered, from the /usr/bin/time stat file."""
+        frameInfo = self.frameInfo
+        runFrame = self.runFrame
+
+        self.__createEnvVariables()
+        self.__writeHeader()
+
+        statFile = runFrame.attributes.get("stat_file")
+        if statFile:
+            self._tempLocations.append(statFile)
+            self._stagingDir = self.rqCore.staging.getFrameDir(statFile)
+
+        proc = None
+        try:
+            if frameInfo.pid and frameInfo.pid > 0:
+                proc = psutil.Process(frameInfo.pid)
+                # Guard against a recycled pid
+                if statFile and statFile not in proc.cmdline():
+                    proc = None
+        # pylint: disable=broad-except
+        except Exception:
+            proc = None
+
+        if proc is not None:
+            msg = "Frame %s recovered with pid %s, output is no longer captured" % (
+                frameInfo.frameId, frameInfo.pid)
+            log.info(msg)
+            self.rqlog.write(msg, prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
+            try:
+                proc.wait()
+            # pylint: disable=broad-except
+            except Exception:
+                pass
+            self._frameExited()
+        else:
+            msg = "Frame %s process %s exited while rqd was down" % (
+                frameInfo.frameId, frameInfo.pid)
+            log.warning(msg)
+            self.rqlog.write(msg, prependTimestamp=rqd.rqconstants.RQD_PREPEND_TIMESTAMP)
+
+        # /usr/bin/time writes the stat file once the command has exited, it only
+        # mentions the exit status when it is not zero
+        frameInfo.exitStatus = 1
+        frameInfo.exitSignal = 0
+        try:
+            with open(statFile, "r", encoding='utf-8') as stats:
+                lines = stats.readlines()
+            frameInfo.exitStatus = 0
+            for line in lines:
+                fields = line.split()
+                if line.startswith("Command exited with non-zero status"):
+                    frameInfo.exitStatus = int(fields[-1])
+                elif line.startswith("Command terminated by signal"):
+                    frameInfo.exitSignal = int(fields[-1])
+                    frameInfo.exitStatus = 1
+                elif len(fields) == 2 and fields[0] == "real":
+                    frameInfo.realtime = fields[1]
+                elif len(fields) == 2 and fields[0] == "user":
+                    frameInfo.utime = fields[1]
+                elif len(fields) == 2 and fields[0] == "sys":
+                    frameInfo.stime = fields[1]
+        # pylint: disable=broad-except
+        except Exception:
+            frameInfo.exitStatus = 1
+            log.warning("Unable to read the exit status of recovered frame %s", frameInfo.frameId)
+
+        self.__writeFooter()
+        self.__cleanup()
+
     def runRecovery(self):
         """Recover a frame that was running before this instance started"""
         if not self.recovery_mode:
@@ -1753,8 +2086,7 @@ exec su -s %s %s -c "echo \$$; %s /usr/bin/time -p -o %s %s %s"
             if run_on_docker:
                 self.recoverDocker()
             elif platform.system() == "Linux":
-                # TODO
-                pass
+                self.recoverLinux()
             elif platform.system() == "Windows":
                 # TODO
                 pass
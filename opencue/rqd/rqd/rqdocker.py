@@ -16,24 +16,600 @@
 # TODO Remove after this program no longer support Python 3.8.*
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import contextlib
 import os
-from typing import Tuple
+import random
+import signal
+from typing import Optional, Tuple
 from configparser import RawConfigParser
 import logging
 import threading
+import time
 
 # pylint: disable=import-error
 import docker
 import docker.models
 import docker.types
 from docker import DockerClient
+import docker.utils
 from docker.models.containers import Container
 from docker.errors import APIError, ImageNotFound
+import requests.exceptions
 # pylint: enable=import-error
 
 log = logging.getLogger(__name__)
 
 
+class LaunchQueue:
+    """Lets a bounded number of container launches talk to the docker daemon at once,
+    the other launches wait in line in the order they arrived."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(concurrency, 1)
+        self.__cond = threading.Condition()
+        self.__waiting = collections.deque()
+        self.__running = 0
+
+    def getWaiting(self) -> int:
+        """Returns the number of launches waiting in line"""
+        with self.__cond:
+            return len(self.__waiting)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Waits for a launch slot, held until the context exits"""
+        # pylint: disable=import-outside-toplevel
+        # rqd.rqconstants imports this module while it loads
+        import rqd.rqmetrics
+        ticket = object()
+        start = time.time()
+        with self.__cond:
+            self.__waiting.append(ticket)
+            rqd.rqmetrics.DOCKER_LAUNCHES_WAITING.set(len(self.__waiting))
+            while self.__waiting[0] is not ticket or self.__running >= self.concurrency:
+                self.__cond.wait()
+            self.__waiting.popleft()
+            self.__running += 1
+            rqd.rqmetrics.DOCKER_LAUNCHES_WAITING.set(len(self.__waiting))
+            # The next in line may fit in a free slot as well
+            self.__cond.notify_all()
+        rqd.rqmetrics.DOCKER_LAUNCH_WAIT_SECONDS.observe(time.time() - start)
+        try:
+            yield
+        finally:
+            with self.__cond:
+                self.__running -= 1
+                self.__cond.notify_all()
+
+
+class PooledContainer:
+    """Idle container of the pool"""
+
+    def __init__(self, container: Container, image_key: str, hostname: str):
+        self.container = container
+        self.image_key = image_key
+        self.hostname = hostname
+        # User of the frames the container ran, recycled containers only run frames
+        # of the same user
+        self.user = None
+        self.uses = 0
+        # A container bound to NUMA nodes can't be unbound, it isn't recycled
+        self.bound = False
+
+
+class ContainerExec:
+    """Frame command exec'd in a pooled container. It stands in for the container of
+    a frame launched on its own: the frame follows its logs, waits for it and removes
+    it the same way, removing it gives the container back to the pool."""
+
+    def __init__(self, client: DockerClient, container: Container, exec_id: str,
+                 stream=None, pool: Optional[ContainerPool] = None,
+                 pooled: Optional[PooledContainer] = None):
+        self.client = client
+        self.container = container
+        self.exec_id = exec_id
+        self.short_id = container.short_id
+        self.__stream = stream
+        self.__pool = pool
+        self.__pooled = pooled
+        self.__exit_code = None
+        self.__killed = False
+
+    def logs(self, stream=True):
+        """Returns the output of the command. The output of a command recovered
+        after a restart of rqd can't be attached to again, it waits for the
+        command to exit instead."""
+        del stream
+        if self.__stream is not None:
+            return self.__stream
+        return self.__waitForExit()
+
+    def __waitForExit(self):
+        yield b"Output of the frame is not recoverable from its pooled container\n"
+        self.wait()
+
+    def top(self) -> dict:
+        """Returns the pid of the command like Container.top returns the processes of
+        a container"""
+        pid = self.client.api.exec_inspect(self.exec_id).get("Pid")
+        if not pid:
+            raise APIError("The pid of exec %s is not known yet" % self.exec_id)
+        return {"Titles": ["UID", "PID"], "Processes": [["root", str(pid)]]}
+
+    def wait(self) -> dict:
+        """Waits for the command to exit"""
+        while self.__exit_code is None:
+            inspect = self.client.api.exec_inspect(self.exec_id)
+            if not inspect.get("Running"):
+                self.__exit_code = inspect.get("ExitCode")
+                if self.__exit_code is None:
+                    self.__exit_code = -1
+                break
+            time.sleep(ContainerPool.EXEC_POLL_SEC)
+        return {"StatusCode": self.__exit_code}
+
+    def kill(self):
+        """Kills the command, the container isn't recycled afterwards"""
+        self.__killed = True
+        try:
+            pid = self.client.api.exec_inspect(self.exec_id).get("Pid")
+            if pid:
+                os.kill(pid, signal.SIGKILL)
+        except (APIError, OSError) as e:
+            log.warning("Failed to kill exec %s on container %s: %s", self.exec_id,
+                        self.short_id, e)
+
+    def remove(self):
+        """Gives the container back to the pool, removes it when it isn't pooled"""
+        if self.__pool is not None:
+            self.__pool.checkin(self.__pooled,
+                                reusable=not self.__killed and self.__exit_code is not None)
+        else:
+            self.container.remove(force=True)
+
+
+class ContainerPool:
+    """Idle containers started ahead of the frames for each OS key of docker_images,
+    so frames skip the creation of their container. A frame runs its command file
+    in an idle container with docker exec. Used containers are removed, or with
+    recycling, given back to the pool for the next frames of the same user.
+
+    The pool keeps as many idle containers of an OS as frames of that OS were
+    launched in the busiest BURST_SEC of the last window_sec, between min_size and
+    max_size, and none while the host has less than min_free_kb of memory
+    available. A background thread creates and removes the containers."""
+
+    LABEL = "opencue.rqd.pool"
+    # Seconds of the buckets the launches are counted by
+    BURST_SEC = 60
+    # Seconds between two maintenances of the pool, checkouts trigger one right away
+    INTERVAL_SEC = 5
+    # Seconds between two checks of a running exec
+    EXEC_POLL_SEC = 0.5
+
+    def __init__(self, agent: RqDocker, hostname: str, max_size: int, min_size: int = 0,
+                 window_sec: int = 300, min_free_kb: int = 4194304, recycle: bool = False,
+                 max_reuses: int = 10):
+        self.agent = agent
+        self.hostname = hostname
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.window_sec = window_sec
+        self.min_free_kb = min_free_kb
+        self.recycle = recycle
+        self.max_reuses = max_reuses
+        self.__lock = threading.Lock()
+        # { <image_key> : deque(PooledContainer) } oldest first
+        self.__idle = {key: collections.deque() for key in agent.docker_images}
+        # [ (PooledContainer, <reusable>), ... ] given back by the frames
+        self.__returned = collections.deque()
+        # { <image_key> : deque(<launch time>) }
+        self.__launches = {key: collections.deque() for key in agent.docker_images}
+        self.__wakeup = threading.Event()
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """Removes the pooled containers left by a previous rqd and starts
+        maintaining the pool"""
+        self.sweep()
+        self.__thread = threading.Thread(target=self.__run, name="DockerPool", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Stops maintaining the pool and removes the idle containers"""
+        self.__stopped.set()
+        self.__wakeup.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        with self.__lock:
+            idle = [pooled for containers in self.__idle.values() for pooled in containers]
+            for containers in self.__idle.values():
+                containers.clear()
+        for pooled in idle:
+            self.__remove(pooled)
+
+    def getIdle(self, image_key: str) -> int:
+        """Returns the number of idle containers of an OS"""
+        with self.__lock:
+            return len(self.__idle.get(image_key, ()))
+
+    def getTarget(self, image_key: str, available_kb: Optional[int] = None) -> int:
+        """Returns the number of idle containers to keep for an OS
+        Args:
+            image_key: OS key of docker_images
+            available_kb: Memory available on the host, read from the host when None
+        """
+        if available_kb is None:
+            # pylint: disable=import-outside-toplevel
+            import psutil
+            available_kb = psutil.virtual_memory().available // 1024
+        if available_kb < self.min_free_kb:
+            return 0
+        now = time.time()
+        with self.__lock:
+            launches = self.__launches.get(image_key, ())
+            while launches and launches[0] < now - self.window_sec:
+                launches.popleft()
+            buckets = collections.Counter(int(launch // self.BURST_SEC) for launch in launches)
+        busiest = max(buckets.values()) if buckets else 0
+        return max(self.min_size, min(busiest, self.max_size))
+
+    def run(self, image_key: str, command: str, environment: dict[str, str],
+            working_dir: str, hostname: str, mem_reservation, mem_limit,
+            cpuset_mems: Optional[str] = None) -> Optional[ContainerExec]:
+        """Runs the command file of a frame in an idle container
+        Returns:
+            ContainerExec: The running command, None when no idle container fits the
+            frame and it has to be launched in its own container
+        """
+        # pylint: disable=import-outside-toplevel
+        import rqd.rqmetrics
+        with self.__lock:
+            self.__launches.setdefault(image_key, collections.deque()).append(time.time())
+        self.__wakeup.set()
+        user = environment.get("USER")
+        client = self.agent.getClient()
+        while True:
+            pooled = self.__checkout(image_key, hostname, user)
+            if pooled is None:
+                rqd.rqmetrics.DOCKER_POOL_CHECKOUTS.inc(os=image_key, result="miss")
+                return None
+            try:
+                mem_limit_bytes = docker.utils.parse_bytes(mem_limit)
+                update_args = {"mem_limit": mem_limit_bytes,
+                               "mem_reservation": docker.utils.parse_bytes(mem_reservation),
+                               # Like a new container, swap up to the memory limit
+                               "memswap_limit": mem_limit_bytes * 2}
+                if cpuset_mems:
+                    update_args["cpuset_mems"] = cpuset_mems
+                    pooled.bound = True
+                pooled.container.update(**update_args)
+                exec_id = client.api.exec_create(
+                    pooled.container.id, [command], stdout=True, stderr=True,
+                    environment=environment, workdir=working_dir)["Id"]
+                stream = client.api.exec_start(exec_id, stream=True)
+            # pylint: disable=broad-except
+            except Exception as e:
+                log.warning("Failed to run a frame on pooled container %s, removing it: %s",
+                            pooled.container.short_id, e)
+                self.__remove(pooled)
+                continue
+            pooled.user = user
+            pooled.uses += 1
+            rqd.rqmetrics.DOCKER_POOL_CHECKOUTS.inc(os=image_key, result="hit")
+            return ContainerExec(client, pooled.container, exec_id, stream, self, pooled)
+
+    def checkin(self, pooled: PooledContainer, reusable: bool):
+        """Gives back the container of a frame that completed"""
+        with self.__lock:
+            self.__returned.append((pooled, reusable))
+        self.__wakeup.set()
+
+    def sweep(self):
+        """Removes the pooled containers no frame runs in, left by a previous rqd"""
+        client = self.agent.getClient()
+        try:
+            containers = client.containers.list(all=True, filters={"label": self.LABEL})
+        except APIError as e:
+            log.warning("Failed to list the pooled containers: %s", e)
+            return
+        for container in containers:
+            exec_ids = container.attrs.get("ExecIDs") or []
+            try:
+                if any(client.api.exec_inspect(exec_id).get("Running")
+                       for exec_id in exec_ids):
+                    # A frame recovered from the backup cache runs in it
+                    continue
+                log.info("Removing pooled container %s left by a previous rqd",
+                         container.short_id)
+                container.remove(force=True)
+            except APIError as e:
+                log.warning("Failed to remove pooled container %s: %s", container.short_id, e)
+
+    def maintain(self, available_kb: Optional[int] = None):
+        """Recycles the containers given back, then creates and removes idle
+        containers to meet the target of each OS"""
+        while True:
+            with self.__lock:
+                if not self.__returned:
+                    break
+                pooled, reusable = self.__returned.popleft()
+            self.__recycle(pooled, reusable)
+
+        for image_key in list(self.__idle):
+            target = self.getTarget(image_key, available_kb)
+            while not self.__stopped.is_set():
+                with self.__lock:
+                    idle = self.__idle[image_key]
+                    extra = idle.popleft() if len(idle) > target else None
+                    missing = len(idle) < target
+                if extra is not None:
+                    self.__remove(extra)
+                elif missing:
+                    if not self.__create(image_key):
+                        break
+                else:
+                    break
+            self.__updateMetrics(image_key)
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            self.__wakeup.clear()
+            try:
+                self.maintain()
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to maintain the container pool")
+            self.__wakeup.wait(self.INTERVAL_SEC)
+
+    def __checkout(self, image_key: str, hostname: str,
+                   user: Optional[str]) -> Optional[PooledContainer]:
+        """Takes the oldest idle container that can run a frame of the user, fresh
+        containers serve any user"""
+        with self.__lock:
+            idle = self.__idle.get(image_key, ())
+            for pooled in idle:
+                if pooled.hostname == hostname and pooled.user in (None, user):
+                    idle.remove(pooled)
+                    return pooled
+        return None
+
+    def __create(self, image_key: str) -> bool:
+        """Starts an idle container"""
+        # Keeps the container running until a frame needs it
+        entrypoint = [self.agent.docker_shell_path, "-c", "exec tail -f /dev/null"]
+        try:
+            container = self.agent.launchContainer(
+                self.agent.getFrameImage(image_key),
+                self.agent.getContainerArgs(environment={}, working_dir="/",
+                                            hostname=self.hostname, entrypoint=entrypoint,
+                                            labels={self.LABEL: image_key}))
+        # pylint: disable=broad-except
+        except Exception as e:
+            log.warning("Failed to start a pooled container for %s: %s", image_key, e)
+            return False
+        with self.__lock:
+            self.__idle[image_key].append(PooledContainer(container, image_key, self.hostname))
+        return True
+
+    def __recycle(self, pooled: PooledContainer, reusable: bool):
+        """Puts a used container back in the pool, removes it when it can't be
+        reused"""
+        if (not self.recycle or not reusable or pooled.bound
+                or pooled.uses >= self.max_reuses or self.__stopped.is_set()):
+            self.__remove(pooled)
+            return
+        with self.__lock:
+            self.__idle[pooled.image_key].append(pooled)
+
+    @staticmethod
+    def __remove(pooled: PooledContainer):
+        try:
+            pooled.container.remove(force=True)
+        # pylint: disable=broad-except
+        except Exception as e:
+            log.warning("Failed to remove pooled container %s: %s",
+                        pooled.container.short_id, e)
+
+    def __updateMetrics(self, image_key: str):
+        # pylint: disable=import-outside-toplevel
+        import rqd.rqmetrics
+        rqd.rqmetrics.DOCKER_POOL_IDLE.set(self.getIdle(image_key), os=image_key)
+
+
+class ImageCache:
+    """Frame images on the host. The images of docker_images are pulled in parallel
+    at boot and their tags refreshed in the background every refresh_sec. Images
+    no container uses are evicted, least recently used first, while the docker
+    data root has less than min_free_mb free. The configured tags are never
+    evicted, frames need them and the refresh would pull them right back, so the
+    evicted images are mostly the older versions of refreshed tags and images of
+    OSs that were removed from the config."""
+
+    def __init__(self, agent: RqDocker, pull_timeout_sec: int = 600, refresh_sec: int = 0,
+                 min_free_mb: int = 10240, root: Optional[str] = None):
+        self.agent = agent
+        self.pull_timeout_sec = pull_timeout_sec
+        self.refresh_sec = refresh_sec
+        self.min_free_mb = min_free_mb
+        self.root = root
+        self.__lock = threading.Lock()
+        # { <image tag> : <time a frame last used it> }
+        self.__last_used = {}
+        self.__last_refresh = time.time()
+        self.__refresh = None
+        self.__refresher = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="DockerImageRefresh")
+        self.__evicted = 0
+        self.__stats = {}
+
+    def pullAll(self, timeout: Optional[float] = None) -> dict[str, Optional[Exception]]:
+        """Pulls the configured images in parallel, waiting up to timeout seconds.
+
+        Returns:
+            dict: { <image> : <error or None> } of the pulls that failed or didn't
+            finish in time
+
+        Raises:
+            RuntimeError: If an image that failed to pull isn't on the host either
+        """
+        if timeout is None:
+            timeout = self.pull_timeout_sec
+        images = sorted(set(self.agent.docker_images.values()))
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(images), 1), thread_name_prefix="DockerImagePull")
+        futures = {executor.submit(self.__pull, image): image for image in images}
+        done, _ = concurrent.futures.wait(futures, timeout=timeout)
+        # Pulls that timed out keep going in the background
+        executor.shutdown(wait=False)
+        failures = {}
+        for future, image in futures.items():
+            if future not in done:
+                failures[image] = TimeoutError("Pull didn't finish in %ss" % timeout)
+            elif future.exception() is not None:
+                failures[image] = future.exception()
+        for image, error in failures.items():
+            if not self.isPresent(image):
+                raise RuntimeError("Failed to download frame docker image %s - %s" %
+                                   (image, error))
+            log.warning("Failed to refresh frame image %s, using the one on the host: %s",
+                        image, error)
+        self.__last_refresh = time.time()
+        return failures
+
+    def refresh(self) -> bool:
+        """Refreshes the configured tags in the background when refresh_sec elapsed
+        since the last refresh. Launches don't wait for it.
+
+        Returns:
+            bool: True if a refresh was started
+        """
+        with self.__lock:
+            if (self.refresh_sec <= 0 or time.time() - self.__last_refresh < self.refresh_sec
+                    or (self.__refresh is not None and not self.__refresh.done())):
+                return False
+            self.__last_refresh = time.time()
+            self.__refresh = self.__refresher.submit(self.__refreshAll)
+            return True
+
+    def markUsed(self, image: str):
+        """Records that a frame was launched on an image"""
+        with self.__lock:
+            self.__last_used[image] = time.time()
+
+    def isPresent(self, image: str) -> bool:
+        """Returns True if the image is on the host"""
+        try:
+            self.agent.getClient().images.get(image)
+            return True
+        except (ImageNotFound, APIError):
+            return False
+
+    def getFreeBytes(self) -> Optional[int]:
+        """Returns the free space of the docker data root, None if it can't be read
+        from rqd"""
+        try:
+            if self.root is None:
+                self.root = self.agent.getClient().info().get("DockerRootDir",
+                                                              "/var/lib/docker")
+            stat = os.statvfs(self.root)
+        except (APIError, OSError) as e:
+            log.debug("Failed to read the free space of the docker data root: %s", e)
+            return None
+        return stat.f_bavail * stat.f_frsize
+
+    def evict(self) -> int:
+        """Removes unused images, least recently used first, until the docker data
+        root has min_free_mb free
+
+        Returns:
+            int: Number of images removed
+        """
+        free = self.getFreeBytes()
+        if self.min_free_mb <= 0 or free is None or free >= self.min_free_mb * 1024 * 1024:
+            return 0
+        client = self.agent.getClient()
+        configured = set(self.agent.docker_images.values())
+        in_use = {container.attrs.get("Image")
+                  for container in client.containers.list(all=True)}
+        with self.__lock:
+            last_used = dict(self.__last_used)
+        candidates = []
+        for image in client.images.list():
+            tags = image.attrs.get("RepoTags") or []
+            if image.id in in_use or configured.intersection(tags):
+                continue
+            # Images that lost their tag to a refresh were never used since
+            used = max([last_used.get(tag, 0) for tag in tags] or [0])
+            candidates.append((used, image.attrs.get("Created", ""), image))
+
+        evicted = 0
+        for _, _, image in sorted(candidates, key=lambda candidate: candidate[:2]):
+            if free >= self.min_free_mb * 1024 * 1024:
+                break
+            try:
+                client.images.remove(image.id)
+            except APIError as e:
+                # Used by a container created since the list
+                log.warning("Failed to evict image %s: %s", image.id, e)
+                continue
+            log.info("Evicted image %s %s", image.id, image.attrs.get("RepoTags") or "")
+            evicted += 1
+            free = self.getFreeBytes() or 0
+        with self.__lock:
+            self.__evicted += evicted
+        return evicted
+
+    def maintain(self):
+        """Starts a background refresh when due, evicts images when the docker data
+        root runs short on space and updates the cache state of the host report"""
+        self.refresh()
+        self.evict()
+        self.updateStats()
+
+    def updateStats(self):
+        """Reads the cache state reported by getAttributes"""
+        client = self.agent.getClient()
+        images = client.images.list()
+        missing = [image for image in sorted(set(self.agent.docker_images.values()))
+                   if not any(image in (cached.attrs.get("RepoTags") or [])
+                              for cached in images)]
+        stats = {"docker_images": str(len(images)),
+                 "docker_images_mb": str(sum(image.attrs.get("Size", 0)
+                                             for image in images) // (1024 * 1024))}
+        free = self.getFreeBytes()
+        if free is not None:
+            stats["docker_free_mb"] = str(free // (1024 * 1024))
+        if missing:
+            stats["docker_images_missing"] = ",".join(missing)
+        with self.__lock:
+            stats["docker_images_evicted"] = str(self.__evicted)
+            self.__stats = stats
+
+    def getAttributes(self) -> dict[str, str]:
+        """Returns the cache state for the attributes of the host report, as of the
+        last maintenance"""
+        with self.__lock:
+            return dict(self.__stats)
+
+    def __pull(self, image: str):
+        name, tag = docker.utils.parse_repository_tag(image)
+        log.info("Downloading frame image: %s", image)
+        start = time.time()
+        self.agent.getClient().images.pull(name, tag)
+        log.info("Downloaded frame image %s in %.1fs", image, time.time() - start)
+
+    def __refreshAll(self):
+        try:
+            self.pullAll()
+        # pylint: disable=broad-except
+        except Exception as e:
+            log.warning("Failed to refresh the frame images: %s", e)
+
+
 class RqDocker:
     """Docker container integration for Rqd.
     Handles launching Docker containers for running frame commands. Provides configuration
@@ -45,6 +621,22 @@ class RqDocker:
     DOCKER_GPU_MODE = "DOCKER_GPU_MODE"
     DOCKER_SHELL_PATH = "DOCKER_SHELL_PATH"
     OVERRIDE_DOCKER_IMAGES = "OVERRIDE_DOCKER_IMAGES"
+    DOCKER_LAUNCH_CONCURRENCY = "DOCKER_LAUNCH_CONCURRENCY"
+    DOCKER_LAUNCH_RETRIES = "DOCKER_LAUNCH_RETRIES"
+    DOCKER_CLIENT_POOL_SIZE = "DOCKER_CLIENT_POOL_SIZE"
+    DOCKER_POOL_MAX_SIZE = "DOCKER_POOL_MAX_SIZE"
+    DOCKER_POOL_MIN_SIZE = "DOCKER_POOL_MIN_SIZE"
+    DOCKER_POOL_WINDOW_SEC = "DOCKER_POOL_WINDOW_SEC"
+    DOCKER_POOL_MIN_FREE_KB = "DOCKER_POOL_MIN_FREE_KB"
+    DOCKER_POOL_RECYCLE = "DOCKER_POOL_RECYCLE"
+    DOCKER_POOL_MAX_REUSES = "DOCKER_POOL_MAX_REUSES"
+    DOCKER_IMAGE_PULL_TIMEOUT_SEC = "DOCKER_IMAGE_PULL_TIMEOUT_SEC"
+    DOCKER_IMAGE_REFRESH_SEC = "DOCKER_IMAGE_REFRESH_SEC"
+    DOCKER_IMAGE_MIN_FREE_MB = "DOCKER_IMAGE_MIN_FREE_MB"
+    DOCKER_IMAGE_ROOT = "DOCKER_IMAGE_ROOT"
+
+    # Seconds before the first retry of a launch, doubled on every retry
+    LAUNCH_RETRY_SEC = 0.5
 
     @classmethod
     def fromConfig(cls, config: RawConfigParser):
@@ -59,7 +651,10 @@ class RqDocker:
             RuntimeError: If Docker images are not properly configured
 
         The config should contain:
-        - [docker.config] section with optional DOCKER_SHELL_PATH and DOCKER_GPU_MODE
+        - [docker.config] section with optional DOCKER_SHELL_PATH, DOCKER_GPU_MODE,
+          DOCKER_LAUNCH_CONCURRENCY, DOCKER_LAUNCH_RETRIES, DOCKER_CLIENT_POOL_SIZE
+          the DOCKER_POOL_* options of the pool of idle containers and the
+          DOCKER_IMAGE_* options of the image cache
         - [docker.images] section mapping OS names to Docker image tags
         - [docker.mounts] section defining container mount points
 
@@ -67,6 +662,8 @@ class RqDocker:
             [docker.config]
             DOCKER_SHELL_PATH=/bin/bash
             DOCKER_GPU_MODE=true
+            DOCKER_LAUNCH_CONCURRENCY=4
+            DOCKER_POOL_MAX_SIZE=4
 
             [docker.images]
             centos7=centos7.3:latest
@@ -88,6 +685,41 @@ class RqDocker:
             gpu_mode = any(value in config.get(cls.DOCKER_CONFIG, cls.DOCKER_GPU_MODE)
                 for value in ["true", "True", "yes", "Yes", "1"])
 
+        # Number of containers created at once, the number of retries of the
+        # launches failing on transient daemon errors, and the number of
+        # connections to the daemon kept open. Each running frame keeps one
+        # connection to follow its logs.
+        launch_options = {}
+        for option, key in ((cls.DOCKER_LAUNCH_CONCURRENCY, "launch_concurrency"),
+                            (cls.DOCKER_LAUNCH_RETRIES, "launch_retries"),
+                            (cls.DOCKER_CLIENT_POOL_SIZE, "client_pool_size")):
+            if config.has_option(cls.DOCKER_CONFIG, option):
+                launch_options[key] = config.getint(cls.DOCKER_CONFIG, option)
+
+        # Pool of idle containers, disabled unless DOCKER_POOL_MAX_SIZE is set
+        pool_options = {}
+        for option, key in ((cls.DOCKER_POOL_MAX_SIZE, "max_size"),
+                            (cls.DOCKER_POOL_MIN_SIZE, "min_size"),
+                            (cls.DOCKER_POOL_WINDOW_SEC, "window_sec"),
+                            (cls.DOCKER_POOL_MIN_FREE_KB, "min_free_kb"),
+                            (cls.DOCKER_POOL_MAX_REUSES, "max_reuses")):
+            if config.has_option(cls.DOCKER_CONFIG, option):
+                pool_options[key] = config.getint(cls.DOCKER_CONFIG, option)
+        if config.has_option(cls.DOCKER_CONFIG, cls.DOCKER_POOL_RECYCLE):
+            pool_options["recycle"] = config.getboolean(cls.DOCKER_CONFIG,
+                                                        cls.DOCKER_POOL_RECYCLE)
+
+        # Image pulls at boot, background refresh of the tags and eviction of unused
+        # images
+        image_options = {}
+        for option, key in ((cls.DOCKER_IMAGE_PULL_TIMEOUT_SEC, "pull_timeout_sec"),
+                            (cls.DOCKER_IMAGE_REFRESH_SEC, "refresh_sec"),
+                            (cls.DOCKER_IMAGE_MIN_FREE_MB, "min_free_mb")):
+            if config.has_option(cls.DOCKER_CONFIG, option):
+                image_options[key] = config.getint(cls.DOCKER_CONFIG, option)
+        if config.has_option(cls.DOCKER_CONFIG, cls.DOCKER_IMAGE_ROOT):
+            image_options["root"] = config.get(cls.DOCKER_CONFIG, cls.DOCKER_IMAGE_ROOT)
+
         docker_images = {}
         if cls.OVERRIDE_DOCKER_IMAGES in os.environ:
             # The OVERRIDE_DOCKER_IMAGES environment variable can be used to
@@ -149,17 +781,29 @@ class RqDocker:
                 logging.exception("Failed to create Mount for key=%s, value=%s",
                                     mount_name, mount_str)
 
-        return cls(sp_os, docker_images, docker_mounts, docker_shell_path, gpu_mode)
+        return cls(sp_os, docker_images, docker_mounts, docker_shell_path, gpu_mode,
+                   pool_options=pool_options, image_options=image_options,
+                   **launch_options)
 
     def __init__(self, sp_os:str, docker_images: dict[str, str],
         docker_mounts: list[docker.types.Mount], docker_shell_path: str,
-        gpu_mode: bool):
+        gpu_mode: bool, launch_concurrency: int = 4, launch_retries: int = 3,
+        client_pool_size: int = 64, pool_options: Optional[dict] = None,
+        image_options: Optional[dict] = None):
         self.sp_os = sp_os
         self.docker_images = docker_images
         self.docker_mounts = docker_mounts
         self.docker_shell_path = docker_shell_path
-        self.docker_lock = threading.Lock()
         self.gpu_mode=gpu_mode
+        self.launch_queue = LaunchQueue(launch_concurrency)
+        self.launch_retries = launch_retries
+        self.client_pool_size = client_pool_size
+        self.__client = None
+        self.__client_lock = threading.Lock()
+        # Arguments of ContainerPool, the pool is started by startPool
+        self.pool_options = pool_options or {}
+        self.pool = None
+        self.image_cache = ImageCache(self, **(image_options or {}))
 
     @staticmethod
     def parse_mount(mount_string):
@@ -179,22 +823,20 @@ class RqDocker:
 
     def refreshFrameImages(self):
         """
-        Download docker images to be used by frames running on this host
+        Download docker images to be used by frames running on this host, in parallel
+        and up to DOCKER_IMAGE_PULL_TIMEOUT_SEC. Images already on the host are kept
+        when their download fails.
         """
-        docker_client = docker.from_env()
-        try:
-            for image in self.docker_images.values():
-                log.info("Downloading frame image: %s", image)
-                name, tag = image.split(":")
-                try:
-                    docker_client.images.pull(name, tag)
-                except (ImageNotFound, APIError) as e:
-                    raise RuntimeError("Failed to download frame docker image for %s:%s - %s" %
-                                        (name, tag, e))
-        finally:
-            docker_client.close()
+        self.image_cache.pullAll()
         log.info("Finished downloading frame images")
 
+    def getImageKey(self, frame_os=None) -> str:
+        """Returns the OS key of docker_images a frame runs on, the first configured
+        one when the frame doesn't require a specific OS"""
+        if frame_os:
+            return frame_os
+        return next(iter(self.docker_images), None)
+
     def getFrameImage(self, frame_os=None) -> str:
         """
         Get the pre-configured image for the given frame_os.
@@ -219,9 +861,12 @@ class RqDocker:
 
     def runContainer(self, image_key: str, environment: dict[str, str], working_dir: str,
         hostname: str, mem_reservation: str, mem_limit: str,
-        entrypoint: str) -> Tuple[DockerClient, Container]:
+        entrypoint: str, cpuset_mems: Optional[str] = None) -> Tuple[DockerClient, Container]:
         """Creates and runs a new Docker container with the given parameters.
 
+        Launches wait in the launch queue for one of the launch_concurrency slots,
+        and are retried up to launch_retries times on transient daemon errors.
+
         Args:
             image_key: OS key to look up Docker image (e.g. 'centos7')
             environment: Dictionary of environment variables to set in container
@@ -230,52 +875,159 @@ class RqDocker:
             mem_reservation: Soft memory limit for container (e.g. '1g')
             mem_limit: Hard memory limit for container (e.g. '2g')
             entrypoint: Container entrypoint command
+            cpuset_mems: NUMA nodes the container memory is bound to (e.g. '0,1')
 
         Returns:
-            Tuple[DockerClient, Container]: Docker client and running container objects
+            Tuple[DockerClient, Container]: The shared Docker client and the running
+            container. The client is shared by all frames and must not be closed.
 
         Raises:
             InvalidFrameOsError: If image_key doesn't match a configured image
             docker.errors.APIError: If container creation/start fails
             RuntimeError: For other Docker-related failures
         """
-        docker_client = docker.from_env()
         image = self.getFrameImage(image_key)
+        self.image_cache.markUsed(image)
+        if self.pool is not None:
+            execution = self.pool.run(self.getImageKey(image_key), entrypoint, environment,
+                                      working_dir, hostname, mem_reservation, mem_limit,
+                                      cpuset_mems)
+            if execution is not None:
+                return (self.getClient(), execution)
+        container = self.launchContainer(image, self.getContainerArgs(
+            environment=environment,
+            working_dir=working_dir,
+            hostname=hostname,
+            entrypoint=entrypoint,
+            mem_reservation=mem_reservation,
+            mem_limit=mem_limit,
+            cpuset_mems=cpuset_mems))
+        return (self.getClient(), container)
+
+    def getContainerArgs(self, environment: dict[str, str], working_dir: str, hostname: str,
+        entrypoint, mem_reservation=None, mem_limit=None, cpuset_mems: Optional[str] = None,
+        labels: Optional[dict[str, str]] = None) -> dict:
+        """Returns the arguments of containers.create for a frame container"""
         device_requests = []
+        extra_args = {}
+        if cpuset_mems:
+            extra_args["cpuset_mems"] = cpuset_mems
+        if mem_reservation is not None:
+            extra_args["mem_reservation"] = mem_reservation
+        if mem_limit is not None:
+            extra_args["mem_limit"] = mem_limit
+        if labels:
+            extra_args["labels"] = labels
         if self.gpu_mode:
             # Similar to gpu=all on the cli counterpart
             device_requests.append(docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]]))
+        return dict(
+            detach=True,
+            environment=environment,
+            working_dir=working_dir,
+            mounts=self.docker_mounts,
+            privileged=True,
+            pid_mode="host",
+            network="host",
+            hostname=hostname,
+            entrypoint=entrypoint,
+            device_requests=device_requests,
+            **extra_args)
+
+    def launchContainer(self, image: str, container_args: dict) -> Container:
+        """Creates and starts a container once a launch slot is free, retrying on
+        transient daemon errors.
+
+        Raises:
+            docker.errors.APIError: If container creation/start fails
+        """
+        # pylint: disable=import-outside-toplevel
+        # rqd.rqconstants imports this module while it loads
+        import rqd.rqmetrics
+        docker_client = self.getClient()
+        with self.launch_queue.slot():
+            start = time.time()
+            attempt = 0
+            while True:
+                try:
+                    container = self.__createContainer(docker_client, image, container_args)
+                    break
+                # pylint: disable=broad-except
+                except Exception as e:
+                    if attempt >= self.launch_retries or not self.isTransientError(e):
+                        raise
+                    attempt += 1
+                    delay = self.LAUNCH_RETRY_SEC * 2 ** (attempt - 1)
+                    delay += random.uniform(0, delay)
+                    rqd.rqmetrics.DOCKER_LAUNCH_RETRIES.inc(reason=type(e).__name__)
+                    log.warning("Failed to launch a container for %s, retrying in %.1fs "
+                                "(%d/%d): %s", image, delay, attempt, self.launch_retries, e)
+                    time.sleep(delay)
+            rqd.rqmetrics.DOCKER_LAUNCH_SECONDS.observe(time.time() - start)
+        return container
+
+    @staticmethod
+    def __createContainer(docker_client: DockerClient, image: str,
+                          container_args: dict) -> Container:
+        """Creates and starts a container, pulling its image when missing. Unlike
+        containers.run, a container that fails to start is removed so the launch
+        can be retried."""
         try:
-            # Use a lock to prevent multiple threads from trying to create containers at the same
-            # time. Experiments without a lock resulted in a fail state
-            with self.docker_lock:
-                container = docker_client.containers.run(image=image,
-                    detach=True,
-                    environment=environment,
-                    working_dir=working_dir,
-                    mounts=self.docker_mounts,
-                    privileged=True,
-                    pid_mode="host",
-                    network="host",
-                    stderr=True,
-                    hostname=hostname,
-                    mem_reservation=mem_reservation,
-                    mem_limit=mem_limit,
-                    entrypoint=entrypoint,
-                    device_requests=device_requests)
-            return (docker_client, container)
-        # pylint: disable=broad-except
-        except Exception as e:
-            # Purposedly not closing the connection on a finally here
-            # as the caller might need to interact with the daemon to collect
-            # logs and status. This portion only handles closing the connection in
-            # case docker.run crashes
-            docker_client.close()
-            raise e
-
-    def new_client(self) -> DockerClient:
-        """A wrapper around the creation of a new client instance"""
-        return docker.from_env()
+            container = docker_client.containers.create(image, **container_args)
+        except ImageNotFound:
+            docker_client.images.pull(image)
+            container = docker_client.containers.create(image, **container_args)
+        try:
+            container.start()
+        except Exception:
+            try:
+                container.remove(force=True)
+            # pylint: disable=broad-except
+            except Exception as e:
+                log.warning("Failed to remove container %s that didn't start: %s",
+                            container.short_id, e)
+            raise
+        return container
+
+    @staticmethod
+    def isTransientError(error: Exception) -> bool:
+        """Returns True for the daemon errors a launch can be retried on: server
+        errors and failures to reach the daemon. Client errors like a missing image
+        or invalid arguments won't go away on their own."""
+        if isinstance(error, APIError):
+            return error.is_server_error()
+        return isinstance(error, (requests.exceptions.ConnectionError,
+                                  requests.exceptions.Timeout))
+
+    def startPool(self, hostname: str):
+        """Starts the pool of idle containers when DOCKER_POOL_MAX_SIZE is set
+        Args:
+            hostname: Hostname of the frame containers
+        """
+        if self.pool_options.get("max_size", 0) <= 0 or self.pool is not None:
+            return
+        self.pool = ContainerPool(self, hostname, **self.pool_options)
+        self.pool.start()
+
+    def stopPool(self):
+        """Stops the pool and removes its idle containers"""
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    def attachExec(self, container_id: str, exec_id: str) -> ContainerExec:
+        """Returns the command of a frame recovered from the backup cache that ran in a
+        pooled container"""
+        client = self.getClient()
+        return ContainerExec(client, client.containers.get(container_id), exec_id)
+
+    def getClient(self) -> DockerClient:
+        """Returns the Docker client shared by all frames, created on first use. Its
+        connection pool holds client_pool_size connections to the daemon."""
+        with self.__client_lock:
+            if self.__client is None:
+                self.__client = docker.from_env(max_pool_size=self.client_pool_size)
+            return self.__client
 
 class InvalidFrameOsError(RuntimeError):
     """Invalid setup for frame container"""
@@ -20,12 +20,20 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import division
 
+import asyncio
+import contextlib
 import logging
+import threading
+import time
 
 import grpc
 
 import opencue_proto.rqd_pb2
 import opencue_proto.rqd_pb2_grpc
+import rqd.rqconstants
+import rqd.rqexceptions
+import rqd.rqlogging
+import rqd.rqmetrics
 
 
 log = logging.getLogger(__name__)
@@ -36,11 +44,22 @@ class RqdInterfaceServicer(opencue_proto.rqd_pb2_grpc.RqdInterfaceServicer):
 
     def __init__(self, rqCore):
         self.rqCore = rqCore
+        # Followed log streams hold a gRPC worker until the frame completes
+        self.__logFollowers = threading.BoundedSemaphore(
+            max(rqd.rqconstants.RQD_LOG_STREAM_MAX_FOLLOWERS, 1))
 
     def LaunchFrame(self, request, context):
         """RPC call that launches the given frame"""
         log.info("Request received: launchFrame")
-        self.rqCore.launchFrame(request.run_frame)
+        try:
+            self.rqCore.launchFrame(request.run_frame)
+        except rqd.rqexceptions.InsufficientMemoryException as e:
+            rqd.rqmetrics.LAUNCH_FAILURES.inc(reason=type(e).__name__)
+            # Tells the cuebot the host is out of memory rather than failing
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "%s: %s" % (e.reason, e))
+        except Exception as e:
+            rqd.rqmetrics.LAUNCH_FAILURES.inc(reason=type(e).__name__)
+            raise
         return opencue_proto.rqd_pb2.RqdStaticLaunchFrameResponse()
 
     def ReportStatus(self, request, context):
@@ -52,12 +71,12 @@ class RqdInterfaceServicer(opencue_proto.rqd_pb2_grpc.RqdInterfaceServicer):
     def GetRunningFrameStatus(self, request, context):
         """RPC call to return the frame info for the given frame id"""
         log.info("Request received: getRunningFrameStatus")
-        frame = self.rqCore.getRunningFrame(request.frameId)
+        frame = self.rqCore.getRunningFrame(request.frame_id)
         if frame:
             return opencue_proto.rqd_pb2.RqdStaticGetRunningFrameStatusResponse(
                 running_frame_info=frame.runningFrameInfo())
         context.set_details(
-            "The requested frame was not found. frameId: {}".format(request.frameId))
+            "The requested frame was not found. frameId: {}".format(request.frame_id))
         context.set_code(grpc.StatusCode.NOT_FOUND)
         return opencue_proto.rqd_pb2.RqdStaticGetRunningFrameStatusResponse()
 
@@ -81,6 +100,30 @@ class RqdInterfaceServicer(opencue_proto.rqd_pb2_grpc.RqdInterfaceServicer):
         self.rqCore.shutdownRqdNow()
         return opencue_proto.rqd_pb2.RqdStaticShutdownNowResponse()
 
+    def StreamFrameLog(self, request, context):
+        """RPC call that streams the log of a running frame"""
+        log.info("Request received: streamFrameLog")
+        frameLog = self.rqCore.getFrameLog(request.frame_id)
+        if frameLog is None:
+            context.set_details(
+                "The requested frame log was not found. frameId: {}".format(request.frame_id))
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            return
+        tail, path = frameLog
+        if request.follow and not self.__logFollowers.acquire(blocking=False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                          "Too many followed log streams")
+        try:
+            for offset, data, eof in rqd.rqlogging.streamLog(
+                    tail, path, offset=request.offset, maxBytes=request.max_bytes,
+                    lastLines=request.last_lines, follow=request.follow,
+                    isActive=context.is_active):
+                yield opencue_proto.rqd_pb2.RqdStaticStreamFrameLogResponse(
+                    offset=offset, data=data, eof=eof)
+        finally:
+            if request.follow:
+                self.__logFollowers.release()
+
     def ShutdownRqdIdle(self, request, context):
         """RPC call that locks all cores and shuts down rqd when it is idle.
            unlockAll will abort the request."""
@@ -147,3 +190,189 @@ class RqdInterfaceServicer(opencue_proto.rqd_pb2_grpc.RqdInterfaceServicer):
         log.info("Request received: unlockAll")
         self.rqCore.unlockAll()
         return opencue_proto.rqd_pb2.RqdStaticUnlockAllResponse()
+
+
+class AbortCall(Exception):
+    """Raised by ThreadContext.abort, the call is aborted once back on the event loop"""
+
+    def __init__(self, code, details):
+        super(AbortCall, self).__init__(details)
+        self.code = code
+        self.details = details
+
+
+class ThreadContext(object):
+    """Context of a grpc.aio call handed to the RqdInterfaceServicer methods, which
+    run in the executor of the aio server"""
+
+    def __init__(self, context):
+        self.__context = context
+
+    def set_code(self, code):
+        """Sets the status code of the call"""
+        self.__context.set_code(code)
+
+    def set_details(self, details):
+        """Sets the status details of the call"""
+        self.__context.set_details(details)
+
+    @staticmethod
+    def abort(code, details):
+        """Aborts the call
+        @raise AbortCall: Always"""
+        raise AbortCall(code, details)
+
+    def is_active(self):
+        """Returns whether the call is still running"""
+        return not self.__context.done()
+
+
+_END = object()
+
+
+def _inline(method):
+    """Returns a coroutine answering the method on the event loop"""
+    async def call(self, request, context):
+        return await self.runInline(method, request, context)
+    call.__name__ = method
+    return call
+
+
+def _blocking(method):
+    """Returns a coroutine running the method in the executor"""
+    async def call(self, request, context):
+        return await self.runBlocking(method, request, context)
+    call.__name__ = method
+    return call
+
+
+def _blockingStream(method):
+    """Returns an async generator running the streaming method in the executor"""
+    async def call(self, request, context):
+        async for response in self.runBlockingStream(method, request, context):
+            yield response
+    call.__name__ = method
+    return call
+
+
+class AsyncRqdInterfaceServicer(object):
+    """Serves RqdInterfaceServicer on a grpc.aio server.
+
+    Calls reading the state of rqd in memory are answered on the event loop. The
+    others run in a bounded executor, with at most RQD_GRPC_METHOD_CONCURRENCY
+    calls of a method at once. LaunchFrame runs in an executor of its own, so a
+    burst of status reports or kills can't take the workers a launch needs."""
+
+    # Run in the launch executor, only bounded by its workers
+    LAUNCH_METHODS = ("LaunchFrame",)
+
+    def __init__(self, rqCore, executor, launchExecutor=None):
+        """AsyncRqdInterfaceServicer class initialization
+        @type  rqCore: rqd.rqcore.RqCore
+        @param rqCore: Main RQD Object
+        @type  executor: concurrent.futures.ThreadPoolExecutor
+        @param executor: Runs the blocking calls
+        @type  launchExecutor: concurrent.futures.ThreadPoolExecutor
+        @param launchExecutor: Runs the frame launches, defaults to executor"""
+        self.servicer = RqdInterfaceServicer(rqCore)
+        self.executor = executor
+        self.launchExecutor = launchExecutor or executor
+        # { <method> : asyncio.Semaphore }, created on the event loop
+        self.__semaphores = {}
+
+    @classmethod
+    def getLimit(cls, method):
+        """Returns the number of calls of a method running at once"""
+        if method in rqd.rqconstants.RQD_GRPC_METHOD_LIMITS:
+            return max(rqd.rqconstants.RQD_GRPC_METHOD_LIMITS[method], 1)
+        if method in cls.LAUNCH_METHODS:
+            return max(rqd.rqconstants.RQD_GRPC_LAUNCH_WORKERS, 1)
+        return max(rqd.rqconstants.RQD_GRPC_METHOD_CONCURRENCY, 1)
+
+    @contextlib.asynccontextmanager
+    async def __slot(self, method):
+        """Waits for a slot of the method, the call is counted as queued until then"""
+        semaphore = self.__semaphores.get(method)
+        if semaphore is None:
+            semaphore = self.__semaphores[method] = asyncio.Semaphore(self.getLimit(method))
+        queuedAt = time.time()
+        rqd.rqmetrics.GRPC_QUEUED_CALLS.inc(method=method)
+        try:
+            await semaphore.acquire()
+        finally:
+            rqd.rqmetrics.GRPC_QUEUED_CALLS.inc(-1, method=method)
+        rqd.rqmetrics.GRPC_QUEUE_SECONDS.observe(time.time() - queuedAt, method=method)
+        rqd.rqmetrics.GRPC_RUNNING_CALLS.inc(method=method)
+        try:
+            yield
+        finally:
+            rqd.rqmetrics.GRPC_RUNNING_CALLS.inc(-1, method=method)
+            semaphore.release()
+
+    async def runInline(self, method, request, context):
+        """Answers a call on the event loop"""
+        try:
+            return getattr(self.servicer, method)(request, ThreadContext(context))
+        except AbortCall as e:
+            await context.abort(e.code, e.details)
+        return None
+
+    async def runBlocking(self, method, request, context):
+        """Answers a call from the executor, once the method has a free slot"""
+        executor = self.launchExecutor if method in self.LAUNCH_METHODS else self.executor
+        try:
+            async with self.__slot(method):
+                return await asyncio.get_running_loop().run_in_executor(
+                    executor, getattr(self.servicer, method), request,
+                    ThreadContext(context))
+        except AbortCall as e:
+            await context.abort(e.code, e.details)
+        return None
+
+    async def runBlockingStream(self, method, request, context):
+        """Streams the responses of a call, produced one by one in the executor. The
+        stream holds a slot of the method until it ends."""
+        responses = getattr(self.servicer, method)(request, ThreadContext(context))
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.__slot(method):
+                while True:
+                    response = await loop.run_in_executor(
+                        self.executor, next, responses, _END)
+                    if response is _END:
+                        return
+                    yield response
+        except AbortCall as e:
+            await context.abort(e.code, e.details)
+        finally:
+            try:
+                responses.close()
+            except ValueError:
+                # Still producing in the executor, it stops once the call is inactive
+                pass
+
+    # Only read the state of rqd in memory
+    GetRunningFrameStatus = _inline("GetRunningFrameStatus")
+    RestartRqdNow = _inline("RestartRqdNow")
+    RestartRqdIdle = _inline("RestartRqdIdle")
+
+    LaunchFrame = _blocking("LaunchFrame")
+    # Builds the host report from /proc and the gpus
+    ReportStatus = _blocking("ReportStatus")
+    KillRunningFrame = _blocking("KillRunningFrame")
+    ShutdownRqdNow = _blocking("ShutdownRqdNow")
+    ShutdownRqdIdle = _blocking("ShutdownRqdIdle")
+    RebootNow = _blocking("RebootNow")
+    RebootIdle = _blocking("RebootIdle")
+    NimbyOn = _blocking("NimbyOn")
+    NimbyOff = _blocking("NimbyOff")
+    Lock = _blocking("Lock")
+    LockAll = _blocking("LockAll")
+    Unlock = _blocking("Unlock")
+    UnlockAll = _blocking("UnlockAll")
+    StreamFrameLog = _blockingStream("StreamFrameLog")
+
+    @staticmethod
+    async def GetRunFrame(request, context):
+        """Not implemented by rqd"""
+        await context.abort(grpc.StatusCode.UNIMPLEMENTED, "Method not implemented!")
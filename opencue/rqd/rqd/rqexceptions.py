@@ -35,3 +35,11 @@ class DuplicateFrameViolationException(Exception):
 
 class InvalidUserException(Exception):
     """RQD attempted to assume the role of an invalid user."""
+
+
+class InsufficientMemoryException(Exception):
+    """RQD refused to launch a frame because the host is short on memory."""
+
+    def __init__(self, message, reason):
+        super(InsufficientMemoryException, self).__init__(message)
+        self.reason = reason
@@ -0,0 +1,250 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""GPU telemetry backends.
+
+Memory values are in kB (1000 bytes), as historically reported by rqd for
+CUE_GPU_MEMORY."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import abc
+import logging
+import math
+import subprocess
+import time
+
+import rqd.rqconstants
+
+
+log = logging.getLogger(__name__)
+
+BACKEND_AUTO = "auto"
+BACKEND_NVML = "nvml"
+BACKEND_NVIDIA_SMI = "nvidia-smi"
+
+
+class GpuDevice(object):
+    """State of a single GPU"""
+    def __init__(self, index, memoryTotal, memoryFree, utilization=0):
+        """GpuDevice class initialization
+        @type  index: int
+        @param index: Index of the device, as used in CUDA_VISIBLE_DEVICES
+        @type  memoryTotal: int
+        @param memoryTotal: Total memory in kB
+        @type  memoryFree: int
+        @param memoryFree: Free memory in kB
+        @type  utilization: int
+        @param utilization: Percent of time a kernel was running over the last sample period"""
+        self.index = index
+        self.memoryTotal = memoryTotal
+        self.memoryFree = memoryFree
+        self.utilization = utilization
+
+    @property
+    def memoryUsed(self):
+        """Memory in use on the device in kB"""
+        return self.memoryTotal - self.memoryFree
+
+
+class GpuProcess(object):
+    """GPU usage of a single process, summed over the devices it uses"""
+    def __init__(self, pid, memoryUsed=0, utilization=0):
+        """GpuProcess class initialization
+        @type  pid: int
+        @param pid: Process id
+        @type  memoryUsed: int
+        @param memoryUsed: GPU memory used by the process in kB
+        @type  utilization: int
+        @param utilization: Percent of SM time used by the process, averaged over the
+                            samples of each device since the last call"""
+        self.pid = pid
+        self.memoryUsed = memoryUsed
+        self.utilization = utilization
+
+
+class GpuSample(object):
+    """A snapshot of the GPUs of the host"""
+    def __init__(self, devices, processes=None):
+        """GpuSample class initialization
+        @type  devices: list<GpuDevice>
+        @param devices: The GPUs of the host
+        @type  processes: dict or None
+        @param processes: { <pid> : GpuProcess } or None if the backend can't tell
+                          the usage per process"""
+        self.devices = devices
+        self.processes = processes
+        self.time = time.time()
+
+    def toResults(self):
+        """Returns the sample in the dict format of Machine.gpuResults"""
+        return {
+            'count': len(self.devices),
+            'total': int(sum(device.memoryTotal for device in self.devices)),
+            'free': int(sum(device.memoryFree for device in self.devices)),
+            'used': {str(device.index): device.memoryUsed for device in self.devices},
+            'utilization': {str(device.index): device.utilization for device in self.devices},
+            'processes': self.processes,
+            'updated': self.time,
+        }
+
+
+class GpuBackend(abc.ABC):
+    """Interface of the GPU telemetry backends"""
+
+    name = None
+    # How long a sample can be reused before sampling again
+    cacheSeconds = 0
+
+    @abc.abstractmethod
+    def sample(self):
+        """Samples the GPUs of the host
+        @rtype:  GpuSample
+        @return: The current state of the GPUs"""
+
+    def close(self):
+        """Releases the resources held by the backend"""
+
+
+class NvmlGpuBackend(GpuBackend):
+    """Samples the GPUs in-process through NVML, cheap enough for every RSS update"""
+
+    name = BACKEND_NVML
+    cacheSeconds = 1
+
+    def __init__(self):
+        """Initializes NVML, raises if pynvml or the driver are not available"""
+        # pylint: disable=import-outside-toplevel,import-error
+        import pynvml
+        # pylint: enable=import-outside-toplevel,import-error
+        self.__nvml = pynvml
+        self.__nvml.nvmlInit()
+        self.__handles = [self.__nvml.nvmlDeviceGetHandleByIndex(index)
+                          for index in range(self.__nvml.nvmlDeviceGetCount())]
+        # Last timestamp per device of the process utilization samples
+        self.__lastSeen = {}
+
+    def sample(self):
+        nvml = self.__nvml
+        devices = []
+        processes = {}
+        for index, handle in enumerate(self.__handles):
+            memory = nvml.nvmlDeviceGetMemoryInfo(handle)
+            utilization = nvml.nvmlDeviceGetUtilizationRates(handle)
+            devices.append(GpuDevice(index,
+                                     math.ceil(memory.total / 1000),
+                                     math.ceil(memory.free / 1000),
+                                     utilization.gpu))
+
+            running = list(nvml.nvmlDeviceGetComputeRunningProcesses(handle))
+            running += list(nvml.nvmlDeviceGetGraphicsRunningProcesses(handle))
+            for proc in running:
+                process = processes.setdefault(proc.pid, GpuProcess(proc.pid))
+                # usedGpuMemory is None when the driver can't tell, eg. on Windows WDDM
+                if proc.usedGpuMemory:
+                    process.memoryUsed += math.ceil(proc.usedGpuMemory / 1000)
+
+            try:
+                samples = nvml.nvmlDeviceGetProcessUtilization(
+                    handle, self.__lastSeen.get(index, 0))
+            # Raised when no process ran since the last sample, or unsupported
+            # pylint: disable=broad-except
+            except Exception:
+                samples = []
+            # { <pid> : [<sm utilization>, ...] } of the samples since the last call
+            deviceSamples = {}
+            for processSample in samples:
+                self.__lastSeen[index] = max(self.__lastSeen.get(index, 0),
+                                             processSample.timeStamp)
+                deviceSamples.setdefault(processSample.pid, []).append(processSample.smUtil)
+            for pid, smUtils in deviceSamples.items():
+                process = processes.setdefault(pid, GpuProcess(pid))
+                process.utilization += int(round(sum(smUtils) / len(smUtils)))
+        return GpuSample(devices, processes)
+
+    def close(self):
+        try:
+            self.__nvml.nvmlShutdown()
+        # pylint: disable=broad-except
+        except Exception:
+            pass
+
+
+class NvidiaSmiGpuBackend(GpuBackend):
+    """Parses the output of nvidia-smi. Forking it is slow, so samples are reused
+    for a minute and usage per process is not available."""
+
+    name = BACKEND_NVIDIA_SMI
+    cacheSeconds = 60
+
+    def sample(self):
+        output = subprocess.getoutput(
+            'nvidia-smi --query-gpu=memory.total,memory.free,count'
+            ' --format=csv,noheader')
+        devices = []
+        for index, line in enumerate(output.splitlines()):
+            # Example "16130 MiB, 16103 MiB, 8"
+            # 1 MiB = 1048.576 KB
+            fields = line.split()
+            devices.append(GpuDevice(index,
+                                     math.ceil(int(fields[0]) * 1048.576),
+                                     math.ceil(int(fields[2]) * 1048.576)))
+        return GpuSample(devices)
+
+
+class FakeGpuBackend(GpuBackend):
+    """Backend returning canned samples, for tests"""
+
+    name = "fake"
+
+    def __init__(self, devices=None, processes=None):
+        """FakeGpuBackend class initialization
+        @type  devices: list<GpuDevice>
+        @param devices: The GPUs to report
+        @type  processes: dict or None
+        @param processes: { <pid> : GpuProcess } to report"""
+        self.devices = devices or []
+        self.processes = processes
+        self.samples = 0
+
+    def sample(self):
+        self.samples += 1
+        return GpuSample(list(self.devices),
+                         None if self.processes is None else dict(self.processes))
+
+
+def getGpuBackend(name=None):
+    """Creates a GPU telemetry backend. In auto mode NVML is preferred and
+    nvidia-smi is used when pynvml or the driver library are missing.
+    @type  name: str
+    @param name: One of auto, nvml or nvidia-smi, defaults to GPU_TELEMETRY_BACKEND
+    @rtype:  GpuBackend
+    @return: The backend"""
+    name = name or rqd.rqconstants.GPU_TELEMETRY_BACKEND
+    if name in (BACKEND_AUTO, BACKEND_NVML):
+        try:
+            return NvmlGpuBackend()
+        # pylint: disable=broad-except
+        except Exception as e:
+            if name == BACKEND_NVML:
+                log.warning("NVML is not available (%s), falling back to nvidia-smi", e)
+            else:
+                log.info("NVML is not available (%s), using nvidia-smi", e)
+    elif name != BACKEND_NVIDIA_SMI:
+        log.warning("Unknown GPU telemetry backend %s, using nvidia-smi", name)
+    return NvidiaSmiGpuBackend()
@@ -0,0 +1,252 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Append-only journal of the running frames, used to recover them after a restart."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from google.protobuf.message import DecodeError
+
+import opencue_proto.rqd_pb2
+import rqd.rqconstants
+
+
+log = logging.getLogger(__name__)
+
+JOURNAL_MAGIC = b"RQDJ\x01"
+RECORD_LAUNCH = 1
+RECORD_UPDATE = 2
+RECORD_COMPLETE = 3
+# Payload length, record type and crc32 of the payload
+RECORD_HEADER = struct.Struct(">IBI")
+
+
+class FrameJournal(object):
+    """Journal of launch, update and complete records of the running frames.
+
+    The file starts with JOURNAL_MAGIC followed by records made of a RECORD_HEADER
+    and a payload: a serialized RunFrame for launch and update records and the
+    frame id for complete records. Records are appended and fsynced in batches, and
+    the file is atomically rewritten with only the live frames once enough records
+    pile up. Replay stops at the first truncated or corrupted record, which is all
+    a crash in the middle of a write can leave behind."""
+
+    # Identifies the kind of messages a journal file holds
+    MAGIC = JOURNAL_MAGIC
+
+    def __init__(self, path):
+        """FrameJournal class initialization
+        @type  path: string
+        @param path: Location of the journal file"""
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__file = None
+        # { <frame_id> : <serialized RunFrame>, ... }
+        self.__live = {}
+        self.__records = 0
+        self.__unsynced = 0
+        self.__lastSync = time.time()
+
+    def replay(self):
+        """Reads the journal and returns the frames that didn't complete.
+        The journal is compacted afterwards, dropping any damaged tail.
+        @rtype:  list
+        @return: List of rqd_pb2.RunFrame"""
+        with self.__lock:
+            self.__live = self.__read()
+            self.__compact()
+            live = list(self.__live.values())
+        return [self._parse(payload) for payload in live]
+
+    def recordLaunch(self, runFrame):
+        """Records a frame that started running
+        @type  runFrame: RunFrame
+        @param runFrame: rqd_pb2.RunFrame"""
+        self.__append(RECORD_LAUNCH, self._key(runFrame), runFrame.SerializeToString())
+
+    def recordUpdate(self, runFrame):
+        """Records the new state of a running frame, if it changed
+        @type  runFrame: RunFrame
+        @param runFrame: rqd_pb2.RunFrame
+        @rtype:  bool
+        @return: True if a record was written"""
+        payload = runFrame.SerializeToString()
+        frameId = self._key(runFrame)
+        with self.__lock:
+            if self.__live.get(frameId) == payload:
+                return False
+        self.__append(RECORD_UPDATE, frameId, payload)
+        return True
+
+    def recordComplete(self, frameId):
+        """Records a frame that is no longer running
+        @type  frameId: string
+        @param frameId: A frame's unique Id"""
+        with self.__lock:
+            if frameId not in self.__live:
+                return
+        self.__append(RECORD_COMPLETE, frameId, frameId.encode("utf-8"))
+
+    def sync(self, force=False):
+        """Flushes pending records to disk if the fsync batch is due and marks the
+        journal as fresh for BACKUP_CACHE_TIME_TO_LIVE_SECONDS
+        @type  force: bool
+        @param force: Fsync regardless of the batch settings"""
+        with self.__lock:
+            if self.__file is None:
+                return
+            if force or self.__syncDue():
+                self.__fsync()
+            os.utime(self.path)
+
+    def close(self):
+        """Syncs and closes the journal file"""
+        with self.__lock:
+            if self.__file is not None:
+                self.__fsync()
+                self.__file.close()
+                self.__file = None
+
+    def liveFrameIds(self):
+        """Returns the ids of the frames the journal considers running"""
+        with self.__lock:
+            return list(self.__live.keys())
+
+    @staticmethod
+    def _key(message):
+        """Returns the frame id of a journaled message"""
+        return message.frame_id
+
+    @staticmethod
+    def _parse(payload):
+        """Parses the payload of a launch or update record"""
+        runFrame = opencue_proto.rqd_pb2.RunFrame()
+        runFrame.ParseFromString(payload)
+        return runFrame
+
+    def __append(self, recordType, frameId, payload):
+        with self.__lock:
+            if self.__file is None:
+                # Start from a clean file holding only what is known to be live
+                self.__compact()
+            self.__file.write(
+                RECORD_HEADER.pack(len(payload), recordType, zlib.crc32(payload)) + payload)
+            self.__file.flush()
+            if recordType == RECORD_COMPLETE:
+                self.__live.pop(frameId, None)
+            else:
+                self.__live[frameId] = payload
+            self.__records += 1
+            self.__unsynced += 1
+
+            if self.__records >= rqd.rqconstants.BACKUP_CACHE_COMPACT_RECORDS and \
+                    self.__records > 2 * len(self.__live):
+                self.__compact()
+            elif self.__syncDue():
+                self.__fsync()
+
+    def __syncDue(self):
+        return self.__unsynced and (
+            self.__unsynced >= rqd.rqconstants.BACKUP_CACHE_FSYNC_BATCH or
+            time.time() - self.__lastSync >= rqd.rqconstants.BACKUP_CACHE_FSYNC_INTERVAL_SEC)
+
+    def __fsync(self):
+        if self.__unsynced:
+            os.fsync(self.__file.fileno())
+        self.__unsynced = 0
+        self.__lastSync = time.time()
+
+    def __read(self):
+        """Folds the journal records into { <frame_id> : <serialized RunFrame> }"""
+        live = {}
+        try:
+            with open(self.path, "rb") as journalFile:
+                data = journalFile.read()
+        except FileNotFoundError:
+            return live
+
+        if not data.startswith(self.MAGIC):
+            if data:
+                log.warning("Ignoring frame journal %s written in an unknown format", self.path)
+            return live
+
+        offset = len(self.MAGIC)
+        while offset < len(data):
+            start = offset + RECORD_HEADER.size
+            if start > len(data):
+                log.warning("Frame journal %s ends with a truncated record", self.path)
+                break
+            length, recordType, crc = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[start:start + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                log.warning("Frame journal %s has a damaged record at offset %d, "
+                            "ignoring the rest of it", self.path, offset)
+                break
+            offset = start + length
+
+            if recordType == RECORD_COMPLETE:
+                live.pop(payload.decode("utf-8", errors="ignore"), None)
+            elif recordType in (RECORD_LAUNCH, RECORD_UPDATE):
+                try:
+                    message = self._parse(payload)
+                except DecodeError:
+                    log.warning("Ignoring a frame journal record that failed to be parsed")
+                    continue
+                live[self._key(message)] = payload
+        return live
+
+    def __compact(self):
+        """Atomically replaces the journal with launch records of the live frames"""
+        tempPath = "%s.tmp" % self.path
+        with open(tempPath, "wb") as tempFile:
+            tempFile.write(self.MAGIC)
+            for payload in self.__live.values():
+                tempFile.write(RECORD_HEADER.pack(
+                    len(payload), RECORD_LAUNCH, zlib.crc32(payload)) + payload)
+            tempFile.flush()
+            os.fsync(tempFile.fileno())
+        os.replace(tempPath, self.path)
+        self.__fsyncDir()
+
+        if self.__file is not None:
+            self.__file.close()
+        # pylint: disable=consider-using-with
+        self.__file = open(self.path, "ab")
+        self.__records = len(self.__live)
+        self.__unsynced = 0
+        self.__lastSync = time.time()
+
+    def __fsyncDir(self):
+        """Makes the rename of a compacted journal durable"""
+        try:
+            dirFd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dirFd)
+        except OSError:
+            pass
+        finally:
+            os.close(dirFd)
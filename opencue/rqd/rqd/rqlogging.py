@@ -16,28 +16,198 @@
 """Logging module, handles logging to files and non-files"""
 
 
+import collections
+import gzip
+import json
 import logging
+import threading
 import time
 import os
 import datetime
 import platform
+import shutil
 
 import rqd.rqconstants
+import rqd.rqmetrics
 
 log = logging.getLogger(__name__)
 log.setLevel(rqd.rqconstants.CONSOLE_LOG_LEVEL)
 
 
+class LogTail(object):
+    """Last bytes written to a frame log, kept in memory so the log of a running frame
+    can be streamed to clients without reading it back from the log filesystem.
+    Offsets are byte offsets in the log."""
+
+    def __init__(self, maxBytes=None):
+        self.maxBytes = maxBytes or rqd.rqconstants.RQD_LOG_TAIL_BUFFER_BYTES
+        self.__cond = threading.Condition()
+        # [ (<offset>, <bytes>), ... ] oldest first
+        self.__chunks = collections.deque()
+        self.__size = 0
+        self.__end = 0
+        self.closed = False
+
+    def getRange(self):
+        """Returns the offsets of the first buffered byte and of the end of the log"""
+        with self.__cond:
+            return self.__end - self.__size, self.__end
+
+    def append(self, data):
+        """Adds bytes written to the log"""
+        if not data:
+            return
+        with self.__cond:
+            self.__chunks.append((self.__end, data))
+            self.__end += len(data)
+            self.__size += len(data)
+            while self.__size - len(self.__chunks[0][1]) >= self.maxBytes:
+                self.__size -= len(self.__chunks.popleft()[1])
+            self.__cond.notify_all()
+
+    def close(self):
+        """Marks the end of the log"""
+        with self.__cond:
+            self.closed = True
+            self.__cond.notify_all()
+
+    def read(self, offset, size):
+        """Returns up to size buffered bytes from offset, None if offset is before the
+        buffered bytes"""
+        with self.__cond:
+            if offset < self.__end - self.__size:
+                return None
+            data = []
+            for chunkOffset, chunk in self.__chunks:
+                chunkEnd = chunkOffset + len(chunk)
+                if chunkEnd <= offset:
+                    continue
+                data.append(chunk[max(offset - chunkOffset, 0):offset - chunkOffset + size])
+                size -= len(data[-1])
+                offset = chunkEnd
+                if size <= 0:
+                    break
+            return b"".join(data)
+
+    def wait(self, offset, timeout):
+        """Waits for bytes past offset to be written or for the log to be closed"""
+        with self.__cond:
+            if self.__end <= offset and not self.closed:
+                self.__cond.wait(timeout)
+
+    def findLastLines(self, lines, path=None):
+        """Returns the offset of the last lines of the log, reading the lines that
+        are no longer buffered from path"""
+        start, end = self.getRange()
+        data = self.read(start, end - start)
+        count = 0
+        # A trailing newline ends the last line rather than starting a new one
+        position = len(data) - 1 if data.endswith(b"\n") else len(data)
+        while True:
+            position = data.rfind(b"\n", 0, position)
+            if position < 0:
+                break
+            count += 1
+            if count == lines:
+                return start + position + 1
+        if start == 0 or path is None:
+            return start
+        try:
+            with open(path, "rb") as fp:
+                while start > 0:
+                    blockStart = max(start - rqd.rqconstants.RQD_LOG_STREAM_CHUNK_BYTES, 0)
+                    fp.seek(blockStart)
+                    block = fp.read(start - blockStart)
+                    position = len(block)
+                    while True:
+                        position = block.rfind(b"\n", 0, position)
+                        if position < 0:
+                            break
+                        count += 1
+                        if count == lines:
+                            return blockStart + position + 1
+                    start = blockStart
+        except (OSError, IOError) as e:
+            log.warning("Failed to read the log %s: %s", path, e)
+            return self.getRange()[0]
+        return 0
+
+
+def streamLog(tail, path=None, offset=0, maxBytes=0, lastLines=0, follow=False,
+              isActive=None):
+    """Yields the chunks of a frame log as (<offset>, <bytes>, <eof>). Buffered bytes
+    are read from memory, older ones from the frame's local log file.
+    @type  tail: LogTail
+    @param tail: Tail of the log
+    @type  path: str
+    @param path: Log file, None if the log is only kept in memory
+    @type  offset: int
+    @param offset: Byte offset to start from
+    @type  maxBytes: int
+    @param maxBytes: Stop after this many bytes, 0 for no limit
+    @type  lastLines: int
+    @param lastLines: Start from the last lines of the log instead of offset
+    @type  follow: bool
+    @param follow: Keep yielding what is written until the log is closed
+    @type  isActive: callable
+    @param isActive: Returns False once the client went away"""
+    if lastLines > 0:
+        offset = tail.findLastLines(lastLines, path)
+    offset = max(offset, 0)
+    sent = 0
+    while isActive is None or isActive():
+        size = rqd.rqconstants.RQD_LOG_STREAM_CHUNK_BYTES
+        if maxBytes:
+            size = min(size, maxBytes - sent)
+            if size <= 0:
+                return
+        data = tail.read(offset, size)
+        if data is None:
+            start = tail.getRange()[0]
+            data = _readLogFile(path, offset, min(size, start - offset))
+            if not data:
+                # The log file is gone or out of reach, skip to the buffered bytes
+                offset = start
+                continue
+        if data:
+            yield offset, data, False
+            offset += len(data)
+            sent += len(data)
+            continue
+        if tail.closed:
+            yield offset, b"", True
+            return
+        if not follow:
+            return
+        tail.wait(offset, rqd.rqconstants.RQD_LOG_STREAM_POLL_SEC)
+
+
+def _readLogFile(path, offset, size):
+    """Reads bytes of a log file, empty if it can't be read"""
+    if path is None:
+        return b""
+    try:
+        with open(path, "rb") as fp:
+            fp.seek(offset)
+            return fp.read(size)
+    except (OSError, IOError) as e:
+        log.warning("Failed to read the log %s: %s", path, e)
+        return b""
+
+
 class RqdLogger(object):
     """Class to abstract file logging, this class tries to act as a file object"""
     filepath = None
     fd = None
     type = 0
+    tail = None
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, append=False):
         """RQDLogger class initialization
            @type    filepath: string
            @param   filepath: The filepath to log to
+           @type    append: bool
+           @param   append: Appends to an existing log instead of rotating it
         """
 
         self.filepath = filepath
@@ -66,9 +236,9 @@ class RqdLogger(object):
 
         try:
             # Rotate any old logs to a max of MAX_LOG_FILES:
-            if os.path.isfile(self.filepath):
+            if not append and os.path.isfile(self.filepath):
                 rotateCount = 1
-                while (os.path.isfile("%s.%s" % (self.filepath, rotateCount))
+                while (findRotatedLog(self.filepath, rotateCount) is not None
                        and rotateCount < rqd.rqconstants.MAX_LOG_FILES):
                     rotateCount += 1
                 os.rename(self.filepath,
@@ -84,7 +254,8 @@ class RqdLogger(object):
             else:
                 raise RuntimeError(err)
         # pylint: disable=consider-using-with
-        self.fd = open(self.filepath, "w+", 1, encoding='utf-8')
+        self.fd = open(self.filepath, "a" if append else "w+", 1, encoding='utf-8')
+        self.tail = LogTail()
         try:
             os.chmod(self.filepath, 0o666)
         # pylint: disable=broad-except
@@ -104,7 +275,9 @@ class RqdLogger(object):
             for line in lines:
                 print("[%s] %s" % (curr_line_timestamp, line), file=self)
         else:
+            rqd.rqmetrics.LOG_BYTES.inc(len(data), destination="file")
             self.fd.write(data)
+            self.tail.append(data.encode('utf-8'))
 
     def writelines(self, __lines):
         """Provides support for writing mutliple lines at a time"""
@@ -114,6 +287,7 @@ class RqdLogger(object):
     def close(self):
         """Closes the file if the backend is file based"""
         self.fd.close()
+        self.tail.close()
 
     def waitForFile(self, maxTries=5):
         """Waits for the file to exist before continuing when using a file backend"""
@@ -132,15 +306,529 @@ class RqdLogger(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
-class LokiLogger(object):
-    """Class for logging to a loki server. It mimics a file object as much as possible"""
-    def __init__(self, lokiURL, runFrame):
+# Suffix of the rotated logs per compression
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# Seconds between two enforcements of the retention of a job log directory
+RETENTION_INTERVAL_SEC = 60
+
+
+def findRotatedLog(filepath, number):
+    """Returns the path of a rotated log, compressed or not, None if there is none
+    @type  filepath: str
+    @param filepath: The current log of the frame
+    @type  number: int
+    @param number: The number of the rotated log"""
+    path = "%s.%d" % (filepath, number)
+    if os.path.isfile(path):
+        return path
+    if rqd.rqconstants.RQD_LOG_COMPRESSION:
+        for suffix in COMPRESSED_SUFFIXES.values():
+            if os.path.isfile(path + suffix):
+                return path + suffix
+    return None
+
+
+def getCompression():
+    """Returns the compression of the rotated logs, None when disabled"""
+    compression = rqd.rqconstants.RQD_LOG_COMPRESSION.strip().lower()
+    if not compression:
+        return None
+    if compression == "zstd":
         try:
-            # pylint: disable=import-outside-toplevel
-            from loki_urllib3_client import LokiClient
+            # pylint: disable=import-outside-toplevel,unused-import
+            import zstandard
+            return compression
         except ImportError:
-            return
-        self.client = LokiClient(url=lokiURL)
+            log.warning("zstandard is not available, compressing the logs with gzip")
+    elif compression != "gzip":
+        log.warning("Unknown log compression %s, compressing the logs with gzip", compression)
+    return "gzip"
+
+
+def compressLog(path, compression):
+    """Compresses a log next to itself and removes it, keeping its mode and times
+    @type  path: str
+    @param path: The log
+    @type  compression: str
+    @param compression: gzip or zstd
+    @rtype:  str
+    @return: The path of the compressed log"""
+    target = path + COMPRESSED_SUFFIXES[compression]
+    partial = target + ".partial"
+    stat = os.stat(path)
+    try:
+        with open(path, "rb") as src, open(partial, "wb") as dst:
+            if compression == "zstd":
+                # pylint: disable=import-outside-toplevel
+                import zstandard
+                with zstandard.ZstdCompressor().stream_writer(dst, closefd=False) as writer:
+                    shutil.copyfileobj(src, writer, 1024 * 1024)
+            else:
+                with gzip.GzipFile(fileobj=dst, mode="wb", mtime=stat.st_mtime) as writer:
+                    shutil.copyfileobj(src, writer, 1024 * 1024)
+        os.chmod(partial, stat.st_mode & 0o777)
+        os.utime(partial, (stat.st_atime, stat.st_mtime))
+        os.rename(partial, target)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.remove(path)
+    rqd.rqmetrics.LOG_COMPRESSION_BYTES.inc(stat.st_size, state="raw")
+    rqd.rqmetrics.LOG_COMPRESSION_BYTES.inc(os.path.getsize(target), state="compressed")
+    return target
+
+
+def enforceRetention(logDir, maxCount, maxBytes):
+    """Removes the rotated logs of a job log directory, oldest first, until at most
+    maxCount of them and maxBytes remain. The current logs of the frames are never
+    removed. The remaining rotated logs of the frames that lost some are renumbered
+    from 1, so the next rotations keep their order.
+    @type  logDir: str
+    @param logDir: The job log directory
+    @type  maxCount: int
+    @param maxCount: Rotated logs kept, 0 for no limit
+    @type  maxBytes: int
+    @param maxBytes: Total size of the rotated logs kept, 0 for no limit
+    @rtype:  int
+    @return: Number of logs removed"""
+    # [ (<mtime>, <size>, <current log>, <number>, <suffix>), ... ]
+    rotated = []
+    for entry in os.scandir(logDir):
+        name, number, suffix = _parseRotatedLog(entry.name)
+        if name is None or not entry.is_file():
+            continue
+        stat = entry.stat()
+        rotated.append((stat.st_mtime, stat.st_size, os.path.join(logDir, name), number,
+                        suffix))
+    rotated.sort()
+    count = len(rotated)
+    total = sum(size for _, size, _, _, _ in rotated)
+    removed = set()
+    for _, size, filepath, number, suffix in rotated:
+        if (not maxCount or count <= maxCount) and (not maxBytes or total <= maxBytes):
+            break
+        path = "%s.%d%s" % (filepath, number, suffix)
+        try:
+            os.remove(path)
+        except OSError as e:
+            log.warning("Failed to remove the log %s: %s", path, e)
+            continue
+        count -= 1
+        total -= size
+        removed.add((filepath, number))
+    for filepath in set(filepath for filepath, _ in removed):
+        remaining = sorted((number, suffix) for _, _, current, number, suffix in rotated
+                           if current == filepath and (current, number) not in removed)
+        for newNumber, (number, suffix) in enumerate(remaining, 1):
+            if newNumber != number:
+                os.rename("%s.%d%s" % (filepath, number, suffix),
+                          "%s.%d%s" % (filepath, newNumber, suffix))
+    rqd.rqmetrics.LOG_RETENTION_REMOVED.inc(len(removed))
+    return len(removed)
+
+
+def _parseRotatedLog(name):
+    """Splits the name of a rotated log in the name of the current log, the number
+    and the compression suffix, (None, None, None) for other files"""
+    for suffix in ("",) + tuple(COMPRESSED_SUFFIXES.values()):
+        if suffix and not name.endswith(suffix):
+            continue
+        base, _, number = name[:len(name) - len(suffix)].rpartition(".")
+        if base.endswith(".rqlog") and number.isdigit():
+            return base, int(number), suffix
+    return None, None, None
+
+
+class LogCompressor(threading.Thread):
+    """Background thread handling the logs of completed frames.
+
+    The logs of the previous attempts of a frame are compressed with
+    RQD_LOG_COMPRESSION, then the retention of its job log directory is enforced,
+    at most every RETENTION_INTERVAL_SEC per directory. The thread runs at the
+    lowest cpu priority, which also lowers its io priority on Linux."""
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="LogCompressor")
+        self.daemon = True
+        # Current logs of completed frames, in completion order
+        self.__queue = collections.OrderedDict()
+        self.__cond = threading.Condition()
+        self.__busy = False
+        # { <log dir> : <time the retention was last enforced> }
+        self.__retentionTimes = {}
+
+    def submit(self, filepath):
+        """Queues the log of a completed frame"""
+        with self.__cond:
+            self.__queue[filepath] = True
+            self.__cond.notify_all()
+
+    def run(self):
+        if platform.system() == "Linux":
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError as e:
+                log.warning("Failed to lower the priority of the log compression: %s", e)
+        while True:
+            with self.__cond:
+                while not self.__queue:
+                    self.__busy = False
+                    self.__cond.notify_all()
+                    self.__cond.wait()
+                self.__busy = True
+                filepath, _ = self.__queue.popitem(last=False)
+            try:
+                self.process(filepath)
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to compress the logs of %s", filepath)
+
+    def waitIdle(self, timeout=None):
+        """Waits for the queued logs to be handled
+        @rtype:  bool
+        @return: False on timeout"""
+        with self.__cond:
+            return self.__cond.wait_for(lambda: not self.__queue and not self.__busy, timeout)
+
+    def process(self, filepath):
+        """Compresses the rotated logs of a frame and enforces the retention of its
+        directory"""
+        compression = getCompression()
+        if compression is not None:
+            for number in range(1, rqd.rqconstants.MAX_LOG_FILES + 1):
+                path = "%s.%d" % (filepath, number)
+                if os.path.isfile(path):
+                    compressLog(path, compression)
+        maxCount = rqd.rqconstants.RQD_LOG_RETENTION_COUNT
+        maxBytes = rqd.rqconstants.RQD_LOG_RETENTION_BYTES
+        if maxCount or maxBytes:
+            logDir = os.path.dirname(filepath)
+            now = time.time()
+            if now - self.__retentionTimes.get(logDir, 0) >= RETENTION_INTERVAL_SEC:
+                self.__retentionTimes[logDir] = now
+                enforceRetention(logDir, maxCount, maxBytes)
+
+
+_logCompressor = None
+_logCompressorLock = threading.Lock()
+
+
+def submitCompletedLog(filepath):
+    """Hands the log of a completed frame to the LogCompressor, when the compression
+    or the retention of the logs is enabled"""
+    global _logCompressor  # pylint: disable=global-statement
+    if not (rqd.rqconstants.RQD_LOG_COMPRESSION or rqd.rqconstants.RQD_LOG_RETENTION_COUNT
+            or rqd.rqconstants.RQD_LOG_RETENTION_BYTES):
+        return
+    with _logCompressorLock:
+        if _logCompressor is None or not _logCompressor.is_alive():
+            _logCompressor = LogCompressor()
+            _logCompressor.start()
+        _logCompressor.submit(filepath)
+
+
+class LokiStream(object):
+    """Lines of a single Loki stream (one frame) waiting to be pushed"""
+    def __init__(self, labels, spill=None):
+        self.labels = labels
+        self.spill = spill
+        self.lines = []
+        self.bytes = 0
+        self.firstTime = 0
+        self.pending = 0
+        self.flushRequested = False
+        self.dropped = 0
+        self.spilled = 0
+
+
+class LokiShipper(threading.Thread):
+    """Background thread that ships frame log lines to a Loki server.
+
+    Lines are queued by LokiLogger.write and grouped per stream. A stream is pushed
+    once it reaches LOKI_BATCH_MAX_LINES lines, LOKI_BATCH_MAX_BYTES bytes or has
+    waited LOKI_BATCH_MAX_WAIT_SEC, using gzip compressed push requests. Writers are
+    only held back when the bounded queue is full, after which LOKI_DROP_POLICY is
+    applied. Batches that can't be delivered are handed to the stream's spill
+    callback, usually the frame's local log file."""
+
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+    def __init__(self, lokiURL):
+        threading.Thread.__init__(self, name="LokiShipper")
+        self.daemon = True
+        self.pushUrl = "%s/loki/api/v1/push" % lokiURL.rstrip("/")
+        self.readyUrl = "%s/ready" % lokiURL.rstrip("/")
+        self.__queue = collections.deque()
+        self.__cond = threading.Condition()
+        self.__buffered = set()
+        self.__interrupt = False
+        self.__retryAfter = 0
+        self.__unreachableBackoff = 0
+        self.__stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "blocked": 0,
+            "pushes": 0,
+            "push_failures": 0,
+        }
+
+    def getStats(self):
+        """Returns a copy of the shipping counters"""
+        with self.__cond:
+            stats = dict(self.__stats)
+            stats["queued"] = len(self.__queue)
+        return stats
+
+    def register(self, labels, spill=None):
+        """Creates a new stream
+        @type  labels: dict
+        @param labels: Loki labels attached to every line of the stream
+        @type  spill: callable
+        @param spill: Receives the lines that couldn't be delivered, returns True if
+                      they were stored
+        @rtype:  LokiStream"""
+        return LokiStream(labels, spill)
+
+    def enqueue(self, stream, line):
+        """Queues a line for the given stream, blocking for at most
+        LOKI_ENQUEUE_TIMEOUT_SEC when the queue is full.
+        @rtype:  bool
+        @return: False if the line was dropped"""
+        entry = (stream, [str(time.time_ns()), line])
+        with self.__cond:
+            maxLines = max(1, rqd.rqconstants.LOKI_QUEUE_MAX_LINES)
+            if len(self.__queue) >= maxLines:
+                self.__stats["blocked"] += 1
+                deadline = time.time() + rqd.rqconstants.LOKI_ENQUEUE_TIMEOUT_SEC
+                while len(self.__queue) >= maxLines and not self.__interrupt:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.__cond.wait(remaining)
+            if len(self.__queue) >= maxLines:
+                if rqd.rqconstants.LOKI_DROP_POLICY == self.DROP_NEWEST:
+                    self.__drop(stream)
+                    return False
+                oldStream, _ = self.__queue.popleft()
+                self.__drop(oldStream)
+                oldStream.pending -= 1
+            self.__queue.append(entry)
+            stream.pending += 1
+            self.__stats["enqueued"] += 1
+            self.__cond.notify_all()
+        return True
+
+    def __drop(self, stream):
+        """Accounts for a dropped line. Must be called with the lock held"""
+        self.__stats["dropped"] += 1
+        stream.dropped += 1
+        self.__cond.notify_all()
+
+    def flush(self, stream, timeout):
+        """Waits for every queued line of the stream to be shipped or spilled
+        @rtype:  bool
+        @return: True if nothing is left pending"""
+        deadline = time.time() + timeout
+        with self.__cond:
+            stream.flushRequested = True
+            self.__cond.notify_all()
+            while stream.pending > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.__cond.wait(remaining)
+        return True
+
+    def stop(self):
+        """Ships everything left and stops the thread"""
+        with self.__cond:
+            self.__interrupt = True
+            self.__cond.notify_all()
+
+    def __nextDeadline(self, now):
+        """Seconds until a buffered stream has to be pushed, None if nothing is buffered"""
+        deadline = None
+        for stream in self.__buffered:
+            if stream.flushRequested:
+                return 0
+            remaining = stream.firstTime + rqd.rqconstants.LOKI_BATCH_MAX_WAIT_SEC - now
+            if deadline is None or remaining < deadline:
+                deadline = remaining
+        return deadline
+
+    def run(self):
+        while True:
+            with self.__cond:
+                while not self.__queue and not self.__interrupt:
+                    timeout = self.__nextDeadline(time.time())
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.__cond.wait(timeout)
+                entries = list(self.__queue)
+                self.__queue.clear()
+                interrupted = self.__interrupt
+                # Wake up writers waiting on a full queue
+                self.__cond.notify_all()
+
+            now = time.time()
+            for stream, value in entries:
+                if not stream.lines:
+                    stream.firstTime = now
+                stream.lines.append(value)
+                stream.bytes += len(value[1])
+                self.__buffered.add(stream)
+
+            self.__shipReady(now, interrupted)
+            if interrupted:
+                return
+
+    def __shipReady(self, now, force=False):
+        """Pushes the streams that reached one of the batch limits"""
+        ready = [stream for stream in self.__buffered
+                 if force or stream.flushRequested
+                 or len(stream.lines) >= rqd.rqconstants.LOKI_BATCH_MAX_LINES
+                 or stream.bytes >= rqd.rqconstants.LOKI_BATCH_MAX_BYTES
+                 or now - stream.firstTime >= rqd.rqconstants.LOKI_BATCH_MAX_WAIT_SEC]
+        for stream in ready:
+            self.__buffered.discard(stream)
+        for batch in self.__makeBatches(ready):
+            self.__shipBatch(batch)
+
+    @staticmethod
+    def __makeBatches(streams):
+        """Splits the buffered lines of the given streams into push requests that
+        respect LOKI_BATCH_MAX_LINES and LOKI_BATCH_MAX_BYTES"""
+        maxLines = max(1, rqd.rqconstants.LOKI_BATCH_MAX_LINES)
+        maxBytes = max(1, rqd.rqconstants.LOKI_BATCH_MAX_BYTES)
+        batches = []
+        batch = []
+        count = size = 0
+        for stream in streams:
+            lines = stream.lines
+            stream.lines = []
+            stream.bytes = 0
+            start = 0
+            for index, value in enumerate(lines):
+                if count and (count >= maxLines or size >= maxBytes):
+                    if index > start:
+                        batch.append((stream, lines[start:index]))
+                    start = index
+                    batches.append(batch)
+                    batch = []
+                    count = size = 0
+                count += 1
+                size += len(value[1])
+            if len(lines) > start:
+                batch.append((stream, lines[start:]))
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __shipBatch(self, batch):
+        """Pushes a batch, spilling it if Loki is unreachable"""
+        sent = time.time() >= self.__retryAfter and self.__push(batch)
+        for stream, lines in batch:
+            stored = False
+            if not sent and stream.spill is not None:
+                try:
+                    stored = stream.spill([line for _, line in lines])
+                # pylint: disable=broad-except
+                except Exception as e:
+                    log.warning("Failed to spill loki lines: %s", e)
+            with self.__cond:
+                if sent:
+                    self.__stats["sent"] += len(lines)
+                elif stored:
+                    self.__stats["spilled"] += len(lines)
+                    stream.spilled += len(lines)
+                else:
+                    self.__stats["dropped"] += len(lines)
+                    stream.dropped += len(lines)
+                stream.pending -= len(lines)
+                self.__cond.notify_all()
+
+    def __push(self, batch):
+        """Sends a gzip compressed push request to Loki
+        @rtype:  bool
+        @return: True if Loki accepted the batch"""
+        # Only imported once logs are shipped to Loki
+        # pylint: disable=import-outside-toplevel
+        import urllib.error
+        import urllib.request
+        payload = {"streams": [{"stream": stream.labels, "values": lines}
+                               for stream, lines in batch]}
+        body = gzip.compress(json.dumps(payload).encode("utf-8"))
+        request = urllib.request.Request(
+            self.pushUrl, data=body, method="POST",
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        error = None
+        for attempt in range(rqd.rqconstants.LOKI_PUSH_RETRIES + 1):
+            if attempt:
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 5))
+            try:
+                with self.__cond:
+                    self.__stats["pushes"] += 1
+                with urllib.request.urlopen(
+                        request, timeout=rqd.rqconstants.LOKI_PUSH_TIMEOUT_SEC) as response:
+                    response.read()
+                self.__unreachableBackoff = 0
+                return True
+            except urllib.error.HTTPError as e:
+                error = e
+                # Client errors won't be fixed by sending the same request again
+                if 400 <= e.code < 500 and e.code != 429:
+                    break
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+        with self.__cond:
+            self.__stats["push_failures"] += 1
+        # Stop hammering an unreachable server, batches get spilled meanwhile
+        self.__unreachableBackoff = min(max(1, self.__unreachableBackoff * 2), 60)
+        self.__retryAfter = time.time() + self.__unreachableBackoff
+        log.warning("Failed to push %d lines to loki at %s: %s",
+                    sum(len(lines) for _, lines in batch), self.pushUrl, error)
+        return False
+
+    def isReady(self):
+        """Returns whether the Loki server is ready to receive lines"""
+        # pylint: disable=import-outside-toplevel
+        import urllib.error
+        import urllib.request
+        try:
+            with urllib.request.urlopen(
+                    self.readyUrl, timeout=rqd.rqconstants.LOKI_PUSH_TIMEOUT_SEC) as response:
+                response.read()
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+
+_lokiShippers = {}
+_lokiShippersLock = threading.Lock()
+
+
+def getLokiShipper(lokiURL):
+    """Returns the running LokiShipper for the given server, starting it if needed"""
+    with _lokiShippersLock:
+        shipper = _lokiShippers.get(lokiURL)
+        if shipper is None or not shipper.is_alive():
+            shipper = LokiShipper(lokiURL)
+            shipper.start()
+            _lokiShippers[lokiURL] = shipper
+        return shipper
+
+
+class LokiLogger(object):
+    """Class for logging to a loki server. It mimics a file object as much as possible.
+    Lines are shipped in batches by a shared LokiShipper thread and spilled to the
+    frame's local log file when Loki can't be reached."""
+    def __init__(self, lokiURL, runFrame):
+        # Lines are only kept in memory for streaming, there is no local log file
+        self.tail = LogTail()
         self.runFrame = runFrame
         self.sessionStartTime = datetime.datetime.now().timestamp()
         self.defaultLogData = {
@@ -151,12 +839,17 @@ class LokiLogger(object):
             'frame_id': self.runFrame.frame_id,
             'session_start_time': str(self.sessionStartTime)
         }
+        self.spillLogger = None
+        self.__spillLock = threading.Lock()
+        self.__closed = False
+        self.shipper = getLokiShipper(lokiURL)
+        self.stream = self.shipper.register(self.defaultLogData, self.spill)
 
     def waitForFile(self, maxTries=5):
         """Waits for the connection to be ready before continuing"""
         tries = 0
         while tries < maxTries:
-            if self.client.ready() is True:
+            if self.shipper.isReady():
                 return
             tries += 1
             time.sleep(0.5 * tries)
@@ -168,21 +861,47 @@ class LokiLogger(object):
         Provides write function for writing to loki server.
         Ignores prepentTimeStamp which is redundant with Loki
         """
-        if len(data.strip()) == 0:
-            return
         if isinstance(data, bytes):
             data = data.decode('utf-8', errors='ignore')
-        requestStatus, requestCode = self.client.post(self.defaultLogData, [data.strip()])
-        if requestStatus is not True:
-            raise IOError(f"Failed to write log to loki server with error : {requestCode}")
+        data = data.strip()
+        if len(data) == 0:
+            return
+        rqd.rqmetrics.LOG_BYTES.inc(len(data), destination="loki")
+        self.tail.append(data.encode('utf-8') + b"\n")
+        self.shipper.enqueue(self.stream, data)
 
     def writelines(self, __lines):
         """Provides support for writing mutliple lines at a time"""
         for line in __lines:
             self.write(line)
 
+    def spill(self, lines):
+        """Writes lines that couldn't be delivered to loki into the frame's log file"""
+        with self.__spillLock:
+            if self.__closed:
+                return False
+            if self.spillLogger is None:
+                if not self.runFrame.log_dir_file:
+                    return False
+                log.warning("Loki unreachable, spilling logs to %s", self.runFrame.log_dir_file)
+                self.spillLogger = RqdLogger(self.runFrame.log_dir_file, append=True)
+            for line in lines:
+                self.spillLogger.write(line + "\n")
+        return True
+
     def close(self):
-        """Dummy function since cloasing it not necessary for the http connection"""
+        """Waits for the pending lines to be shipped"""
+        if not self.shipper.flush(self.stream, rqd.rqconstants.LOKI_CLOSE_TIMEOUT_SEC):
+            log.warning("Timed out shipping logs to loki for %s", self.runFrame.frame_id)
+        if self.stream.dropped or self.stream.spilled:
+            log.warning("Loki stream for %s dropped %d lines and spilled %d lines",
+                        self.runFrame.frame_id, self.stream.dropped, self.stream.spilled)
+        with self.__spillLock:
+            self.__closed = True
+            self.stream.spill = None
+            if self.spillLogger is not None:
+                self.spillLogger.close()
+        self.tail.close()
 
     def __enter__(self):
         return self
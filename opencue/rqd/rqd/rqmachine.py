@@ -28,7 +28,6 @@ import codecs
 import ctypes
 import errno
 import logging
-import math
 import os
 import platform
 import re
@@ -56,7 +55,10 @@ import opencue_proto.host_pb2
 import opencue_proto.report_pb2
 import rqd.rqconstants
 import rqd.rqexceptions
+import rqd.rqgpu
+import rqd.rqmetrics
 import rqd.rqswap
+import rqd.rqtopology
 import rqd.rqutil
 
 
@@ -66,16 +68,23 @@ KILOBYTE = 1024
 
 class Machine(object):
     """Gathers information about the machine and resources"""
-    def __init__(self, rqCore, coreInfo):
+    def __init__(self, rqCore, coreInfo, deferProbes=False):
         """Machine class initialization
         @type   rqCore: rqd.rqcore.RqCore
         @param  rqCore: Main RQD Object, used to access frames and nimby states
         @type  coreInfo: opencue_proto.report_pb2.CoreDetail
         @param coreInfo: Object contains information on the state of all cores
+        @type  deferProbes: bool
+        @param deferProbes: Leaves the gpu probe to the caller, which runs setupGpu
+                            before the boot report. The cpu topology is always read
+                            here, frames can't be launched or recovered without it.
         """
         self.__rqCore = rqCore
         self.__coreInfo = coreInfo
         self.__gpusets = set()
+        self.__gpuBackend = None
+        # The gpus are only sampled once setupGpu ran, sampling them can take seconds
+        self.__gpuReady = False
 
         # A dictionary built from /proc/cpuinfo containing
         # { <physical id> : { <core_id> : set([<processor>, <processor>, ...]), ... }, ... }
@@ -85,12 +94,22 @@ class Machine(object):
         # { <processor> : (<physical id>, <core_id>), ... }
         self.__physid_and_coreid_by_proc = {}
 
+        self.__topology = None
+        self.__coreAllocator = None
+
+        # { <frame_id> : (<time>, <read bytes>, <write bytes>) }
+        self.__ioHistory = {}
+        # { <resource>_<some|full> : (<time>, <microseconds stalled>) }
+        self.__pressureHistory = {}
+
         if platform.system() == 'Linux':
-            self.__vmstat = rqd.rqswap.VmStat()
+            self.__vmstat = rqd.rqswap.VmStat(rqCore.scheduler)
 
         self.state = opencue_proto.host_pb2.UP
 
         self.__renderHost = opencue_proto.report_pb2.RenderHost()
+        # Time of the last update of the dynamic fields of the renderHost struct
+        self.__renderHostTime = None
         self.__initMachineTags()
         self.__initMachineStats()
 
@@ -106,8 +125,9 @@ class Machine(object):
 
         self.__pidHistory = {}
 
-        self.setupGpu()
         self.setupTaskset()
+        if not deferProbes:
+            self.setupGpu()
 
     def isNimbySafeToRunJobs(self):
         """Returns False if nimby should be triggered due to resource limits"""
@@ -180,11 +200,18 @@ class Machine(object):
                     return True
         return False
 
-    def __updateGpuAndLlu(self, frame):
+    def __updateGpuAndLlu(self, frame, framePids=None):
         if 'GPU_LIST' in frame.runFrame.attributes:
+            gpuProcesses = self.getGpuProcesses()
             usedGpuMemory = 0
-            for unitId in frame.runFrame.attributes.get('GPU_LIST').split(','):
-                usedGpuMemory += self.getGpuMemoryUsed(unitId)
+            if gpuProcesses is not None and framePids is not None:
+                # Only count what the frame's own processes use
+                for pid in framePids:
+                    if int(pid) in gpuProcesses:
+                        usedGpuMemory += gpuProcesses[int(pid)].memoryUsed
+            else:
+                for unitId in frame.runFrame.attributes.get('GPU_LIST').split(','):
+                    usedGpuMemory += self.getGpuMemoryUsed(unitId)
 
             frame.usedGpuMemory = usedGpuMemory
             frame.maxUsedGpuMemory = max(usedGpuMemory, frame.maxUsedGpuMemory)
@@ -331,6 +358,7 @@ class Machine(object):
             bootTime = self.getBootTime()
 
             values = list(frames.values())
+            ioData = {"time": time.time()}
             for frame in values:
                 if frame.pid is not None and frame.pid > 0:
                     session = str(frame.pid)
@@ -429,16 +457,97 @@ class Machine(object):
                     frame.maxVsize = max(vsize, frame.maxVsize)
 
                     frame.runFrame.attributes["pcpu"] = str(pcpu)
+                    frame.pids = sessions[session]
+                    self.__updateFrameIo(frame, sessions[session], ioData)
 
-                    self.__updateGpuAndLlu(frame)
+                    self.__updateGpuAndLlu(frame, sessions[session])
 
             # Store the current data for the next check
             self.__pidHistory = pidData
+            self.__ioHistory = ioData
 
         # pylint: disable=broad-except
         except Exception as e:
             log.exception('Failure with rss update due to: %s', e)
 
+    def __updateFrameIo(self, frame, framePids, ioData):
+        """Sums the io of the processes of a frame into its attributes, rates are
+        computed from the totals of the previous rss update"""
+        readBytes = writeBytes = 0
+        for pid in framePids:
+            procIo = self._getProcIo(pid)
+            if procIo is not None:
+                readBytes += procIo[0]
+                writeBytes += procIo[1]
+        now = ioData["time"]
+        ioData[frame.frameId] = (now, readBytes, writeBytes)
+
+        attributes = frame.runFrame.attributes
+        attributes["io_read_bytes"] = str(readBytes)
+        attributes["io_write_bytes"] = str(writeBytes)
+        if frame.frameId in self.__ioHistory:
+            oldTime, oldReadBytes, oldWriteBytes = self.__ioHistory[frame.frameId]
+            if now > oldTime:
+                # Totals drop when processes exit before their parent collects them
+                attributes["io_read_rate"] = str(
+                    int(max(readBytes - oldReadBytes, 0) / (now - oldTime)))
+                attributes["io_write_rate"] = str(
+                    int(max(writeBytes - oldWriteBytes, 0) / (now - oldTime)))
+
+    def _getProcIo(self, pid):
+        """Returns the bytes a process read from and wrote to storage, None if
+        /proc/<pid>/io can't be read"""
+        readBytes = writeBytes = None
+        try:
+            with open(rqd.rqconstants.PATH_PROC_PID_IO.format(pid), "r",
+                      encoding='utf-8') as ioFile:
+                for line in ioFile:
+                    if line.startswith("read_bytes:"):
+                        readBytes = int(line.split()[1])
+                    elif line.startswith("write_bytes:"):
+                        writeBytes = int(line.split()[1])
+        except (OSError, IOError, ValueError, IndexError):
+            # Exited, or owned by another user when rqd doesn't run as root
+            return None
+        if readBytes is None or writeBytes is None:
+            return None
+        return readBytes, writeBytes
+
+    def getPressure(self):
+        """Returns the share of time tasks stalled on cpu, memory and io since the
+        last call, from the pressure stall information of the kernel. The 10 seconds
+        average of the kernel is used on the first call.
+        @rtype:  dict
+        @return: { "psi_<cpu|memory|io>_<some|full>" : <percent as str> }"""
+        pressure = {}
+        now = time.time()
+        for resourceName in ("cpu", "memory", "io"):
+            try:
+                with open(rqd.rqconstants.PATH_PRESSURE.format(resourceName), "r",
+                          encoding='utf-8') as pressureFile:
+                    lines = pressureFile.readlines()
+            except (OSError, IOError):
+                # Kernels without CONFIG_PSI
+                continue
+            for line in lines:
+                fields = line.split()
+                if not fields:
+                    continue
+                values = dict(field.split("=", 1) for field in fields[1:])
+                key = "%s_%s" % (resourceName, fields[0])
+                try:
+                    total = int(values["total"])
+                    percent = float(values["avg10"])
+                except (KeyError, ValueError):
+                    continue
+                if key in self.__pressureHistory:
+                    oldTime, oldTotal = self.__pressureHistory[key]
+                    if now > oldTime:
+                        percent = min(max(total - oldTotal, 0) / 1e4 / (now - oldTime), 100.0)
+                self.__pressureHistory[key] = (now, total)
+                pressure["psi_" + key] = "%.2f" % percent
+        return pressure
+
     def _getProcSwap(self, pid):
         """Helper function to get swap memory used by a process"""
         swap_used = 0
@@ -496,9 +605,36 @@ class Machine(object):
         usedMemory = self.__getGpuValues()['used']
         return usedMemory[unitId] if unitId in usedMemory else 0
 
+    def getGpuUtilization(self, unitId):
+        """Returns the percent of time a kernel was running on a gpu"""
+        utilization = self.__getGpuValues()['utilization']
+        return utilization[unitId] if unitId in utilization else 0
+
+    def getGpuProcesses(self):
+        """Returns the gpu usage per process
+        @rtype:  dict or None
+        @return: { <pid> : rqd.rqgpu.GpuProcess } or None if the gpu telemetry
+                 backend can't tell the usage per process"""
+        return self.__getGpuValues()['processes']
+
+    def getGpuBackend(self):
+        """Returns the gpu telemetry backend, creating it on first use
+        @rtype:  rqd.rqgpu.GpuBackend"""
+        if self.__gpuBackend is None:
+            self.__gpuBackend = rqd.rqgpu.getGpuBackend()
+        return self.__gpuBackend
+
+    def setGpuBackend(self, backend):
+        """Replaces the gpu telemetry backend
+        @type  backend: rqd.rqgpu.GpuBackend
+        @param backend: The backend to sample the gpus with"""
+        self.__gpuBackend = backend
+        self.__resetGpuResults()
+
     # pylint: disable=attribute-defined-outside-init
     def __resetGpuResults(self):
-        self.gpuResults = {'count': 0, 'total': 0, 'free': 0, 'used': {}, 'updated': 0}
+        self.gpuResults = {'count': 0, 'total': 0, 'free': 0, 'used': {}, 'utilization': {},
+                           'processes': None, 'updated': 0}
 
     def __getGpuValues(self):
         if not hasattr(self, 'gpuNotSupported'):
@@ -507,51 +643,34 @@ class Machine(object):
             if not rqd.rqconstants.ALLOW_GPU:
                 self.gpuNotSupported = True
                 return self.gpuResults
-            if self.gpuResults['updated'] > int(time.time()) - 60:
+            backend = self.getGpuBackend()
+            if self.gpuResults['updated'] > time.time() - backend.cacheSeconds:
                 return self.gpuResults
             try:
-                nvidia_smi = subprocess.getoutput(
-                    'nvidia-smi --query-gpu=memory.total,memory.free,count'
-                    ' --format=csv,noheader')
-                total = 0
-                free = 0
-                count = 0
-                unitId = 0
-                for line in nvidia_smi.splitlines():
-                    # Example "16130 MiB, 16103 MiB, 8"
-                    # 1 MiB = 1048.576 KB
-                    l = line.split()
-                    unitTotal = math.ceil(int(l[0]) * 1048.576)
-                    unitFree = math.ceil(int(l[2]) * 1048.576)
-                    total += unitTotal
-                    free += unitFree
-                    count = int(l[-1])
-                    self.gpuResults['used'][str(unitId)] = unitTotal - unitFree
-                    unitId += 1
-
-                self.gpuResults['total'] = int(total)
-                self.gpuResults['free'] = int(free)
-                self.gpuResults['count'] = count
-                self.gpuResults['updated'] = int(time.time())
+                self.gpuResults = backend.sample().toResults()
             # pylint: disable=broad-except
             except Exception as e:
-                self.gpuNotSupported = True
-                self.__resetGpuResults()
+                # Keep the last known values and try again once they expire
+                self.gpuResults['updated'] = time.time()
                 log.warning(
-                    'Failed to query nvidia-smi due to: %s at %s',
-                    e, traceback.extract_tb(sys.exc_info()[2]))
+                    'Failed to sample the gpus with %s due to: %s at %s',
+                    backend.name, e, traceback.extract_tb(sys.exc_info()[2]))
         else:
             self.__resetGpuResults()
         return self.gpuResults
 
-    def __getSwapout(self):
+    def getSwapoutRate(self):
+        """Returns the recent page out rate of the host, 0 when unknown"""
         if platform.system() == "Linux":
             try:
-                return str(int(self.__vmstat.getRecentPgoutRate()))
+                return self.__vmstat.getRecentPgoutRate()
             # pylint: disable=broad-except
             except Exception:
-                return str(0)
-        return str(0)
+                return 0
+        return 0
+
+    def __getSwapout(self):
+        return str(int(self.getSwapoutRate()))
 
     @rqd.rqutil.Memoize
     def getTimezone(self):
@@ -862,11 +981,14 @@ class Machine(object):
 
             self.__renderHost.free_swap = freeSwapMem
             self.__renderHost.free_mem = freeMem + cachedMem
-            self.__renderHost.num_gpus = self.getGpuCount()
-            self.__renderHost.total_gpu_mem = self.getGpuMemoryTotal()
-            self.__renderHost.free_gpu_mem = self.getGpuMemoryFree()
+            if self.__gpuReady:
+                self.__updateGpuStats()
 
             self.__renderHost.attributes['swapout'] = self.__getSwapout()
+            self.__renderHost.attributes.update(self.getPressure())
+            if rqd.rqconstants.DOCKER_AGENT is not None:
+                self.__renderHost.attributes.update(
+                    rqd.rqconstants.DOCKER_AGENT.image_cache.getAttributes())
 
         elif platform.system() == 'Darwin':
             self.updateMacMemory()
@@ -880,24 +1002,45 @@ class Machine(object):
             self.__renderHost.free_mcp = TEMP_DEFAULT
             self.__renderHost.free_swap = int(stats.ullAvailPageFile / 1024)
             self.__renderHost.free_mem = int(stats.ullAvailPhys / 1024)
-            self.__renderHost.num_gpus = self.getGpuCount()
-            self.__renderHost.total_gpu_mem = self.getGpuMemoryTotal()
-            self.__renderHost.free_gpu_mem = self.getGpuMemoryFree()
+            if self.__gpuReady:
+                self.__updateGpuStats()
 
         # Updates dynamic information
         self.__renderHost.load = self.getLoadAvg()
         self.__renderHost.nimby_enabled = self.__rqCore.nimby.is_ready
         self.__renderHost.nimby_locked = self.__rqCore.nimby.locked
         self.__renderHost.state = self.state
+        self.__renderHostTime = time.time()
+
+    def __updateGpuStats(self):
+        """Updates the gpu information of the host"""
+        self.__renderHost.num_gpus = self.getGpuCount()
+        self.__renderHost.total_gpu_mem = self.getGpuMemoryTotal()
+        self.__renderHost.free_gpu_mem = self.getGpuMemoryFree()
 
     def getHostInfo(self):
         """Updates and returns the renderHost struct"""
         self.updateMachineStats()
         return self.__renderHost
 
+    def getCachedHostInfo(self):
+        """Returns the renderHost struct of the last update, only refreshing its
+        nimby and state fields, unless it is older than RQD_HOST_INFO_MAX_AGE_SEC.
+        Keeps the frame complete reports from reading /proc, statvfs and the gpus."""
+        if (self.__renderHostTime is None or
+                time.time() - self.__renderHostTime > rqd.rqconstants.RQD_HOST_INFO_MAX_AGE_SEC):
+            return self.getHostInfo()
+        self.__renderHost.nimby_enabled = self.__rqCore.nimby.is_ready
+        self.__renderHost.nimby_locked = self.__rqCore.nimby.locked
+        self.__renderHost.state = self.state
+        return self.__renderHost
+
     def getHostReport(self):
         """Updates and returns the hostReport struct"""
         self.__hostReport.host.CopyFrom(self.getHostInfo())
+        # pylint: disable=no-member
+        self.__hostReport.host.attributes.update(rqd.rqmetrics.LAUNCH_WINDOW.summary())
+        # pylint: enable=no-member
 
         self.__hostReport.ClearField('frames')
         self.__rqCore.sanitizeFrames()
@@ -931,10 +1074,18 @@ class Machine(object):
     def setupTaskset(self):
         """ Setup rqd for hyper-threading """
         self.__coreInfo.reserved_cores.clear()
+        self.__topology = rqd.rqtopology.CpuTopology.discover(self.__procs_by_physid_and_coreid)
+        self.__coreAllocator = rqd.rqtopology.CoreAllocator(self.__topology)
+        if self.__topology.isNuma():
+            log.info('Taskset: %d NUMA nodes, %d L3 domains', len(self.__topology.nodeMasks),
+                     len(self.__topology.l3Masks))
 
     def setupGpu(self):
         """ Setup rqd for Gpus """
         self.__gpusets = set(range(self.getGpuCount()))
+        self.__gpuReady = True
+        if platform.system() in ("Linux", "Windows"):
+            self.__updateGpuStats()
 
     def reserveHT(self, frameCores):
         """ Reserve cores for use by taskset
@@ -951,55 +1102,56 @@ class Machine(object):
             return None
         log.info('Taskset: Requesting reserve of %d', (frameCores // 100))
 
-        # Look for the most idle physical cpu.
-        # Prefer to assign cores from the same physical cpu.
-        # Spread different frames around on different physical cpus.
-        avail_cores = {}
-        avail_cores_count = 0
-        reserved_cores = self.__coreInfo.reserved_cores
-
-        for physid, cores in self.__procs_by_physid_and_coreid.items():
-            for coreid in cores.keys():
-                if int(physid) in reserved_cores and \
-                        int(coreid) in reserved_cores[int(physid)].coreid:
-                    continue
-                avail_cores.setdefault(physid, set()).add(coreid)
-                avail_cores_count += 1
-
-        remaining_cores = frameCores / 100
-
-        if avail_cores_count < remaining_cores:
+        # Pack the frame on the fewest NUMA nodes and L3 domains,
+        # the allocator picks the best fitting ones to limit fragmentation.
+        mask = self.__coreAllocator.reserve(frameCores // 100)
+        if mask is None:
             err = ('Not launching, insufficient hyperthreading cores to reserve '
                    'based on frameCores (%s < %s)')  \
-                  % (avail_cores_count, remaining_cores)
+                  % (self.__coreAllocator.freeCount(), frameCores // 100)
             log.critical(err)
             raise rqd.rqexceptions.CoreReservationFailureException(err)
 
+        reserved_cores = self.__coreInfo.reserved_cores
         tasksets = []
+        for core in rqd.rqtopology.iterBits(mask):
+            physid, coreid = self.__topology.cores[core]
+            # Give all the hyperthreads on this core.
+            # This counts as one core.
+            reserved_cores[int(physid)].coreid.extend([int(coreid)])
+            tasksets.extend(self.__topology.procsByCore[core])
 
-        for physid, cores in sorted(
-                avail_cores.items(),
-                # Return the physical socket that has
-                # the most idle cores first.
-                key=lambda tup: len(tup[1]),
-                reverse=True):
-
-            while remaining_cores > 0 and len(cores) > 0:
-                coreid = cores.pop()
-                # Give all the hyperthreads on this core.
-                # This counts as one core.
-                reserved_cores[int(physid)].coreid.extend([int(coreid)])
-                remaining_cores -= 1
+        log.warning('Taskset: Reserving procs - %s', ','.join(tasksets))
 
-                for procid in self.__procs_by_physid_and_coreid[physid][coreid]:
-                    tasksets.append(procid)
+        return ','.join(tasksets)
 
-            if remaining_cores == 0:
-                break
+    def reserveRecoveredHT(self, reservedHT):
+        """ Reserves the cores of a frame recovered from the backup cache
+        Not thread safe, use with locking.
+        @type:  string
+        @param: The cpu-list of the frame. ex: '0,8,1,9'
+        """
+        log.info('Taskset: Reserving recovered procs - %s', reservedHT)
+        mask = self.__topology.getMask(reservedHT.split(','))
+        self.__coreAllocator.reserveMask(mask)
 
-        log.warning('Taskset: Reserving procs - %s', ','.join(tasksets))
+        reserved_cores = self.__coreInfo.reserved_cores
+        for core in rqd.rqtopology.iterBits(mask):
+            physid, coreid = self.__topology.cores[core]
+            if int(coreid) not in reserved_cores[int(physid)].coreid:
+                reserved_cores[int(physid)].coreid.extend([int(coreid)])
 
-        return ','.join(tasksets)
+    def getNumaNodes(self, reservedHT):
+        """ Returns the NUMA nodes of a cpu-list when the host has several of them
+        @type:  string
+        @param: The cpu-list used for taskset. ex: '0,8,1,9'
+        @rtype:  string
+        @return: The node-list for numactl. ex: '0,1', or None
+        """
+        if self.__topology is None or not self.__topology.isNuma():
+            return None
+        mask = self.__topology.getMask(reservedHT.split(','))
+        return ','.join(str(node) for node in self.__topology.getNodes(mask)) or None
 
     # pylint: disable=inconsistent-return-statements
     def releaseHT(self, reservedHT):
@@ -1015,6 +1167,8 @@ class Machine(object):
         # Remove these cores from the reserved set.
         # Silently ignore any that weren't really reserved or
         # aren't valid core identities.
+        self.__coreAllocator.release(self.__topology.getMask(reservedHT.split(',')))
+
         reserved_cores = self.__coreInfo.reserved_cores
         for core in reservedHT.split(','):
             physical_id_str, core_id_str = self.__physid_and_coreid_by_proc.get(core)
@@ -0,0 +1,587 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Prometheus metrics of rqd, served over http in the text exposition format."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import bisect
+import collections
+import logging
+import threading
+import time
+
+import rqd.rqconstants
+
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Label value of the frames above RQD_METRICS_MAX_FRAMES
+OTHER_FRAMES = "_other"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _formatLabels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """Base class of the metrics, values are kept per tuple of label values"""
+
+    metricType = None
+
+    def __init__(self, name, documentation, labelNames=()):
+        """Metric class initialization
+        @type  name: str
+        @param name: Name of the metric
+        @type  documentation: str
+        @param documentation: Help text of the metric
+        @type  labelNames: tuple
+        @param labelNames: Names of the labels"""
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelNames)
+
+    def reset(self):
+        """Forgets all values"""
+        with self._lock:
+            self._values = {}
+
+    def render(self):
+        """Returns the metric in the text exposition format"""
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.metricType)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._renderValue(key, value))
+        return lines
+
+    def _renderValue(self, key, value):
+        return ["%s%s %s" % (self.name, _formatLabels(self.labelNames, key),
+                             _formatValue(value))]
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    metricType = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Increments the counter"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """Returns the current value"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    """A value that can go up and down"""
+
+    metricType = "gauge"
+
+    def set(self, value, **labels):
+        """Sets the gauge"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Counts observations in cumulative buckets"""
+
+    metricType = "histogram"
+
+    def __init__(self, name, documentation, labelNames=(), buckets=DEFAULT_BUCKETS):
+        """Histogram class initialization
+        @type  buckets: tuple
+        @param buckets: Upper bounds of the buckets"""
+        super(Histogram, self).__init__(name, documentation, labelNames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        """Records an observation"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def getCount(self, **labels):
+        """Returns the number of observations"""
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0))
+            return sum(counts)
+
+    def _renderValue(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (
+                self.name, _formatLabels(self.labelNames, key, ("le", _formatValue(bound))),
+                cumulative))
+        labels = _formatLabels(self.labelNames, key)
+        lines.append("%s_sum%s %s" % (self.name, labels, _formatValue(total)))
+        lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+
+class Registry(object):
+    """Holds the metrics, and collectors that set gauges right before a scrape"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__metrics = []
+        self.__collectors = []
+
+    def register(self, metric):
+        """Adds a metric to the registry and returns it"""
+        with self.__lock:
+            self.__metrics.append(metric)
+        return metric
+
+    def addCollector(self, collector):
+        """Adds a callable run before each scrape"""
+        with self.__lock:
+            self.__collectors.append(collector)
+
+    def removeCollector(self, collector):
+        """Removes a collector added by addCollector"""
+        with self.__lock:
+            if collector in self.__collectors:
+                self.__collectors.remove(collector)
+
+    def render(self):
+        """Returns all the metrics in the text exposition format"""
+        with self.__lock:
+            collectors = list(self.__collectors)
+            metrics = list(self.__metrics)
+        for collector in collectors:
+            try:
+                collector()
+            # pylint: disable=broad-except
+            except Exception:
+                log.exception("Failed to collect metrics")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CORES = REGISTRY.register(Gauge(
+    "rqd_cores", "Cores of the host by state, 100 = 1 physical core", ("state",)))
+FRAMES_RUNNING = REGISTRY.register(Gauge(
+    "rqd_frames_running", "Number of running frames"))
+FRAME_RSS = REGISTRY.register(Gauge(
+    "rqd_frame_rss_kb", "Resident memory of a running frame in kB", ("frame",)))
+FRAME_MAX_RSS = REGISTRY.register(Gauge(
+    "rqd_frame_max_rss_kb", "Peak resident memory of a running frame in kB", ("frame",)))
+FRAME_VSIZE = REGISTRY.register(Gauge(
+    "rqd_frame_vsize_kb", "Virtual memory of a running frame in kB", ("frame",)))
+FRAME_SWAP = REGISTRY.register(Gauge(
+    "rqd_frame_swap_kb", "Swap used by a running frame in kB", ("frame",)))
+FRAME_PCPU = REGISTRY.register(Gauge(
+    "rqd_frame_pcpu", "Cpu usage of a running frame, 1 = one core", ("frame",)))
+RSS_UPDATE_SECONDS = REGISTRY.register(Histogram(
+    "rqd_rss_update_seconds", "Time spent sampling the running frames"))
+RSS_SAMPLES = REGISTRY.register(Counter(
+    "rqd_rss_samples_total", "Samples of the rss of a single frame between rss updates"))
+RSS_SAMPLER_CPU_RATIO = REGISTRY.register(Gauge(
+    "rqd_rss_sampler_cpu_ratio", "Share of one core the rss sampling asks for"))
+REPORT_SECONDS = REGISTRY.register(Histogram(
+    "rqd_report_seconds", "Time spent sending a report to cuebot", ("report",)))
+REPORT_FAILURES = REGISTRY.register(Counter(
+    "rqd_report_failures_total", "Reports that failed to be sent to cuebot", ("report",)))
+LAUNCH_FAILURES = REGISTRY.register(Counter(
+    "rqd_launch_failures_total", "Frames that failed to launch", ("reason",)))
+ADMISSION_REJECTIONS = REGISTRY.register(Counter(
+    "rqd_admission_rejections_total", "Frame launches refused for lack of memory",
+    ("reason",)))
+LOG_BYTES = REGISTRY.register(Counter(
+    "rqd_log_bytes_total", "Bytes of frame logs written", ("destination",)))
+LOG_COMPRESSION_BYTES = REGISTRY.register(Counter(
+    "rqd_log_compression_bytes_total", "Bytes of rotated frame logs compressed, before and "
+    "after compression", ("state",)))
+LOG_RETENTION_REMOVED = REGISTRY.register(Counter(
+    "rqd_log_retention_removed_total", "Rotated frame logs removed by the log retention"))
+SCHEDULER_TASK_SECONDS = REGISTRY.register(Histogram(
+    "rqd_scheduler_task_seconds", "Duration of the runs of the periodic tasks", ("task",)))
+SCHEDULER_SKIPPED_RUNS = REGISTRY.register(Counter(
+    "rqd_scheduler_skipped_runs_total", "Runs of periodic tasks skipped because they were late",
+    ("task",)))
+SCHEDULER_TASK_FAILURES = REGISTRY.register(Counter(
+    "rqd_scheduler_task_failures_total", "Runs of periodic tasks that raised", ("task",)))
+OUTBOX_REPORTS = REGISTRY.register(Gauge(
+    "rqd_outbox_reports", "Frame complete reports waiting to be replayed to cuebot"))
+OUTBOX_DROPPED = REGISTRY.register(Counter(
+    "rqd_outbox_dropped_total", "Frame complete reports dropped from a full outbox"))
+FRAME_EXIT_REPORT_SECONDS = REGISTRY.register(Histogram(
+    "rqd_frame_exit_report_seconds", "Time from a frame process exiting to cuebot "
+    "receiving its frame complete report", buckets=DEFAULT_BUCKETS + (60, 300, 900)))
+LAUNCH_PHASE_SECONDS = REGISTRY.register(Histogram(
+    "rqd_launch_phase_seconds", "Time spent in each phase of a frame launch", ("phase",)))
+LAUNCH_SECONDS = REGISTRY.register(Histogram(
+    "rqd_launch_seconds", "Time from a launch request to the frame process starting"))
+DOCKER_LAUNCH_SECONDS = REGISTRY.register(Histogram(
+    "rqd_docker_launch_seconds", "Time spent creating and starting a frame container"))
+DOCKER_LAUNCH_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "rqd_docker_launch_wait_seconds", "Time container launches waited for a launch slot"))
+DOCKER_LAUNCHES_WAITING = REGISTRY.register(Gauge(
+    "rqd_docker_launches_waiting", "Container launches waiting for a launch slot"))
+DOCKER_LAUNCH_RETRIES = REGISTRY.register(Counter(
+    "rqd_docker_launch_retries_total", "Container launches retried on transient daemon errors",
+    ("reason",)))
+DOCKER_POOL_IDLE = REGISTRY.register(Gauge(
+    "rqd_docker_pool_idle", "Idle containers in the container pool", ("os",)))
+DOCKER_POOL_CHECKOUTS = REGISTRY.register(Counter(
+    "rqd_docker_pool_checkouts_total", "Frames that found an idle container in the pool or not",
+    ("os", "result")))
+GRPC_QUEUED_CALLS = REGISTRY.register(Gauge(
+    "rqd_grpc_queued_calls", "Calls of the aio gRPC server waiting for a slot of their method",
+    ("method",)))
+GRPC_RUNNING_CALLS = REGISTRY.register(Gauge(
+    "rqd_grpc_running_calls", "Calls of the aio gRPC server running in its executor",
+    ("method",)))
+GRPC_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "rqd_grpc_queue_seconds", "Time calls of the aio gRPC server waited for a slot",
+    ("method",)))
+STARTUP_PHASE_SECONDS = REGISTRY.register(Gauge(
+    "rqd_startup_phase_seconds", "Time spent in each phase of the startup of rqd",
+    ("phase",)))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "rqd_startup_seconds", "Time from the process start to the boot report"))
+
+
+class LaunchTrace(object):
+    """Times the phases of a frame launch. Each mark closes the phase that
+    started at the previous mark, so the phases add up to the launch time."""
+
+    def __init__(self, frameId):
+        """LaunchTrace class initialization
+        @type  frameId: str
+        @param frameId: The frame being launched"""
+        self.frameId = frameId
+        self.startTime = time.time()
+        # [ (<phase>, <seconds>), ... ]
+        self.phases = []
+        self.__lastMark = time.perf_counter()
+        self.__launchSeconds = None
+
+    def mark(self, phase):
+        """Ends a phase
+        @type  phase: str
+        @param phase: Name of the phase that just ended"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.__lastMark))
+        self.__lastMark = now
+
+    def format(self):
+        """Returns the phases in ms, ex: 'checks=0.1 reserve=0.3 total=12.5'"""
+        total = sum(seconds for _, seconds in self.phases)
+        return " ".join("%s=%.1f" % (phase, seconds * 1000)
+                        for phase, seconds in self.phases + [("total", total)])
+
+    def finish(self, runFrame):
+        """Ends the trace once the frame process started: logs it, attaches it to the
+        frame attributes and records it in the launch histograms
+        @type  runFrame: RunFrame
+        @param runFrame: rqd_pb2.RunFrame"""
+        if self.__launchSeconds is not None:
+            return
+        self.__launchSeconds = sum(seconds for _, seconds in self.phases)
+        timing = self.format()
+        runFrame.attributes["launch_timing_ms"] = timing
+        log.info("Launch timing of %s in ms: %s", self.frameId, timing)
+
+        LAUNCH_SECONDS.observe(self.__launchSeconds)
+        for phase, seconds in self.phases:
+            LAUNCH_PHASE_SECONDS.observe(seconds, phase=phase)
+        LAUNCH_WINDOW.add(self.__launchSeconds, self.phases)
+
+
+class StartupTrace(object):
+    """Times the phases of the startup of rqd, from the process start to the boot
+    report. Slow probes of the host run in background threads while the gRPC server
+    comes up, their phases overlap the others so the phases don't add up to the
+    total."""
+
+    def __init__(self, startTime=None):
+        """StartupTrace class initialization
+        @type  startTime: float
+        @param startTime: Epoch the process started at, now when None"""
+        self.startTime = startTime if startTime is not None else time.time()
+        # [ (<phase>, <seconds>), ... ]
+        self.phases = []
+        self.totalSeconds = None
+        self.__lastMark = self.startTime
+        self.__lock = threading.Lock()
+        self.__threads = []
+        self.__errors = []
+
+    def mark(self, phase):
+        """Ends a phase, ignored once the startup finished
+        @type  phase: str
+        @param phase: Name of the phase that just ended"""
+        now = time.time()
+        with self.__lock:
+            if self.totalSeconds is None:
+                self.phases.append((phase, now - self.__lastMark))
+            self.__lastMark = now
+
+    def runInBackground(self, phase, func):
+        """Runs a probe in a thread, timed as its own phase
+        @type  phase: str
+        @param phase: Name of the phase
+        @type  func: callable
+        @param func: The probe"""
+        def run():
+            startTime = time.time()
+            try:
+                func()
+            # pylint: disable=broad-except
+            except Exception as e:
+                with self.__lock:
+                    self.__errors.append(e)
+            finally:
+                with self.__lock:
+                    self.phases.append((phase, time.time() - startTime))
+
+        thread = threading.Thread(target=run, name="RqdStartup-%s" % phase, daemon=True)
+        self.__threads.append(thread)
+        thread.start()
+
+    def wait(self):
+        """Waits for the background probes
+        @raise Exception: The first error a probe raised"""
+        for thread in self.__threads:
+            thread.join()
+        with self.__lock:
+            if self.__errors:
+                raise self.__errors[0]
+
+    def format(self):
+        """Returns the phases in seconds, ex: 'imports=0.41 machine=0.02 total=1.20'"""
+        with self.__lock:
+            phases = list(self.phases)
+        if self.totalSeconds is not None:
+            phases.append(("total", self.totalSeconds))
+        return " ".join("%s=%.2f" % (phase, seconds) for phase, seconds in phases)
+
+    def finish(self):
+        """Ends the trace before the boot report: logs it and records it in the
+        startup gauges"""
+        with self.__lock:
+            if self.totalSeconds is not None:
+                return
+            self.totalSeconds = time.time() - self.startTime
+            phases = list(self.phases)
+        log.warning("Startup timing in seconds: %s", self.format())
+        STARTUP_SECONDS.set(self.totalSeconds)
+        for phase, seconds in phases:
+            STARTUP_PHASE_SECONDS.set(seconds, phase=phase)
+
+
+class LaunchWindow(object):
+    """Rolling window of the latest launch traces, summarized in host reports"""
+
+    def __init__(self, size):
+        """LaunchWindow class initialization
+        @type  size: int
+        @param size: Number of launches kept"""
+        self.__lock = threading.Lock()
+        self.__launches = collections.deque(maxlen=size)
+
+    def add(self, launchSeconds, phases):
+        """Records a launch
+        @type  launchSeconds: float
+        @param launchSeconds: Total launch time
+        @type  phases: list
+        @param phases: [ (<phase>, <seconds>), ... ]"""
+        with self.__lock:
+            self.__launches.append((launchSeconds, phases))
+
+    @staticmethod
+    def __percentile(values, percent):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def summary(self):
+        """Returns the launch latency and the 95th percentile of each phase, in ms
+        @rtype:  dict
+        @return: { 'launch_latency_ms': 'n=.. p50=.. p95=.. max=..',
+                   'launch_phase_p95_ms': '<phase>=.. ...' }, empty without launches"""
+        with self.__lock:
+            launches = list(self.__launches)
+        if not launches:
+            return {}
+        totals = [seconds * 1000 for seconds, _ in launches]
+        byPhase = collections.OrderedDict()
+        for _, phases in launches:
+            for phase, seconds in phases:
+                byPhase.setdefault(phase, []).append(seconds * 1000)
+        return {
+            "launch_latency_ms": "n=%d p50=%.1f p95=%.1f max=%.1f" % (
+                len(totals), self.__percentile(totals, 50), self.__percentile(totals, 95),
+                max(totals)),
+            "launch_phase_p95_ms": " ".join(
+                "%s=%.1f" % (phase, self.__percentile(values, 95))
+                for phase, values in byPhase.items()),
+        }
+
+
+LAUNCH_WINDOW = LaunchWindow(rqd.rqconstants.RQD_LAUNCH_TRACE_WINDOW)
+
+
+def collectRqCore(rqCore):
+    """Sets the gauges describing the cores and the running frames. Frames are
+    labeled with job/frame, beyond RQD_METRICS_MAX_FRAMES they are summed up
+    under OTHER_FRAMES to keep the number of series bounded.
+    @type  rqCore: rqd.rqcore.RqCore
+    @param rqCore: Main RQD Object"""
+    cores = rqCore.getCoreInfo()
+    CORES.set(cores.idle_cores, state="idle")
+    CORES.set(cores.booked_cores, state="booked")
+    CORES.set(cores.locked_cores, state="locked")
+    CORES.set(cores.total_cores, state="total")
+
+    frames = []
+    for frameId in rqCore.getFrameKeys():
+        try:
+            frames.append(rqCore.getFrame(frameId))
+        except KeyError:
+            pass
+    FRAMES_RUNNING.set(len(frames))
+
+    values = {}
+    for index, frame in enumerate(sorted(frames, key=lambda f: f.frameId)):
+        if index < rqd.rqconstants.RQD_METRICS_MAX_FRAMES:
+            label = "%s/%s" % (frame.runFrame.job_name, frame.runFrame.frame_name)
+        else:
+            label = OTHER_FRAMES
+        try:
+            pcpu = float(frame.runFrame.attributes.get("pcpu", 0))
+        except ValueError:
+            pcpu = 0
+        current = values.get(label, (0, 0, 0, 0, 0))
+        values[label] = (current[0] + frame.rss, current[1] + frame.maxRss,
+                         current[2] + frame.vsize, current[3] + frame.usedSwapMemory,
+                         current[4] + pcpu)
+
+    for gauge in (FRAME_RSS, FRAME_MAX_RSS, FRAME_VSIZE, FRAME_SWAP, FRAME_PCPU):
+        gauge.reset()
+    for label, (rss, maxRss, vsize, swap, pcpu) in values.items():
+        FRAME_RSS.set(rss, frame=label)
+        FRAME_MAX_RSS.set(maxRss, frame=label)
+        FRAME_VSIZE.set(vsize, frame=label)
+        FRAME_SWAP.set(swap, frame=label)
+        FRAME_PCPU.set(pcpu, frame=label)
+
+
+def makeMetricsHandler():
+    """Returns the http handler serving the registry on /metrics, http.server is only
+    imported when the metrics are served"""
+    # pylint: disable=import-outside-toplevel
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Serves the registry on /metrics"""
+
+        def do_GET(self):
+            """Handles a scrape"""
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # pylint: disable=redefined-builtin
+        def log_message(self, format, *args):
+            log.debug("metrics: " + format, *args)
+
+    return MetricsHandler
+
+
+class MetricsServer(object):
+    """Http server exposing the metrics from a daemon thread"""
+
+    def __init__(self, rqCore, port=None, address=None):
+        """MetricsServer class initialization
+        @type  rqCore: rqd.rqcore.RqCore
+        @param rqCore: Main RQD Object
+        @type  port: int
+        @param port: Port to listen on, 0 picks a free one
+        @type  address: str
+        @param address: Address to listen on"""
+        # pylint: disable=import-outside-toplevel
+        from http.server import ThreadingHTTPServer
+        self.__collector = lambda: collectRqCore(rqCore)
+        self.httpServer = ThreadingHTTPServer(
+            (address if address is not None else rqd.rqconstants.RQD_METRICS_ADDRESS,
+             port if port is not None else rqd.rqconstants.RQD_METRICS_PORT),
+            makeMetricsHandler())
+        self.httpServer.daemon_threads = True
+        self.port = self.httpServer.server_address[1]
+        self.__thread = threading.Thread(target=self.httpServer.serve_forever,
+                                         name="RqdMetrics", daemon=True)
+
+    def start(self):
+        """Starts serving the metrics"""
+        REGISTRY.addCollector(self.__collector)
+        self.__thread.start()
+        log.warning("Serving metrics on port %s", self.port)
+
+    def stop(self):
+        """Stops serving the metrics"""
+        REGISTRY.removeCollector(self.__collector)
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
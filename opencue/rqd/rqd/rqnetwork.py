@@ -22,14 +22,18 @@ from __future__ import division
 
 from builtins import object
 from concurrent import futures
-from random import shuffle
 import abc
+import asyncio
 import atexit
+import bisect
+import collections
 import datetime
+import hashlib
 import logging
 import os
 import platform
 import subprocess
+import threading
 import time
 
 # Disable GRPC fork support to avoid the warning:
@@ -46,6 +50,7 @@ import opencue_proto.rqd_pb2_grpc
 import rqd.rqconstants
 import rqd.rqexceptions
 import rqd.rqdservicers
+import rqd.rqmetrics
 import rqd.rqutil
 
 
@@ -85,10 +90,36 @@ class RunningFrame(object):
 
         self.lluTime = 0
         self.childrenProcs = {}
+        # Pids of the frame found by the last rss update
+        self.pids = []
         self.completeReportSent = False
+        # Time the frame process exited, times its frame complete report
+        self.exitTime = None
+        # rqd.rqmetrics.LaunchTrace of a frame being launched
+        self.launchTrace = None
+
+        # Messages are only rebuilt when the sampled values they hold changed
+        self.__frameInfo = None
+        self.__frameInfoKey = None
+        self.__children = None
+        self.__childrenKey = None
 
     def runningFrameInfo(self):
-        """Returns the RunningFrameInfo object"""
+        """Returns the RunningFrameInfo object
+        @rtype:  opencue_proto.report_pb2.RunningFrameInfo
+        @return: The frame's state, shared between calls until it changes"""
+        childrenKey = self.__getChildrenKey()
+        key = (self.rss, self.maxRss, self.vsize, self.maxVsize, self.lluTime,
+               self.usedGpuMemory, self.maxUsedGpuMemory, self.usedSwapMemory,
+               tuple(sorted(self.runFrame.attributes.items())), childrenKey)
+        if self.__frameInfo is not None and key == self.__frameInfoKey:
+            return self.__frameInfo
+
+        if self.__children is None or childrenKey != self.__childrenKey:
+            self.__children = self._serializeChildrenProcs()
+            self.__childrenKey = childrenKey
+        children = self.__children
+
         runningFrameInfo = opencue_proto.report_pb2.RunningFrameInfo(
             resource_id=self.runFrame.resource_id,
             job_id=self.runFrame.job_id,
@@ -107,11 +138,21 @@ class RunningFrame(object):
             num_gpus=self.runFrame.num_gpus,
             max_used_gpu_memory=self.maxUsedGpuMemory,
             used_gpu_memory=self.usedGpuMemory,
-            children=self._serializeChildrenProcs(),
+            children=children,
             used_swap_memory=self.usedSwapMemory,
         )
+        self.__frameInfo = runningFrameInfo
+        self.__frameInfoKey = key
         return runningFrameInfo
 
+    def __getChildrenKey(self):
+        """The children process values that end up in the serialized stats,
+        the command line of a pid doesn't change"""
+        return tuple(
+            (pid, values["state"], values["rss"], values["vsize"],
+             values["statm_rss"], values["statm_size"])
+            for pid, values in sorted(self.childrenProcs.items()))
+
     def _serializeChildrenProcs(self):
         """ Collect and serialize children proc stats for protobuf
             Convert to Kilobytes:
@@ -199,11 +240,16 @@ class GrpcServer(object):
         self.server = grpc.server(
             futures.ThreadPoolExecutor(max_workers=rqd.rqconstants.RQD_GRPC_MAX_WORKERS))
         self.servicers = ['RqdInterfaceServicer']
+        self.port = self.server.add_insecure_port(self.getListenAddress())
+
+    @staticmethod
+    def getListenAddress():
+        """Returns the address the server listens on"""
         listenAddress = "[::]"
         if rqd.rqconstants.RQD_NETWORK_INTERFACE:
             listenAddress = rqd.rqutil.getInterfaceIp(rqd.rqconstants.RQD_NETWORK_INTERFACE,
                                                       ipv6=rqd.rqconstants.RQD_USE_IPV6_AS_HOSTNAME)
-        self.server.add_insecure_port(f'{listenAddress}:{rqd.rqconstants.RQD_GRPC_PORT}')
+        return f'{listenAddress}:{rqd.rqconstants.RQD_GRPC_PORT}'
 
     def addServicers(self):
         """Registers the gRPC servicers defined in rqdservicers.py."""
@@ -229,10 +275,14 @@ class GrpcServer(object):
                     raise exc
                 # pylint: enable=no-member
 
-    def serve(self):
-        """Starts serving gRPC."""
+    def start(self):
+        """Registers the servicers and starts the server."""
         self.addServicers()
         self.server.start()
+
+    def serve(self):
+        """Starts serving gRPC."""
+        self.start()
         if rqd.rqconstants.RQD_GRPC_RETRY_CONNECTION:
             self.connectGrpcWithRetries()
         else:
@@ -243,10 +293,14 @@ class GrpcServer(object):
         self.serve()
         self.stayAlive()
 
+    def stop(self, grace):
+        """Stops the server, waiting up to grace seconds for the calls in progress."""
+        self.server.stop(grace)
+
     def shutdown(self):
         """Stops the gRPC server."""
         log.warning('Stopping grpc server.')
-        self.server.stop(10)
+        self.stop(10)
 
     def stayAlive(self):
         """Runs forever until killed."""
@@ -254,7 +308,264 @@ class GrpcServer(object):
             while True:
                 time.sleep(rqd.rqconstants.RQD_GRPC_SLEEP_SEC)
         except KeyboardInterrupt:
-            self.server.stop(0)
+            self.stop(0)
+
+
+class AsyncGrpcServer(GrpcServer):
+    """gRPC server running on an asyncio event loop in its own thread.
+
+    Calls are served by rqd.rqdservicers.AsyncRqdInterfaceServicer: cheap status
+    calls on the event loop, LaunchFrame in an executor of its own and the others
+    in a bounded executor with a concurrency limit per method."""
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, rqCore):
+        self.rqCore = rqCore
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=max(rqd.rqconstants.RQD_GRPC_MAX_WORKERS, 1),
+            thread_name_prefix="RqdGrpc")
+        self.launchExecutor = futures.ThreadPoolExecutor(
+            max_workers=max(rqd.rqconstants.RQD_GRPC_LAUNCH_WORKERS, 1),
+            thread_name_prefix="RqdGrpcLaunch")
+        self.loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(
+            target=self.loop.run_forever, name="RqdGrpcLoop", daemon=True)
+        self.__thread.start()
+        self.server = self.runOnLoop(self.__createServer())
+
+    async def __createServer(self):
+        server = grpc.aio.server()
+        self.port = server.add_insecure_port(self.getListenAddress())
+        return server
+
+    def runOnLoop(self, coroutine):
+        """Runs a coroutine on the event loop of the server
+        @return: The result of the coroutine"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def start(self):
+        """Registers the servicer and starts the server."""
+        async def start():
+            opencue_proto.rqd_pb2_grpc.add_RqdInterfaceServicer_to_server(
+                rqd.rqdservicers.AsyncRqdInterfaceServicer(
+                    self.rqCore, self.executor, self.launchExecutor),
+                self.server)
+            await self.server.start()
+        self.runOnLoop(start())
+
+    def stop(self, grace):
+        """Stops the server, then its event loop and executors."""
+        if self.loop.is_closed():
+            return
+        self.runOnLoop(self.server.stop(grace))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.__thread.join()
+        self.loop.close()
+        self.executor.shutdown(wait=False)
+        self.launchExecutor.shutdown(wait=False)
+
+
+class CuebotHealth(object):
+    """Health state of a cuebot as seen by rqd"""
+
+    def __init__(self):
+        self.failures = 0
+        # The cuebot is skipped until then, unless all the cuebots are down
+        self.downUntil = 0
+        self.lastError = None
+
+    def isUp(self, now=None):
+        """Returns whether the cuebot should be tried"""
+        return self.downUntil <= (now or time.time())
+
+
+class CuebotChannelManager(object):
+    """Channels to all the configured cuebots with failover.
+
+    Each rqd prefers the cuebots in the order given by a consistent hash ring of
+    its hostname, which spreads the hosts evenly and only moves the hosts of a
+    cuebot that is added or removed. Calls go to the first cuebot that is up in
+    that order and fail over to the next one on UNAVAILABLE or DEADLINE_EXCEEDED.
+    A failed cuebot is skipped for an exponentially growing time, after which it is
+    tried again, so hosts move back to their preferred cuebot once it recovers.
+    The channel of a failed cuebot is no longer handed out, and closed once the
+    calls still running on it are done."""
+
+    FAILOVER_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+    # Points of each cuebot on the hash ring
+    VIRTUAL_NODES = 64
+
+    def __init__(self, cuebots, port, hostname):
+        """CuebotChannelManager class initialization
+        @type  cuebots: list<str>
+        @param cuebots: Cuebot hosts, as host or host:port
+        @type  port: int
+        @param port: Port of the cuebots given without one
+        @type  hostname: str
+        @param hostname: Name of this host, used to pick its preferred cuebots"""
+        if not cuebots:
+            raise rqd.rqexceptions.RqdException("CUEBOT_HOSTNAME is empty")
+        self.port = port
+        self.cuebots = self.preferenceOrder(cuebots, hostname)
+        self.current = None
+        self.__lock = threading.Lock()
+        self.__channels = {}
+        # { <channel> : <calls running on it> }
+        self.__calls = collections.Counter()
+        # Channels of the failed cuebots, closed after their last call
+        self.__retired = set()
+        self.__health = {cuebot: CuebotHealth() for cuebot in self.cuebots}
+
+    @staticmethod
+    def __hash(value):
+        return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+    @classmethod
+    def preferenceOrder(cls, cuebots, hostname):
+        """Orders the cuebots by walking the hash ring from the hostname
+        @rtype:  list<str>
+        @return: The distinct cuebots, preferred first"""
+        ring = sorted((cls.__hash("%s#%d" % (cuebot, i)), cuebot)
+                      for cuebot in set(cuebots) for i in range(cls.VIRTUAL_NODES))
+        start = bisect.bisect(ring, (cls.__hash(hostname), ""))
+        order = []
+        for i in range(len(ring)):
+            cuebot = ring[(start + i) % len(ring)][1]
+            if cuebot not in order:
+                order.append(cuebot)
+        return order
+
+    def getAddress(self, cuebot):
+        """Returns the host:port address of a cuebot"""
+        if cuebot.startswith("[") or cuebot.count(":") == 1:
+            return cuebot
+        if ":" in cuebot:
+            return "[%s]:%s" % (cuebot, self.port)
+        return "%s:%s" % (cuebot, self.port)
+
+    def getHealth(self, cuebot):
+        """Returns the CuebotHealth of a cuebot"""
+        return self.__health[cuebot]
+
+    def getCandidates(self):
+        """Returns the cuebots to try in order: the ones that are up by preference,
+        then the ones that are down, the soonest to be retried first"""
+        now = time.time()
+        with self.__lock:
+            up = [cuebot for cuebot in self.cuebots if self.__health[cuebot].isUp(now)]
+            down = sorted((cuebot for cuebot in self.cuebots if cuebot not in up),
+                          key=lambda cuebot: self.__health[cuebot].downUntil)
+        return up + down
+
+    def getChannel(self, cuebot):
+        """Returns the channel to a cuebot, creating it on first use"""
+        with self.__lock:
+            channel = self.__channels.get(cuebot)
+            if channel is None:
+                channel = grpc.insecure_channel(self.getAddress(cuebot))
+                if len(self.cuebots) == 1:
+                    # Nowhere to fail over, retry on the same cuebot instead
+                    channel = grpc.intercept_channel(channel, RetryOnRpcErrorClientInterceptor(
+                        max_attempts=4,
+                        sleeping_policy=ExponentialBackoff(init_backoff_ms=100,
+                                                           max_backoff_ms=1600,
+                                                           multiplier=2),
+                        status_for_retry=(grpc.StatusCode.UNAVAILABLE,),
+                    ))
+                self.__channels[cuebot] = channel
+            return channel
+
+    def call(self, send):
+        """Calls the preferred cuebot that is up, failing over to the others
+        @type  send: callable
+        @param send: Called with a channel, makes the gRPC call
+        @return: What send returned
+        @raise grpc.RpcError: The error of the last cuebot when none answered"""
+        lastError = None
+        for cuebot in self.getCandidates():
+            channel = self.__acquire(cuebot)
+            try:
+                result = send(channel)
+            except grpc.RpcError as e:
+                # pylint: disable=no-member
+                if e.code() not in self.FAILOVER_CODES:
+                    raise
+                # pylint: enable=no-member
+                self.markDown(cuebot, e)
+                lastError = e
+                continue
+            finally:
+                self.__release(channel)
+            self.markUp(cuebot)
+            return result
+        raise lastError
+
+    def __acquire(self, cuebot):
+        """Returns the channel to a cuebot, counting the call running on it"""
+        channel = self.getChannel(cuebot)
+        with self.__lock:
+            self.__calls[channel] += 1
+        return channel
+
+    def __release(self, channel):
+        """Counts a call done, closing the channel after the last call if it was
+        retired meanwhile"""
+        with self.__lock:
+            self.__calls[channel] -= 1
+            if self.__calls[channel] > 0:
+                return
+            del self.__calls[channel]
+            if channel not in self.__retired:
+                return
+            self.__retired.discard(channel)
+        channel.close()
+
+    def markDown(self, cuebot, error):
+        """Skips a cuebot for a while after a failed call"""
+        with self.__lock:
+            health = self.__health[cuebot]
+            health.failures += 1
+            health.lastError = error
+            delay = min(
+                rqd.rqconstants.CUEBOT_FAILOVER_RETRY_MAX_SEC,
+                rqd.rqconstants.CUEBOT_FAILOVER_RETRY_MIN_SEC * 2 ** (health.failures - 1))
+            health.downUntil = time.time() + delay
+            # A new channel connects right away when the cuebot is tried again,
+            # instead of waiting for the reconnect backoff of the old one. Calls
+            # still running on the old one would be cancelled by closing it now.
+            channel = self.__channels.pop(cuebot, None)
+            if channel is not None and self.__calls[channel] > 0:
+                self.__retired.add(channel)
+                channel = None
+        if channel is not None:
+            channel.close()
+        # pylint: disable=no-member
+        log.warning("Cuebot %s is unreachable, skipping it for %ss: %s",
+                    cuebot, delay, error.code())
+        # pylint: enable=no-member
+
+    def markUp(self, cuebot):
+        """Records a successful call to a cuebot"""
+        with self.__lock:
+            health = self.__health[cuebot]
+            recovered = health.failures > 0
+            health.failures = 0
+            health.downUntil = 0
+            health.lastError = None
+            previous, self.current = self.current, cuebot
+        if recovered:
+            log.warning("Cuebot %s is reachable again", cuebot)
+        if previous is not None and previous != cuebot:
+            log.warning("Reporting to cuebot %s instead of %s", cuebot, previous)
+
+    def close(self):
+        """Closes the channels"""
+        with self.__lock:
+            channels = list(self.__channels.values()) + list(self.__retired)
+            self.__channels.clear()
+            self.__retired.clear()
+        for channel in channels:
+            channel.close()
 
 
 class Network(object):
@@ -263,11 +574,14 @@ class Network(object):
         """Network class initialization"""
         self.rqCore = rqCore
         self.grpcServer = None
-        self.channel = None
+        self.channels = None
 
     def start_grpc(self):
         """Starts the gRPC server."""
-        self.grpcServer = GrpcServer(self.rqCore)
+        if rqd.rqconstants.RQD_GRPC_ASYNC:
+            self.grpcServer = AsyncGrpcServer(self.rqCore)
+        else:
+            self.grpcServer = GrpcServer(self.rqCore)
         self.grpcServer.serveForever()
 
     def stopGrpc(self):
@@ -277,57 +591,54 @@ class Network(object):
             del self.grpcServer
 
     def closeChannel(self):
-        """Closes the gRPC channel."""
-        self.channel.close()
-        del self.channel
-        self.channel = None
-
-    def __getChannel(self):
+        """Closes the gRPC channels."""
+        if self.channels is not None:
+            self.channels.close()
+            self.channels = None
+
+    def getChannels(self):
+        """Returns the manager of the channels to the cuebots
+        @rtype:  CuebotChannelManager"""
         # TODO(bcipriano) Add support for the facility nameserver or drop this concept? (Issue #152)
-        if self.channel is None:
-            # create interceptors
-            interceptors = (
-                RetryOnRpcErrorClientInterceptor(
-                    max_attempts=4,
-                    sleeping_policy=ExponentialBackoff(init_backoff_ms=100,
-                                                       max_backoff_ms=1600,
-                                                       multiplier=2),
-                    status_for_retry=(grpc.StatusCode.UNAVAILABLE,),
-                ),
-            )
-
-            cuebots = rqd.rqconstants.CUEBOT_HOSTNAME.strip().split()
-            if len(cuebots) == 0:
-                raise rqd.rqexceptions.RqdException("CUEBOT_HOSTNAME is empty")
-            shuffle(cuebots)
-            self.channel = grpc.insecure_channel('%s:%s' % (cuebots[0],
-                                                            rqd.rqconstants.CUEBOT_GRPC_PORT))
-            self.channel = grpc.intercept_channel(self.channel, *interceptors)
+        if self.channels is None:
+            self.channels = CuebotChannelManager(
+                rqd.rqconstants.CUEBOT_HOSTNAME.strip().split(),
+                rqd.rqconstants.CUEBOT_GRPC_PORT,
+                rqd.rqutil.getHostname())
             atexit.register(self.closeChannel)
+        return self.channels
 
-    def __getReportStub(self):
-        self.__getChannel()
-        return opencue_proto.report_pb2_grpc.RqdReportInterfaceStub(self.channel)
+    def __sendReport(self, name, method, request):
+        """Sends a report to the cuebots, recording its latency and failures"""
+        def send(channel):
+            stub = opencue_proto.report_pb2_grpc.RqdReportInterfaceStub(channel)
+            return getattr(stub, method)(request, timeout=rqd.rqconstants.RQD_TIMEOUT)
+
+        startTime = time.time()
+        try:
+            self.getChannels().call(send)
+        except Exception:
+            rqd.rqmetrics.REPORT_FAILURES.inc(report=name)
+            raise
+        finally:
+            rqd.rqmetrics.REPORT_SECONDS.observe(time.time() - startTime, report=name)
 
     def reportRqdStartup(self, report):
         """Wraps the ability to send a startup report to rqd via grpc"""
-        stub = self.__getReportStub()
         request = opencue_proto.report_pb2.RqdReportRqdStartupRequest(boot_report=report)
-        stub.ReportRqdStartup(request, timeout=rqd.rqconstants.RQD_TIMEOUT)
+        self.__sendReport("startup", "ReportRqdStartup", request)
 
     def reportStatus(self, report):
         """Wraps the ability to send a status report to the cuebot via grpc"""
-        stub = self.__getReportStub()
         request = opencue_proto.report_pb2.RqdReportStatusRequest(host_report=report)
-        stub.ReportStatus(request, timeout=rqd.rqconstants.RQD_TIMEOUT)
+        self.__sendReport("status", "ReportStatus", request)
 
     def reportRunningFrameCompletion(self, report):
         """Wraps the ability to send a running frame completion report
            to the cuebot via grpc"""
-        stub = self.__getReportStub()
         request = opencue_proto.report_pb2.RqdReportRunningFrameCompletionRequest(
             frame_complete_report=report)
-        stub.ReportRunningFrameCompletion(request, timeout=rqd.rqconstants.RQD_TIMEOUT)
+        self.__sendReport("frame_complete", "ReportRunningFrameCompletion", request)
 
 
 # Python 2/3 compatible implementation of ABC
@@ -20,7 +20,12 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import division
 
+import ctypes
+import ctypes.util
 import os
+import shutil
+import struct
+import subprocess
 import threading
 import time
 import logging
@@ -31,32 +36,245 @@ import rqd.rqutil
 
 log = logging.getLogger(__name__)
 
+# struct input_event of the evdev interface: timeval, type, code and value
+INPUT_EVENT_FORMAT = "llHHi"
+INPUT_EVENT_SIZE = struct.calcsize(INPUT_EVENT_FORMAT)
+# Event types of keys and buttons, relative and absolute axes
+INPUT_EVENT_TYPES = (0x01, 0x02, 0x03)
+# Seconds an activity read from a backend has to be newer than the last one to
+# count, the idle times of the backends are not exact
+ACTIVITY_TOLERANCE_SEC = 1
+
+
+class IdleBackend(object):
+    """Reads how long the user of the host has been idle, polled by Nimby"""
+
+    name = None
+
+    def get_idle_seconds(self):
+        """Returns the seconds since the last user input"""
+        raise NotImplementedError
+
+    def close(self):
+        """Releases the resources of the backend"""
+
+
+class X11IdleBackend(IdleBackend):
+    """Idle time of the X server, from the MIT-SCREEN-SAVER extension"""
+
+    name = "x11"
+
+    class XScreenSaverInfo(ctypes.Structure):
+        """XScreenSaverInfo of libXss"""
+        _fields_ = [("window", ctypes.c_ulong),
+                    ("state", ctypes.c_int),
+                    ("kind", ctypes.c_int),
+                    ("til_or_since", ctypes.c_ulong),
+                    ("idle", ctypes.c_ulong),
+                    ("eventMask", ctypes.c_ulong)]
+
+    def __init__(self):
+        Nimby.setup_display()
+        xlib = self.load_library("X11")
+        xss = self.load_library("Xss")
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        xlib.XFree.argtypes = [ctypes.c_void_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(self.XScreenSaverInfo)
+        xss.XScreenSaverQueryInfo.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(self.XScreenSaverInfo)]
+
+        self.__xlib = xlib
+        self.__xss = xss
+        self.__display = xlib.XOpenDisplay(os.environ["DISPLAY"].encode())
+        if not self.__display:
+            raise OSError("Cannot open the display %s" % os.environ["DISPLAY"])
+        self.__root = xlib.XDefaultRootWindow(self.__display)
+        self.__info = xss.XScreenSaverAllocInfo()
+        # Fails early when the X server doesn't have the extension
+        self.get_idle_seconds()
+
+    @staticmethod
+    def load_library(name):
+        """Loads a shared library of X11"""
+        path = ctypes.util.find_library(name)
+        if path is None:
+            raise OSError("lib%s is not installed" % name)
+        return ctypes.CDLL(path)
+
+    def get_idle_seconds(self):
+        if not self.__xss.XScreenSaverQueryInfo(self.__display, self.__root, self.__info):
+            raise OSError("The X server doesn't support the MIT-SCREEN-SAVER extension")
+        return self.__info.contents.idle / 1000.0
+
+    def close(self):
+        if self.__display:
+            self.__xlib.XFree(self.__info)
+            self.__xlib.XCloseDisplay(self.__display)
+            self.__display = None
+
+
+class LogindIdleBackend(IdleBackend):
+    """Idle hint systemd-logind aggregates from the sessions of the host. Desktop
+    environments set the idle hint of their session after their own idle delay."""
+
+    name = "logind"
+
+    COMMAND = ["loginctl", "show-session", "--property=IdleHint", "--property=IdleSinceHint"]
+
+    def __init__(self):
+        if shutil.which(self.COMMAND[0]) is None:
+            raise OSError("loginctl is not installed")
+        self.get_idle_seconds()
+
+    def read_properties(self):
+        """Returns the idle properties of the logind manager"""
+        output = subprocess.run(self.COMMAND, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                check=True, timeout=10).stdout.decode("utf-8")
+        return dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
+
+    def get_idle_seconds(self):
+        properties = self.read_properties()
+        if properties.get("IdleHint") != "yes":
+            return 0.0
+        # Microseconds since the epoch, 0 when no session was ever active
+        idleSince = int(properties.get("IdleSinceHint") or 0) / 1000000.0
+        return max(time.time() - idleSince, 0.0)
+
+
+class DevInputIdleBackend(IdleBackend):
+    """Timestamps of the events of the input devices. The events queue up in the
+    kernel between two polls and only the timestamp of the latest one is kept, so
+    nothing runs in between. Requires read access to the /dev/input devices."""
+
+    name = "devinput"
+
+    def __init__(self):
+        # { <path> : <file descriptor> }
+        self.__devices = {}
+        self.__last_event = time.time()
+        self.__open_devices()
+        if not self.__devices:
+            raise OSError("No readable input device in %s" % rqd.rqconstants.PATH_DEV_INPUT)
+
+    def __open_devices(self):
+        """Opens the devices plugged since the last poll"""
+        try:
+            names = [name for name in os.listdir(rqd.rqconstants.PATH_DEV_INPUT)
+                     if name.startswith("event")]
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(rqd.rqconstants.PATH_DEV_INPUT, name)
+            if path not in self.__devices:
+                try:
+                    self.__devices[path] = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                except OSError as e:
+                    log.debug("Nimby: cannot read %s: %s", path, e)
+
+    def __read_events(self, fd):
+        """Returns the time of the latest user input queued on a device, None if
+        there is none"""
+        latest = None
+        while True:
+            try:
+                data = os.read(fd, INPUT_EVENT_SIZE * 64)
+            except BlockingIOError:
+                # The queue of the device is drained
+                return latest
+            if not data:
+                return latest
+            for offset in range(0, len(data) - INPUT_EVENT_SIZE + 1, INPUT_EVENT_SIZE):
+                seconds, microseconds, eventType, _, _ = struct.unpack_from(
+                    INPUT_EVENT_FORMAT, data, offset)
+                if eventType in INPUT_EVENT_TYPES:
+                    latest = max(latest or 0, seconds + microseconds / 1000000.0)
+
+    def get_idle_seconds(self):
+        self.__open_devices()
+        for path, fd in list(self.__devices.items()):
+            try:
+                latest = self.__read_events(fd)
+            except OSError:
+                # Unplugged
+                os.close(fd)
+                del self.__devices[path]
+                continue
+            if latest is not None:
+                self.__last_event = max(self.__last_event, latest)
+        return max(time.time() - self.__last_event, 0.0)
+
+    def close(self):
+        for fd in self.__devices.values():
+            os.close(fd)
+        self.__devices.clear()
+
+
+# Backends of NIMBY_IDLE_BACKEND polling the idle time, pynput is handled by Nimby
+IDLE_BACKENDS = {
+    backend.name: backend
+    for backend in (X11IdleBackend, LogindIdleBackend, DevInputIdleBackend)
+}
+
+
 class Nimby(threading.Thread):
-    """A thread that monitors user activity through keyboard and mouse input.
+    """A thread that monitors user activity.
 
-    This class uses the pynput library to detect when a user is actively using
-    the computer. When user activity is detected, it locks the machine from being
-    used for rendering (nimby lock). When the user becomes inactive for a specified
-    period, it releases the machine for rendering (nimby unlock).
+    By default, this class uses the pynput library to get keyboard and mouse
+    events. With NIMBY_IDLE_BACKEND set to one of IDLE_BACKENDS, it polls the idle
+    time of the host every NIMBY_IDLE_POLL_INTERVAL_SEC instead, so nothing runs
+    in RQD while the user works. When user activity is detected, it locks the
+    machine from being used for rendering (nimby lock). When the user becomes
+    inactive for a specified period, it releases the machine for rendering
+    (nimby unlock).
 
     Attributes:
-        is_ready (bool): Whether pynput was successfully imported and initialized.
+        is_ready (bool): Whether the idle backend was successfully initialized.
         rq_core: Reference to the RQD core for managing nimby state.
         locked (bool): Whether the host is currently locked for rendering.
         last_activity_time (float): Timestamp of the last detected user activity.
+        backend (IdleBackend): Backend polled for the idle time, None with pynput.
     """
     def __init__(self, rqCore, noOp=False):
         self.is_ready = False
         self.rq_core = rqCore
         self.locked = False
+        self.backend = None
         self.__is_user_active = False
         self.__interrupt = False
 
-        # When running on NoOp mode, nimby will skip initializing pynput and
+        # When running on NoOp mode, nimby will skip initializing its backend and
         # only report its default values
         if noOp:
             return
 
+        backendName = rqd.rqconstants.NIMBY_IDLE_BACKEND
+        if backendName == "pynput":
+            self.__init_pynput()
+            return
+        if backendName not in IDLE_BACKENDS:
+            log.warning("Unknown nimby idle backend %s, pick from pynput, %s", backendName,
+                        ", ".join(sorted(IDLE_BACKENDS)))
+            return
+        try:
+            self.backend = IDLE_BACKENDS[backendName]()
+        # pylint: disable=broad-except
+        except Exception as e:
+            log.warning("Failed to initialize the %s idle backend: %s", backendName, e)
+            return
+        self.is_ready = True
+
+        threading.Thread.__init__(self)
+
+        self.idle_threshold = rqd.rqconstants.MINIMUM_IDLE
+        self.interval = min(rqd.rqconstants.NIMBY_IDLE_POLL_INTERVAL_SEC,
+                            rqd.rqconstants.CHECK_INTERVAL_LOCKED)
+        self.last_activity_time = time.time()
+
+    def __init_pynput(self):
         try:
             Nimby.setup_display()
             # pylint: disable=import-outside-toplevel
@@ -100,22 +318,30 @@ class Nimby(threading.Thread):
     def run(self):
         """Start nimby thread"""
         if not self.is_ready:
-            log.error("Nimby cannot be started. Pynput failed to be initialized")
+            log.error("Nimby cannot be started. Its idle backend failed to be initialized")
             return
-        log.warning("Starting NimbyPynput thread")
-        self.mouse_listener.start()
-        self.keyboard_listener.start()
+        if self.backend is None:
+            log.warning("Starting NimbyPynput thread")
+            self.mouse_listener.start()
+            self.keyboard_listener.start()
+        else:
+            log.warning("Starting Nimby thread polling the %s idle backend", self.backend.name)
 
         try:
             while not self.__interrupt:
+                if self.backend is not None:
+                    self.__poll_backend()
                 self.__check_state()
                 time.sleep(self.interval)
         except KeyboardInterrupt:
             log.warning("Nimby thread interrupted")
         finally:
             self.is_ready = False
-            self.mouse_listener.stop()
-            self.keyboard_listener.stop()
+            if self.backend is None:
+                self.mouse_listener.stop()
+                self.keyboard_listener.stop()
+            else:
+                self.backend.close()
 
     def stop(self):
         """Stop nimby thread"""
@@ -136,11 +362,27 @@ class Nimby(threading.Thread):
                 log.warning(
                     "Nimby: Not unlocking host due to resource limitations")
 
+    def __poll_backend(self):
+        """Records the last user input of the idle backend as an interaction when
+        it is newer than the last activity"""
+        try:
+            idle = self.backend.get_idle_seconds()
+        # pylint: disable=broad-except
+        except Exception as e:
+            log.warning("Nimby: Failed to read the idle time from %s: %s", self.backend.name, e)
+            return
+        activity = time.time() - idle
+        if activity > self.last_activity_time + ACTIVITY_TOLERANCE_SEC:
+            self.__record_activity(activity)
+
     # pylint: disable=unused-argument
     def __on_interaction(self, *args):
+        self.__record_activity(time.time())
+
+    def __record_activity(self, activityTime):
         if not self.__is_user_active:
             self.__lock_host_for_rendering()
-        self.last_activity_time = time.time()
+        self.last_activity_time = activityTime
         self.__is_user_active = True
 
     def __unlock_host_for_rendering(self):
@@ -0,0 +1,364 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Sending of the frame complete reports, and outbox of the ones the cuebot
+didn't receive yet."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import logging
+import random
+import threading
+import time
+
+import opencue_proto.report_pb2
+import rqd.rqconstants
+import rqd.rqjournal
+import rqd.rqmetrics
+
+
+log = logging.getLogger(__name__)
+
+
+class ReportJournal(rqd.rqjournal.FrameJournal):
+    """Journal of the FrameCompleteReports waiting in the outbox"""
+
+    MAGIC = b"RQDO\x01"
+
+    @staticmethod
+    def _key(message):
+        return message.frame.frame_id
+
+    @staticmethod
+    def _parse(payload):
+        report = opencue_proto.report_pb2.FrameCompleteReport()
+        report.ParseFromString(payload)
+        return report
+
+
+class ReportOutbox(object):
+    """Bounded queue of FrameCompleteReports replayed to the cuebot with an
+    exponential backoff. Reports are deduplicated by frame id and, when a path is
+    given, journaled so they survive a restart of rqd. Held reports are being sent
+    by the ReportSender and aren't replayed until it releases them."""
+
+    def __init__(self, path=None, maxReports=None):
+        """ReportOutbox class initialization
+        @type  path: str
+        @param path: Location of the outbox journal, None to keep it in memory
+        @type  maxReports: int
+        @param maxReports: Reports kept before dropping the oldest ones,
+                           defaults to RQD_OUTBOX_MAX_REPORTS"""
+        self.maxReports = maxReports or rqd.rqconstants.RQD_OUTBOX_MAX_REPORTS
+        self.__condition = threading.Condition()
+        # { <frame_id> : FrameCompleteReport } in the order they were queued
+        self.__reports = collections.OrderedDict()
+        # { <frame_id> : <time the frame exited> } of the reports queued since rqd started
+        self.__exitTimes = {}
+        # Frame ids of the reports held by the ReportSender
+        self.__held = set()
+        self.__failures = 0
+        self.__nextAttempt = 0
+        self.__send = None
+        self.__thread = None
+        self.__stopped = False
+        self.__journal = None
+        if path:
+            self.__journal = ReportJournal(path)
+            for report in self.__journal.replay():
+                self.__reports[report.frame.frame_id] = report
+            if self.__reports:
+                log.warning("Loaded %d frame complete reports from the outbox",
+                            len(self.__reports))
+        self.__updateGauge()
+
+    def __len__(self):
+        with self.__condition:
+            return len(self.__reports)
+
+    def isBacklogged(self):
+        """Returns whether reports are waiting to be replayed, in which case new ones
+        should be queued behind them instead of waiting on an unreachable cuebot"""
+        with self.__condition:
+            return len(self.__reports) > len(self.__held)
+
+    def add(self, report, exitTime=None, hold=False):
+        """Queues a report, replacing a queued report of the same frame
+        @type  report: FrameCompleteReport
+        @param report: report_pb2.FrameCompleteReport
+        @type  exitTime: float
+        @param exitTime: Time the frame exited, to time the report once it is sent
+        @type  hold: bool
+        @param hold: Don't replay the report until it is released"""
+        frameId = report.frame.frame_id
+        with self.__condition:
+            self.__reports.pop(frameId, None)
+            self.__reports[frameId] = report
+            if hold:
+                self.__held.add(frameId)
+            else:
+                self.__held.discard(frameId)
+            if exitTime is not None:
+                self.__exitTimes[frameId] = exitTime
+            dropped = []
+            while len(self.__reports) > self.maxReports:
+                droppedReport = self.__reports.popitem(last=False)[1]
+                self.__exitTimes.pop(droppedReport.frame.frame_id, None)
+                self.__held.discard(droppedReport.frame.frame_id)
+                dropped.append(droppedReport)
+            if self.__journal is not None:
+                self.__journal.recordLaunch(report)
+                for droppedReport in dropped:
+                    self.__journal.recordComplete(droppedReport.frame.frame_id)
+                self.__journal.sync(force=True)
+            self.__updateGauge()
+            self.__condition.notify_all()
+        for droppedReport in dropped:
+            rqd.rqmetrics.OUTBOX_DROPPED.inc()
+            log.error("Outbox is full, dropping the frame complete report of %s/%s (%s)",
+                      droppedReport.frame.job_name, droppedReport.frame.frame_name,
+                      droppedReport.frame.frame_id)
+
+    def release(self, report):
+        """Leaves a held report to the replays
+        @type  report: FrameCompleteReport
+        @param report: report_pb2.FrameCompleteReport"""
+        with self.__condition:
+            if self.__reports.get(report.frame.frame_id) is not report:
+                return
+            self.__held.discard(report.frame.frame_id)
+            self.__updateGauge()
+            self.__condition.notify_all()
+
+    def flush(self, send):
+        """Sends up to RQD_OUTBOX_BATCH_SIZE queued reports, oldest first, stopping at
+        the first failure
+        @type  send: callable
+        @param send: Sends a FrameCompleteReport, raises on failure
+        @rtype:  bool
+        @return: True if the batch was sent"""
+        with self.__condition:
+            batch = [report for frameId, report in self.__reports.items()
+                     if frameId not in self.__held][:rqd.rqconstants.RQD_OUTBOX_BATCH_SIZE]
+        for report in batch:
+            try:
+                send(report)
+            # pylint: disable=broad-except
+            except Exception as e:
+                with self.__condition:
+                    self.__failures += 1
+                    delay = min(rqd.rqconstants.RQD_OUTBOX_RETRY_MAX_SEC,
+                                rqd.rqconstants.RQD_OUTBOX_RETRY_MIN_SEC *
+                                2 ** (self.__failures - 1))
+                    # Spread the replays of the hosts after a cuebot restart
+                    delay *= random.uniform(1, 1.5)
+                    self.__nextAttempt = time.time() + delay
+                    queued = len(self.__reports)
+                log.warning("Failed to replay %d frame complete reports, retrying in %.0fs: %s",
+                            queued, delay, e)
+                return False
+            self.remove(report)
+        with self.__condition:
+            self.__failures = 0
+            self.__nextAttempt = 0
+        if batch:
+            log.info("Replayed %d frame complete reports from the outbox", len(batch))
+        return True
+
+    def start(self, send):
+        """Starts replaying the queued reports in the background
+        @type  send: callable
+        @param send: Sends a FrameCompleteReport, raises on failure"""
+        with self.__condition:
+            self.__send = send
+            self.__stopped = False
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+            self.__thread = threading.Thread(target=self.__run, name="rqd-outbox")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def stop(self):
+        """Stops replaying and closes the journal"""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+        if self.__journal is not None:
+            self.__journal.close()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__stopped and (
+                        len(self.__reports) == len(self.__held)
+                        or time.time() < self.__nextAttempt):
+                    timeout = None
+                    if len(self.__reports) > len(self.__held):
+                        timeout = self.__nextAttempt - time.time()
+                    self.__condition.wait(timeout)
+                if self.__stopped:
+                    return
+                send = self.__send
+            self.flush(send)
+
+    def remove(self, report):
+        """Removes a sent report unless a newer one replaced it
+        @type  report: FrameCompleteReport
+        @param report: report_pb2.FrameCompleteReport"""
+        frameId = report.frame.frame_id
+        with self.__condition:
+            if self.__reports.get(frameId) is not report:
+                return
+            del self.__reports[frameId]
+            self.__held.discard(frameId)
+            exitTime = self.__exitTimes.pop(frameId, None)
+            if self.__journal is not None:
+                self.__journal.recordComplete(frameId)
+                self.__journal.sync()
+            self.__updateGauge()
+        if exitTime is not None:
+            rqd.rqmetrics.FRAME_EXIT_REPORT_SECONDS.observe(time.time() - exitTime)
+
+    def __updateGauge(self):
+        rqd.rqmetrics.OUTBOX_REPORTS.set(len(self.__reports) - len(self.__held))
+
+
+class ReportSender(object):
+    """Sends the frame complete reports from a background thread, so the frame
+    attendants don't wait on the cuebot. A report is held in the outbox before it is
+    sent, so it survives a restart of rqd, and removed once the cuebot received it.
+    It is tried RQD_REPORT_SEND_ATTEMPTS times before it is left to the replays of
+    the outbox, right away while older reports are waiting there."""
+
+    def __init__(self, send, outbox):
+        """ReportSender class initialization
+        @type  send: callable
+        @param send: Sends a FrameCompleteReport, raises on failure
+        @type  outbox: ReportOutbox
+        @param outbox: Outbox holding the reports until they are sent"""
+        self.__send = send
+        self.__outbox = outbox
+        self.__condition = threading.Condition()
+        # [ FrameCompleteReport ] in the order they were submitted
+        self.__queue = collections.deque()
+        self.__sending = False
+        self.__stopped = False
+        self.__thread = None
+
+    def __len__(self):
+        with self.__condition:
+            return len(self.__queue) + int(self.__sending)
+
+    def submit(self, report, exitTime=None):
+        """Queues a report to be sent, without waiting on the cuebot
+        @type  report: FrameCompleteReport
+        @param report: report_pb2.FrameCompleteReport
+        @type  exitTime: float
+        @param exitTime: Time the frame exited, to time the report"""
+        with self.__condition:
+            if self.__stopped:
+                self.__outbox.add(report, exitTime)
+                return
+            self.__outbox.add(report, exitTime, hold=True)
+            self.__queue.append(report)
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__run, name="rqd-report-sender")
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__condition.notify_all()
+
+    def waitIdle(self, timeout=None):
+        """Waits until the submitted reports were sent or left to the outbox
+        @type  timeout: float
+        @param timeout: Seconds to wait, None to wait as long as it takes
+        @rtype:  bool
+        @return: True if no report is waiting"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.__condition:
+            while self.__queue or self.__sending:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+        return True
+
+    def stop(self, timeout=None):
+        """Stops sending, the reports still waiting are left to the outbox
+        @type  timeout: float
+        @param timeout: Seconds to wait for the report being sent, it stays in the
+                        outbox if it wasn't sent in time"""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        with self.__condition:
+            pending = list(self.__queue)
+            self.__queue.clear()
+            self.__condition.notify_all()
+        for report in pending:
+            self.__outbox.release(report)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__stopped and not self.__queue:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                report = self.__queue.popleft()
+                self.__sending = True
+            try:
+                self.__deliver(report)
+            finally:
+                with self.__condition:
+                    self.__sending = False
+                    self.__condition.notify_all()
+
+    def __deliver(self, report):
+        """Sends a report, retrying with a backoff, or leaves it to the outbox"""
+        frame = report.frame
+        attempts = max(rqd.rqconstants.RQD_REPORT_SEND_ATTEMPTS, 1)
+        for attempt in range(1, attempts + 1):
+            # Queue behind the reports cuebot didn't receive yet instead of waiting on it
+            if self.__outbox.isBacklogged():
+                break
+            try:
+                self.__send(report)
+            # pylint: disable=broad-except
+            except Exception as e:
+                if attempt == attempts:
+                    log.warning("Failed to send the frame complete report of %s/%s (%s), "
+                                "queuing it in the outbox: %s",
+                                frame.job_name, frame.frame_name, frame.frame_id, e)
+                    break
+                delay = rqd.rqconstants.RQD_REPORT_RETRY_SEC * 2 ** (attempt - 1)
+                log.info("Failed to send the frame complete report of %s, retrying in "
+                         "%.1fs: %s", frame.frame_id, delay, e)
+                with self.__condition:
+                    if not self.__stopped:
+                        self.__condition.wait(delay)
+                    if self.__stopped:
+                        break
+                continue
+            self.__outbox.remove(report)
+            return
+        self.__outbox.release(report)
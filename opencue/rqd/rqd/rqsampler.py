@@ -0,0 +1,222 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Adaptive sampling of the resident memory of the running frames.
+
+The full rss update scans all of /proc every RSS_UPDATE_INTERVAL to find the
+processes of each frame. In between, frames whose memory grows fast or gets close
+to their memory limit are sampled on their own by reading the statm file of the
+processes found by the last full update, so short memory peaks still make it to
+maxRss. Stable frames are left to the full update. The cpu time spent on sampling
+is kept under RSS_SAMPLE_CPU_BUDGET by stretching the sampling intervals."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import logging
+import resource
+import threading
+import time
+
+import psutil
+
+import rqd.rqconstants
+import rqd.rqmetrics
+
+
+log = logging.getLogger(__name__)
+
+# Weight of the latest measure in the moving averages of the sampling costs
+COST_DECAY = 0.2
+
+
+class FrameSampling(object):
+    """Sampling state of a running frame"""
+
+    def __init__(self, interval):
+        self.rss = None
+        self.sampleTime = None
+        # Growth of the rss in kB per second
+        self.growth = 0.0
+        self.interval = interval
+        self.nextSample = 0
+
+
+class RssSampler(object):
+    """Picks the frames due for a sample and their next sampling interval"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # { <frame_id> : FrameSampling }
+        self.__frames = {}
+        # Moving averages of the cpu seconds spent per fast sample and per full update
+        self.__sampleCost = 0.0
+        self.__updateCost = 0.0
+        self.__pageSize = resource.getpagesize() // 1024
+
+    @staticmethod
+    def getMinInterval():
+        """Returns the shortest interval between two samples of a frame"""
+        return rqd.rqconstants.RSS_SAMPLE_MIN_INTERVAL_SEC
+
+    @staticmethod
+    def getMaxInterval():
+        """Returns the longest interval between two samples of a frame, the full
+        update samples every frame at least that often"""
+        return rqd.rqconstants.RSS_UPDATE_INTERVAL
+
+    def getInterval(self, frameId):
+        """Returns the current sampling interval of a frame, None if unknown"""
+        with self.__lock:
+            sampling = self.__frames.get(frameId)
+            return None if sampling is None else sampling.interval
+
+    def getCpuRatio(self):
+        """Returns the share of one core the sampling would take at the intervals it
+        wants, the intervals are stretched when it is above RSS_SAMPLE_CPU_BUDGET"""
+        with self.__lock:
+            return sum(self.__getCpuRatios())
+
+    def recordUpdate(self, frames, cpuSeconds, availableMemory=None):
+        """Records the rss measured by a full update of the running frames
+        @type  frames: dict
+        @param frames: { <frame_id> : RunningFrame }
+        @type  cpuSeconds: float
+        @param cpuSeconds: Cpu time the full update took
+        @type  availableMemory: int
+        @param availableMemory: Memory available on the host in kB, read from the
+                                host when None"""
+        now = time.time()
+        if availableMemory is None:
+            availableMemory = psutil.virtual_memory().available // 1024
+        with self.__lock:
+            self.__updateCost += COST_DECAY * (cpuSeconds - self.__updateCost)
+            for frameId in list(self.__frames):
+                if frameId not in frames:
+                    del self.__frames[frameId]
+            for frameId, frame in frames.items():
+                self.__record(frameId, frame, frame.rss, now, availableMemory)
+
+    def sample(self, frames, availableMemory=None):
+        """Samples the rss of the frames due for it
+        @type  frames: dict
+        @param frames: { <frame_id> : RunningFrame }
+        @type  availableMemory: int
+        @param availableMemory: Memory available on the host in kB, read from the
+                                host when None
+        @rtype:  int
+        @return: Number of frames sampled"""
+        now = time.time()
+        with self.__lock:
+            due = [(frameId, frame) for frameId, frame in frames.items()
+                   if frameId in self.__frames and frame.pids
+                   and self.__frames[frameId].nextSample <= now]
+        if not due:
+            return 0
+        if availableMemory is None:
+            availableMemory = psutil.virtual_memory().available // 1024
+
+        for frameId, frame in due:
+            startCpu = time.thread_time()
+            rss = self.readRss(frame.pids)
+            cost = time.thread_time() - startCpu
+            if rss is None:
+                continue
+            frame.rss = rss
+            frame.maxRss = max(rss, frame.maxRss)
+            rqd.rqmetrics.RSS_SAMPLES.inc()
+            with self.__lock:
+                self.__sampleCost += COST_DECAY * (cost - self.__sampleCost)
+                self.__record(frameId, frame, rss, time.time(), availableMemory)
+        with self.__lock:
+            rqd.rqmetrics.RSS_SAMPLER_CPU_RATIO.set(sum(self.__getCpuRatios()))
+        return len(due)
+
+    def readRss(self, pids):
+        """Returns the total rss of processes in kB, None if none of them is alive
+        @type  pids: list
+        @param pids: Pids as strings"""
+        rss = None
+        for pid in pids:
+            try:
+                with open(rqd.rqconstants.PATH_PROC_PID_STATM.format(pid), "rb") as statm:
+                    pages = int(statm.read().split()[1])
+            except (OSError, IOError, IndexError, ValueError):
+                # The process exited since the last full update
+                continue
+            rss = (rss or 0) + pages * self.__pageSize
+        return rss
+
+    def __record(self, frameId, frame, rss, now, availableMemory=None):
+        """Updates the growth and the next sample of a frame"""
+        sampling = self.__frames.get(frameId)
+        if sampling is None:
+            sampling = self.__frames[frameId] = FrameSampling(self.getMaxInterval())
+        elif sampling.sampleTime is not None and now > sampling.sampleTime:
+            sampling.growth = (rss - sampling.rss) / (now - sampling.sampleTime)
+        sampling.rss = rss
+        sampling.sampleTime = now
+        sampling.nextSample = now + self.__getNextInterval(
+            sampling, self.__getHeadroom(frame, rss, availableMemory))
+
+    @staticmethod
+    def __getHeadroom(frame, rss, availableMemory):
+        """Returns the kB the frame can still grow by before reaching its memory
+        limit or running the host out of memory, None if unknown"""
+        headrooms = []
+        if frame.runFrame.hard_memory_limit > 0:
+            headrooms.append(frame.runFrame.hard_memory_limit - rss)
+        if availableMemory is not None:
+            headrooms.append(availableMemory)
+        return max(min(headrooms), 0) if headrooms else None
+
+    def __getNextInterval(self, sampling, headroom):
+        """Samples a frame often enough to catch it at least RSS_SAMPLE_SAFETY times
+        before it reaches its limit at its current growth, backing off gradually
+        while it is stable. Returns the interval stretched to the cpu budget."""
+        minInterval = self.getMinInterval()
+        maxInterval = self.getMaxInterval()
+        interval = maxInterval
+        if headroom is not None:
+            if sampling.growth > 0:
+                interval = headroom / sampling.growth / rqd.rqconstants.RSS_SAMPLE_SAFETY
+            if headroom <= sampling.rss * rqd.rqconstants.RSS_SAMPLE_HEADROOM_RATIO:
+                interval = minInterval
+        # Shorten at once, lengthen by doubling
+        interval = min(interval, sampling.interval * 2)
+        interval = max(minInterval, min(maxInterval, interval))
+
+        # Stretch the intervals while sampling costs more than the budget left by
+        # the full updates
+        sampling.interval = interval
+        updateRatio, sampleRatio = self.__getCpuRatios()
+        available = rqd.rqconstants.RSS_SAMPLE_CPU_BUDGET - updateRatio
+        if available <= 0:
+            return maxInterval
+        if sampleRatio > available:
+            interval = min(maxInterval, interval * sampleRatio / available)
+        return interval
+
+    def __getCpuRatios(self):
+        """Returns the shares of one core spent by the full updates and by the fast
+        samples of the frames sampled more often than the full update"""
+        maxInterval = self.getMaxInterval()
+        sampleRatio = 0.0
+        for sampling in self.__frames.values():
+            if sampling.interval < maxInterval:
+                sampleRatio += self.__sampleCost / sampling.interval
+        return self.__updateCost / maxInterval, sampleRatio
@@ -0,0 +1,285 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Single thread running the periodic tasks of rqd.
+
+Tasks run one at a time so two runs of a task never overlap. Blocking tasks,
+the ones waiting on the network or the docker daemon, run on a worker thread of
+their own instead so a hung call doesn't hold up the other tasks, but still never
+overlap with themselves. Asking for a run of a task that is running queues a
+single run after the current one. Runs are planned
+from the previous planned time rather than from when the previous run ended, so
+slow runs don't make a task drift. Runs that are missed because a task took
+longer than its interval are skipped and counted instead of piling up."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import heapq
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+
+import rqd.rqmetrics
+
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicTask(object):
+    """A function called periodically by the Scheduler"""
+
+    def __init__(self, name, function, interval, jitter=0.0, blocking=False):
+        """PeriodicTask class initialization
+        @type  name: str
+        @param name: Unique name of the task, used in metrics
+        @type  function: callable
+        @param function: Called without arguments
+        @type  interval: float or callable
+        @param interval: Seconds between runs, or a callable returning them
+        @type  jitter: float
+        @param jitter: Runs are delayed by up to this fraction of the interval
+        @type  blocking: bool
+        @param blocking: Runs on its own thread instead of the scheduler thread"""
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.jitter = jitter
+        self.blocking = blocking
+        # Planned time of the next run, before jitter
+        self.due = 0
+        # Time the next run starts, jitter included
+        self.nextRun = 0
+        self.runs = 0
+        self.skipped = 0
+        self.lastDuration = None
+        self.cancelled = False
+        self.running = False
+        # Time of the run asked by runSoon while the task was running
+        self.rerunAt = None
+        # Worker thread of a blocking task, woken up for each run
+        self.worker = None
+        self.wakeup = threading.Event()
+
+    def getInterval(self):
+        """Returns the seconds until the next run"""
+        if callable(self.interval):
+            return self.interval()
+        return self.interval
+
+    def plan(self, due):
+        """Plans the next run"""
+        self.due = due
+        self.nextRun = due
+        if self.jitter:
+            self.nextRun += random.uniform(0, self.jitter * self.getInterval())
+
+
+class Scheduler(object):
+    """Runs periodic tasks from a priority queue on a single thread"""
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        # [ (<nextRun>, <sequence>, PeriodicTask), ... ]
+        self.__queue = []
+        self.__sequence = itertools.count()
+        # { <name> : PeriodicTask }
+        self.__tasks = {}
+        self.__thread = None
+        self.__stopped = False
+
+    def start(self):
+        """Starts running the tasks"""
+        with self.__condition:
+            self.__stopped = False
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+            self.__thread = threading.Thread(target=self.__run, name="rqd-scheduler")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def stop(self):
+        """Stops running the tasks, waiting for the running one to return"""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+            tasks = list(self.__tasks.values())
+        for task in tasks:
+            task.wakeup.set()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    def schedule(self, name, function, interval, jitter=0.0, delay=None, blocking=False):
+        """Adds a periodic task, replacing the task of the same name
+        @type  name: str
+        @param name: Unique name of the task
+        @type  function: callable
+        @param function: Called without arguments
+        @type  interval: float or callable
+        @param interval: Seconds between runs, or a callable returning them
+        @type  jitter: float
+        @param jitter: Runs are delayed by up to this fraction of the interval
+        @type  delay: float
+        @param delay: Seconds until the first run, defaults to the interval
+        @type  blocking: bool
+        @param blocking: Runs the task on its own thread, for tasks that may wait on
+                         the network or other processes
+        @rtype:  PeriodicTask
+        @return: The task"""
+        task = PeriodicTask(name, function, interval, jitter, blocking)
+        with self.__condition:
+            previous = self.__tasks.get(name)
+            if previous is not None:
+                previous.cancelled = True
+                previous.wakeup.set()
+            self.__tasks[name] = task
+            task.plan(time.time() + (task.getInterval() if delay is None else delay))
+            self.__push(task)
+        return task
+
+    def cancel(self, name):
+        """Removes a task"""
+        with self.__condition:
+            task = self.__tasks.pop(name, None)
+            if task is not None:
+                task.cancelled = True
+                task.wakeup.set()
+
+    def getTask(self, name):
+        """Returns a task by name, None if it is not scheduled"""
+        with self.__condition:
+            return self.__tasks.get(name)
+
+    def timeUntil(self, name):
+        """Returns the seconds until the next run of a task, None if it is not scheduled"""
+        with self.__condition:
+            task = self.__tasks.get(name)
+            if task is None:
+                return None
+            return task.nextRun - time.time()
+
+    def runSoon(self, name, delay=0):
+        """Moves the next run of a task earlier, the following runs are planned from it.
+        A task that is running runs again once it returns.
+        @type  name: str
+        @param name: Name of the task
+        @type  delay: float
+        @param delay: Seconds until the run"""
+        with self.__condition:
+            task = self.__tasks.get(name)
+            runAt = time.time() + delay
+            if task is None:
+                return
+            if task.running:
+                if task.rerunAt is None or runAt < task.rerunAt:
+                    task.rerunAt = runAt
+                return
+            if task.nextRun <= runAt:
+                return
+            task.due = task.nextRun = runAt
+            self.__push(task)
+
+    def __push(self, task):
+        """Queues the next run of a task, the queue may hold stale entries of it"""
+        heapq.heappush(self.__queue, (task.nextRun, next(self.__sequence), task))
+        self.__condition.notify_all()
+
+    def __next(self):
+        """Waits for the next task due, None once stopped"""
+        with self.__condition:
+            while not self.__stopped:
+                if not self.__queue:
+                    self.__condition.wait()
+                    continue
+                nextRun, _, task = self.__queue[0]
+                if task.cancelled or nextRun != task.nextRun:
+                    heapq.heappop(self.__queue)
+                    continue
+                wait = nextRun - time.time()
+                if wait > 0:
+                    self.__condition.wait(wait)
+                    continue
+                heapq.heappop(self.__queue)
+                # Not queued again until the run returns
+                task.nextRun = math.inf
+                task.running = True
+                return task
+        return None
+
+    def __run(self):
+        while True:
+            task = self.__next()
+            if task is None:
+                return
+            if task.blocking:
+                if task.worker is None or not task.worker.is_alive():
+                    task.worker = threading.Thread(
+                        target=self.__work, args=(task,), name="rqd-task-%s" % task.name)
+                    task.worker.daemon = True
+                    task.worker.start()
+                task.wakeup.set()
+            else:
+                self.__runTask(task)
+
+    def __work(self, task):
+        """Worker thread of a blocking task, runs it each time it is woken up"""
+        while True:
+            task.wakeup.wait()
+            task.wakeup.clear()
+            with self.__condition:
+                if self.__stopped or task.cancelled:
+                    task.running = False
+                    return
+            self.__runTask(task)
+
+    def __runTask(self, task):
+        """Runs a task and plans its next run"""
+        startTime = time.time()
+        try:
+            task.function()
+        # pylint: disable=broad-except
+        except Exception:
+            rqd.rqmetrics.SCHEDULER_TASK_FAILURES.inc(task=task.name)
+            log.exception("Periodic task %s failed", task.name)
+        endTime = time.time()
+        task.runs += 1
+        task.lastDuration = endTime - startTime
+        rqd.rqmetrics.SCHEDULER_TASK_SECONDS.observe(task.lastDuration, task=task.name)
+
+        with self.__condition:
+            task.running = False
+            if task.cancelled:
+                return
+            if task.rerunAt is not None:
+                # runSoon was called while the task ran
+                task.due = task.nextRun = task.rerunAt
+                task.rerunAt = None
+                self.__push(task)
+                return
+            interval = max(task.getInterval(), 0.001)
+            due = task.due + interval
+            if due <= endTime:
+                skipped = int((endTime - due) // interval) + 1
+                due += skipped * interval
+                task.skipped += skipped
+                rqd.rqmetrics.SCHEDULER_SKIPPED_RUNS.inc(skipped, task=task.name)
+                log.debug("Periodic task %s skipped %d runs", task.name, skipped)
+            task.plan(due)
+            self.__push(task)
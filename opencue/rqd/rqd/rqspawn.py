@@ -0,0 +1,437 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Spawn helper process for launching frames.
+
+Forking rqd itself copies a large multi-threaded process and preexec_fn is not
+safe with threads. The helper is a small single-threaded process started at
+boot: rqd sends it launch requests over a unix socket, it forks and execs the
+command and sends back the pid with the pipes of the process through
+SCM_RIGHTS. Frames are children of the helper, which reports their exit status.
+
+The helper only uses the standard library so it starts fast and stays small."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import array
+import errno
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+
+log = logging.getLogger(__name__)
+
+# Biggest message, a request holds the whole environment of a frame
+MAX_MESSAGE_SIZE = 1 << 20
+# stdin, stdout and stderr
+PIPE_COUNT = 3
+
+
+class SpawnHelperError(Exception):
+    """The spawn helper is not available."""
+
+
+def _sendMessage(sock, message, fds=()):
+    """Sends a json message with optional file descriptors"""
+    ancillary = []
+    if fds:
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+    sock.sendmsg([json.dumps(message).encode("utf-8")], ancillary)
+
+
+def _receiveMessage(sock):
+    """Receives a json message
+    @rtype:  tuple
+    @return: (<message or None on EOF>, [<fd>, ...])
+    @raise ValueError: When the message is not json, the fds it carried are closed"""
+    fds = array.array("i")
+    data, ancillary, _, _ = sock.recvmsg(
+        MAX_MESSAGE_SIZE, socket.CMSG_LEN(PIPE_COUNT * fds.itemsize))
+    for level, kind, cmsgData in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsgData[:len(cmsgData) - (len(cmsgData) % fds.itemsize)])
+    if not data:
+        return None, list(fds)
+    try:
+        return json.loads(data.decode("utf-8")), list(fds)
+    except ValueError:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def _exitCode(status):
+    """Converts a waitpid status to a Popen returncode"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class SpawnedProcess(object):
+    """A process launched by the spawn helper, with the subset of the
+    subprocess.Popen interface used for frames"""
+
+    def __init__(self, pid, stdin, stdout, stderr):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.__exited = threading.Event()
+
+    def _setExited(self, returncode):
+        """Called by the helper client when the process exited"""
+        self.returncode = returncode
+        self.__exited.set()
+
+    def poll(self):
+        """Returns the returncode, None while the process is running"""
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """Waits for the process to exit
+        @rtype:  int
+        @return: The returncode, negative for a signal"""
+        if not self.__exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.pid, timeout)
+        return self.returncode
+
+    def send_signal(self, sig):
+        """Sends a signal to the process if it is still running"""
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def kill(self):
+        """Kills the process"""
+        self.send_signal(signal.SIGKILL)
+
+    def terminate(self):
+        """Terminates the process"""
+        self.send_signal(signal.SIGTERM)
+
+
+class SpawnHelper(object):
+    """Client side of the spawn helper, thread safe"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__sock = None
+        self.__process = None
+        self.__readerThread = None
+        self.__stopping = False
+        self.__nextId = 0
+        # { <request id> : [<threading.Event>, <response>, <fds>] }
+        self.__pending = {}
+        # { <pid> : SpawnedProcess }
+        self.__running = {}
+        # { <pid> : <returncode> } of processes that exited before their launch
+        # response was handled
+        self.__exited = {}
+
+    def start(self):
+        """Starts the helper process"""
+        with self.__lock:
+            if self.isAlive():
+                return
+            parentSock, childSock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            for sock in (parentSock, childSock):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MAX_MESSAGE_SIZE)
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+            try:
+                # pylint: disable=consider-using-with
+                self.__process = subprocess.Popen(
+                    [sys.executable, "-m", "rqd.rqspawn", str(childSock.fileno())],
+                    pass_fds=(childSock.fileno(),), env=env, close_fds=True,
+                    start_new_session=True)
+            finally:
+                childSock.close()
+            self.__sock = parentSock
+            self.__stopping = False
+            self.__readerThread = threading.Thread(
+                target=self.__readResponses, args=(parentSock,), name="rqd-spawn-reader")
+            self.__readerThread.daemon = True
+            self.__readerThread.start()
+            log.info("Started the spawn helper, pid %s", self.__process.pid)
+
+    def stop(self):
+        """Stops the helper, the processes it launched keep running"""
+        with self.__lock:
+            sock = self.__sock
+            self.__sock = None
+            self.__stopping = True
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        if self.__process is not None:
+            try:
+                self.__process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.__process.kill()
+                self.__process.wait()
+
+    def isAlive(self):
+        """Returns whether the helper can launch processes"""
+        return self.__sock is not None and self.__process is not None \
+            and self.__process.poll() is None
+
+    def spawn(self, argv, env=None, cwd=None, cpus=None, uid=None, gid=None, timeout=None):
+        """Launches a process in a new session with piped stdin, stdout and stderr
+        @type  argv: list<str>
+        @param argv: The command
+        @type  env: dict
+        @param env: The environment, defaults to the one of the helper
+        @type  cwd: str
+        @param cwd: The working directory
+        @type  cpus: list<int>
+        @param cpus: Cpus the process is bound to
+        @type  uid: int
+        @param uid: User to run as
+        @type  gid: int
+        @param gid: Group to run as
+        @type  timeout: float
+        @param timeout: Seconds to wait for the helper, None to wait as long as it takes.
+                        A process the helper launches after that is killed.
+        @rtype:  SpawnedProcess
+        @return: The running process
+        @raise SpawnHelperError: When the helper is not available or didn't answer
+        @raise OSError: When the command can't be executed"""
+        request = {"argv": list(argv), "env": env, "cwd": cwd, "cpus": cpus,
+                   "uid": uid, "gid": gid}
+        with self.__lock:
+            if not self.isAlive():
+                raise SpawnHelperError("The spawn helper is not running")
+            self.__nextId += 1
+            request["id"] = self.__nextId
+            pending = [threading.Event(), None, []]
+            self.__pending[request["id"]] = pending
+            try:
+                _sendMessage(self.__sock, request)
+            except OSError as e:
+                del self.__pending[request["id"]]
+                raise SpawnHelperError("Failed to send to the spawn helper: %s" % e) from e
+
+        if not pending[0].wait(timeout):
+            with self.__lock:
+                abandoned = self.__pending.pop(request["id"], None) is not None
+            if abandoned:
+                raise SpawnHelperError("The spawn helper didn't answer in %ss" % timeout)
+        response, fds = pending[1], pending[2]
+        if response is None:
+            raise SpawnHelperError("The spawn helper exited")
+        if "error" in response:
+            raise OSError(response.get("errno") or errno.EIO, response["error"])
+
+        # pylint: disable=consider-using-with
+        process = SpawnedProcess(response["pid"],
+                                 os.fdopen(fds[0], "wb"),
+                                 os.fdopen(fds[1], "rb"),
+                                 os.fdopen(fds[2], "rb"))
+        with self.__lock:
+            self.__running[process.pid] = process
+            if process.pid in self.__exited:
+                self.__running.pop(process.pid)._setExited(self.__exited.pop(process.pid))
+        return process
+
+    def __readResponses(self, sock):
+        """Dispatches the launch responses and exit notifications of the helper"""
+        while True:
+            try:
+                message, fds = _receiveMessage(sock)
+            except OSError:
+                message, fds = None, []
+            if message is None:
+                break
+            if "exited" in message:
+                with self.__lock:
+                    process = self.__running.pop(message["exited"], None)
+                    if process is None:
+                        self.__exited[message["exited"]] = message["returncode"]
+                if process is not None:
+                    process._setExited(message["returncode"])
+                continue
+            with self.__lock:
+                pending = self.__pending.pop(message.get("id"), None)
+            if pending is None:
+                for fd in fds:
+                    os.close(fd)
+                if "pid" in message:
+                    self.__killAbandoned(message["pid"])
+                continue
+            pending[1] = message
+            pending[2] = fds
+            pending[0].set()
+
+        if not self.__stopping:
+            log.warning("The spawn helper exited")
+        with self.__lock:
+            self.__sock = None
+            pending = list(self.__pending.values())
+            self.__pending.clear()
+            running = list(self.__running.values())
+            self.__running.clear()
+        for event, _, _ in pending:
+            event.set()
+        for process in running:
+            threading.Thread(target=self.__waitOrphan, args=(process,), daemon=True).start()
+
+    @staticmethod
+    def __killAbandoned(pid):
+        """Kills a process launched after its spawn request timed out, the frame was
+        forked by rqd instead"""
+        log.warning("The spawn helper launched pid %s after its request timed out, "
+                    "killing it", pid)
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError as e:
+            log.error("Failed to kill pid %s launched by the spawn helper: %s", pid, e)
+
+    @staticmethod
+    def __waitOrphan(process):
+        """Waits for a process whose exit status was lost with the helper"""
+        while True:
+            try:
+                os.kill(process.pid, 0)
+            except ProcessLookupError:
+                break
+            except PermissionError:
+                pass
+            threading.Event().wait(1)
+        log.warning("Exit status of pid %s was lost with the spawn helper", process.pid)
+        process._setExited(1)
+
+
+def _launch(request):
+    """Forks and execs a request
+    @rtype:  tuple
+    @return: (<response>, [<fd>, ...] to send)"""
+    stdinRead, stdinWrite = os.pipe()
+    stdoutRead, stdoutWrite = os.pipe()
+    stderrRead, stderrWrite = os.pipe()
+    errorRead, errorWrite = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # pylint: disable=broad-except
+        try:
+            os.close(errorRead)
+            os.setsid()
+            os.dup2(stdinRead, 0)
+            os.dup2(stdoutWrite, 1)
+            os.dup2(stderrWrite, 2)
+            os.set_inheritable(errorWrite, False)
+            os.closerange(3, errorWrite)
+            os.closerange(errorWrite + 1, os.sysconf("SC_OPEN_MAX"))
+            if request.get("cwd"):
+                os.chdir(request["cwd"])
+            if request.get("cpus"):
+                os.sched_setaffinity(0, request["cpus"])
+            if request.get("gid") is not None:
+                os.setgid(request["gid"])
+            if request.get("uid") is not None:
+                os.setuid(request["uid"])
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+            if request.get("env") is None:
+                os.execvp(request["argv"][0], request["argv"])
+            os.execvpe(request["argv"][0], request["argv"], request["env"])
+        except BaseException as e:
+            error = {"errno": getattr(e, "errno", None),
+                     "error": getattr(e, "strerror", None) or str(e)}
+            os.write(errorWrite, json.dumps(error).encode("utf-8"))
+        finally:
+            os._exit(255)  # pylint: disable=protected-access
+
+    for fd in (stdinRead, stdoutWrite, stderrWrite, errorWrite):
+        os.close(fd)
+    with os.fdopen(errorRead, "rb") as errorFile:
+        error = errorFile.read()
+    if error:
+        os.waitpid(pid, 0)
+        for fd in (stdinWrite, stdoutRead, stderrRead):
+            os.close(fd)
+        response = json.loads(error.decode("utf-8"))
+        response["id"] = request.get("id")
+        return response, []
+    return {"id": request.get("id"), "pid": pid}, [stdinWrite, stdoutRead, stderrRead]
+
+
+def _reap(sock):
+    """Reports the processes that exited"""
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        _sendMessage(sock, {"exited": pid, "returncode": _exitCode(status)})
+
+
+def serve(fd):
+    """Main loop of the helper process
+    @type  fd: int
+    @param fd: The socket connected to rqd"""
+    sock = socket.socket(fileno=fd)
+    wakeupRead, wakeupWrite = os.pipe()
+    os.set_blocking(wakeupWrite, False)
+    signal.set_wakeup_fd(wakeupWrite)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            readable, _, _ = select.select([sock, wakeupRead], [], [])
+        except InterruptedError:
+            continue
+        if wakeupRead in readable:
+            os.read(wakeupRead, 4096)
+        if sock in readable:
+            request = None
+            try:
+                request, received = _receiveMessage(sock)
+                # Requests don't carry file descriptors
+                for receivedFd in received:
+                    os.close(receivedFd)
+                if request is None:
+                    # rqd exited, the frames keep running in their own sessions
+                    return
+                response, fds = _launch(request)
+            # pylint: disable=broad-except
+            except Exception as e:
+                requestId = request.get("id") if isinstance(request, dict) else None
+                response, fds = {"id": requestId, "error": str(e)}, []
+            _sendMessage(sock, response, fds)
+            for pipeFd in fds:
+                os.close(pipeFd)
+        _reap(sock)
+
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]))
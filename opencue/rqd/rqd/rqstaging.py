@@ -0,0 +1,193 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Staging area of the command and stat files of the linux frames.
+
+Each frame gets a directory under RQD_STAGING_PATH, usually on a tmpfs like
+/dev/shm, for its command file and the stat file of /usr/bin/time, instead of
+writing them to the temp directory of the host which may be a slow local disk
+or nfs. The directories of completed frames are removed by batches from the
+scheduler rather than by the frame attendants, and the ones left over by an
+rqd that died are swept when rqd starts."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import logging
+import os
+import platform
+import shutil
+import threading
+import time
+
+import rqd.rqconstants
+import rqd.rqutil
+
+
+log = logging.getLogger(__name__)
+
+
+def getFilesystemType(path):
+    """Returns the type of the filesystem a path is on, None if it is unknown
+    @type  path: str
+    @param path: Path on the filesystem
+    @rtype:  str"""
+    path = os.path.realpath(path)
+    fsType = None
+    longestMount = ""
+    try:
+        with open(rqd.rqconstants.PATH_MOUNTS, "r", encoding='utf-8') as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace("\\040", " ")
+                prefix = mount.rstrip("/") + "/"
+                if (path == mount or path.startswith(prefix)) and len(mount) >= len(longestMount):
+                    longestMount = mount
+                    fsType = fields[2]
+    except (OSError, IOError):
+        pass
+    return fsType
+
+
+class StagingArea(object):
+    """Per frame directories of the command and stat files of the frames"""
+
+    def __init__(self, root=None):
+        """StagingArea class initialization
+        @type  root: str
+        @param root: Staging directory, defaults to RQD_STAGING_PATH"""
+        self.root = rqd.rqconstants.RQD_STAGING_PATH if root is None else root
+        self.enabled = False
+        self.__lock = threading.Lock()
+        # Directories of the completed frames waiting to be removed
+        self.__released = collections.deque()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__released)
+
+    def setup(self):
+        """Creates the staging directory. It belongs to the rqd user so the frame
+        directories are created and removed without raising the permissions.
+        @rtype:  bool
+        @return: Whether the frames are staged"""
+        if not self.root or platform.system() != "Linux":
+            return False
+        rqd.rqutil.permissionsHigh()
+        try:
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root, 0o755)
+            if rqd.rqconstants.RQD_BECOME_JOB_USER:
+                os.chown(self.root, rqd.rqconstants.RQD_UID, rqd.rqconstants.RQD_GID)
+        except OSError as e:
+            log.warning("Unable to create the staging directory %s, frame files are kept "
+                        "in the temp directory: %s", self.root, e)
+            return False
+        finally:
+            rqd.rqutil.permissionsLow()
+        fsType = getFilesystemType(self.root)
+        if fsType != "tmpfs":
+            log.warning("Staging directory %s is on %s instead of a tmpfs", self.root, fsType)
+        self.enabled = True
+        return True
+
+    def createFrameDir(self, frameId):
+        """Creates the staging directory of a frame
+        @type  frameId: str
+        @param frameId: Id of the frame
+        @rtype:  str
+        @return: Path of the directory, None when the frame isn't staged"""
+        if not self.enabled:
+            return None
+        frameDir = os.path.join(self.root, "%s-%s" % (frameId, time.time()))
+        try:
+            os.mkdir(frameDir, 0o755)
+        except OSError as e:
+            log.warning("Unable to create the staging directory of frame %s, its files "
+                        "are kept in the temp directory: %s", frameId, e)
+            return None
+        return frameDir
+
+    def getFrameDir(self, path):
+        """Returns the frame directory holding a staged file
+        @type  path: str
+        @param path: Path of a command or stat file
+        @rtype:  str
+        @return: The frame directory, None if the file isn't staged"""
+        if not self.root or not path:
+            return None
+        frameDir = os.path.dirname(os.path.abspath(path))
+        if os.path.dirname(frameDir) != os.path.abspath(self.root):
+            return None
+        return frameDir
+
+    def release(self, frameDir):
+        """Queues the directory of a completed frame for removal
+        @type  frameDir: str
+        @param frameDir: Frame directory"""
+        with self.__lock:
+            self.__released.append(frameDir)
+
+    def sweep(self, keepFrameIds=()):
+        """Queues the frame directories left over by a previous rqd for removal,
+        except the ones of the frames it recovered
+        @type  keepFrameIds: iterable
+        @param keepFrameIds: Ids of the recovered frames
+        @rtype:  int
+        @return: Number of directories queued"""
+        if not self.enabled:
+            return 0
+        keep = set(keepFrameIds)
+        try:
+            names = os.listdir(self.root)
+        except OSError as e:
+            log.warning("Unable to list the staging directory %s: %s", self.root, e)
+            return 0
+        leftovers = [os.path.join(self.root, name) for name in names
+                     if name.rsplit("-", 1)[0] not in keep]
+        if leftovers:
+            log.warning("Removing %d frame directories left over in %s",
+                        len(leftovers), self.root)
+            with self.__lock:
+                self.__released.extend(leftovers)
+        return len(leftovers)
+
+    def purge(self, batchSize=None):
+        """Removes a batch of the released frame directories
+        @type  batchSize: int
+        @param batchSize: Directories removed, defaults to RQD_STAGING_CLEANUP_BATCH
+        @rtype:  int
+        @return: Number of directories removed"""
+        batchSize = batchSize or rqd.rqconstants.RQD_STAGING_CLEANUP_BATCH
+        batch = []
+        with self.__lock:
+            while self.__released and len(batch) < batchSize:
+                batch.append(self.__released.popleft())
+        removed = 0
+        for frameDir in batch:
+            try:
+                if os.path.isdir(frameDir) and not os.path.islink(frameDir):
+                    shutil.rmtree(frameDir)
+                elif os.path.lexists(frameDir):
+                    os.remove(frameDir)
+                removed += 1
+            except OSError as e:
+                log.warning("Unable to remove the staging directory %s: %s", frameDir, e)
+        return removed
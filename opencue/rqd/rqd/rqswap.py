@@ -67,56 +67,23 @@ class SampleData(object):
         return self.__pgpgout
 
 
-class RepeatedTimer(threading.Thread):
-    """
-    A repeated timer.
-    """
-
-    def __init__(self, interval, function, *args, **kwargs):
-        threading.Thread.__init__(self)
-        self.__interval = interval
-        self.__callable = function
-        self.__args = args
-        self.__kwargs = kwargs
-        self.__event = threading.Event()
-        self.__event.set()
-
-    def run(self):
-        while self.__event.is_set():
-            try:
-                timer = threading.Timer(self.__interval,
-                                        self.__callable,
-                                        self.__args,
-                                        self.__kwargs)
-                timer.start()
-                timer.join()
-            # pylint: disable=broad-except
-            except Exception:
-                # Catch all exceptions here.
-                pass
-
-    def cancel(self):
-        """
-        Cancel the repeated timer.
-        """
-        self.__event.clear()
-
-
 class VmStat(object):
     """
     A simple class to return pgpgout number from /proc/vmstat.
     """
 
-    def __init__(self):
+    def __init__(self, scheduler):
+        """
+        Constructor, samples /proc/vmstat as a task of the rqd scheduler.
+        @type  scheduler: rqd.rqscheduler.Scheduler
+        @param scheduler: Runs the periodic sampling
+        """
         self.__interval = 15
         self.__sampleSize = 10
         self.__lock = threading.Lock()
         self.__sampleData = []
-        self.__repeatedTimer = RepeatedTimer(
-            self.__interval,
-            self.__getPgoutNum)
-        self.__repeatedTimer.daemon = True
-        self.__repeatedTimer.start()
+        self.__scheduler = scheduler
+        self.__scheduler.schedule("vmstat", self.__getPgoutNum, self.__interval)
 
     def __getSampleDataCopy(self):
         with self.__lock:
@@ -189,6 +156,6 @@ class VmStat(object):
 
     def stopSample(self):
         """
-        Stop the repeated timer.
+        Stop sampling.
         """
-        self.__repeatedTimer.cancel()
+        self.__scheduler.cancel("vmstat")
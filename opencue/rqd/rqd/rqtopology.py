@@ -0,0 +1,310 @@
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""CPU topology discovery and NUMA aware core allocation.
+
+Cores are the physical cores found in /proc/cpuinfo, each one holding all of its
+hyper-threads. They are numbered from 0 and sets of cores are int bitmasks."""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import logging
+import os
+import random
+import re
+
+import rqd.rqconstants
+
+
+log = logging.getLogger(__name__)
+
+
+def parseCpuList(cpuList):
+    """Parses a kernel cpu list, ex: '0-3,8,10-11'
+    @type  cpuList: str
+    @param cpuList: The cpu list
+    @rtype:  list<int>
+    @return: The cpu numbers"""
+    cpus = []
+    for part in cpuList.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def bitCount(mask):
+    """Returns the number of cores in a mask"""
+    return bin(mask).count('1')
+
+
+def iterBits(mask):
+    """Yields the cores of a mask in increasing order"""
+    core = 0
+    while mask:
+        if mask & 1:
+            yield core
+        mask >>= 1
+        core += 1
+
+
+class CpuTopology(object):
+    """Cores of the host grouped by NUMA node and L3 cache domain"""
+
+    def __init__(self, procsByPhysidAndCoreid, nodeByProc=None, l3ByProc=None):
+        """CpuTopology class initialization
+        @type  procsByPhysidAndCoreid: dict
+        @param procsByPhysidAndCoreid: { <physical id> : { <core id> : set([<processor>]) } }
+        @type  nodeByProc: dict
+        @param nodeByProc: { <processor> : <numa node> }, sockets are used when missing
+        @type  l3ByProc: dict
+        @param l3ByProc: { <processor> : <l3 domain> }, sockets are used when missing"""
+        nodeByProc = nodeByProc or {}
+        l3ByProc = l3ByProc or {}
+
+        # [ (<physical id>, <core id>), ... ]
+        self.cores = []
+        # [ [<processor>, ...], ... ] matching self.cores
+        self.procsByCore = []
+        # { <processor> : <core> }
+        self.coreByProc = {}
+        # { <numa node> : <mask> }
+        self.nodeMasks = {}
+        # { <l3 domain> : <mask> }
+        self.l3Masks = {}
+        # [ <numa node>, ... ] matching self.cores
+        self.nodeByCore = []
+
+        for physid in sorted(procsByPhysidAndCoreid, key=int):
+            cores = procsByPhysidAndCoreid[physid]
+            for coreid in sorted(cores, key=int):
+                procs = sorted(cores[coreid], key=int)
+                core = len(self.cores)
+                self.cores.append((physid, coreid))
+                self.procsByCore.append(procs)
+                for proc in procs:
+                    self.coreByProc[proc] = core
+                node = nodeByProc.get(procs[0], int(physid))
+                l3 = l3ByProc.get(procs[0], "socket%s" % physid)
+                self.nodeByCore.append(node)
+                self.nodeMasks[node] = self.nodeMasks.get(node, 0) | (1 << core)
+                self.l3Masks[l3] = self.l3Masks.get(l3, 0) | (1 << core)
+
+    @classmethod
+    def discover(cls, procsByPhysidAndCoreid, sysPath=None):
+        """Builds the topology, reading NUMA nodes and L3 caches from sysfs
+        @type  procsByPhysidAndCoreid: dict
+        @param procsByPhysidAndCoreid: { <physical id> : { <core id> : set([<processor>]) } }
+        @type  sysPath: str
+        @param sysPath: Location of /sys/devices/system
+        @rtype:  CpuTopology"""
+        sysPath = sysPath or rqd.rqconstants.PATH_SYS_DEVICES_SYSTEM
+        nodeByProc = {}
+        l3ByProc = {}
+
+        nodePath = os.path.join(sysPath, 'node')
+        try:
+            for entry in os.listdir(nodePath):
+                match = re.match(r'^node(\d+)$', entry)
+                if not match:
+                    continue
+                with open(os.path.join(nodePath, entry, 'cpulist'), encoding='utf-8') as f:
+                    for proc in parseCpuList(f.read()):
+                        nodeByProc[str(proc)] = int(match.group(1))
+        except (OSError, ValueError) as e:
+            log.debug('NUMA nodes are not available: %s', e)
+            nodeByProc = {}
+
+        for cores in procsByPhysidAndCoreid.values():
+            for procs in cores.values():
+                for proc in procs:
+                    l3 = cls.__readL3Domain(sysPath, proc)
+                    if l3 is not None:
+                        l3ByProc[proc] = l3
+        return cls(procsByPhysidAndCoreid, nodeByProc, l3ByProc)
+
+    @staticmethod
+    def __readL3Domain(sysPath, proc):
+        """Returns the cpus sharing the L3 cache of a processor, as a domain key"""
+        cachePath = os.path.join(sysPath, 'cpu', 'cpu%s' % proc, 'cache')
+        try:
+            for index in os.listdir(cachePath):
+                indexPath = os.path.join(cachePath, index)
+                with open(os.path.join(indexPath, 'level'), encoding='utf-8') as f:
+                    if f.read().strip() != '3':
+                        continue
+                with open(os.path.join(indexPath, 'shared_cpu_list'), encoding='utf-8') as f:
+                    return f.read().strip()
+        except OSError:
+            pass
+        return None
+
+    def isNuma(self):
+        """Returns whether the host has more than one NUMA node"""
+        return len(self.nodeMasks) > 1
+
+    def getProcs(self, mask):
+        """Returns the processors of the cores of a mask"""
+        procs = []
+        for core in iterBits(mask):
+            procs.extend(self.procsByCore[core])
+        return procs
+
+    def getMask(self, procs):
+        """Returns the mask of the cores holding some processors, unknown ones are ignored"""
+        mask = 0
+        for proc in procs:
+            if proc in self.coreByProc:
+                mask |= 1 << self.coreByProc[proc]
+        return mask
+
+    def getNodes(self, mask):
+        """Returns the NUMA nodes of the cores of a mask"""
+        return sorted(set(self.nodeByCore[core] for core in iterBits(mask)))
+
+
+class CoreAllocator(object):
+    """Reserves cores, packing each request on the fewest NUMA nodes and L3 domains.
+    Not thread safe, use with locking."""
+
+    def __init__(self, topology):
+        """CoreAllocator class initialization
+        @type  topology: CpuTopology
+        @param topology: The cores to allocate"""
+        self.topology = topology
+        self.free = (1 << len(topology.cores)) - 1
+
+    def freeCount(self):
+        """Returns the number of idle cores"""
+        return bitCount(self.free)
+
+    def reserve(self, count):
+        """Reserves cores
+        @type  count: int
+        @param count: The number of cores
+        @rtype:  int
+        @return: The mask of the reserved cores, or None if there are not enough"""
+        if count <= 0 or self.freeCount() < count:
+            return None
+
+        # Best fit in a single L3 domain, then in a single NUMA node
+        for domains in (self.topology.l3Masks, self.topology.nodeMasks):
+            domain = self.__bestFit(domains, count)
+            if domain is not None:
+                return self.__take(domain, count)
+
+        # Span as few NUMA nodes as possible: drain the emptiest nodes
+        # and best fit the remainder
+        mask = 0
+        remaining = count
+        nodes = sorted(self.topology.nodeMasks.items(),
+                       key=lambda item: (-bitCount(self.free & item[1]), item[0]))
+        for node, nodeMask in nodes:
+            nodeFree = bitCount(self.free & nodeMask)
+            if nodeFree >= remaining:
+                rest = {n: m for n, m in self.topology.nodeMasks.items()
+                        if not m & mask}
+                mask |= self.__take(self.__bestFit(rest, remaining) or nodeMask, remaining)
+                break
+            mask |= self.__take(nodeMask, nodeFree)
+            remaining -= nodeFree
+        return mask
+
+    def reserveMask(self, mask):
+        """Marks specific cores as reserved, ex: for recovered frames"""
+        self.free &= ~mask
+
+    def release(self, mask):
+        """Releases reserved cores"""
+        self.free |= mask & ((1 << len(self.topology.cores)) - 1)
+
+    def __bestFit(self, domains, count):
+        """Returns the mask of the domain with the fewest idle cores that fits count"""
+        best = None
+        bestFree = None
+        for _, domainMask in sorted(domains.items(), key=lambda item: str(item[0])):
+            domainFree = bitCount(self.free & domainMask)
+            if domainFree >= count and (bestFree is None or domainFree < bestFree):
+                best = domainMask
+                bestFree = domainFree
+        return best
+
+    def __take(self, domainMask, count):
+        """Reserves count idle cores of a domain, filling its fullest L3 domains first"""
+        mask = 0
+        l3Masks = sorted(
+            (l3Mask for l3Mask in self.topology.l3Masks.values() if l3Mask & domainMask),
+            key=lambda l3Mask: bitCount(self.free & l3Mask & domainMask))
+        for l3Mask in l3Masks:
+            for core in iterBits(self.free & l3Mask & domainMask):
+                if count == 0:
+                    break
+                mask |= 1 << core
+                count -= 1
+        self.free &= ~mask
+        return mask
+
+
+def simulateFragmentation(topology, iterations=100000, maxCores=None, seed=0,
+                          allocatorClass=CoreAllocator):
+    """Simulates a long frame churn and measures how fragmented the reservations get.
+    Frames of random sizes are reserved until one doesn't fit, then a random
+    running frame is released.
+    @type  topology: CpuTopology
+    @param topology: The host to simulate
+    @type  iterations: int
+    @param iterations: The number of reservations to attempt
+    @type  maxCores: int
+    @param maxCores: The biggest frame, defaults to the cores of a NUMA node
+    @rtype:  dict
+    @return: Average NUMA nodes and L3 domains per frame, the percentage of frames
+             spanning several NUMA nodes, and of those that did while a single node
+             had enough idle cores"""
+    rand = random.Random(seed)
+    allocator = allocatorClass(topology)
+    maxCores = maxCores or max(bitCount(mask) for mask in topology.nodeMasks.values())
+    running = []
+    frames = nodes = l3s = spanning = avoidable = 0
+    for _ in range(iterations):
+        count = rand.randint(1, maxCores)
+        fitsOneNode = any(bitCount(allocator.free & nodeMask) >= count
+                          for nodeMask in topology.nodeMasks.values())
+        mask = allocator.reserve(count)
+        if mask is None:
+            if running:
+                allocator.release(running.pop(rand.randrange(len(running))))
+            continue
+        running.append(mask)
+        frames += 1
+        frameNodes = len(topology.getNodes(mask))
+        nodes += frameNodes
+        spanning += frameNodes > 1
+        avoidable += frameNodes > 1 and fitsOneNode
+        l3s += sum(1 for l3Mask in topology.l3Masks.values() if l3Mask & mask)
+    frames = max(frames, 1)
+    return {
+        'frames': frames,
+        'nodes_per_frame': nodes / frames,
+        'l3_per_frame': l3s / frames,
+        'spanning_pct': 100.0 * spanning / frames,
+        'avoidable_spanning_pct': 100.0 * avoidable / frames,
+    }
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqadmission, with a simulation of the memory of a host."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import threading
+import unittest
+
+import mock
+import pyfakefs.fake_filesystem_unittest
+
+import opencue_proto.rqd_pb2
+import rqd.rqadmission
+import rqd.rqconstants
+import rqd.rqexceptions
+import rqd.rqnetwork
+
+
+GB = 1024 * 1024
+
+MEMINFO = """MemTotal:       67108864 kB
+MemFree:         1048576 kB
+MemAvailable:   10485760 kB
+Buffers:          102400 kB
+Cached:          8388608 kB
+"""
+
+PRESSURE_MEMORY = """some avg10=35.00 avg60=12.00 avg300=3.00 total=9000000
+full avg10=22.50 avg60=8.00 avg300=2.00 total=6000000
+"""
+
+
+def makeRunFrame(frameId, reservation):
+    return opencue_proto.rqd_pb2.RunFrame(frame_id=frameId, soft_memory_limit=reservation)
+
+
+class SimulatedFrame(object):
+    """Frame whose rss ramps up linearly to its peak, then stays there"""
+
+    def __init__(self, host, frameId, reservation, peak, ramp, duration):
+        self.runningFrame = rqd.rqnetwork.RunningFrame(
+            mock.MagicMock(), makeRunFrame(frameId, reservation))
+        self.peak = peak
+        self.ramp = ramp
+        self.duration = duration
+        self.start = host.time
+
+    def step(self, now):
+        elapsed = now - self.start
+        self.runningFrame.rss = int(self.peak * min(elapsed / self.ramp, 1.0))
+        return elapsed < self.duration
+
+
+class SimulatedHost(object):
+    """Memory of a host running simulated frames. The oom killer takes the largest
+    frame whenever the frames don't fit in memory."""
+
+    def __init__(self, total, system=2 * GB):
+        self.total = total
+        self.system = system
+        self.time = 0
+        # { <frame_id> : SimulatedFrame }
+        self.frames = {}
+        self.oomKills = 0
+        self.completed = 0
+        self.refused = []
+
+    def getAvailable(self):
+        return self.total - self.system - sum(
+            frame.runningFrame.rss for frame in self.frames.values())
+
+    def getPressure(self):
+        """Tasks start stalling on memory when less than 2GB is available"""
+        available = self.getAvailable()
+        if available >= 2 * GB:
+            return 0.0, 0.0
+        stall = min((2 * GB - available) / (2 * GB) * 100, 100.0)
+        return stall, stall / 2
+
+    def getRunningFrames(self):
+        return {frameId: frame.runningFrame for frameId, frame in self.frames.items()}
+
+    def getReserved(self):
+        return sum(frame.runningFrame.runFrame.soft_memory_limit
+                   for frame in self.frames.values())
+
+    def launch(self, controller, frame):
+        """Launches a frame, through the admission controller when there is one"""
+        if controller is not None:
+            try:
+                controller.admit(frame.runningFrame.runFrame, self.getRunningFrames)
+            except rqd.rqexceptions.InsufficientMemoryException as e:
+                self.refused.append(e.reason)
+                return False
+        self.frames[frame.runningFrame.frameId] = frame
+        return True
+
+    def step(self):
+        self.time += 1
+        for frameId, frame in list(self.frames.items()):
+            if not frame.step(self.time):
+                del self.frames[frameId]
+                self.completed += 1
+        while self.getAvailable() < 0:
+            largest = max(self.frames, key=lambda frameId: self.frames[frameId].runningFrame.rss)
+            del self.frames[largest]
+            self.oomKills += 1
+
+
+class SimulatedAdmissionController(rqd.rqadmission.AdmissionController):
+    """Admission controller reading the memory of a simulated host"""
+
+    def __init__(self, host):
+        machine = mock.MagicMock()
+        machine.getSwapoutRate.return_value = 0
+        super(SimulatedAdmissionController, self).__init__(machine)
+        self.host = host
+
+    def readMeminfo(self):
+        return self.host.total, self.host.getAvailable()
+
+    def readMemoryPressure(self):
+        return self.host.getPressure()
+
+
+def simulate(useController, ticks=600):
+    """Books frames reserving 8GB that peak at 11GB on a 64GB host the way the
+    cuebot does, from the reservations. One launch every 5 ticks, the frames
+    reach their peak in 3 ticks."""
+    host = SimulatedHost(64 * GB)
+    controller = SimulatedAdmissionController(host) if useController else None
+    launched = 0
+    for tick in range(ticks):
+        if tick % 5 == 0 and host.getReserved() + 8 * GB <= host.total - host.system:
+            frame = SimulatedFrame(host, "frame-%d" % launched, reservation=8 * GB,
+                                   peak=11 * GB, ramp=3, duration=100)
+            if host.launch(controller, frame):
+                launched += 1
+        host.step()
+    return host
+
+
+@mock.patch.object(rqd.rqconstants, "RQD_ADMISSION_MAX_MEMORY_PRESSURE", 10.0)
+@mock.patch.object(rqd.rqconstants, "RQD_ADMISSION_MAX_SWAPOUT", 0)
+@mock.patch.object(rqd.rqconstants, "RQD_ADMISSION_MIN_FREE_KB", GB // 2)
+@mock.patch.object(rqd.rqconstants, "RQD_ADMISSION_DEFER_SEC", 0)
+class AdmissionSimulationTests(unittest.TestCase):
+    """Runs the admission controller against a simulated host."""
+
+    def test_withoutControllerFramesGetKilled(self):
+        host = simulate(useController=False)
+
+        self.assertGreater(host.oomKills, 0)
+
+    def test_controllerPreventsOomKills(self):
+        host = simulate(useController=True)
+
+        self.assertEqual(0, host.oomKills)
+        self.assertGreater(host.completed, 0)
+        self.assertIn(rqd.rqadmission.INSUFFICIENT_MEMORY, host.refused)
+
+    def test_unusedReservationsAreKept(self):
+        # Frames using less than they reserved leave room that is still counted
+        # as theirs
+        host = SimulatedHost(64 * GB)
+        controller = SimulatedAdmissionController(host)
+        for i in range(4):
+            host.launch(controller, SimulatedFrame(
+                host, "frame-%d" % i, reservation=12 * GB, peak=2 * GB, ramp=1,
+                duration=100))
+        host.step()
+
+        self.assertFalse(host.launch(controller, SimulatedFrame(
+            host, "frame-4", reservation=16 * GB, peak=2 * GB, ramp=1, duration=100)))
+        self.assertTrue(host.launch(controller, SimulatedFrame(
+            host, "frame-5", reservation=8 * GB, peak=2 * GB, ramp=1, duration=100)))
+
+    def test_concurrentLaunchesCountPendingReservations(self):
+        host = SimulatedHost(20 * GB, system=0)
+        controller = SimulatedAdmissionController(host)
+
+        controller.admit(makeRunFrame("frame-1", 8 * GB), dict)
+        controller.admit(makeRunFrame("frame-2", 8 * GB), dict)
+        with self.assertRaises(rqd.rqexceptions.InsufficientMemoryException):
+            controller.admit(makeRunFrame("frame-3", 8 * GB), dict)
+
+        # A frame that won't launch gives its reservation back
+        controller.release("frame-2")
+        controller.admit(makeRunFrame("frame-3", 8 * GB), dict)
+
+    def test_memoryPressure(self):
+        host = SimulatedHost(64 * GB)
+        controller = SimulatedAdmissionController(host)
+        host.frames["frame-1"] = SimulatedFrame(
+            host, "frame-1", reservation=8 * GB, peak=61 * GB, ramp=1, duration=100)
+        host.step()
+
+        with self.assertRaises(rqd.rqexceptions.InsufficientMemoryException) as context:
+            controller.admit(makeRunFrame("frame-2", 0), host.getRunningFrames)
+        self.assertEqual(rqd.rqadmission.MEMORY_PRESSURE, context.exception.reason)
+
+    def test_swapping(self):
+        host = SimulatedHost(64 * GB)
+        controller = SimulatedAdmissionController(host)
+        controller._AdmissionController__machine.getSwapoutRate.return_value = 250
+
+        with mock.patch.object(rqd.rqconstants, "RQD_ADMISSION_MAX_SWAPOUT", 100), \
+                self.assertRaises(rqd.rqexceptions.InsufficientMemoryException) as context:
+            controller.admit(makeRunFrame("frame-1", GB), dict)
+        self.assertEqual(rqd.rqadmission.SWAPPING, context.exception.reason)
+
+    @mock.patch.object(rqd.rqadmission, "DEFER_POLL_SEC", 0.05)
+    def test_deferredLaunchWaitsForMemory(self):
+        host = SimulatedHost(16 * GB, system=0)
+        controller = SimulatedAdmissionController(host)
+        host.frames["frame-1"] = SimulatedFrame(
+            host, "frame-1", reservation=12 * GB, peak=12 * GB, ramp=1, duration=2)
+        host.step()
+        timer = threading.Timer(0.2, host.step)
+        timer.start()
+
+        with mock.patch.object(rqd.rqconstants, "RQD_ADMISSION_DEFER_SEC", 2):
+            controller.admit(makeRunFrame("frame-2", 8 * GB), host.getRunningFrames)
+        timer.join()
+        self.assertEqual(1, host.completed)
+
+
+class AdmissionControllerReadTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests reading the memory state from /proc."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.create_file(rqd.rqconstants.PATH_MEMINFO, contents=MEMINFO)
+        machine = mock.MagicMock()
+        machine.getSwapoutRate.return_value = 12.5
+        self.controller = rqd.rqadmission.AdmissionController(machine)
+
+    def test_readState(self):
+        self.fs.create_file(
+            rqd.rqconstants.PATH_PRESSURE.format("memory"), contents=PRESSURE_MEMORY)
+        frame = rqd.rqnetwork.RunningFrame(mock.MagicMock(), makeRunFrame("frame-1", 4 * GB))
+        frame.rss = GB
+
+        state = self.controller.readState({"frame-1": frame})
+
+        self.assertEqual(64 * GB, state.total)
+        self.assertEqual(10 * GB, state.available)
+        self.assertEqual(3 * GB, state.outstanding)
+        self.assertEqual(35.0, state.pressureSome)
+        self.assertEqual(22.5, state.pressureFull)
+        self.assertEqual(12.5, state.swapoutRate)
+
+    def test_readStateWithoutPressure(self):
+        state = self.controller.readState({})
+
+        self.assertEqual(0.0, state.pressureFull)
+
+
+if __name__ == '__main__':
+    unittest.main()
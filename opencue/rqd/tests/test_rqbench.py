@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqbench."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import os
+import platform
+import subprocess
+import threading
+import unittest
+
+import grpc
+
+import opencue_proto.report_pb2
+import opencue_proto.report_pb2_grpc
+import rqd.rqbench
+
+
+class WorkloadTests(unittest.TestCase):
+    """Tests the commands of the synthetic frames."""
+
+    def test_commandsPrintMarkers(self):
+        for workload in rqd.rqbench.WORKLOADS:
+            output = subprocess.run(
+                ["/bin/sh", "-c", rqd.rqbench.makeCommand(workload, 0.1, 1)],
+                stdout=subprocess.PIPE, check=True).stdout.decode().split("\n")
+
+            self.assertTrue(output[0].startswith(rqd.rqbench.START_MARKER), workload)
+            self.assertTrue(output[-2].startswith(rqd.rqbench.EXIT_MARKER), workload)
+
+    def test_unknownWorkload(self):
+        with self.assertRaises(ValueError):
+            rqd.rqbench.Benchmark(workloads=["render"])
+
+    def test_percentile(self):
+        self.assertIsNone(rqd.rqbench.percentile([], 0.5))
+        self.assertEqual(51, rqd.rqbench.percentile(range(1, 101), 0.5))
+        self.assertEqual(100, rqd.rqbench.percentile(range(1, 101), 0.99))
+
+
+class StandInCuebotTests(unittest.TestCase):
+    """Tests the cuebot stand-in recording the reports."""
+
+    def setUp(self):
+        self.cuebot = rqd.rqbench.StandInCuebot()
+        self.cuebot.start()
+        self.addCleanup(self.cuebot.stop)
+        channel = grpc.insecure_channel("127.0.0.1:%d" % self.cuebot.port)
+        self.addCleanup(channel.close)
+        self.stub = opencue_proto.report_pb2_grpc.RqdReportInterfaceStub(channel)
+
+    def test_waitForCompletions(self):
+        recorder = self.cuebot.recorder
+        self.assertFalse(recorder.waitForCompletions(["frame-1"], 0.05))
+
+        request = opencue_proto.report_pb2.RqdReportRunningFrameCompletionRequest()
+        request.frame_complete_report.frame.frame_id = "frame-1"
+        timer = threading.Timer(
+            0.1, self.stub.ReportRunningFrameCompletion, args=(request,))
+        timer.start()
+
+        self.assertTrue(recorder.waitForCompletions(["frame-1"], 5))
+        timer.join()
+        self.assertIn("frame-1", recorder.completions)
+
+
+@unittest.skipUnless(platform.system() == "Linux" and os.path.exists("/usr/bin/time"),
+                     "Frames run through /usr/bin/time on Linux")
+class BenchmarkTests(unittest.TestCase):
+    """Runs a short benchmark against an RQD subprocess."""
+
+    def test_run(self):
+        benchmark = rqd.rqbench.Benchmark(
+            frames=4, burst=2, workloads=sorted(rqd.rqbench.WORKLOADS), seconds=0.2,
+            megabytes=8, timeout=60, overrides={"RQD_ADMISSION_CONTROL": False})
+
+        report = benchmark.run()
+
+        self.assertEqual(0, report["failed_launches"])
+        self.assertEqual(4, report["completed"])
+        self.assertEqual(0, report["nonzero_exits"])
+        # The output of the frames makes it to the logs up to their exit
+        self.assertEqual(4, report["launch_latency_sec"]["count"])
+        self.assertEqual(4, report["report_lag_sec"]["count"])
+        self.assertGreater(report["rqd_rss_kb"]["max"], 0)
+        self.assertGreater(report["log_bytes_per_sec"], 0)
+        self.assertIn("launch latency", rqd.rqbench.formatReport(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
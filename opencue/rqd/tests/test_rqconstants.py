@@ -36,6 +36,7 @@ import rqd.rqconstants
 import rqd.rqcore
 import rqd.rqmachine
 import rqd.rqnimby
+import rqd.rqscheduler
 import rqd.rqutil
 
 from .test_rqmachine import (
@@ -98,6 +99,7 @@ class RqConstantTests(pyfakefs.fake_filesystem_unittest.TestCase):
 
     def makeRqMachine(self):
         rqCore = mock.MagicMock(spec=rqd.rqcore.RqCore)
+        rqCore.scheduler = mock.MagicMock(spec=rqd.rqscheduler.Scheduler)
         nimby = mock.MagicMock(spec=rqd.rqnimby.Nimby)
         rqCore.nimby = nimby
         nimby.is_ready = False
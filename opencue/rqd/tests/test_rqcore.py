@@ -23,6 +23,9 @@ from __future__ import absolute_import
 
 from builtins import str
 import os.path
+import sys
+import tempfile
+import time
 import unittest
 import subprocess
 
@@ -35,8 +38,11 @@ import opencue_proto.rqd_pb2
 import rqd.rqconstants
 import rqd.rqcore
 import rqd.rqexceptions
+import rqd.rqjournal
+import rqd.rqmetrics
 import rqd.rqnetwork
 import rqd.rqnimby
+import rqd.rqstaging
 
 
 class RqCoreTests(unittest.TestCase):
@@ -50,6 +56,32 @@ class RqCoreTests(unittest.TestCase):
         self.nimbyMock = nimbyMock
         self.rqcore = rqd.rqcore.RqCore()
 
+    @mock.patch("rqd.rqnimby.Nimby", new=mock.MagicMock())
+    @mock.patch("rqd.rqnetwork.Network", autospec=True)
+    @mock.patch("rqd.rqmachine.Machine", new=mock.MagicMock())
+    @mock.patch("platform.system", new=mock.Mock(return_value="Linux"))
+    def test_recoveredFramesCanReport(self, networkMock):
+        recovered = []
+
+        def recoverCache(rqcore):
+            # Recovered frames that already exited report their completion right away
+            rqcore.reportSender.submit(opencue_proto.report_pb2.FrameCompleteReport(
+                frame=opencue_proto.report_pb2.RunningFrameInfo(frame_id="frame-id")))
+            recovered.append(rqcore)
+            return ["frame-id"]
+
+        with tempfile.TemporaryDirectory() as backupDir, \
+                mock.patch.object(rqd.rqconstants, "BACKUP_CACHE_PATH",
+                                  os.path.join(backupDir, "cache.dat")), \
+                mock.patch.object(rqd.rqcore.RqCore, "recoverCache", autospec=True,
+                                  side_effect=recoverCache):
+            rqcore = rqd.rqcore.RqCore()
+            self.assertTrue(rqcore.reportSender.waitIdle(5))
+            rqcore.outbox.stop()
+
+        self.assertEqual([rqcore], recovered)
+        networkMock.return_value.reportRunningFrameCompletion.assert_called_once()
+
     @mock.patch.object(rqd.rqcore.RqCore, "nimbyOn")
     def test_startServer(self, nimbyOnMock):
         rqd.rqconstants.OVERRIDE_NIMBY = False
@@ -113,37 +145,56 @@ class RqCoreTests(unittest.TestCase):
         networkMock.return_value.start_grpc.assert_called()
         nimbyOnMock.assert_not_called()
 
-    @mock.patch("threading.Timer")
-    def test_grpcConnected(self, timerMock):
-        update_rss_thread = mock.MagicMock()
-        interval_thread = mock.MagicMock()
-        timerMock.side_effect = [update_rss_thread, interval_thread]
+    def test_grpcConnected(self):
+        self.rqcore.scheduler = mock.MagicMock()
 
         self.rqcore.grpcConnected()
 
-        self.networkMock.return_value.reportRqdStartup.assert_called()
-        update_rss_thread.start.assert_called()
-        interval_thread.start.assert_called()
+        bootReport = self.machineMock.return_value.getBootReport.return_value
+        self.networkMock.return_value.reportRqdStartup.assert_called_with(bootReport)
+        bootReport.host.attributes.__setitem__.assert_called_with(
+            "startup_timing_sec", self.rqcore.startup.format())
+        self.assertIsNotNone(self.rqcore.startup.totalSeconds)
+        scheduled = [call[0][0] for call in self.rqcore.scheduler.schedule.call_args_list]
+        self.assertIn("rss", scheduled)
+        self.assertIn("ping", scheduled)
+        self.rqcore.scheduler.start.assert_called()
+
+    def test_startProbes(self):
+        self.rqcore.docker_agent = mock.MagicMock()
+
+        self.rqcore.startProbes()
+        self.rqcore.startup.wait()
+
+        self.machineMock.return_value.setupGpu.assert_called_with()
+        # The cpu topology is read by the machine before any frame launches
+        self.machineMock.return_value.setupTaskset.assert_not_called()
+        # The container pool starts once the images are pulled
+        self.rqcore.docker_agent.refreshFrameImages.assert_called_with()
+        self.rqcore.docker_agent.startPool.assert_called()
+        phases = [phase for phase, _ in self.rqcore.startup.phases]
+        self.assertIn("gpu_probe", phases)
+        self.assertIn("docker_images", phases)
 
     @mock.patch.object(rqd.rqcore.RqCore, "sendStatusReport", autospec=True)
-    @mock.patch("threading.Timer")
-    def test_onInterval(self, timerMock, sendStatusReportMock):
+    def test_onInterval(self, sendStatusReportMock):
         self.rqcore.onInterval()
 
-        timerMock.return_value.start.assert_called()
         sendStatusReportMock.assert_called_with(self.rqcore)
 
-    @mock.patch("threading.Timer", autospec=True)
-    def test_onIntervalWithSleepTime(self, timerMock):
-        sleep_time = 72
+    def test_requestStatusReport(self):
+        self.rqcore.scheduler = mock.MagicMock()
+        self.rqcore.scheduler.timeUntil.return_value = 3 * rqd.rqconstants.RQD_MIN_PING_INTERVAL_SEC
 
-        self.rqcore.onInterval(sleepTime=sleep_time)
+        self.rqcore.requestStatusReport()
+        self.rqcore.scheduler.runSoon.assert_called_with("ping")
 
-        timerMock.assert_called_with(sleep_time, mock.ANY)
-        timerMock.return_value.start.assert_called()
+        self.rqcore.scheduler.reset_mock()
+        self.rqcore.scheduler.timeUntil.return_value = 1
+        self.rqcore.requestStatusReport()
+        self.rqcore.scheduler.runSoon.assert_not_called()
 
     @mock.patch.object(rqd.rqcore.RqCore, "shutdownRqdNow")
-    @mock.patch("threading.Timer", new=mock.MagicMock())
     def test_onIntervalShutdown(self, shutdownRqdNowMock):
         self.rqcore.shutdownRqdIdle()
         self.machineMock.return_value.isUserLoggedIn.return_value = False
@@ -154,17 +205,26 @@ class RqCoreTests(unittest.TestCase):
 
         shutdownRqdNowMock.assert_called_with()
 
-    @mock.patch("threading.Timer")
-    def test_updateRss(self, timerMock):
+    def test_updateRss(self):
         self.rqcore.storeFrame(
             "frame-id", mock.MagicMock(spec=rqd.rqnetwork.RunningFrame)
         )
         self.rqcore.backup_cache_path = None
+        self.rqcore.rssSampler = mock.MagicMock()
 
         self.rqcore.updateRss()
 
         self.machineMock.return_value.rssUpdate.assert_called()
-        timerMock.return_value.start.assert_called()
+        self.rqcore.rssSampler.recordUpdate.assert_called()
+
+    def test_sampleRss(self):
+        frame = mock.MagicMock(spec=rqd.rqnetwork.RunningFrame)
+        self.rqcore.storeFrame("frame-id", frame)
+        self.rqcore.rssSampler = mock.MagicMock()
+
+        self.rqcore.sampleRss()
+
+        self.rqcore.rssSampler.sample.assert_called_with({"frame-id": frame})
 
     def test_getFrame(self):
         frame_id = "arbitrary-frame-id"
@@ -288,14 +348,12 @@ class RqCoreTests(unittest.TestCase):
     @mock.patch.object(rqd.rqcore.RqCore, "nimbyOff")
     @mock.patch("os._exit")
     def test_shutdown(self, nimbyOffMock, exitMock):
-        self.rqcore.onIntervalThread = mock.MagicMock()
-        self.rqcore.updateRssThread = mock.MagicMock()
+        self.rqcore.scheduler = mock.MagicMock()
 
         self.rqcore.shutdown()
 
         nimbyOffMock.assert_called()
-        self.rqcore.onIntervalThread.cancel.assert_called()
-        self.rqcore.updateRssThread.cancel.assert_called()
+        self.rqcore.scheduler.stop.assert_called()
 
     @mock.patch("rqd.rqnetwork.Network", autospec=True)
     @mock.patch("os._exit")
@@ -400,6 +458,43 @@ class RqCoreTests(unittest.TestCase):
         with self.assertRaises(rqd.rqexceptions.CoreReservationFailureException):
             self.rqcore.launchFrame(frame)
 
+    def test_launchFrameWithInsufficientMemory(self):
+        self.rqcore.cores = opencue_proto.report_pb2.CoreDetail(
+            total_cores=100, idle_cores=20
+        )
+        self.machineMock.return_value.state = opencue_proto.host_pb2.UP
+        self.nimbyMock.return_value.locked = False
+        self.rqcore.admission = mock.MagicMock()
+        self.rqcore.admission.admit.side_effect = \
+            rqd.rqexceptions.InsufficientMemoryException("Not launching", "memory_pressure")
+        frame = opencue_proto.rqd_pb2.RunFrame(uid=22, num_cores=10)
+
+        with self.assertRaises(rqd.rqexceptions.InsufficientMemoryException):
+            self.rqcore.launchFrame(frame)
+        # pylint: disable=no-member
+        self.assertEqual(20, self.rqcore.cores.idle_cores)
+
+    @mock.patch("rqd.rqcore.FrameAttendantThread")
+    def test_launchFrameFailureReleasesAdmission(self, frameThreadMock):
+        self.rqcore.cores = opencue_proto.report_pb2.CoreDetail(
+            total_cores=100, idle_cores=20
+        )
+        self.machineMock.return_value.state = opencue_proto.host_pb2.UP
+        self.nimbyMock.return_value.locked = False
+        self.rqcore.admission = mock.MagicMock()
+        frameThreadMock.return_value.start.side_effect = RuntimeError("can't start new thread")
+        frame = opencue_proto.rqd_pb2.RunFrame(frame_id="frame-id", uid=22, num_cores=10)
+
+        with self.assertRaises(RuntimeError):
+            self.rqcore.launchFrame(frame)
+        self.rqcore.admission.release.assert_called_once_with("frame-id")
+
+        self.rqcore.admission.reset_mock()
+        self.rqcore.cores.idle_cores = 5
+        with self.assertRaises(rqd.rqexceptions.CoreReservationFailureException):
+            self.rqcore.launchFrame(frame)
+        self.rqcore.admission.release.assert_called_once_with("frame-id")
+
     def test_getRunningFrame(self):
         frameId = "arbitrary-frame-id"
         frame = opencue_proto.rqd_pb2.RunFrame(frame_id=frameId)
@@ -408,6 +503,22 @@ class RqCoreTests(unittest.TestCase):
         self.assertEqual(frame, self.rqcore.getRunningFrame(frameId))
         self.assertIsNone(self.rqcore.getRunningFrame("some-unknown-frame-id"))
 
+    def test_getFrameLog(self):
+        frameId = "arbitrary-frame-id"
+        runningFrame = rqd.rqnetwork.RunningFrame(
+            self.rqcore, opencue_proto.rqd_pb2.RunFrame(frame_id=frameId))
+        runningFrame.frameAttendantThread = mock.MagicMock()
+        runningFrame.frameAttendantThread.rqlog.filepath = "/logs/frame.rqlog"
+        self.rqcore.storeFrame(frameId, runningFrame)
+
+        self.assertEqual(
+            (runningFrame.frameAttendantThread.rqlog.tail, "/logs/frame.rqlog"),
+            self.rqcore.getFrameLog(frameId))
+        self.assertIsNone(self.rqcore.getFrameLog("some-unknown-frame-id"))
+
+        runningFrame.frameAttendantThread.rqlog = None
+        self.assertIsNone(self.rqcore.getFrameLog(frameId))
+
     @mock.patch("os._exit")
     def test_rebootNowNoUser(self, exitMock):
         self.machineMock.return_value.isUserLoggedIn.return_value = False
@@ -568,11 +679,12 @@ class RqCoreTests(unittest.TestCase):
         renderHost = opencue_proto.report_pb2.RenderHost(
             name="arbitrary-host-name"
         )
-        self.rqcore.machine.getHostInfo.return_value = renderHost
+        self.rqcore.machine.getCachedHostInfo.return_value = renderHost
         self.rqcore.nimby = mock.MagicMock()
         self.rqcore.nimby.locked.return_value = False
         self.rqcore.network.reportRunningFrameCompletion = mock.MagicMock()
         self.rqcore.sendFrameCompleteReport(frameInfo)
+        self.assertTrue(self.rqcore.reportSender.waitIdle(5))
 
         self.rqcore.network.reportRunningFrameCompletion.assert_called_once_with(
             opencue_proto.report_pb2.FrameCompleteReport(
@@ -587,27 +699,88 @@ class RqCoreTests(unittest.TestCase):
             )
         )
 
+    @mock.patch.object(rqd.rqconstants, "RQD_REPORT_SEND_ATTEMPTS", 2)
+    @mock.patch.object(rqd.rqconstants, "RQD_REPORT_RETRY_SEC", 0)
+    def test_sendFrameCompleteReportQueuesInOutbox(self):
+        runFrame = opencue_proto.rqd_pb2.RunFrame(frame_id="frameId", job_name="job")
+        frameInfo = rqd.rqnetwork.RunningFrame(self.rqcore, runFrame)
+        frameInfo.exitStatus = 0
+        frameInfo.ignoreNimby = True
+        self.rqcore.machine.getCachedHostInfo.return_value = opencue_proto.report_pb2.RenderHost()
+        self.rqcore.network.reportRunningFrameCompletion = mock.MagicMock(
+            side_effect=RuntimeError("cuebot is down"))
+
+        self.rqcore.sendFrameCompleteReport(frameInfo)
+        self.assertTrue(self.rqcore.reportSender.waitIdle(5))
+
+        # Retried before being queued
+        self.assertTrue(frameInfo.completeReportSent)
+        self.assertEqual(2, self.rqcore.network.reportRunningFrameCompletion.call_count)
+        self.assertEqual(1, len(self.rqcore.outbox))
+
+        # Following reports are queued without waiting on cuebot
+        runFrame2 = opencue_proto.rqd_pb2.RunFrame(frame_id="frameId2", job_name="job")
+        frameInfo2 = rqd.rqnetwork.RunningFrame(self.rqcore, runFrame2)
+        frameInfo2.exitStatus = 0
+        frameInfo2.ignoreNimby = True
+        self.rqcore.sendFrameCompleteReport(frameInfo2)
+        self.assertTrue(self.rqcore.reportSender.waitIdle(5))
+
+        self.assertEqual(2, self.rqcore.network.reportRunningFrameCompletion.call_count)
+        self.assertEqual(2, len(self.rqcore.outbox))
+
+    @mock.patch.object(rqd.rqconstants, "RQD_REPORT_RETRY_SEC", 0)
+    def test_sendFrameCompleteReportRetries(self):
+        runFrame = opencue_proto.rqd_pb2.RunFrame(frame_id="frameId", job_name="job")
+        frameInfo = rqd.rqnetwork.RunningFrame(self.rqcore, runFrame)
+        frameInfo.exitStatus = 0
+        frameInfo.ignoreNimby = True
+        frameInfo.exitTime = time.time()
+        self.rqcore.machine.getCachedHostInfo.return_value = opencue_proto.report_pb2.RenderHost()
+        self.rqcore.network.reportRunningFrameCompletion = mock.MagicMock(
+            side_effect=[RuntimeError("cuebot is restarting"), None])
+        observed = rqd.rqmetrics.FRAME_EXIT_REPORT_SECONDS.getCount()
+
+        self.rqcore.sendFrameCompleteReport(frameInfo)
+        self.assertTrue(self.rqcore.reportSender.waitIdle(5))
+
+        self.assertEqual(2, self.rqcore.network.reportRunningFrameCompletion.call_count)
+        self.assertEqual(0, len(self.rqcore.outbox))
+        self.assertEqual(observed + 1, rqd.rqmetrics.FRAME_EXIT_REPORT_SECONDS.getCount())
+
 
 class RqCoreBackupTests(pyfakefs.fake_filesystem_unittest.TestCase):
     def setUp(self):
         self.rqcore = rqd.rqcore.RqCore()
         self.setUpPyfakefs()
 
-    @mock.patch('builtins.open', new_callable=mock.mock_open)
-    def test_backupCache_withPath(self, mockOpen):
-        """Test backupCache writes frame data when backup path is configured"""
+    def test_backupCache_withPath(self):
+        """Test backupCache journals frame data when backup path is configured"""
         self.rqcore.backup_cache_path = '/tmp/rqd/cache.dat'
+        os.makedirs('/tmp/rqd')
         frameId = 'frame123'
-        runningFrame = mock.MagicMock()
-        runningFrame.runFrame = mock.MagicMock()
-        runningFrame.runFrame.SerializeToString.return_value = b'serialized_frame_data'
+        frame = opencue_proto.rqd_pb2.RunFrame(frame_id=frameId, num_cores=4)
+        runningFrame = rqd.rqnetwork.RunningFrame(self.rqcore, frame)
         self.rqcore.storeFrame(frameId, runningFrame)
+        frame.pid = 1234
+
+        self.rqcore.backupCache()
+
+        self.assertTrue(os.path.exists('/tmp/rqd/cache.dat'))
+        journal = rqd.rqjournal.FrameJournal('/tmp/rqd/cache.dat')
+        self.assertEqual([frame], journal.replay())
 
+    def test_deleteFrame_completesJournal(self):
+        """Test a deleted frame is not recovered from the backup"""
+        self.rqcore.backup_cache_path = 'cache.dat'
+        frameId = 'frame123'
+        frame = opencue_proto.rqd_pb2.RunFrame(frame_id=frameId, num_cores=4)
+        self.rqcore.storeFrame(frameId, rqd.rqnetwork.RunningFrame(self.rqcore, frame))
         self.rqcore.backupCache()
 
-        mockOpen.assert_called_once_with('/tmp/rqd/cache.dat', 'wb')
-        handle = mockOpen()
-        handle.write.assert_called_with(b'serialized_frame_data')
+        self.rqcore.deleteFrame(frameId)
+
+        self.assertEqual([], rqd.rqjournal.FrameJournal('cache.dat').replay())
 
     def test_backupCache_noPath(self):
         """Test backupCache does nothing when no backup path configured"""
@@ -675,6 +848,21 @@ class RqCoreBackupTests(pyfakefs.fake_filesystem_unittest.TestCase):
         self.assertEqual(4, self.rqcore.cores.idle_cores)
         self.assertEqual(4, self.rqcore.cores.booked_cores)
 
+    @mock.patch("rqd.rqcore.FrameAttendantThread", autospec=True)
+    def test_recoverCache_reservesCpuList(self, attendant_patch):
+        """Test the cores of a recovered frame aren't given to new frames"""
+        self.rqcore.backup_cache_path = 'cache.dat'
+        self.rqcore.machine = mock.MagicMock()
+        frame = opencue_proto.rqd_pb2.RunFrame(
+            frame_id='frame123', num_cores=200, attributes={'CPU_LIST': '0,8,1,9'})
+        self.rqcore.storeFrame('frame123', rqd.rqnetwork.RunningFrame(self.rqcore, frame))
+        self.rqcore.backupCache()
+        self.rqcore._RqCore__cache = {}
+
+        self.assertEqual(['frame123'], self.rqcore.recoverCache())
+
+        self.rqcore.machine.reserveRecoveredHT.assert_called_once_with('0,8,1,9')
+
     def test_recoverCache_invalidFrame(self):
         """Test recoverCache loads frame data from valid backup file"""
         self.rqcore.backup_cache_path = 'cache.dat'
@@ -688,6 +876,7 @@ class RqCoreBackupTests(pyfakefs.fake_filesystem_unittest.TestCase):
 @mock.patch("rqd.rqutil.checkAndCreateUser", new=mock.MagicMock())
 @mock.patch("rqd.rqutil.permissionsHigh", new=mock.MagicMock())
 @mock.patch("rqd.rqutil.permissionsLow", new=mock.MagicMock())
+@mock.patch("os.set_blocking", new=mock.MagicMock())
 @mock.patch("subprocess.Popen")
 @mock.patch("time.time")
 @mock.patch("rqd.rqutil.permissionsUser", spec=True)
@@ -729,13 +918,13 @@ class FrameAttendantThreadTests(pyfakefs.fake_filesystem_unittest.TestCase):
         selectMock.return_value.poll.return_value = []
 
         rqCore = mock.MagicMock()
-        rqCore.intervalStartTime = 20
-        rqCore.intervalSleepTime = 40
         rqCore.machine.getTempPath.return_value = jobTempPath
         rqCore.machine.isDesktop.return_value = True
-        rqCore.machine.getHostInfo.return_value = renderHost
+        rqCore.machine.getCachedHostInfo.return_value = renderHost
         rqCore.nimby.locked = False
         rqCore.docker_agent = None
+        rqCore.spawnHelper = None
+        rqCore.staging.createFrameDir.return_value = None
         children = opencue_proto.report_pb2.ChildrenProcStats()
 
         runFrame = opencue_proto.rqd_pb2.RunFrame(
@@ -781,6 +970,93 @@ class FrameAttendantThreadTests(pyfakefs.fake_filesystem_unittest.TestCase):
         rqCore.sendFrameCompleteReport.assert_called_with(
             frameInfo
         )
+        # The cores were released once, when the process exited
+        rqCore.releaseCores.assert_called_once_with(0, None, None)
+        self.assertEqual(currentTime, frameInfo.exitTime)
+
+    @mock.patch("platform.system", new=mock.Mock(return_value="Linux"))
+    @mock.patch("tempfile.gettempdir")
+    @mock.patch("select.poll")
+    def test_runLinuxWithSpawnHelper(
+        self, selectMock, getTempDirMock, permsUser, timeMock, popenMock
+    ):
+        del permsUser
+        jobTempPath = "/job/temp/path/"
+        tempDir = "/some/random/temp/dir"
+        self.fs.create_dir(tempDir)
+        timeMock.return_value = 1568070634.3
+        getTempDirMock.return_value = tempDir
+        selectMock.return_value.poll.return_value = []
+
+        rqCore = mock.MagicMock()
+        rqCore.machine.getTempPath.return_value = jobTempPath
+        rqCore.machine.isDesktop.return_value = False
+        rqCore.machine.getCachedHostInfo.return_value = opencue_proto.report_pb2.RenderHost(
+            name="arbitrary-host-name")
+        rqCore.docker_agent = None
+        rqCore.staging.createFrameDir.return_value = None
+        rqCore.spawnHelper.isAlive.return_value = True
+        rqCore.spawnHelper.spawn.return_value.pid = 1234
+        rqCore.spawnHelper.spawn.return_value.wait.return_value = 0
+        runFrame = opencue_proto.rqd_pb2.RunFrame(
+            frame_id="arbitrary-frame-id",
+            job_name="arbitrary-job-name",
+            frame_name="arbitrary-frame-name",
+            uid=928,
+            user_name="my-random-user",
+            log_dir="/path/to/log/dir/",
+        )
+        frameInfo = rqd.rqnetwork.RunningFrame(rqCore, runFrame)
+
+        attendantThread = rqd.rqcore.FrameAttendantThread(rqCore, runFrame, frameInfo)
+        attendantThread.start()
+        attendantThread.join()
+
+        popenMock.assert_not_called()
+        rqCore.spawnHelper.spawn.assert_called_with(
+            mock.ANY, env=mock.ANY, cwd=jobTempPath,
+            timeout=rqd.rqconstants.RQD_SPAWN_HELPER_TIMEOUT_SEC)
+        self.assertEqual(1234, runFrame.pid)
+        rqCore.sendFrameCompleteReport.assert_called_with(frameInfo)
+
+    @mock.patch("platform.system", new=mock.Mock(return_value="Linux"))
+    @mock.patch("select.poll")
+    def test_runLinuxStaged(self, selectMock, permsUser, timeMock, popenMock):
+        del permsUser
+        stagingPath = "/dev/shm/rqd"
+        self.fs.create_dir(stagingPath)
+        timeMock.return_value = 1568070634.3
+        selectMock.return_value.poll.return_value = []
+        popenMock.return_value.wait.return_value = 0
+        popenMock.return_value.stdout.readline.return_value = None
+        popenMock.return_value.stderr.readline.return_value = None
+
+        rqCore = mock.MagicMock()
+        rqCore.machine.getTempPath.return_value = "/job/temp/path/"
+        rqCore.machine.isDesktop.return_value = False
+        rqCore.docker_agent = None
+        rqCore.spawnHelper = None
+        rqCore.staging = rqd.rqstaging.StagingArea(stagingPath)
+        rqCore.staging.enabled = True
+        runFrame = opencue_proto.rqd_pb2.RunFrame(
+            frame_id="frame-id", job_name="job", frame_name="frame", uid=928,
+            user_name="my-random-user", log_dir="/path/to/log/dir/")
+        frameInfo = rqd.rqnetwork.RunningFrame(rqCore, runFrame)
+
+        attendantThread = rqd.rqcore.FrameAttendantThread(rqCore, runFrame, frameInfo)
+        attendantThread.start()
+        attendantThread.join()
+
+        frameDir = stagingPath + "/frame-id-1568070634.3"
+        command = popenMock.call_args[0][0]
+        self.assertEqual(["/usr/bin/time", "-p", "-o",
+                          frameDir + "/rqd-stat-frame-id-1568070634.3",
+                          frameDir + "/rqd-cmd-frame-id-1568070634.3"], command)
+        # The frame directory is left to the staging cleanup
+        self.assertTrue(os.path.isfile(frameDir + "/rqd-cmd-frame-id-1568070634.3"))
+        self.assertEqual(1, len(rqCore.staging))
+        self.assertEqual(1, rqCore.staging.purge())
+        self.assertFalse(os.path.exists(frameDir))
 
     @mock.patch('platform.system', new=mock.Mock(return_value='Linux'))
     @mock.patch('tempfile.gettempdir')
@@ -807,11 +1083,9 @@ class FrameAttendantThreadTests(pyfakefs.fake_filesystem_unittest.TestCase):
         getTempDirMock.return_value = tempDir
 
         rqCore = mock.MagicMock()
-        rqCore.intervalStartTime = 20
-        rqCore.intervalSleepTime = 40
         rqCore.machine.getTempPath.return_value = jobTempPath
         rqCore.machine.isDesktop.return_value = True
-        rqCore.machine.getHostInfo.return_value = renderHost
+        rqCore.machine.getCachedHostInfo.return_value = renderHost
         rqCore.nimby.locked = False
 
         children = opencue_proto.report_pb2.ChildrenProcStats()
@@ -911,11 +1185,9 @@ class FrameAttendantThreadTests(pyfakefs.fake_filesystem_unittest.TestCase):
         popenMock.return_value.returncode = returnCode
 
         rqCore = mock.MagicMock()
-        rqCore.intervalStartTime = 20
-        rqCore.intervalSleepTime = 40
         rqCore.machine.getTempPath.return_value = jobTempPath
         rqCore.machine.isDesktop.return_value = True
-        rqCore.machine.getHostInfo.return_value = renderHost
+        rqCore.machine.getCachedHostInfo.return_value = renderHost
         rqCore.nimby.locked = False
         children = opencue_proto.report_pb2.ChildrenProcStats()
 
@@ -985,11 +1257,9 @@ class FrameAttendantThreadTests(pyfakefs.fake_filesystem_unittest.TestCase):
         popenMock.return_value.stdout.readline.return_value = None
 
         rqCore = mock.MagicMock()
-        rqCore.intervalStartTime = 20
-        rqCore.intervalSleepTime = 40
         rqCore.machine.getTempPath.return_value = jobTempPath
         rqCore.machine.isDesktop.return_value = True
-        rqCore.machine.getHostInfo.return_value = renderHost
+        rqCore.machine.getCachedHostInfo.return_value = renderHost
         rqCore.nimby.locked = False
         rqCore.docker_agent = None
         children = opencue_proto.report_pb2.ChildrenProcStats()
@@ -1037,6 +1307,52 @@ class FrameAttendantThreadTests(pyfakefs.fake_filesystem_unittest.TestCase):
             frameInfo
         )
 
+    def test_postFrameActionReportsBeforeDeleting(self, permsUser, timeMock, popenMock):
+        # pylint: disable=unused-argument
+        rqCore = mock.MagicMock()
+        runFrame = opencue_proto.rqd_pb2.RunFrame(frame_id="arbitrary-frame-id")
+        frameInfo = rqd.rqnetwork.RunningFrame(rqCore, runFrame)
+        attendantThread = rqd.rqcore.FrameAttendantThread(rqCore, runFrame, frameInfo)
+
+        attendantThread.postFrameAction()
+
+        calls = [name for name, _, _ in rqCore.mock_calls
+                 if name in ("sendFrameCompleteReport", "deleteFrame")]
+        self.assertEqual(["sendFrameCompleteReport", "deleteFrame"], calls)
+
+
+class ImportTimeTests(unittest.TestCase):
+    """Bounds the time it takes to import rqd, the optional subsystems are only
+    imported once enabled."""
+
+    SCRIPT = "\n".join([
+        "import sys",
+        "import time",
+        "start = time.time()",
+        "import rqd.rqcore",
+        "print(time.time() - start)",
+        "print(' '.join(name for name in %r if name in sys.modules))",
+    ])
+
+    OPTIONAL_MODULES = ("docker", "pynput", "pynvml", "http.server", "urllib.request")
+
+    def test_importTime(self):
+        rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in (rootDir, env.get("PYTHONPATH")) if path)
+        # Through a file, rqconstants reads the arguments of the command line
+        with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as script:
+            script.write(self.SCRIPT % (self.OPTIONAL_MODULES,))
+        self.addCleanup(os.remove, script.name)
+
+        output = subprocess.check_output(
+            [sys.executable, script.name], cwd=rootDir, env=env,
+            stderr=subprocess.DEVNULL).decode("utf-8").splitlines()
+
+        self.assertLess(float(output[0]), 5.0)
+        self.assertEqual("", output[1])
+
 
 if __name__ == "__main__":
     unittest.main()
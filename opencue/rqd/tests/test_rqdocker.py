@@ -0,0 +1,612 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for the container launches of rqd.rqdocker."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import configparser
+import threading
+import time
+import unittest
+
+import docker.errors
+import mock
+import requests
+
+import rqd.rqdocker
+import rqd.rqmetrics
+
+
+GB = 1024 * 1024
+
+
+def serverError(status=500):
+    response = requests.Response()
+    response.status_code = status
+    return docker.errors.APIError("daemon error", response=response)
+
+
+class FakeContainer(object):
+    """Container of the fake docker client"""
+
+    def __init__(self, client, image, kwargs):
+        self.client = client
+        self.image = image
+        self.kwargs = kwargs
+        self.id = self.short_id = "%08d" % len(client.containers.created)
+        self.labels = kwargs.get("labels") or {}
+        self.attrs = {"ExecIDs": [], "Image": "sha256:" + image}
+        self.updates = []
+        self.started = False
+        self.removed = False
+
+    def start(self):
+        self.client.containers.beforeStart(self)
+        self.started = True
+
+    def remove(self, force=False):
+        self.removed = True
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+
+
+class FakeContainers(object):
+    """Container collection of the fake docker client. Creations take createSeconds,
+    failures pops the errors to raise on the next creations."""
+
+    def __init__(self, client):
+        self.client = client
+        self.created = []
+        self.failures = []
+        self.startFailures = []
+        self.createSeconds = 0
+        self.running = 0
+        self.maxRunning = 0
+        self.lock = threading.Lock()
+
+    def create(self, image, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.maxRunning = max(self.maxRunning, self.running)
+        try:
+            time.sleep(self.createSeconds)
+            with self.lock:
+                if self.failures:
+                    raise self.failures.pop(0)
+                if image not in self.client.images.pulled:
+                    raise docker.errors.ImageNotFound("No such image: %s" % image)
+                container = FakeContainer(self.client, image, kwargs)
+                self.created.append(container)
+                return container
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def beforeStart(self, container):
+        if self.startFailures:
+            raise self.startFailures.pop(0)
+
+    def get(self, containerId):
+        for container in self.created:
+            if container.id == containerId and not container.removed:
+                return container
+        raise docker.errors.NotFound("No such container: %s" % containerId)
+
+    def list(self, all=False, filters=None):
+        # pylint: disable=redefined-builtin
+        del all
+        label = (filters or {}).get("label")
+        return [container for container in self.created
+                if not container.removed and (label is None or label in container.labels)]
+
+
+class FakeApi(object):
+    """Low level api of the fake docker client, execs output their pid then exit
+    with exitCode"""
+
+    def __init__(self, client):
+        self.client = client
+        self.execs = {}
+        self.exitCode = 0
+
+    def exec_create(self, containerId, cmd, **kwargs):
+        container = self.client.containers.get(containerId)
+        execId = "exec-%d" % len(self.execs)
+        self.execs[execId] = {"Running": False, "ExitCode": None, "Pid": 4242,
+                              "cmd": cmd, "kwargs": kwargs, "container": container}
+        container.attrs["ExecIDs"].append(execId)
+        return {"Id": execId}
+
+    def exec_start(self, execId, stream=False):
+        self.execs[execId]["Running"] = True
+        return self.__output(execId)
+
+    def __output(self, execId):
+        yield b"4242\n"
+        yield b"frame output\n"
+        self.execs[execId].update(Running=False, ExitCode=self.exitCode)
+
+    def exec_inspect(self, execId):
+        return self.execs[execId]
+
+
+class FakeImage(object):
+    """Image of the fake docker client"""
+
+    def __init__(self, imageId, tags=(), size=GB * 1024, created="2024-01-01"):
+        self.id = imageId
+        self.attrs = {"Id": imageId, "RepoTags": list(tags), "Size": size,
+                      "Created": created}
+
+
+class FakeImages(object):
+    """Image collection of the fake docker client. pulled holds the tags on the host,
+    others the images that aren't pulled by tag. Pulls take pullSeconds, the
+    images of pullFailures fail to pull."""
+
+    def __init__(self, pulled):
+        self.pulled = set(pulled)
+        self.others = []
+        self.pullSeconds = 0
+        self.pullFailures = set()
+
+    def pull(self, name, tag=None):
+        image = name if tag is None else "%s:%s" % (name, tag)
+        time.sleep(self.pullSeconds)
+        if image in self.pullFailures:
+            raise docker.errors.APIError("Failed to pull %s" % image)
+        self.pulled.add(image)
+
+    def get(self, image):
+        if image not in self.pulled:
+            raise docker.errors.ImageNotFound("No such image: %s" % image)
+        return FakeImage("sha256:" + image, [image])
+
+    def list(self):
+        return [FakeImage("sha256:" + tag, [tag]) for tag in sorted(self.pulled)] + self.others
+
+    def remove(self, imageId):
+        self.pulled.discard(imageId[len("sha256:"):])
+        self.others = [image for image in self.others if image.id != imageId]
+
+
+class FakeDockerClient(object):
+    """Stands in for docker.DockerClient"""
+
+    def __init__(self, images=("centos7.3:latest",)):
+        self.containers = FakeContainers(self)
+        self.images = FakeImages(images)
+        self.api = FakeApi(self)
+        self.closed = False
+
+    def info(self):
+        return {"DockerRootDir": "/var/lib/docker"}
+
+    def close(self):
+        self.closed = True
+
+
+@mock.patch.object(rqd.rqdocker.RqDocker, "LAUNCH_RETRY_SEC", 0.01)
+class RqDockerLaunchTests(unittest.TestCase):
+    """Tests for rqd.rqdocker.RqDocker.runContainer."""
+
+    def setUp(self):
+        self.client = FakeDockerClient()
+        fromEnvPatcher = mock.patch("docker.from_env", return_value=self.client)
+        self.fromEnv = fromEnvPatcher.start()
+        self.addCleanup(fromEnvPatcher.stop)
+        self.agent = rqd.rqdocker.RqDocker(
+            "centos7", {"centos7": "centos7.3:latest"}, [], "/bin/sh", False,
+            launch_concurrency=3, launch_retries=2, client_pool_size=32)
+
+    def runContainer(self, results=None):
+        result = self.agent.runContainer(
+            image_key="centos7", environment={}, working_dir="/tmp", hostname="host",
+            mem_reservation="1GB", mem_limit="2GB", entrypoint="/tmp/cmd")
+        if results is not None:
+            results.append(result)
+        return result
+
+    def test_sharesClient(self):
+        client, container = self.runContainer()
+        self.runContainer()
+
+        self.assertIs(self.client, client)
+        self.fromEnv.assert_called_once_with(max_pool_size=32)
+        self.assertTrue(container.started)
+        self.assertEqual("/tmp/cmd", container.kwargs["entrypoint"])
+        self.assertTrue(container.kwargs["detach"])
+        self.assertFalse(self.client.closed)
+
+    def test_concurrentLaunchesAreBounded(self):
+        self.client.containers.createSeconds = 0.05
+        waitCount = rqd.rqmetrics.DOCKER_LAUNCH_WAIT_SECONDS.getCount()
+        results = []
+        threads = [threading.Thread(target=self.runContainer, args=(results,))
+                   for _ in range(10)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(10, len(results))
+        self.assertEqual(3, self.client.containers.maxRunning)
+        # Serialized launches would take 10 * 0.05s
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(waitCount + 10, rqd.rqmetrics.DOCKER_LAUNCH_WAIT_SECONDS.getCount())
+        self.assertEqual(0, self.agent.launch_queue.getWaiting())
+
+    def test_retriesTransientErrors(self):
+        retries = rqd.rqmetrics.DOCKER_LAUNCH_RETRIES.get(reason="APIError")
+        self.client.containers.failures = [serverError(), requests.exceptions.ConnectionError()]
+
+        _, container = self.runContainer()
+
+        self.assertTrue(container.started)
+        self.assertEqual(retries + 1, rqd.rqmetrics.DOCKER_LAUNCH_RETRIES.get(reason="APIError"))
+
+    def test_givesUpAfterRetries(self):
+        self.client.containers.failures = [serverError(), serverError(502), serverError(503)]
+
+        with self.assertRaises(docker.errors.APIError):
+            self.runContainer()
+        self.assertEqual([], self.client.containers.created)
+
+    def test_doesNotRetryClientErrors(self):
+        self.client.containers.failures = [serverError(400), serverError()]
+
+        with self.assertRaises(docker.errors.APIError):
+            self.runContainer()
+        # The server error queued after the client error was never reached
+        self.assertEqual(1, len(self.client.containers.failures))
+
+    def test_removesContainersThatDoNotStart(self):
+        self.client.containers.startFailures = [serverError()]
+
+        _, container = self.runContainer()
+
+        first = self.client.containers.created[0]
+        self.assertTrue(first.removed)
+        self.assertFalse(first.started)
+        self.assertTrue(container.started)
+
+    def test_pullsMissingImage(self):
+        self.client.images.pulled.clear()
+
+        _, container = self.runContainer()
+
+        self.assertEqual("centos7.3:latest", container.image)
+
+    def test_invalidFrameOs(self):
+        with self.assertRaises(rqd.rqdocker.InvalidFrameOsError):
+            self.agent.runContainer(
+                image_key="rocky9", environment={}, working_dir="/tmp", hostname="host",
+                mem_reservation="1GB", mem_limit="2GB", entrypoint="/tmp/cmd")
+
+
+@mock.patch.object(rqd.rqdocker.ContainerPool, "EXEC_POLL_SEC", 0.01)
+class ContainerPoolTests(unittest.TestCase):
+    """Tests for rqd.rqdocker.ContainerPool."""
+
+    def setUp(self):
+        self.client = FakeDockerClient(images=("centos7.3:latest", "rocky9.3:latest"))
+        fromEnvPatcher = mock.patch("docker.from_env", return_value=self.client)
+        fromEnvPatcher.start()
+        self.addCleanup(fromEnvPatcher.stop)
+        self.agent = rqd.rqdocker.RqDocker(
+            "centos7,rocky9", {"centos7": "centos7.3:latest", "rocky9": "rocky9.3:latest"},
+            [], "/bin/sh", False)
+        self.pool = self.agent.pool = rqd.rqdocker.ContainerPool(
+            self.agent, "host", max_size=4, min_free_kb=GB)
+
+    def runFrame(self, user="user", imageKey="centos7"):
+        return self.agent.runContainer(
+            image_key=imageKey, environment={"USER": user}, working_dir="/tmp",
+            hostname="host", mem_reservation=GB * 1024, mem_limit="2GB",
+            entrypoint="/tmp/rqd-cmd")[1]
+
+    def launch(self, count, imageKey="centos7"):
+        """Records launches that found no idle container"""
+        for _ in range(count):
+            self.assertIsNone(self.pool.run(imageKey, "/tmp/cmd", {}, "/tmp", "host", 1, 2))
+
+    def idleContainers(self):
+        return [container for container in self.client.containers.created
+                if not container.removed and container.labels]
+
+    def test_targetFollowsBusiestMinute(self):
+        self.assertEqual(0, self.pool.getTarget("centos7", available_kb=64 * GB))
+
+        self.launch(3)
+
+        self.assertEqual(3, self.pool.getTarget("centos7", available_kb=64 * GB))
+        self.assertEqual(0, self.pool.getTarget("rocky9", available_kb=64 * GB))
+        # Not while the host is short on memory
+        self.assertEqual(0, self.pool.getTarget("centos7", available_kb=GB // 2))
+        self.launch(5)
+        self.assertEqual(4, self.pool.getTarget("centos7", available_kb=64 * GB))
+
+        # Launches older than the window are forgotten
+        with mock.patch("time.time", return_value=time.time() + 301):
+            self.assertEqual(0, self.pool.getTarget("centos7", available_kb=64 * GB))
+
+    def test_maintainStartsIdleContainers(self):
+        self.launch(2)
+
+        self.pool.maintain(available_kb=64 * GB)
+
+        self.assertEqual(2, self.pool.getIdle("centos7"))
+        containers = self.idleContainers()
+        self.assertEqual({"opencue.rqd.pool": "centos7"}, containers[0].labels)
+        self.assertEqual("host", containers[0].kwargs["hostname"])
+        self.assertNotIn("mem_limit", containers[0].kwargs)
+        self.assertEqual(2, rqd.rqmetrics.DOCKER_POOL_IDLE.get(os="centos7"))
+
+        # Emptied when the host runs short on memory
+        self.pool.maintain(available_kb=GB // 2)
+        self.assertEqual(0, self.pool.getIdle("centos7"))
+        self.assertEqual([], self.idleContainers())
+
+    def test_frameRunsInIdleContainer(self):
+        self.launch(1)
+        self.pool.maintain(available_kb=64 * GB)
+        pooled = self.idleContainers()[0]
+        hits = rqd.rqmetrics.DOCKER_POOL_CHECKOUTS.get(os="centos7", result="hit")
+
+        container = self.runFrame()
+
+        self.assertIsInstance(container, rqd.rqdocker.ContainerExec)
+        self.assertEqual(pooled.short_id, container.short_id)
+        self.assertEqual([{"mem_limit": 2 * GB * 1024, "mem_reservation": GB * 1024,
+                           "memswap_limit": 4 * GB * 1024}], pooled.updates)
+        execution = self.client.api.execs[container.exec_id]
+        self.assertEqual(["/tmp/rqd-cmd"], execution["cmd"])
+        self.assertEqual({"USER": "user"}, execution["kwargs"]["environment"])
+        self.assertEqual(
+            [b"4242\n", b"frame output\n"], list(container.logs(stream=True)))
+        self.assertEqual(4242, int(container.top()["Processes"][0][1]))
+        self.assertEqual({"StatusCode": 0}, container.wait())
+        self.assertEqual(hits + 1,
+                         rqd.rqmetrics.DOCKER_POOL_CHECKOUTS.get(os="centos7", result="hit"))
+
+        # Used containers are removed without recycling
+        container.remove()
+        self.pool.maintain(available_kb=64 * GB)
+        self.assertTrue(pooled.removed)
+
+    def test_recycledContainersOnlyRunFramesOfSameUser(self):
+        self.pool.recycle = True
+        # No fresh container joins the recycled one
+        self.pool.max_size = 1
+        self.launch(1)
+        self.pool.maintain(available_kb=64 * GB)
+        container = self.runFrame(user="alice")
+        list(container.logs())
+        container.wait()
+        container.remove()
+        self.pool.maintain(available_kb=64 * GB)
+        self.assertFalse(container.container.removed)
+
+        self.assertNotIsInstance(self.runFrame(user="bob"), rqd.rqdocker.ContainerExec)
+        self.assertEqual(container.short_id, self.runFrame(user="alice").short_id)
+
+    def test_killedFramesAreNotRecycled(self):
+        self.pool.recycle = True
+        self.launch(1)
+        self.pool.maintain(available_kb=64 * GB)
+        container = self.runFrame()
+
+        with mock.patch("os.kill") as killMock:
+            container.kill()
+        killMock.assert_called_once_with(4242, mock.ANY)
+        container.remove()
+        self.pool.maintain(available_kb=0)
+
+        self.assertTrue(container.container.removed)
+
+    def test_brokenIdleContainerFallsBackToNewContainer(self):
+        self.launch(1)
+        self.pool.maintain(available_kb=64 * GB)
+        pooled = self.idleContainers()[0]
+        pooled.update = mock.Mock(side_effect=docker.errors.APIError("container is gone"))
+
+        container = self.runFrame()
+
+        self.assertTrue(pooled.removed)
+        self.assertNotIsInstance(container, rqd.rqdocker.ContainerExec)
+        self.assertEqual("/tmp/rqd-cmd", container.kwargs["entrypoint"])
+
+    @mock.patch("psutil.virtual_memory")
+    def test_startAndStop(self, virtualMemoryMock):
+        virtualMemoryMock.return_value.available = 64 * GB * 1024
+        self.pool.min_size = 1
+        self.pool.start()
+        for _ in range(100):
+            if self.pool.getIdle("rocky9"):
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, self.pool.getIdle("centos7"))
+        self.assertEqual(1, self.pool.getIdle("rocky9"))
+
+        self.pool.stop()
+
+        self.assertEqual([], self.idleContainers())
+
+    def test_sweepKeepsContainersOfRecoveredFrames(self):
+        self.launch(2)
+        self.pool.maintain(available_kb=64 * GB)
+        busy, idle = self.idleContainers()
+        execId = self.client.api.exec_create(busy.id, ["/tmp/cmd"])["Id"]
+        self.client.api.exec_start(execId, stream=True)
+
+        self.pool.sweep()
+
+        self.assertFalse(busy.removed)
+        self.assertTrue(idle.removed)
+
+        # The recovered frame waits for its command to exit
+        self.client.api.execs[execId].update(Running=False, ExitCode=3)
+        container = self.agent.attachExec(busy.id, execId)
+        self.assertEqual(1, len(list(container.logs(stream=True))))
+        self.assertEqual({"StatusCode": 3}, container.wait())
+        container.remove()
+        self.assertTrue(busy.removed)
+
+
+class ImageCacheTests(unittest.TestCase):
+    """Tests for rqd.rqdocker.ImageCache."""
+
+    def setUp(self):
+        self.client = FakeDockerClient(images=())
+        fromEnvPatcher = mock.patch("docker.from_env", return_value=self.client)
+        fromEnvPatcher.start()
+        self.addCleanup(fromEnvPatcher.stop)
+        self.agent = rqd.rqdocker.RqDocker(
+            "centos7,rocky9", {"centos7": "centos7.3:latest", "rocky9": "rocky9.3:latest"},
+            [], "/bin/sh", False, image_options={"min_free_mb": 4 * 1024})
+        self.cache = self.agent.image_cache
+
+    def setDiskSize(self, sizeMb):
+        """The images fill a disk of sizeMb"""
+        def statvfs(path):
+            self.assertEqual("/var/lib/docker", path)
+            used = sum(image.attrs["Size"] for image in self.client.images.list())
+            return mock.Mock(f_frsize=1, f_bavail=sizeMb * 1024 * 1024 - used)
+        statvfsPatcher = mock.patch("os.statvfs", side_effect=statvfs)
+        statvfsPatcher.start()
+        self.addCleanup(statvfsPatcher.stop)
+
+    def test_pullsInParallel(self):
+        self.client.images.pullSeconds = 0.1
+        start = time.time()
+
+        self.assertEqual({}, self.cache.pullAll())
+
+        self.assertLess(time.time() - start, 0.18)
+        self.assertEqual({"centos7.3:latest", "rocky9.3:latest"}, self.client.images.pulled)
+
+    def test_failedPullKeepsImageOnHost(self):
+        self.client.images.pulled.add("rocky9.3:latest")
+        self.client.images.pullFailures.add("rocky9.3:latest")
+
+        failures = self.cache.pullAll()
+
+        self.assertEqual(["rocky9.3:latest"], list(failures))
+        self.client.images.pulled.clear()
+        with self.assertRaises(RuntimeError):
+            self.cache.pullAll()
+
+    def test_pullTimeout(self):
+        self.client.images.pulled.add("centos7.3:latest")
+        self.client.images.pullSeconds = 0.2
+
+        with self.assertRaises(RuntimeError) as context:
+            self.cache.pullAll(timeout=0.05)
+        self.assertIn("rocky9.3:latest", str(context.exception))
+
+    def test_refreshRunsInBackground(self):
+        self.cache.refresh_sec = 60
+        self.client.images.pullSeconds = 0.1
+        self.assertFalse(self.cache.refresh())
+
+        with mock.patch("time.time", return_value=time.time() + 61):
+            start = time.time()
+            self.assertTrue(self.cache.refresh())
+            self.assertLess(time.time() - start, 0.05)
+            # Not twice at once
+            self.assertFalse(self.cache.refresh())
+        for _ in range(50):
+            if len(self.client.images.pulled) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual({"centos7.3:latest", "rocky9.3:latest"}, self.client.images.pulled)
+
+    def test_evictsLeastRecentlyUsed(self):
+        self.client.images.pulled.update(
+            ["centos7.3:latest", "rocky9.3:latest", "old:1", "old:2", "running:1"])
+        # An older version of a refreshed tag
+        self.client.images.others.append(FakeImage("sha256:dangling"))
+        self.client.containers.create("running:1")
+        self.cache.markUsed("old:1")
+        self.cache.markUsed("old:2")
+        self.cache.markUsed("old:1")
+        # 6 images of 1GB on 8GB, 2GB free out of the 4GB to keep free
+        self.setDiskSize(8 * 1024)
+
+        self.assertEqual(2, self.cache.evict())
+
+        self.assertEqual({"centos7.3:latest", "rocky9.3:latest", "old:1", "running:1"},
+                         self.client.images.pulled)
+        self.assertEqual([], self.client.images.others)
+        # Free space is back above the threshold
+        self.assertEqual(0, self.cache.evict())
+
+    def test_configuredImagesAreNeverEvicted(self):
+        self.client.images.pulled.update(["centos7.3:latest", "rocky9.3:latest"])
+        self.setDiskSize(2 * 1024)
+
+        self.assertEqual(0, self.cache.evict())
+        self.assertEqual(2, len(self.client.images.pulled))
+
+    def test_attributes(self):
+        self.client.images.pulled.update(["centos7.3:latest", "old:1"])
+        self.client.images.others.append(FakeImage("sha256:dangling"))
+        self.setDiskSize(6 * 1024)
+
+        self.cache.maintain()
+
+        # The dangling image made room
+        self.assertEqual({"docker_images": "2",
+                          "docker_images_mb": "2048",
+                          "docker_free_mb": "4096",
+                          "docker_images_missing": "rocky9.3:latest",
+                          "docker_images_evicted": "1"}, self.cache.getAttributes())
+
+
+class RqDockerConfigTests(unittest.TestCase):
+    """Tests for rqd.rqdocker.RqDocker.fromConfig."""
+
+    def test_launchOptions(self):
+        config = configparser.RawConfigParser()
+        config.read_string(
+            "[docker.config]\n"
+            "DOCKER_LAUNCH_CONCURRENCY=8\n"
+            "DOCKER_LAUNCH_RETRIES=5\n"
+            "DOCKER_POOL_MAX_SIZE=2\n"
+            "DOCKER_POOL_RECYCLE=true\n"
+            "DOCKER_IMAGE_REFRESH_SEC=3600\n"
+            "[docker.images]\n"
+            "centos7=centos7.3:latest\n"
+            "[docker.mounts]\n")
+
+        agent = rqd.rqdocker.RqDocker.fromConfig(config)
+
+        self.assertEqual(8, agent.launch_queue.concurrency)
+        self.assertEqual(5, agent.launch_retries)
+        self.assertEqual(64, agent.client_pool_size)
+        self.assertEqual({"max_size": 2, "recycle": True}, agent.pool_options)
+        self.assertEqual(3600, agent.image_cache.refresh_sec)
+        self.assertEqual(10240, agent.image_cache.min_free_mb)
+
+
+if __name__ == '__main__':
+    unittest.main()
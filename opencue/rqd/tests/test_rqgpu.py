@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqgpu."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import collections
+import unittest
+
+import mock
+
+import rqd.rqgpu
+
+
+ProcessInfo = collections.namedtuple('ProcessInfo', 'pid usedGpuMemory')
+ProcessSample = collections.namedtuple('ProcessSample', 'pid timeStamp smUtil')
+
+
+class NvmlGpuBackendTests(unittest.TestCase):
+    """Tests for rqd.rqgpu.NvmlGpuBackend."""
+
+    def setUp(self):
+        self.nvml = mock.MagicMock()
+        self.nvml.nvmlDeviceGetCount.return_value = 2
+        self.nvml.nvmlDeviceGetHandleByIndex.side_effect = lambda index: 'gpu%d' % index
+        self.nvml.nvmlDeviceGetMemoryInfo.return_value = mock.Mock(
+            total=16000000000, free=8000000000)
+        self.nvml.nvmlDeviceGetUtilizationRates.return_value = mock.Mock(gpu=50)
+        self.nvml.nvmlDeviceGetComputeRunningProcesses.return_value = [
+            ProcessInfo(100, 2000000000)]
+        self.nvml.nvmlDeviceGetGraphicsRunningProcesses.return_value = []
+        patcher = mock.patch.dict('sys.modules', {'pynvml': self.nvml})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_processUtilizationIsAveraged(self):
+        self.nvml.nvmlDeviceGetProcessUtilization.side_effect = lambda handle, lastSeen: {
+            'gpu0': [ProcessSample(100, 1, 40), ProcessSample(100, 2, 60),
+                     ProcessSample(100, 3, 80)],
+            'gpu1': [ProcessSample(100, 5, 10)],
+        }[handle]
+        backend = rqd.rqgpu.NvmlGpuBackend()
+
+        sample = backend.sample()
+
+        # Averaged over the samples of a device, summed over the devices
+        self.assertEqual(70, sample.processes[100].utilization)
+        self.assertEqual(4000000, sample.processes[100].memoryUsed)
+        self.assertEqual([16000000, 16000000],
+                         [device.memoryTotal for device in sample.devices])
+
+        # Only the samples since the last call are requested
+        backend.sample()
+        self.nvml.nvmlDeviceGetProcessUtilization.assert_any_call('gpu0', 3)
+        self.nvml.nvmlDeviceGetProcessUtilization.assert_any_call('gpu1', 5)
+
+    def test_backendsImplementSample(self):
+        with self.assertRaises(TypeError):
+            # pylint: disable=abstract-class-instantiated
+            rqd.rqgpu.GpuBackend()
+
+
+if __name__ == '__main__':
+    unittest.main()
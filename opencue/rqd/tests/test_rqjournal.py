@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqjournal."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import os
+import unittest
+
+import mock
+import pyfakefs.fake_filesystem_unittest
+
+import opencue_proto.rqd_pb2
+import rqd.rqconstants
+import rqd.rqjournal
+
+
+JOURNAL_PATH = '/tmp/rqd/cache.dat'
+
+
+def makeFrame(frameId, pid=0):
+    return opencue_proto.rqd_pb2.RunFrame(frame_id=frameId, job_name='job', pid=pid)
+
+
+class FrameJournalTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests for rqd.rqjournal.FrameJournal."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        os.makedirs(os.path.dirname(JOURNAL_PATH))
+        self.journal = rqd.rqjournal.FrameJournal(JOURNAL_PATH)
+
+    def replay(self):
+        self.journal.close()
+        return rqd.rqjournal.FrameJournal(JOURNAL_PATH).replay()
+
+    def test_replayEmpty(self):
+        self.assertEqual([], self.journal.replay())
+
+    def test_launchUpdateComplete(self):
+        self.journal.recordLaunch(makeFrame('frame1'))
+        self.journal.recordLaunch(makeFrame('frame2'))
+        self.journal.recordUpdate(makeFrame('frame1', pid=42))
+        self.journal.recordComplete('frame2')
+
+        self.assertEqual([makeFrame('frame1', pid=42)], self.replay())
+
+    def test_recordUpdateSkipsUnchanged(self):
+        self.journal.recordLaunch(makeFrame('frame1'))
+
+        self.assertFalse(self.journal.recordUpdate(makeFrame('frame1')))
+        self.assertTrue(self.journal.recordUpdate(makeFrame('frame1', pid=42)))
+
+    def test_damagedTailIsIgnored(self):
+        self.journal.recordLaunch(makeFrame('frame1'))
+        self.journal.recordLaunch(makeFrame('frame2'))
+        self.journal.close()
+        with open(JOURNAL_PATH, 'r+b') as journalFile:
+            journalFile.truncate(os.path.getsize(JOURNAL_PATH) - 3)
+
+        self.assertEqual([makeFrame('frame1')], self.replay())
+
+    def test_corruptedRecordIsIgnored(self):
+        self.journal.recordLaunch(makeFrame('frame1'))
+        self.journal.recordUpdate(makeFrame('frame1', pid=42))
+        self.journal.close()
+        with open(JOURNAL_PATH, 'r+b') as journalFile:
+            journalFile.seek(-1, os.SEEK_END)
+            journalFile.write(b'\xff')
+
+        self.assertEqual([makeFrame('frame1')], self.replay())
+
+    def test_unknownFormatIsIgnored(self):
+        with open(JOURNAL_PATH, 'wb') as journalFile:
+            journalFile.write(b'\x00\x00\x00\x10not a journal')
+
+        self.assertEqual([], self.journal.replay())
+
+    @mock.patch.object(rqd.rqconstants, 'BACKUP_CACHE_COMPACT_RECORDS', 10)
+    def test_compaction(self):
+        self.journal.recordLaunch(makeFrame('frame1'))
+        sizeAfterLaunch = os.path.getsize(JOURNAL_PATH)
+        for pid in range(1, 20):
+            self.journal.recordUpdate(makeFrame('frame1', pid=pid))
+
+        self.assertLess(os.path.getsize(JOURNAL_PATH), 3 * sizeAfterLaunch)
+        self.assertEqual([makeFrame('frame1', pid=19)], self.replay())
+
+    @mock.patch.object(rqd.rqconstants, 'BACKUP_CACHE_FSYNC_BATCH', 3)
+    @mock.patch.object(rqd.rqconstants, 'BACKUP_CACHE_FSYNC_INTERVAL_SEC', 3600)
+    @mock.patch('os.fsync')
+    def test_fsyncIsBatched(self, fsyncMock):
+        self.journal.recordLaunch(makeFrame('frame1'))
+        fsyncMock.reset_mock()
+
+        self.journal.recordUpdate(makeFrame('frame1', pid=1))
+        fsyncMock.assert_not_called()
+        self.journal.recordUpdate(makeFrame('frame1', pid=2))
+        fsyncMock.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
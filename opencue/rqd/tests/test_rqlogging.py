@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for the log tails and the log compression of rqd.rqlogging."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import gzip
+import os
+import sys
+import threading
+import unittest
+
+import mock
+import pyfakefs.fake_filesystem_unittest
+
+import opencue_proto.rqd_pb2
+import rqd.rqconstants
+import rqd.rqlogging
+
+
+LOG_PATH = "/logs/frame.rqlog"
+
+
+@mock.patch.object(rqd.rqconstants, "RQD_LOG_STREAM_CHUNK_BYTES", 16)
+@mock.patch.object(rqd.rqconstants, "RQD_LOG_STREAM_POLL_SEC", 0.05)
+class LogTailTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests for rqd.rqlogging.LogTail and rqd.rqlogging.streamLog."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.lines = [("line %02d\n" % i).encode() for i in range(20)]
+        self.fs.create_file(LOG_PATH, contents=b"".join(self.lines))
+        self.tail = rqd.rqlogging.LogTail(maxBytes=32)
+        for line in self.lines:
+            self.tail.append(line)
+
+    def read(self, *args, **kwargs):
+        chunks = list(rqd.rqlogging.streamLog(self.tail, *args, **kwargs))
+        return b"".join(data for _, data, _ in chunks), chunks
+
+    def test_keepsLastBytes(self):
+        start, end = self.tail.getRange()
+
+        self.assertEqual(160, end)
+        self.assertLess(end - start, 32 + len(self.lines[0]))
+        self.assertIsNone(self.tail.read(0, 10))
+        self.assertEqual(self.lines[-1], self.tail.read(152, 100))
+        self.assertEqual(b"", self.tail.read(160, 100))
+
+    def test_readsOlderBytesFromFile(self):
+        data, chunks = self.read(LOG_PATH, offset=8)
+
+        self.assertEqual(b"".join(self.lines)[8:], data)
+        self.assertTrue(all(len(chunk) <= 16 for _, chunk, _ in chunks))
+        self.assertFalse(chunks[-1][2])
+
+    def test_maxBytes(self):
+        data, _ = self.read(LOG_PATH, offset=8, maxBytes=20)
+
+        self.assertEqual(b"".join(self.lines)[8:28], data)
+
+    def test_lastLines(self):
+        data, chunks = self.read(LOG_PATH, lastLines=2)
+        self.assertEqual(b"".join(self.lines[-2:]), data)
+        self.assertEqual(144, chunks[0][0])
+
+        # Lines that are no longer buffered come from the file
+        data, _ = self.read(LOG_PATH, lastLines=10)
+        self.assertEqual(b"".join(self.lines[-10:]), data)
+
+        data, _ = self.read(LOG_PATH, lastLines=100)
+        self.assertEqual(b"".join(self.lines), data)
+
+    def test_withoutFileStartsFromBuffer(self):
+        data, chunks = self.read(None, offset=0)
+
+        start, _ = self.tail.getRange()
+        self.assertEqual(start, chunks[0][0])
+        self.assertEqual(b"".join(self.lines)[start:], data)
+
+    def test_followUntilClosed(self):
+        def writeMore():
+            self.tail.append(b"last line\n")
+            self.tail.close()
+
+        timer = threading.Timer(0.1, writeMore)
+        timer.start()
+        data, chunks = self.read(LOG_PATH, offset=152, follow=True)
+        timer.join()
+
+        self.assertEqual(self.lines[-1] + b"last line\n", data)
+        self.assertEqual((170, b"", True), chunks[-1])
+
+    def test_followStopsWhenClientLeaves(self):
+        active = iter([True, True, False])
+        _, chunks = self.read(LOG_PATH, offset=160, follow=True,
+                              isActive=lambda: next(active))
+
+        self.assertEqual([], chunks)
+
+
+class RqdLoggerTailTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests the tail of the file backed frame logs."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.create_dir("/logs")
+
+    def test_writesToTail(self):
+        rqlog = rqd.rqlogging.RqdLogger(LOG_PATH)
+        rqlog.write("some output\n")
+        print("more output", file=rqlog)
+        rqlog.close()
+
+        data = b"".join(chunk for _, chunk, _ in rqd.rqlogging.streamLog(rqlog.tail))
+        with open(LOG_PATH, "rb") as fp:
+            self.assertEqual(fp.read(), data)
+        self.assertEqual(b"some output\nmore output\n", data)
+        self.assertTrue(rqlog.tail.closed)
+
+
+@mock.patch("rqd.rqlogging.getLokiShipper")
+class LokiLoggerTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests for rqd.rqlogging.LokiLogger."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.create_dir("/logs")
+        self.runFrame = opencue_proto.rqd_pb2.RunFrame(
+            frame_id="frame-id", job_name="job", frame_name="frame", log_dir_file=LOG_PATH)
+
+    def test_spillAppendsToLog(self, shipperMock):
+        shipperMock.return_value.register.side_effect = rqd.rqlogging.LokiStream
+        self.fs.create_file(LOG_PATH, contents="earlier attempt\n")
+
+        rqlog = rqd.rqlogging.LokiLogger("http://loki:3100", self.runFrame)
+        self.assertTrue(rqlog.spill(["line 1"]))
+        self.assertTrue(rqlog.spill(["line 2"]))
+        rqlog.close()
+
+        self.assertEqual(["frame.rqlog"], os.listdir("/logs"))
+        with open(LOG_PATH, "r", encoding="utf-8") as fp:
+            self.assertEqual("earlier attempt\nline 1\nline 2\n", fp.read())
+
+    @mock.patch("time.sleep", new=mock.Mock())
+    def test_waitForFile(self, shipperMock):
+        shipperMock.return_value.isReady.side_effect = [False, True]
+
+        rqd.rqlogging.LokiLogger("http://loki:3100", self.runFrame).waitForFile()
+
+        self.assertEqual(2, shipperMock.return_value.isReady.call_count)
+        shipperMock.return_value.isReady.side_effect = None
+        shipperMock.return_value.isReady.return_value = False
+        with self.assertRaises(IOError):
+            rqd.rqlogging.LokiLogger("http://loki:3100", self.runFrame).waitForFile(2)
+
+
+@mock.patch.object(rqd.rqconstants, "RQD_LOG_COMPRESSION", "gzip")
+class LogCompressionTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests the compression and the retention of the rotated frame logs."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.create_dir("/logs")
+
+    def createLog(self, path, contents, mtime):
+        self.fs.create_file(path, contents=contents)
+        os.utime(path, (mtime, mtime))
+
+    def test_compressesRotatedLogs(self):
+        self.createLog(LOG_PATH, b"attempt 3\n", 3000)
+        self.createLog(LOG_PATH + ".1", b"attempt 1\n", 1000)
+        self.createLog(LOG_PATH + ".2", b"attempt 2\n", 2000)
+
+        rqd.rqlogging.LogCompressor().process(LOG_PATH)
+
+        self.assertEqual(["frame.rqlog", "frame.rqlog.1.gz", "frame.rqlog.2.gz"],
+                         sorted(os.listdir("/logs")))
+        with gzip.open(LOG_PATH + ".2.gz", "rb") as fp:
+            self.assertEqual(b"attempt 2\n", fp.read())
+        self.assertEqual(2000, os.path.getmtime(LOG_PATH + ".2.gz"))
+
+    def test_rotationSkipsCompressedLogs(self):
+        self.createLog(LOG_PATH, b"attempt 2\n", 2000)
+        self.createLog(LOG_PATH + ".1.gz", b"", 1000)
+
+        rqd.rqlogging.RqdLogger(LOG_PATH).close()
+
+        with open(LOG_PATH + ".2", "rb") as fp:
+            self.assertEqual(b"attempt 2\n", fp.read())
+
+    def test_zstdFallsBackToGzip(self):
+        with mock.patch.object(rqd.rqconstants, "RQD_LOG_COMPRESSION", "zstd"), \
+                mock.patch.dict(sys.modules, {"zstandard": None}):
+            self.assertEqual("gzip", rqd.rqlogging.getCompression())
+        with mock.patch.object(rqd.rqconstants, "RQD_LOG_COMPRESSION", ""):
+            self.assertIsNone(rqd.rqlogging.getCompression())
+
+    def test_retentionRemovesOldestLogs(self):
+        other = "/logs/other.rqlog"
+        self.createLog(LOG_PATH, b"current", 5000)
+        self.createLog(LOG_PATH + ".1.gz", b"1", 1000)
+        self.createLog(LOG_PATH + ".2.gz", b"2", 3000)
+        self.createLog(LOG_PATH + ".3", b"3", 4000)
+        self.createLog(other + ".1", b"1", 2000)
+
+        removed = rqd.rqlogging.enforceRetention("/logs", 2, 0)
+
+        self.assertEqual(2, removed)
+        # The current log is kept and the attempts left are renumbered in order
+        self.assertEqual(["frame.rqlog", "frame.rqlog.1.gz", "frame.rqlog.2"],
+                         sorted(os.listdir("/logs")))
+        with open(LOG_PATH + ".2", "rb") as fp:
+            self.assertEqual(b"3", fp.read())
+
+    def test_retentionBytes(self):
+        self.createLog(LOG_PATH + ".1", b"x" * 100, 1000)
+        self.createLog(LOG_PATH + ".2", b"x" * 100, 2000)
+        self.createLog(LOG_PATH + ".3", b"x" * 100, 3000)
+
+        self.assertEqual(1, rqd.rqlogging.enforceRetention("/logs", 0, 250))
+        self.assertEqual(0, rqd.rqlogging.enforceRetention("/logs", 0, 250))
+
+    def test_submitCompletedLog(self):
+        self.createLog(LOG_PATH, b"attempt 2\n", 2000)
+        self.createLog(LOG_PATH + ".1", b"attempt 1\n", 1000)
+
+        rqd.rqlogging.submitCompletedLog(LOG_PATH)
+
+        # pylint: disable=protected-access
+        self.assertTrue(rqd.rqlogging._logCompressor.waitIdle(5))
+        self.assertTrue(os.path.exists(LOG_PATH + ".1.gz"))
+
+
+if __name__ == '__main__':
+    unittest.main()
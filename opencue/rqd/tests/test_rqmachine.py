@@ -32,9 +32,11 @@ import opencue_proto.report_pb2
 import opencue_proto.rqd_pb2
 import rqd.rqconstants
 import rqd.rqcore
+import rqd.rqgpu
 import rqd.rqmachine
 import rqd.rqnetwork
 import rqd.rqnimby
+import rqd.rqscheduler
 import rqd.rqutil
 
 
@@ -160,6 +162,19 @@ PROC_PID_STATM = '152510 14585 7032 9343 0 65453 0'
 
 PROC_PID_CMDLINE = ' sleep 20'
 
+PROC_PID_IO = '''rchar: 5000000
+wchar: 3000000
+syscr: 120
+syscw: 80
+read_bytes: 4096000
+write_bytes: 2048000
+cancelled_write_bytes: 0
+'''
+
+PRESSURE_IO = '''some avg10=12.50 avg60=4.00 avg300=1.00 total=3000000
+full avg10=5.00 avg60=2.00 avg300=0.50 total=1000000
+'''
+
 @mock.patch.object(rqd.rqutil.Memoize, 'isCached', new=mock.MagicMock(return_value=False))
 @mock.patch('platform.system', new=mock.MagicMock(return_value='Linux'))
 @mock.patch('os.statvfs', new=mock.MagicMock())
@@ -176,6 +191,7 @@ class MachineTests(pyfakefs.fake_filesystem_unittest.TestCase):
         self.meminfo = self.fs.create_file('/proc/meminfo', contents=MEMINFO_MODERATE_USAGE)
 
         self.rqCore = mock.MagicMock(spec=rqd.rqcore.RqCore)
+        self.rqCore.scheduler = mock.MagicMock(spec=rqd.rqscheduler.Scheduler)
         self.nimby = mock.MagicMock(spec=rqd.rqnimby.Nimby)
         self.rqCore.nimby = self.nimby
         self.nimby.is_ready = False
@@ -267,6 +283,47 @@ class MachineTests(pyfakefs.fake_filesystem_unittest.TestCase):
         processMock.return_value.cmdline.return_value = "some_command"
         self._test_rssUpdate(PROC_PID_STAT)
 
+    @mock.patch('psutil.Process')
+    def test_rssUpdateIo(self, processMock):
+        rqd.rqconstants.SYS_HERTZ = 100
+        pid = 105
+        self.fs.create_file('/proc/%d/stat' % pid, contents=PROC_PID_STAT)
+        self.fs.create_file('/proc/%s/statm' % pid, contents=PROC_PID_STATM)
+        procIo = self.fs.create_file('/proc/%s/io' % pid, contents=PROC_PID_IO)
+        runningFrame = rqd.rqnetwork.RunningFrame(
+            self.rqCore, opencue_proto.rqd_pb2.RunFrame(frame_id='frame-id'))
+        runningFrame.pid = pid
+
+        with mock.patch('time.time', return_value=1570057887.61):
+            self.machine.rssUpdate({'frame-id': runningFrame})
+        attributes = runningFrame.runFrame.attributes
+        self.assertEqual('4096000', attributes['io_read_bytes'])
+        self.assertEqual('2048000', attributes['io_write_bytes'])
+        self.assertNotIn('io_read_rate', attributes)
+
+        procIo.set_contents(PROC_PID_IO.replace('read_bytes: 4096000', 'read_bytes: 6096000'))
+        with mock.patch('time.time', return_value=1570057897.61):
+            self.machine.rssUpdate({'frame-id': runningFrame})
+        self.assertEqual('200000', attributes['io_read_rate'])
+        self.assertEqual('0', attributes['io_write_rate'])
+
+    def test_getPressure(self):
+        pressureIo = self.fs.create_file('/proc/pressure/io', contents=PRESSURE_IO)
+
+        with mock.patch('time.time', return_value=1000.0):
+            pressure = self.machine.getPressure()
+        # The kernel average is used until there is a previous sample
+        self.assertEqual('12.50', pressure['psi_io_some'])
+        self.assertEqual('5.00', pressure['psi_io_full'])
+        self.assertNotIn('psi_cpu_some', pressure)
+
+        # 2s of stall over 10s
+        pressureIo.set_contents(PRESSURE_IO.replace('total=3000000', 'total=5000000'))
+        with mock.patch('time.time', return_value=1010.0):
+            pressure = self.machine.getPressure()
+        self.assertEqual('20.00', pressure['psi_io_some'])
+        self.assertEqual('0.00', pressure['psi_io_full'])
+
     @mock.patch('time.time', new=mock.MagicMock(return_value=1570057887.61))
     @mock.patch('psutil.Process')
     def test_rssUpdateWithSpaces(self, processMock):
@@ -304,6 +361,7 @@ class MachineTests(pyfakefs.fake_filesystem_unittest.TestCase):
             delattr(self.machine, 'gpuNotSupported')
         if hasattr(self.machine, 'gpuResults'):
             delattr(self.machine, 'gpuResults')
+        self.machine.setGpuBackend(rqd.rqgpu.NvidiaSmiGpuBackend())
 
     @mock.patch.object(
         rqd.rqconstants, 'ALLOW_GPU', new=mock.MagicMock(return_value=True))
@@ -333,6 +391,57 @@ class MachineTests(pyfakefs.fake_filesystem_unittest.TestCase):
         self.assertEqual(135308248, self.machine.getGpuMemoryTotal())
         self.assertEqual(122701222, self.machine.getGpuMemoryFree())
 
+    @mock.patch.object(
+        rqd.rqconstants, 'ALLOW_GPU', new=mock.MagicMock(return_value=True))
+    @mock.patch('subprocess.getoutput',
+        new=mock.MagicMock(return_value='sh: nvidia-smi: command not found'))
+    def test_getGpuStatRecoversFromErrors(self):
+        self._resetGpuStat()
+        self.assertEqual(0, self.machine.getGpuMemoryFree())
+        self.assertFalse(hasattr(self.machine, 'gpuNotSupported'))
+
+        self.machine.setGpuBackend(rqd.rqgpu.FakeGpuBackend(
+            [rqd.rqgpu.GpuDevice(0, 1000, 400, utilization=75)]))
+        self.assertEqual(400, self.machine.getGpuMemoryFree())
+        self.assertEqual(75, self.machine.getGpuUtilization('0'))
+
+    @mock.patch.object(
+        rqd.rqconstants, 'ALLOW_GPU', new=mock.MagicMock(return_value=True))
+    def test_getGpuProcesses(self):
+        self._resetGpuStat()
+        backend = rqd.rqgpu.FakeGpuBackend(
+            [rqd.rqgpu.GpuDevice(0, 1000, 400), rqd.rqgpu.GpuDevice(1, 1000, 1000)],
+            {10: rqd.rqgpu.GpuProcess(10, 500, 60), 20: rqd.rqgpu.GpuProcess(20, 100)})
+        self.machine.setGpuBackend(backend)
+
+        self.assertEqual(2, self.machine.getGpuCount())
+        self.assertEqual(600, self.machine.getGpuMemoryUsed('0'))
+        self.assertEqual(500, self.machine.getGpuProcesses()[10].memoryUsed)
+        self.assertEqual(60, self.machine.getGpuProcesses()[10].utilization)
+
+    @mock.patch('os.statvfs', new=mock.MagicMock())
+    @mock.patch('platform.system', new=mock.MagicMock(return_value='Linux'))
+    @mock.patch.object(rqd.rqconstants, 'ALLOW_GPU', new=True)
+    def test_deferProbes(self):
+        backend = rqd.rqgpu.FakeGpuBackend([rqd.rqgpu.GpuDevice(0, 1000, 400)])
+
+        with mock.patch('rqd.rqgpu.getGpuBackend', return_value=backend) as getGpuBackendMock:
+            machine = rqd.rqmachine.Machine(self.rqCore, self.coreDetail, deferProbes=True)
+            # The gpus are left to the probes running along the gRPC server
+            getGpuBackendMock.assert_not_called()
+            self.assertEqual(0, machine.getHostInfo().num_gpus)
+
+            # Frames launched before the probes finish get their cores
+            cpuList = machine.reserveHT(100)
+            self.assertTrue(cpuList)
+            machine.releaseHT(cpuList)
+            self.assertEqual(0, len(self.coreDetail.reserved_cores))
+
+            machine.setupGpu()
+
+        self.assertEqual(1, machine.getHostInfo().num_gpus)
+        self.assertEqual(1000, machine.getHostInfo().total_gpu_mem)
+
     def test_getPathEnv(self):
         self.assertEqual(
             '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin',
@@ -368,6 +477,22 @@ class MachineTests(pyfakefs.fake_filesystem_unittest.TestCase):
         self.assertEqual(False, hostInfo.nimby_locked)
         self.assertEqual(opencue_proto.host_pb2.UP, hostInfo.state)
 
+    def test_getCachedHostInfo(self):
+        # pylint: disable=no-member
+        self.assertEqual(25699176, self.machine.getCachedHostInfo().free_mem)
+        self.meminfo.set_contents(MEMINFO_NONE_FREE)
+        self.nimby.locked = True
+
+        hostInfo = self.machine.getCachedHostInfo()
+
+        self.assertEqual(25699176, hostInfo.free_mem)
+        self.assertEqual(True, hostInfo.nimby_locked)
+
+        with mock.patch.object(rqd.rqconstants, 'RQD_HOST_INFO_MAX_AGE_SEC', -1):
+            hostInfo = self.machine.getCachedHostInfo()
+
+        self.assertNotEqual(25699176, hostInfo.free_mem)
+
     def test_getHostReport(self):
         frame1 = mock.MagicMock(spec=rqd.rqnetwork.RunningFrame)
         frame1Info = opencue_proto.report_pb2.RunningFrameInfo(resource_id='arbitrary-id-1')
@@ -399,6 +524,51 @@ class MachineTests(pyfakefs.fake_filesystem_unittest.TestCase):
         # Verify core info was copied into the report.
         self.assertEqual(coreDetail, hostReport.core_info)
 
+    def test_getHostReportDockerImages(self):
+        self.rqCore.getFrameKeys.return_value = []
+        self.rqCore.getCoreInfo.return_value = opencue_proto.report_pb2.CoreDetail()
+        dockerAgent = mock.MagicMock()
+        dockerAgent.image_cache.getAttributes.return_value = {
+            'docker_images': '3', 'docker_free_mb': '20480'}
+
+        with mock.patch.object(rqd.rqconstants, 'DOCKER_AGENT', dockerAgent):
+            hostReport = self.machine.getHostReport()
+
+        # pylint: disable=no-member
+        self.assertEqual('3', hostReport.host.attributes['docker_images'])
+        self.assertEqual('20480', hostReport.host.attributes['docker_free_mb'])
+
+    def test_getHostReportAlwaysHasChildren(self):
+        runFrame = opencue_proto.rqd_pb2.RunFrame(frame_id='frame1', num_cores=1)
+        frame = rqd.rqnetwork.RunningFrame(self.rqCore, runFrame)
+        frame.childrenProcs['123'] = {
+            'name': 'render', 'state': 'S', 'rss': 400, 'vsize': 1000, 'statm_rss': 400,
+            'statm_size': 1000, 'cmd_line': ['render', '-f', '1'], 'start_time': 10}
+        self.rqCore.getFrameKeys.return_value = ['frame1']
+        self.rqCore.getFrame.return_value = frame
+        self.rqCore.getCoreInfo.return_value = opencue_proto.report_pb2.CoreDetail()
+
+        def reportedChildren():
+            # pylint: disable=no-member
+            return len(self.machine.getHostReport().frames[0].children.children)
+
+        # Cuebot overwrites the stored children with every report
+        self.assertEqual(1, reportedChildren())
+        self.assertEqual(1, reportedChildren())
+        frame.childrenProcs['123']['rss'] = 800
+        # pylint: disable=no-member
+        self.assertEqual(800, self.machine.getHostReport().frames[0].children.children[0]
+                         .stat.rss)
+
+    def test_runningFrameInfoIsCached(self):
+        runFrame = opencue_proto.rqd_pb2.RunFrame(frame_id='frame1', num_cores=1)
+        frame = rqd.rqnetwork.RunningFrame(self.rqCore, runFrame)
+
+        info = frame.runningFrameInfo()
+        self.assertIs(info, frame.runningFrameInfo())
+        frame.rss = 100
+        self.assertEqual(100, frame.runningFrameInfo().rss)
+
     def test_getBootReport(self):
         bootReport = self.machine.getBootReport()
 
@@ -485,6 +655,26 @@ class MachineTests(pyfakefs.fake_filesystem_unittest.TestCase):
         with self.assertRaises(rqd.rqexceptions.CoreReservationFailureException):
             tasksets4 = self.machine.reserveHT(300)
 
+    def test_reserveRecoveredHT(self):
+        cpuInfo = os.path.join(os.path.dirname(__file__), 'cpuinfo', '_cpuinfo_shark_ht_8-4-2-2')
+        self.fs.add_real_file(cpuInfo)
+        self.machine.testInitMachineStats(cpuInfo)
+        self.machine.setupTaskset()
+
+        self.machine.reserveRecoveredHT('0,8,1,9')
+
+        # pylint: disable=no-member
+        self.assertEqual([0, 1], list(self.coreDetail.reserved_cores[0].coreid))
+        # New frames get the other cores
+        tasksets = self.machine.reserveHT(600).split(',')
+        self.assertFalse(set(tasksets) & {'0', '8', '1', '9'})
+        with self.assertRaises(rqd.rqexceptions.CoreReservationFailureException):
+            self.machine.reserveHT(100)
+
+        # Until the recovered frame exits
+        self.machine.releaseHT('0,8,1,9')
+        self.assertEqual(['0', '1', '8', '9'], sorted(self.machine.reserveHT(200).split(',')))
+
 
     def test_tags(self):
         tags = ["test1", "test2", "test3"]
@@ -565,6 +755,7 @@ class MacOsTests(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures for macOS tests."""
         self.rqCore = mock.MagicMock(spec=rqd.rqcore.RqCore)
+        self.rqCore.scheduler = mock.MagicMock(spec=rqd.rqscheduler.Scheduler)
         self.nimby = mock.MagicMock(spec=rqd.rqnimby.Nimby)
         self.rqCore.nimby = self.nimby
         self.nimby.is_ready = False
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqmetrics."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import threading
+import unittest
+import urllib.request
+
+import mock
+
+import opencue_proto.report_pb2
+import opencue_proto.rqd_pb2
+import rqd.rqconstants
+import rqd.rqmetrics
+import rqd.rqnetwork
+
+
+class MetricTests(unittest.TestCase):
+    """Tests for the rqd.rqmetrics metric types."""
+
+    def test_counter(self):
+        counter = rqd.rqmetrics.Counter("test_total", "Help", ("reason",))
+        counter.inc(reason="a")
+        counter.inc(2, reason='with "quotes"')
+
+        self.assertEqual([
+            '# HELP test_total Help',
+            '# TYPE test_total counter',
+            'test_total{reason="a"} 1',
+            'test_total{reason="with \\"quotes\\""} 2',
+        ], counter.render())
+
+    def test_histogram(self):
+        histogram = rqd.rqmetrics.Histogram("test_seconds", "Help", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual([
+            '# HELP test_seconds Help',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3',
+        ], histogram.render())
+        self.assertEqual(3, histogram.getCount())
+
+
+class CollectRqCoreTests(unittest.TestCase):
+    """Tests for rqd.rqmetrics.collectRqCore."""
+
+    def setUp(self):
+        self.rqCore = mock.MagicMock()
+        self.rqCore.getCoreInfo.return_value = opencue_proto.report_pb2.CoreDetail(
+            total_cores=800, idle_cores=400, booked_cores=300, locked_cores=100)
+        frames = {}
+        for index in range(3):
+            runFrame = opencue_proto.rqd_pb2.RunFrame(
+                frame_id='frame%d' % index, job_name='job', frame_name='%04d-layer' % index)
+            runFrame.attributes['pcpu'] = '1.5'
+            frame = rqd.rqnetwork.RunningFrame(self.rqCore, runFrame)
+            frame.rss = 100
+            frames[runFrame.frame_id] = frame
+        self.rqCore.getFrameKeys.return_value = list(frames.keys())
+        self.rqCore.getFrame.side_effect = lambda frameId: frames[frameId]
+
+    @mock.patch.object(rqd.rqconstants, 'RQD_METRICS_MAX_FRAMES', 1)
+    def test_frameLabelsAreBounded(self):
+        rqd.rqmetrics.collectRqCore(self.rqCore)
+
+        self.assertEqual(400, rqd.rqmetrics.CORES.get(state='idle'))
+        self.assertEqual(3, rqd.rqmetrics.FRAMES_RUNNING.get())
+        self.assertEqual(100, rqd.rqmetrics.FRAME_RSS.get(frame='job/0000-layer'))
+        self.assertEqual(200, rqd.rqmetrics.FRAME_RSS.get(frame=rqd.rqmetrics.OTHER_FRAMES))
+        self.assertEqual(3.0, rqd.rqmetrics.FRAME_PCPU.get(frame=rqd.rqmetrics.OTHER_FRAMES))
+        self.assertEqual(0, rqd.rqmetrics.FRAME_RSS.get(frame='job/0001-layer'))
+
+    def test_metricsServer(self):
+        server = rqd.rqmetrics.MetricsServer(self.rqCore, port=0, address='127.0.0.1')
+        server.start()
+        try:
+            response = urllib.request.urlopen('http://127.0.0.1:%d/metrics' % server.port)
+            body = response.read().decode('utf-8')
+        finally:
+            server.stop()
+
+        self.assertEqual(rqd.rqmetrics.CONTENT_TYPE, response.headers['Content-Type'])
+        self.assertIn('rqd_cores{state="booked"} 300', body)
+        self.assertIn('rqd_frame_rss_kb{frame="job/0002-layer"} 100', body)
+
+
+class LaunchTraceTests(unittest.TestCase):
+    """Tests for rqd.rqmetrics.LaunchTrace."""
+
+    @mock.patch('time.perf_counter', side_effect=[0.0, 0.002, 0.003, 0.013])
+    def test_finish(self, _):
+        window = rqd.rqmetrics.LaunchWindow(10)
+        runFrame = opencue_proto.rqd_pb2.RunFrame(frame_id='frameId')
+        trace = rqd.rqmetrics.LaunchTrace('frameId')
+        trace.mark('checks')
+        trace.mark('reserve')
+        trace.mark('spawn')
+
+        with mock.patch.object(rqd.rqmetrics, 'LAUNCH_WINDOW', window):
+            trace.finish(runFrame)
+            trace.finish(runFrame)
+
+        self.assertEqual('checks=2.0 reserve=1.0 spawn=10.0 total=13.0',
+                         runFrame.attributes['launch_timing_ms'])
+        self.assertEqual({
+            'launch_latency_ms': 'n=1 p50=13.0 p95=13.0 max=13.0',
+            'launch_phase_p95_ms': 'checks=2.0 reserve=1.0 spawn=10.0',
+        }, window.summary())
+
+    def test_windowIsBounded(self):
+        window = rqd.rqmetrics.LaunchWindow(2)
+        self.assertEqual({}, window.summary())
+        for seconds in (0.1, 0.2, 0.3):
+            window.add(seconds, [('spawn', seconds)])
+
+        self.assertEqual('n=2 p50=300.0 p95=300.0 max=300.0',
+                         window.summary()['launch_latency_ms'])
+
+
+class StartupTraceTests(unittest.TestCase):
+    """Tests for rqd.rqmetrics.StartupTrace."""
+
+    def setUp(self):
+        self.now = 1000.0
+        timePatcher = mock.patch('time.time', side_effect=lambda: self.now)
+        timePatcher.start()
+        self.addCleanup(timePatcher.stop)
+
+    def test_finish(self):
+        trace = rqd.rqmetrics.StartupTrace(startTime=999.5)
+        trace.mark('imports')
+        self.now += 0.25
+        trace.mark('machine')
+        self.now += 1.0
+        trace.finish()
+        # Phases after the boot report are not part of the startup
+        self.now += 5.0
+        trace.mark('grpc_server')
+        trace.finish()
+
+        self.assertEqual('imports=0.50 machine=0.25 total=1.75', trace.format())
+        self.assertEqual(1.75, rqd.rqmetrics.STARTUP_SECONDS.get())
+        self.assertEqual(0.25, rqd.rqmetrics.STARTUP_PHASE_SECONDS.get(phase='machine'))
+
+    def test_runInBackground(self):
+        trace = rqd.rqmetrics.StartupTrace()
+        started = threading.Event()
+        release = threading.Event()
+
+        def probe():
+            started.set()
+            release.wait(5)
+            self.now += 2.0
+
+        trace.runInBackground('gpu_probe', probe)
+        self.assertTrue(started.wait(5))
+        trace.mark('grpc_server')
+        release.set()
+        trace.wait()
+
+        self.assertEqual([('grpc_server', 0.0), ('gpu_probe', 2.0)], trace.phases)
+
+    def test_waitRaisesProbeErrors(self):
+        trace = rqd.rqmetrics.StartupTrace()
+
+        def probe():
+            raise ValueError('no images')
+
+        trace.runInBackground('docker_images', probe)
+
+        with self.assertRaises(ValueError):
+            trace.wait()
+        self.assertEqual(['docker_images'], [phase for phase, _ in trace.phases])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqnetwork."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+from concurrent import futures
+import collections
+import inspect
+import threading
+import time
+import unittest
+
+import grpc
+import mock
+
+import opencue_proto.report_pb2
+import opencue_proto.report_pb2_grpc
+import opencue_proto.rqd_pb2
+import opencue_proto.rqd_pb2_grpc
+import rqd.rqconstants
+import rqd.rqdservicers
+import rqd.rqexceptions
+import rqd.rqlogging
+import rqd.rqmetrics
+import rqd.rqnetwork
+
+
+class StandInCuebot(opencue_proto.report_pb2_grpc.RqdReportInterfaceServicer):
+    """Local gRPC stand-in of a cuebot, counting the status reports it receives"""
+
+    def __init__(self, port=0):
+        self.reports = 0
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        opencue_proto.report_pb2_grpc.add_RqdReportInterfaceServicer_to_server(
+            self, self.server)
+        self.port = self.server.add_insecure_port('localhost:%d' % port)
+        self.server.start()
+
+    def ReportStatus(self, request, context):
+        self.reports += 1
+        return opencue_proto.report_pb2.RqdReportStatusResponse()
+
+    def stop(self):
+        self.server.stop(0).wait()
+
+
+def sendStatus(channel):
+    stub = opencue_proto.report_pb2_grpc.RqdReportInterfaceStub(channel)
+    return stub.ReportStatus(opencue_proto.report_pb2.RqdReportStatusRequest(), timeout=5)
+
+
+class UnavailableError(grpc.RpcError):
+    """RpcError of an unreachable cuebot"""
+
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+
+class CuebotChannelManagerTests(unittest.TestCase):
+    """Tests for rqd.rqnetwork.CuebotChannelManager."""
+
+    def test_preferenceOrderSpreadsHosts(self):
+        cuebots = ['cuebot1', 'cuebot2', 'cuebot3']
+        primaries = collections.Counter(
+            rqd.rqnetwork.CuebotChannelManager.preferenceOrder(cuebots, 'host%d' % i)[0]
+            for i in range(3000))
+
+        self.assertEqual(set(cuebots), set(primaries))
+        for count in primaries.values():
+            self.assertGreater(count, 700)
+
+    def test_preferenceOrderIsConsistent(self):
+        hosts = ['host%d' % i for i in range(1000)]
+        before = {host: rqd.rqnetwork.CuebotChannelManager.preferenceOrder(
+            ['cuebot1', 'cuebot2', 'cuebot3'], host)[0] for host in hosts}
+        after = {host: rqd.rqnetwork.CuebotChannelManager.preferenceOrder(
+            ['cuebot1', 'cuebot2'], host)[0] for host in hosts}
+
+        # Only the hosts of the removed cuebot move
+        for host in hosts:
+            if before[host] != 'cuebot3':
+                self.assertEqual(before[host], after[host])
+
+    def test_getAddress(self):
+        manager = rqd.rqnetwork.CuebotChannelManager(['cuebot'], 8443, 'host')
+
+        self.assertEqual('cuebot:8443', manager.getAddress('cuebot'))
+        self.assertEqual('cuebot:1234', manager.getAddress('cuebot:1234'))
+        self.assertEqual('[::1]:8443', manager.getAddress('::1'))
+        self.assertEqual('[::1]:1234', manager.getAddress('[::1]:1234'))
+
+    def test_emptyCuebots(self):
+        with self.assertRaises(rqd.rqexceptions.RqdException):
+            rqd.rqnetwork.CuebotChannelManager([], 8443, 'host')
+
+    @mock.patch.object(rqd.rqconstants, 'CUEBOT_FAILOVER_RETRY_MIN_SEC', 0.5)
+    def test_failoverAndRecovery(self):
+        cuebots = [StandInCuebot(), StandInCuebot()]
+        addresses = ['localhost:%d' % cuebot.port for cuebot in cuebots]
+        manager = rqd.rqnetwork.CuebotChannelManager(addresses, 0, 'host')
+        preferred = cuebots[addresses.index(manager.cuebots[0])]
+        other = cuebots[addresses.index(manager.cuebots[1])]
+        try:
+            manager.call(sendStatus)
+            self.assertEqual((1, 0), (preferred.reports, other.reports))
+
+            # Fail over while the preferred cuebot is down
+            preferred.stop()
+            manager.call(sendStatus)
+            manager.call(sendStatus)
+            self.assertEqual(2, other.reports)
+            self.assertFalse(manager.getHealth(manager.cuebots[0]).isUp())
+
+            # Move back once it recovers
+            preferred = StandInCuebot(preferred.port)
+            time.sleep(0.6)
+            manager.call(sendStatus)
+            self.assertEqual((1, 2), (preferred.reports, other.reports))
+            self.assertEqual(manager.cuebots[0], manager.current)
+        finally:
+            manager.close()
+            preferred.stop()
+            other.stop()
+
+    @mock.patch('grpc.insecure_channel')
+    def test_markDownWaitsForRunningCalls(self, channelMock):
+        channelMock.side_effect = lambda address: mock.MagicMock(name=address)
+        manager = rqd.rqnetwork.CuebotChannelManager(['cuebot1', 'cuebot2'], 8443, 'host')
+        preferred = manager.getChannel(manager.cuebots[0])
+        running = threading.Event()
+        release = threading.Event()
+
+        def slowCall(channel):
+            running.set()
+            release.wait(5)
+            return channel
+
+        def failingCall(channel):
+            if channel is preferred:
+                raise UnavailableError()
+            return channel
+
+        caller = threading.Thread(target=manager.call, args=(slowCall,))
+        caller.start()
+        try:
+            self.assertTrue(running.wait(5))
+            self.assertIsNot(preferred, manager.call(failingCall))
+
+            # No longer handed out, but not closed under the running call
+            self.assertIsNot(preferred, manager.getChannel(manager.cuebots[0]))
+            preferred.close.assert_not_called()
+        finally:
+            release.set()
+            caller.join(5)
+        preferred.close.assert_called_once_with()
+        manager.close()
+
+    def test_allCuebotsDown(self):
+        cuebot = StandInCuebot()
+        address = 'localhost:%d' % cuebot.port
+        cuebot.stop()
+        manager = rqd.rqnetwork.CuebotChannelManager([address, 'localhost:1'], 0, 'host')
+        try:
+            with self.assertRaises(grpc.RpcError):
+                manager.call(sendStatus)
+            self.assertFalse(manager.getHealth(address).isUp())
+        finally:
+            manager.close()
+
+
+class AsyncGrpcServerTests(unittest.TestCase):
+    """Tests for rqd.rqnetwork.AsyncGrpcServer."""
+
+    def setUp(self):
+        for name, value in (('RQD_GRPC_PORT', 0), ('RQD_NETWORK_INTERFACE', None),
+                            ('RQD_GRPC_MAX_WORKERS', 4),
+                            ('RQD_GRPC_METHOD_LIMITS', {'ReportStatus': 1})):
+            patcher = mock.patch.object(rqd.rqconstants, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rqCore = mock.MagicMock()
+        self.server = rqd.rqnetwork.AsyncGrpcServer(self.rqCore)
+        self.server.start()
+        self.channel = grpc.insecure_channel('localhost:%d' % self.server.port)
+        self.stub = opencue_proto.rqd_pb2_grpc.RqdInterfaceStub(self.channel)
+
+    def tearDown(self):
+        self.channel.close()
+        self.server.stop(0)
+
+    def test_allMethodsAreAsync(self):
+        for name, _ in inspect.getmembers(
+                opencue_proto.rqd_pb2_grpc.RqdInterfaceServicer, inspect.isfunction):
+            method = getattr(rqd.rqdservicers.AsyncRqdInterfaceServicer, name)
+            self.assertTrue(inspect.iscoroutinefunction(method)
+                            or inspect.isasyncgenfunction(method), name)
+
+    def test_statusOnEventLoop(self):
+        threads = []
+
+        def getRunningFrame(frameId):
+            threads.append(threading.current_thread().name)
+
+        self.rqCore.getRunningFrame.side_effect = getRunningFrame
+
+        with self.assertRaises(grpc.RpcError) as context:
+            self.stub.GetRunningFrameStatus(
+                opencue_proto.rqd_pb2.RqdStaticGetRunningFrameStatusRequest(frame_id='frame'),
+                timeout=5)
+
+        self.assertEqual(grpc.StatusCode.NOT_FOUND, context.exception.code())
+        self.assertEqual(['RqdGrpcLoop'], threads)
+
+    def test_launchFrameWhileReportsQueue(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def reportStatus():
+            started.set()
+            release.wait(5)
+            return opencue_proto.report_pb2.HostReport()
+
+        self.rqCore.reportStatus.side_effect = reportStatus
+        reports = [self.stub.ReportStatus.future(
+            opencue_proto.rqd_pb2.RqdStaticReportStatusRequest(), timeout=10)
+            for _ in range(3)]
+        try:
+            self.assertTrue(started.wait(5))
+            deadline = time.time() + 5
+            while (rqd.rqmetrics.GRPC_QUEUED_CALLS.get(method='ReportStatus') < 2
+                   and time.time() < deadline):
+                time.sleep(0.01)
+            self.assertEqual(2, rqd.rqmetrics.GRPC_QUEUED_CALLS.get(method='ReportStatus'))
+
+            # The reports waiting on their limit don't hold a worker
+            self.stub.LaunchFrame(opencue_proto.rqd_pb2.RqdStaticLaunchFrameRequest(
+                run_frame=opencue_proto.rqd_pb2.RunFrame(frame_id='frame')), timeout=5)
+            self.rqCore.launchFrame.assert_called()
+        finally:
+            release.set()
+        for report in reports:
+            report.result()
+        self.assertEqual(0, rqd.rqmetrics.GRPC_QUEUED_CALLS.get(method='ReportStatus'))
+
+    def test_launchFrameWhileWorkersBusy(self):
+        release = threading.Event()
+        started = threading.Semaphore(0)
+
+        def getRunningFrame(frameId):
+            started.release()
+            release.wait(30)
+
+        # The kills take all the RQD_GRPC_MAX_WORKERS workers
+        self.rqCore.getRunningFrame.side_effect = getRunningFrame
+        calls = [self.stub.KillRunningFrame.future(
+            opencue_proto.rqd_pb2.RqdStaticKillRunningFrameRequest(frame_id='frame'),
+            timeout=30) for _ in range(4)]
+        try:
+            for _ in range(4):
+                self.assertTrue(started.acquire(timeout=5))
+
+            self.stub.LaunchFrame(opencue_proto.rqd_pb2.RqdStaticLaunchFrameRequest(
+                run_frame=opencue_proto.rqd_pb2.RunFrame(frame_id='frame')), timeout=2)
+            self.rqCore.launchFrame.assert_called()
+        finally:
+            release.set()
+        for call in calls:
+            call.exception()
+
+    def test_abort(self):
+        self.rqCore.launchFrame.side_effect = rqd.rqexceptions.InsufficientMemoryException(
+            'Not launching', 'swapping')
+
+        with self.assertRaises(grpc.RpcError) as context:
+            self.stub.LaunchFrame(opencue_proto.rqd_pb2.RqdStaticLaunchFrameRequest(
+                run_frame=opencue_proto.rqd_pb2.RunFrame(frame_id='frame')), timeout=5)
+
+        self.assertEqual(grpc.StatusCode.RESOURCE_EXHAUSTED, context.exception.code())
+        self.assertIn('swapping', context.exception.details())
+
+    def test_streamFrameLog(self):
+        tail = rqd.rqlogging.LogTail()
+        tail.append(b'line 1\n')
+        tail.append(b'line 2\n')
+        tail.close()
+        self.rqCore.getFrameLog.return_value = (tail, None)
+
+        responses = list(self.stub.StreamFrameLog(
+            opencue_proto.rqd_pb2.RqdStaticStreamFrameLogRequest(frame_id='frame'), timeout=5))
+
+        self.assertEqual(b'line 1\nline 2\n', b''.join(response.data for response in responses))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,9 +21,15 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 
+import ctypes
 import os
+import struct
+import shutil
+import subprocess
 import sys
+import tempfile
 import time
+import unittest
 
 import mock
 import pyfakefs.fake_filesystem_unittest
@@ -190,3 +196,160 @@ class NimbyTest(pyfakefs.fake_filesystem_unittest.TestCase):
 
         # Re-enable pynput mock for other tests
         self.pynput_patch.start()
+
+
+def packEvents(*events):
+    """Packs (<time>, <type>) as struct input_event"""
+    return b"".join(
+        struct.pack(rqd.rqnimby.INPUT_EVENT_FORMAT, int(eventTime),
+                    int((eventTime % 1) * 1000000), eventType, 0, 0)
+        for eventTime, eventType in events)
+
+
+class FakeIdleBackend(rqd.rqnimby.IdleBackend):
+    """Idle backend returning the idle time set by the test"""
+
+    name = "fake"
+    idle = 3600.0
+
+    def get_idle_seconds(self):
+        return self.idle
+
+
+@mock.patch.dict(rqd.rqnimby.IDLE_BACKENDS, {"fake": FakeIdleBackend})
+@mock.patch.object(rqd.rqconstants, "MINIMUM_IDLE", 900)
+class IdleBackendTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests the idle backends polled by rqd.rqnimby.Nimby."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.rqCore = mock.MagicMock()
+        self.rqCore.machine.isNimbySafeToRunJobs.return_value = True
+
+    @mock.patch("time.time")
+    def test_pollingBackendLocksAndUnlocks(self, timeMock):
+        start = timeMock.return_value = 1000000.0
+        with mock.patch.object(rqd.rqconstants, "NIMBY_IDLE_BACKEND", "fake"):
+            nimby = rqd.rqnimby.Nimby(self.rqCore)
+        self.assertTrue(nimby.is_ready)
+        self.assertEqual("fake", nimby.backend.name)
+
+        # Idle since before nimby started
+        timeMock.return_value = start + 5
+        nimby._Nimby__poll_backend()
+        self.assertFalse(nimby.locked)
+
+        timeMock.return_value = start + 60
+        nimby.backend.idle = 2
+        nimby._Nimby__poll_backend()
+        self.assertTrue(nimby.locked)
+        self.rqCore.onNimbyLock.assert_called_once()
+
+        # The unlock counts from the last input the backend saw
+        timeMock.return_value = start + 950
+        nimby.backend.idle = 892
+        nimby._Nimby__poll_backend()
+        nimby._Nimby__check_state()
+        self.assertTrue(nimby.locked)
+        timeMock.return_value = start + 1000
+        nimby.backend.idle = 942
+        nimby._Nimby__poll_backend()
+        nimby._Nimby__check_state()
+        self.assertFalse(nimby.locked)
+        self.rqCore.onNimbyLock.assert_called_once()
+        self.rqCore.onNimbyUnlock.assert_called_once()
+
+    def test_unavailableBackend(self):
+        with mock.patch.object(rqd.rqconstants, "NIMBY_IDLE_BACKEND", "x11"), \
+                mock.patch("ctypes.util.find_library", return_value=None):
+            nimby = rqd.rqnimby.Nimby(self.rqCore)
+
+        self.assertFalse(nimby.is_ready)
+        nimby.run()
+        self.rqCore.onNimbyLock.assert_not_called()
+
+    @mock.patch.dict(os.environ, {"DISPLAY": ":1"})
+    @mock.patch("ctypes.CDLL")
+    @mock.patch("ctypes.util.find_library", new=lambda name: "lib%s.so" % name)
+    def test_x11(self, cdllMock):
+        info = rqd.rqnimby.X11IdleBackend.XScreenSaverInfo()
+
+        def queryInfo(display, root, infoPointer):
+            info.idle = 42500
+            return 1
+
+        cdllMock.return_value.XOpenDisplay.return_value = 1234
+        cdllMock.return_value.XScreenSaverAllocInfo.return_value = ctypes.pointer(info)
+        cdllMock.return_value.XScreenSaverQueryInfo.side_effect = queryInfo
+
+        backend = rqd.rqnimby.X11IdleBackend()
+
+        self.assertEqual(42.5, backend.get_idle_seconds())
+        cdllMock.return_value.XOpenDisplay.assert_called_with(b":1")
+        backend.close()
+        self.assertEqual([ctypes.c_void_p], cdllMock.return_value.XCloseDisplay.argtypes)
+        self.assertEqual([ctypes.c_void_p], cdllMock.return_value.XFree.argtypes)
+        cdllMock.return_value.XCloseDisplay.assert_called_once_with(1234)
+
+    @mock.patch("shutil.which", new=mock.Mock(return_value="/usr/bin/loginctl"))
+    @mock.patch("subprocess.run")
+    def test_logind(self, runMock):
+        idleSince = int((time.time() - 600) * 1000000)
+        runMock.return_value = subprocess.CompletedProcess(
+            [], 0, stdout=b"IdleHint=yes\nIdleSinceHint=%d\n" % idleSince)
+
+        backend = rqd.rqnimby.LogindIdleBackend()
+
+        self.assertAlmostEqual(600, backend.get_idle_seconds(), delta=5)
+        runMock.return_value.stdout = b"IdleHint=no\nIdleSinceHint=0\n"
+        self.assertEqual(0, backend.get_idle_seconds())
+
+    @mock.patch("time.time")
+    def test_devinput(self, timeMock):
+        now = timeMock.return_value = 1000000.0
+        device = os.path.join(rqd.rqconstants.PATH_DEV_INPUT, "event0")
+        self.fs.create_file(device)
+        self.fs.create_file(os.path.join(rqd.rqconstants.PATH_DEV_INPUT, "mice"))
+        backend = rqd.rqnimby.DevInputIdleBackend()
+        self.assertEqual(0, backend.get_idle_seconds())
+
+        # Only key, button and axis events are user inputs
+        with open(device, "ab") as fp:
+            fp.write(packEvents((now + 50, 1), (now + 59, 0)))
+        timeMock.return_value = now + 80
+        self.assertEqual(30, backend.get_idle_seconds())
+
+        # Events queued after the last poll
+        with open(device, "ab") as fp:
+            fp.write(packEvents((now + 75.5, 2)))
+        self.assertEqual(4.5, backend.get_idle_seconds())
+        backend.close()
+
+    def test_devinputWithoutDevices(self):
+        self.fs.create_dir(rqd.rqconstants.PATH_DEV_INPUT)
+
+        with self.assertRaises(OSError):
+            rqd.rqnimby.DevInputIdleBackend()
+
+
+class DevInputPipeTests(unittest.TestCase):
+    """Tests rqd.rqnimby.DevInputIdleBackend with a real non-blocking fd."""
+
+    def setUp(self):
+        self.inputDir = tempfile.mkdtemp()
+        self.device = os.path.join(self.inputDir, "event0")
+        os.mkfifo(self.device)
+        self.addCleanup(shutil.rmtree, self.inputDir)
+
+    def test_readUntilDrained(self):
+        with mock.patch.object(rqd.rqconstants, "PATH_DEV_INPUT", self.inputDir):
+            backend = rqd.rqnimby.DevInputIdleBackend()
+        self.addCleanup(backend.close)
+        # Keeping a writer open makes the drained reads fail with EAGAIN
+        writer = os.open(self.device, os.O_WRONLY)
+        self.addCleanup(os.close, writer)
+
+        now = float(int(time.time()))
+        os.write(writer, packEvents((now + 3600, 1), (now + 3500, 2)))
+        with mock.patch("time.time", return_value=now + 3660):
+            self.assertEqual(60, backend.get_idle_seconds())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqoutbox."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+import pyfakefs.fake_filesystem_unittest
+
+import opencue_proto.report_pb2
+import rqd.rqconstants
+import rqd.rqmetrics
+import rqd.rqoutbox
+
+
+OUTBOX_PATH = '/tmp/rqd/cache.dat.outbox'
+
+
+def makeReport(frameId, exitStatus=0):
+    return opencue_proto.report_pb2.FrameCompleteReport(
+        frame=opencue_proto.report_pb2.RunningFrameInfo(frame_id=frameId, job_name='job'),
+        exit_status=exitStatus)
+
+
+class ReportOutboxTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests for rqd.rqoutbox.ReportOutbox."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        os.makedirs(os.path.dirname(OUTBOX_PATH))
+
+    def test_dedupeByFrameId(self):
+        outbox = rqd.rqoutbox.ReportOutbox()
+        outbox.add(makeReport('frame1', exitStatus=1))
+        outbox.add(makeReport('frame1', exitStatus=2))
+        sent = []
+
+        self.assertTrue(outbox.flush(sent.append))
+        self.assertEqual([makeReport('frame1', exitStatus=2)], sent)
+        self.assertEqual(0, len(outbox))
+        self.assertEqual(0, rqd.rqmetrics.OUTBOX_REPORTS.get())
+
+    def test_oldestReportsAreDropped(self):
+        outbox = rqd.rqoutbox.ReportOutbox(maxReports=2)
+        dropped = rqd.rqmetrics.OUTBOX_DROPPED.get()
+        for frameId in ('frame1', 'frame2', 'frame3'):
+            outbox.add(makeReport(frameId))
+        sent = []
+        outbox.flush(sent.append)
+
+        self.assertEqual([makeReport('frame2'), makeReport('frame3')], sent)
+        self.assertEqual(dropped + 1, rqd.rqmetrics.OUTBOX_DROPPED.get())
+
+    def test_reportsSurviveRestart(self):
+        outbox = rqd.rqoutbox.ReportOutbox(OUTBOX_PATH)
+        outbox.add(makeReport('frame1'))
+        outbox.add(makeReport('frame2'))
+        outbox.flush(mock.Mock(side_effect=[None, RuntimeError('cuebot is down')]))
+        outbox.stop()
+
+        sent = []
+        rqd.rqoutbox.ReportOutbox(OUTBOX_PATH).flush(sent.append)
+        self.assertEqual([makeReport('frame2')], sent)
+
+    @mock.patch.object(rqd.rqconstants, 'RQD_OUTBOX_BATCH_SIZE', 2)
+    def test_flushIsBatched(self):
+        outbox = rqd.rqoutbox.ReportOutbox()
+        for frameId in ('frame1', 'frame2', 'frame3'):
+            outbox.add(makeReport(frameId))
+        send = mock.Mock()
+
+        outbox.flush(send)
+
+        self.assertEqual(2, send.call_count)
+        self.assertEqual(1, len(outbox))
+
+    @mock.patch.object(rqd.rqconstants, 'RQD_OUTBOX_RETRY_MIN_SEC', 1)
+    @mock.patch.object(rqd.rqconstants, 'RQD_OUTBOX_RETRY_MAX_SEC', 5)
+    @mock.patch('random.uniform', new=mock.Mock(return_value=1))
+    @mock.patch('time.time', new=mock.Mock(return_value=1000))
+    def test_backoff(self):
+        outbox = rqd.rqoutbox.ReportOutbox()
+        outbox.add(makeReport('frame1'))
+        send = mock.Mock(side_effect=RuntimeError('cuebot is down'))
+
+        delays = []
+        for _ in range(5):
+            self.assertFalse(outbox.flush(send))
+            # pylint: disable=protected-access
+            delays.append(outbox._ReportOutbox__nextAttempt - 1000)
+
+        self.assertEqual([1, 2, 4, 5, 5], delays)
+        self.assertEqual(1, len(outbox))
+
+    def test_replayTimesExit(self):
+        outbox = rqd.rqoutbox.ReportOutbox()
+        outbox.add(makeReport('frame1'), exitTime=1000)
+        observed = rqd.rqmetrics.FRAME_EXIT_REPORT_SECONDS.getCount()
+
+        outbox.flush(mock.Mock())
+
+        self.assertEqual(observed + 1, rqd.rqmetrics.FRAME_EXIT_REPORT_SECONDS.getCount())
+
+
+@mock.patch.object(rqd.rqconstants, 'RQD_REPORT_SEND_ATTEMPTS', 3)
+@mock.patch.object(rqd.rqconstants, 'RQD_REPORT_RETRY_SEC', 0)
+class ReportSenderTests(unittest.TestCase):
+    """Tests for rqd.rqoutbox.ReportSender."""
+
+    def test_sendsInOrder(self):
+        sent = []
+        sender = rqd.rqoutbox.ReportSender(sent.append, rqd.rqoutbox.ReportOutbox())
+        for frameId in ('frame1', 'frame2', 'frame3'):
+            sender.submit(makeReport(frameId))
+
+        self.assertTrue(sender.waitIdle(5))
+        self.assertEqual(['frame1', 'frame2', 'frame3'],
+                         [report.frame.frame_id for report in sent])
+        self.assertEqual(0, len(sender))
+
+    def test_failedReportGoesToOutbox(self):
+        outbox = rqd.rqoutbox.ReportOutbox()
+        send = mock.Mock(side_effect=RuntimeError('cuebot is down'))
+        sender = rqd.rqoutbox.ReportSender(send, outbox)
+
+        sender.submit(makeReport('frame1'))
+        self.assertTrue(sender.waitIdle(5))
+        self.assertEqual(3, send.call_count)
+        self.assertEqual(1, len(outbox))
+
+        # Queued behind the backlog without trying cuebot
+        sender.submit(makeReport('frame2'))
+        self.assertTrue(sender.waitIdle(5))
+        self.assertEqual(3, send.call_count)
+        self.assertEqual(2, len(outbox))
+
+    def test_reportIsJournaledBeforeSending(self):
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        path = os.path.join(tempDir, 'cache.dat.outbox')
+        outbox = rqd.rqoutbox.ReportOutbox(path)
+        journaled = []
+
+        def send(report):
+            with open(path, 'rb') as journalFile:
+                journaled.append(report.SerializeToString() in journalFile.read())
+            # Held by the sender, not replayed meanwhile
+            self.assertFalse(outbox.isBacklogged())
+
+        sender = rqd.rqoutbox.ReportSender(send, outbox)
+        sender.submit(makeReport('frame1'))
+
+        self.assertTrue(sender.waitIdle(5))
+        self.assertEqual([True], journaled)
+        self.assertEqual(0, len(outbox))
+        outbox.stop()
+        self.assertEqual([], list(rqd.rqoutbox.ReportJournal(path).replay()))
+
+    def test_stopDoesNotWaitOnCuebot(self):
+        outbox = rqd.rqoutbox.ReportOutbox()
+        release = threading.Event()
+        sending = threading.Event()
+
+        def send(report):
+            sending.set()
+            release.wait(10)
+
+        sender = rqd.rqoutbox.ReportSender(send, outbox)
+        sender.submit(makeReport('frame1'))
+        sender.submit(makeReport('frame2'))
+        self.assertTrue(sending.wait(5))
+        try:
+            sender.stop(0.1)
+
+            # The report being sent stays held, the other one is left to the replays
+            self.assertEqual(2, len(outbox))
+            sent = []
+            outbox.flush(sent.append)
+            self.assertEqual(['frame2'], [report.frame.frame_id for report in sent])
+        finally:
+            release.set()
+        self.assertTrue(sender.waitIdle(5))
+        self.assertEqual(0, len(outbox))
+
+    def test_stopLeavesPendingReportsToOutbox(self):
+        outbox = rqd.rqoutbox.ReportOutbox()
+        sender = rqd.rqoutbox.ReportSender(mock.Mock(), outbox)
+        sender.stop()
+
+        sender.submit(makeReport('frame1'))
+
+        self.assertEqual(0, len(sender))
+        self.assertEqual(1, len(outbox))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqsampler."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import resource
+import unittest
+
+import mock
+import pyfakefs.fake_filesystem_unittest
+
+import opencue_proto.rqd_pb2
+import rqd.rqconstants
+import rqd.rqnetwork
+import rqd.rqsampler
+
+
+PAGE_KB = resource.getpagesize() // 1024
+GB = 1024 * 1024
+
+
+@mock.patch.object(rqd.rqconstants, "RSS_UPDATE_INTERVAL", 10)
+@mock.patch.object(rqd.rqconstants, "RSS_SAMPLE_MIN_INTERVAL_SEC", 1)
+@mock.patch.object(rqd.rqconstants, "RSS_SAMPLE_CPU_BUDGET", 0.01)
+class RssSamplerTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests for rqd.rqsampler.RssSampler."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.now = 1000.0
+        timePatcher = mock.patch("time.time", side_effect=lambda: self.now)
+        timePatcher.start()
+        self.addCleanup(timePatcher.stop)
+        self.sampler = rqd.rqsampler.RssSampler()
+
+    def makeFrame(self, rss, hardLimit=0):
+        runFrame = opencue_proto.rqd_pb2.RunFrame(
+            frame_id="frame-id", hard_memory_limit=hardLimit)
+        frame = rqd.rqnetwork.RunningFrame(mock.MagicMock(), runFrame)
+        frame.pids = ["100", "101"]
+        frame.rss = frame.maxRss = rss
+        self.setRss(rss)
+        return frame
+
+    def setRss(self, rss):
+        contents = "1000 %d 0 0 0 0 0" % (rss // PAGE_KB // 2)
+        for pid in ("100", "101"):
+            path = rqd.rqconstants.PATH_PROC_PID_STATM.format(pid)
+            if self.fs.exists(path):
+                self.fs.get_object(path).set_contents(contents)
+            else:
+                self.fs.create_file(path, contents=contents)
+
+    def update(self, frames, rss, elapsed, cpuSeconds=0.0):
+        self.now += elapsed
+        for frame in frames.values():
+            frame.rss = rss
+        self.setRss(rss)
+        self.sampler.recordUpdate(frames, cpuSeconds, availableMemory=64 * GB)
+
+    def test_readRss(self):
+        frame = self.makeFrame(2 * GB)
+
+        self.assertEqual(2 * GB, self.sampler.readRss(frame.pids))
+        self.assertEqual(2 * GB, self.sampler.readRss(frame.pids + ["102"]))
+        self.assertIsNone(self.sampler.readRss(["102"]))
+
+    def test_stableFrameIsLeftToUpdates(self):
+        frames = {"frame-id": self.makeFrame(2 * GB, hardLimit=8 * GB)}
+        self.update(frames, 2 * GB, 0)
+        self.update(frames, 2 * GB, 10)
+
+        self.assertEqual(10, self.sampler.getInterval("frame-id"))
+        self.now += 5
+        self.assertEqual(0, self.sampler.sample(frames, availableMemory=64 * GB))
+
+    def test_growingFrameIsSampledFaster(self):
+        frame = self.makeFrame(2 * GB, hardLimit=8 * GB)
+        frames = {"frame-id": frame}
+        self.update(frames, 2 * GB, 0)
+        # 4GB of headroom left, growing 200MB/s
+        self.update(frames, 4 * GB, 10)
+
+        interval = self.sampler.getInterval("frame-id")
+        self.assertLess(interval, 10)
+        self.assertGreaterEqual(interval, 1)
+
+        # A peak in between updates makes it to maxRss
+        self.now += interval
+        self.setRss(6 * GB)
+        self.assertEqual(1, self.sampler.sample(frames, availableMemory=64 * GB))
+        self.assertEqual(6 * GB, frame.rss)
+        self.assertEqual(6 * GB, frame.maxRss)
+        self.assertLessEqual(self.sampler.getInterval("frame-id"), interval)
+
+    def test_frameCloseToHostMemoryGetsShortestInterval(self):
+        frames = {"frame-id": self.makeFrame(20 * GB)}
+        self.sampler.recordUpdate(frames, 0.0, availableMemory=GB)
+
+        self.assertEqual(1, self.sampler.getInterval("frame-id"))
+
+    def test_backsOffGradually(self):
+        frames = {"frame-id": self.makeFrame(2 * GB, hardLimit=16 * GB)}
+        self.update(frames, 2 * GB, 0)
+        # 9GB of headroom left, growing 512MB/s
+        self.update(frames, 7 * GB, 10)
+        self.assertEqual(4.5, self.sampler.getInterval("frame-id"))
+
+        # Stable again, the interval doubles up to the update interval
+        self.update(frames, 7 * GB, 1)
+        self.assertEqual(9, self.sampler.getInterval("frame-id"))
+        self.update(frames, 7 * GB, 1)
+        self.assertEqual(10, self.sampler.getInterval("frame-id"))
+
+    def test_cpuBudgetStretchesIntervals(self):
+        frames = {"frame-id": self.makeFrame(15 * GB, hardLimit=16 * GB)}
+        self.update(frames, 15 * GB, 0)
+        self.assertEqual(1, self.sampler.getInterval("frame-id"))
+
+        # Full updates taking all of the budget leave no room for samples
+        self.update(frames, 15 * GB, 1, cpuSeconds=1.0)
+        self.now += 5
+        self.assertEqual(0, self.sampler.sample(frames, availableMemory=64 * GB))
+        self.assertGreater(self.sampler.getCpuRatio(), 0.01)
+
+    def test_forgetsCompletedFrames(self):
+        frames = {"frame-id": self.makeFrame(2 * GB)}
+        self.update(frames, 2 * GB, 0)
+        self.update({}, 0, 10)
+
+        self.assertIsNone(self.sampler.getInterval("frame-id"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqscheduler."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+import rqd.rqmetrics
+import rqd.rqscheduler
+
+
+class SchedulerTests(unittest.TestCase):
+    """Tests for rqd.rqscheduler.Scheduler."""
+
+    def setUp(self):
+        self.scheduler = rqd.rqscheduler.Scheduler()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_runsPeriodically(self):
+        calls = []
+        self.scheduler.schedule("count", lambda: calls.append(time.time()), 0.05, delay=0)
+        self.scheduler.start()
+        time.sleep(0.27)
+        self.scheduler.stop()
+
+        self.assertGreaterEqual(len(calls), 4)
+        self.assertLessEqual(len(calls), 7)
+        # Runs keep to the plan instead of drifting
+        self.assertAlmostEqual(calls[-1] - calls[0], 0.05 * (len(calls) - 1), delta=0.04)
+
+    def test_slowTaskSkipsRuns(self):
+        self.scheduler.schedule("slow", lambda: time.sleep(0.12), 0.05, delay=0)
+        self.scheduler.start()
+        time.sleep(0.2)
+        self.scheduler.stop()
+
+        task = self.scheduler.getTask("slow")
+        self.assertGreaterEqual(task.skipped, 2)
+        self.assertGreaterEqual(task.lastDuration, 0.12)
+        self.assertGreaterEqual(
+            rqd.rqmetrics.SCHEDULER_SKIPPED_RUNS.get(task="slow"), task.skipped)
+
+    def test_runSoon(self):
+        ran = threading.Event()
+        self.scheduler.schedule("ping", ran.set, 60)
+        self.scheduler.start()
+        self.assertGreater(self.scheduler.timeUntil("ping"), 50)
+
+        self.scheduler.runSoon("ping")
+
+        self.assertTrue(ran.wait(1))
+        # The following runs are planned from the early one
+        time.sleep(0.05)
+        self.assertGreater(self.scheduler.timeUntil("ping"), 50)
+
+    def test_cancel(self):
+        calls = []
+        self.scheduler.schedule("count", lambda: calls.append(1), 0.02, delay=0)
+        self.scheduler.start()
+        time.sleep(0.05)
+        self.scheduler.cancel("count")
+        count = len(calls)
+        time.sleep(0.06)
+
+        self.assertEqual(count, len(calls))
+        self.assertIsNone(self.scheduler.getTask("count"))
+        self.assertIsNone(self.scheduler.timeUntil("count"))
+
+    def test_failingTaskKeepsRunning(self):
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise ValueError("failed")
+
+        failures = rqd.rqmetrics.SCHEDULER_TASK_FAILURES.get(task="fail")
+        self.scheduler.schedule("fail", fail, 0.02, delay=0)
+        self.scheduler.start()
+        time.sleep(0.07)
+        self.scheduler.stop()
+
+        self.assertGreaterEqual(len(calls), 2)
+        self.assertEqual(
+            failures + len(calls), rqd.rqmetrics.SCHEDULER_TASK_FAILURES.get(task="fail"))
+
+    def test_callableInterval(self):
+        intervals = iter([0.01, 0.01, 60])
+        calls = []
+        self.scheduler.schedule("ping", lambda: calls.append(1), lambda: next(intervals), delay=0)
+        self.scheduler.start()
+        time.sleep(0.1)
+
+        self.assertEqual(3, len(calls))
+        self.assertGreater(self.scheduler.timeUntil("ping"), 50)
+
+    def test_blockingTaskRunsOnItsOwnThread(self):
+        hung = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def ping():
+            hung.set()
+            release.wait(5)
+
+        self.scheduler.schedule("ping", ping, 0.01, delay=0, blocking=True)
+        self.scheduler.schedule("rss", lambda: calls.append(1), 0.02, delay=0)
+        self.scheduler.start()
+        self.assertTrue(hung.wait(1))
+        time.sleep(0.1)
+
+        # The other tasks keep running, and the blocked task doesn't overlap itself
+        self.assertGreaterEqual(len(calls), 3)
+        self.assertEqual(0, self.scheduler.getTask("ping").runs)
+        release.set()
+        time.sleep(0.05)
+        self.assertGreaterEqual(self.scheduler.getTask("ping").runs, 1)
+
+    def test_runSoonWhileRunning(self):
+        running = threading.Event()
+        release = threading.Event()
+        lock = threading.Lock()
+        state = {"running": 0, "overlaps": 0}
+        threads = set()
+
+        def ping():
+            with lock:
+                state["running"] += 1
+                if state["running"] > 1:
+                    state["overlaps"] += 1
+            threads.add(threading.current_thread().ident)
+            running.set()
+            release.wait(5)
+            with lock:
+                state["running"] -= 1
+
+        self.scheduler.schedule("ping", ping, 60, delay=0, blocking=True)
+        self.scheduler.start()
+        self.assertTrue(running.wait(1))
+        running.clear()
+        for _ in range(3):
+            self.scheduler.runSoon("ping")
+        time.sleep(0.05)
+        self.assertEqual(1, state["running"])
+
+        # Runs once more after the current run, on the same worker thread
+        release.set()
+        self.assertTrue(running.wait(1))
+        time.sleep(0.05)
+        self.assertEqual(2, self.scheduler.getTask("ping").runs)
+        self.assertEqual(0, state["overlaps"])
+        self.assertEqual(1, len(threads))
+        self.assertGreater(self.scheduler.timeUntil("ping"), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqspawn."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import os
+import platform
+import select
+import signal
+import time
+import unittest
+
+import rqd.rqspawn
+
+
+@unittest.skipUnless(platform.system() == "Linux", "The spawn helper needs Linux")
+class SpawnHelperTests(unittest.TestCase):
+    """Tests for rqd.rqspawn.SpawnHelper, with a real helper process."""
+
+    def setUp(self):
+        self.helper = rqd.rqspawn.SpawnHelper()
+        self.helper.start()
+
+    def tearDown(self):
+        self.helper.stop()
+
+    def test_spawn(self):
+        process = self.helper.spawn(
+            ["/bin/sh", "-c", "echo $VALUE; pwd; echo error >&2; exit 3"],
+            env={"VALUE": "value", "PATH": "/bin:/usr/bin"}, cwd="/")
+
+        self.assertEqual(b"value\n/\n", process.stdout.read())
+        self.assertEqual(b"error\n", process.stderr.read())
+        self.assertEqual(3, process.wait(10))
+        self.assertEqual(3, process.poll())
+
+    def test_spawnInNewSession(self):
+        process = self.helper.spawn(["/bin/sleep", "30"])
+
+        self.assertEqual(process.pid, os.getsid(process.pid))
+        process.kill()
+        self.assertEqual(-signal.SIGKILL, process.wait(10))
+
+    def test_spawnWithCpus(self):
+        cpu = sorted(os.sched_getaffinity(0))[0]
+        process = self.helper.spawn(["/bin/cat", "/proc/self/status"], cpus=[cpu])
+
+        status = process.stdout.read().decode("utf-8")
+        process.wait(10)
+        self.assertIn("Cpus_allowed_list:\t%d\n" % cpu, status)
+
+    def test_spawnMissingCommand(self):
+        with self.assertRaises(FileNotFoundError):
+            self.helper.spawn(["/nonexistent/command"])
+        self.assertTrue(self.helper.isAlive())
+
+    def test_spawnTimeout(self):
+        # pylint: disable=protected-access
+        helperPid = self.helper._SpawnHelper__process.pid
+        os.kill(helperPid, signal.SIGSTOP)
+        try:
+            with self.assertRaises(rqd.rqspawn.SpawnHelperError):
+                self.helper.spawn(["/bin/sleep", "30"], timeout=0.5)
+        finally:
+            os.kill(helperPid, signal.SIGCONT)
+
+        # Launched once the helper resumes, then killed since rqd forked the frame
+        exited = self.helper._SpawnHelper__exited
+        deadline = time.time() + 10
+        while not exited and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual([-signal.SIGKILL], list(exited.values()))
+        self.assertTrue(self.helper.isAlive())
+
+    def test_malformedRequest(self):
+        readFd, writeFd = os.pipe()
+        try:
+            # pylint: disable=protected-access
+            rqd.rqspawn._sendMessage(self.helper._SpawnHelper__sock, [], [writeFd])
+            self.helper._SpawnHelper__sock.sendmsg([b"not json"])
+            os.close(writeFd)
+            writeFd = None
+
+            # The helper closed the fd it received
+            self.assertTrue(select.select([readFd], [], [], 10)[0])
+            self.assertEqual(b"", os.read(readFd, 1))
+        finally:
+            os.close(readFd)
+            if writeFd is not None:
+                os.close(writeFd)
+
+        self.assertTrue(self.helper.isAlive())
+        process = self.helper.spawn(["/bin/true"])
+        self.assertEqual(0, process.wait(10))
+
+    def test_spawnAfterStop(self):
+        self.helper.stop()
+
+        self.assertFalse(self.helper.isAlive())
+        with self.assertRaises(rqd.rqspawn.SpawnHelperError):
+            self.helper.spawn(["/bin/true"])
+
+
+if __name__ == '__main__':
+    unittest.main()
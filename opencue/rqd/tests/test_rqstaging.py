@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqstaging."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import os
+import unittest
+
+import mock
+import pyfakefs.fake_filesystem_unittest
+
+import rqd.rqconstants
+import rqd.rqstaging
+
+
+STAGING_PATH = '/dev/shm/rqd'
+
+MOUNTS = """/dev/sda1 / ext4 rw,relatime 0 0
+tmpfs /dev/shm tmpfs rw,nosuid,nodev 0 0
+nfs:/export /net/render\\040farm nfs4 rw 0 0
+"""
+
+
+@mock.patch('platform.system', new=mock.MagicMock(return_value='Linux'))
+@mock.patch('rqd.rqutil.permissionsHigh', new=mock.MagicMock())
+@mock.patch('rqd.rqutil.permissionsLow', new=mock.MagicMock())
+@mock.patch.object(rqd.rqconstants, 'RQD_BECOME_JOB_USER', False)
+class StagingAreaTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests for rqd.rqstaging.StagingArea."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+        self.fs.create_file(rqd.rqconstants.PATH_MOUNTS, contents=MOUNTS)
+        self.staging = rqd.rqstaging.StagingArea(STAGING_PATH)
+
+    def test_getFilesystemType(self):
+        self.fs.create_dir('/net/render farm/shots')
+
+        self.assertEqual('tmpfs', rqd.rqstaging.getFilesystemType(STAGING_PATH))
+        self.assertEqual('ext4', rqd.rqstaging.getFilesystemType('/tmp'))
+        self.assertEqual('nfs4', rqd.rqstaging.getFilesystemType('/net/render farm/shots'))
+
+    def test_disabledWithoutPath(self):
+        staging = rqd.rqstaging.StagingArea('')
+
+        self.assertFalse(staging.setup())
+        self.assertIsNone(staging.createFrameDir('frame-id'))
+
+    def test_createFrameDir(self):
+        self.assertTrue(self.staging.setup())
+
+        frameDir = self.staging.createFrameDir('frame-id')
+
+        self.assertTrue(os.path.isdir(frameDir))
+        self.assertEqual(STAGING_PATH, os.path.dirname(frameDir))
+        self.assertEqual(frameDir, self.staging.getFrameDir(
+            os.path.join(frameDir, 'rqd-stat-frame-id')))
+        self.assertIsNone(self.staging.getFrameDir('/tmp/rqd-stat-frame-id'))
+
+    def test_purgeIsBatched(self):
+        self.staging.setup()
+        frameDirs = []
+        for frameId in ('frame1', 'frame2', 'frame3'):
+            frameDir = self.staging.createFrameDir(frameId)
+            self.fs.create_file(os.path.join(frameDir, 'rqd-cmd-%s' % frameId))
+            self.staging.release(frameDir)
+            frameDirs.append(frameDir)
+
+        self.assertEqual(2, self.staging.purge(batchSize=2))
+        self.assertEqual(1, len(self.staging))
+        self.assertFalse(os.path.exists(frameDirs[0]))
+        self.assertTrue(os.path.exists(frameDirs[2]))
+
+        self.assertEqual(1, self.staging.purge(batchSize=2))
+        self.assertEqual([], os.listdir(STAGING_PATH))
+
+    def test_sweepKeepsRecoveredFrames(self):
+        self.fs.create_dir(os.path.join(STAGING_PATH, 'recovered-frame-1568070634.3'))
+        self.fs.create_dir(os.path.join(STAGING_PATH, 'crashed-frame-1568070634.3'))
+        self.fs.create_file(os.path.join(STAGING_PATH, 'stray-file'))
+        self.staging.setup()
+
+        self.assertEqual(2, self.staging.sweep(['recovered-frame']))
+        self.assertEqual(2, self.staging.purge())
+
+        self.assertEqual(['recovered-frame-1568070634.3'], os.listdir(STAGING_PATH))
+
+
+if __name__ == '__main__':
+    unittest.main()
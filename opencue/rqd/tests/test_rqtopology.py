@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#  Copyright Contributors to the OpenCue Project
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+"""Tests for rqd.rqtopology."""
+
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import unittest
+
+import pyfakefs.fake_filesystem_unittest
+
+import rqd.rqtopology
+
+
+def makeHost(sockets=2, nodesPerSocket=2, l3PerNode=2, coresPerL3=4):
+    """Builds the cpuinfo mapping and the sysfs NUMA/L3 layout of a host with
+    2 hyper-threads per core"""
+    procsByPhysidAndCoreid = {}
+    nodeByProc = {}
+    l3ByProc = {}
+    coresPerSocket = nodesPerSocket * l3PerNode * coresPerL3
+    totalCores = sockets * coresPerSocket
+    for core in range(totalCores):
+        physid, coreid = divmod(core, coresPerSocket)
+        procs = {str(core), str(core + totalCores)}
+        procsByPhysidAndCoreid.setdefault(str(physid), {})[str(coreid)] = procs
+        for proc in procs:
+            nodeByProc[proc] = core // (l3PerNode * coresPerL3)
+            l3ByProc[proc] = 'l3-%d' % (core // coresPerL3)
+    return procsByPhysidAndCoreid, nodeByProc, l3ByProc
+
+
+class LegacyAllocator(rqd.rqtopology.CoreAllocator):
+    """The former reserveHT policy: cores of the socket with the most idle cores first"""
+
+    def reserve(self, count):
+        if self.freeCount() < count:
+            return None
+        idleBySocket = {}
+        for core, (physid, _) in enumerate(self.topology.cores):
+            if self.free >> core & 1:
+                idleBySocket.setdefault(physid, []).append(core)
+        mask = 0
+        for cores in sorted(idleBySocket.values(), key=len, reverse=True):
+            while count and cores:
+                mask |= 1 << cores.pop()
+                count -= 1
+        self.free &= ~mask
+        return mask
+
+
+class CpuTopologyTests(pyfakefs.fake_filesystem_unittest.TestCase):
+    """Tests for rqd.rqtopology.CpuTopology."""
+
+    def setUp(self):
+        self.setUpPyfakefs()
+
+    def test_parseCpuList(self):
+        self.assertEqual([0, 1, 2, 3, 8, 10, 11], rqd.rqtopology.parseCpuList('0-3,8,10-11\n'))
+
+    def test_discover(self):
+        procs, _, _ = makeHost(sockets=1, nodesPerSocket=2, l3PerNode=1, coresPerL3=2)
+        self.fs.create_file('/sys/devices/system/node/node0/cpulist', contents='0-1,4-5\n')
+        self.fs.create_file('/sys/devices/system/node/node1/cpulist', contents='2-3,6-7\n')
+        self.fs.create_file('/sys/devices/system/node/possible', contents='0-1\n')
+        for proc in range(8):
+            cache = '/sys/devices/system/cpu/cpu%d/cache/' % proc
+            self.fs.create_file(cache + 'index2/level', contents='2\n')
+            self.fs.create_file(cache + 'index2/shared_cpu_list', contents='%d\n' % proc)
+            self.fs.create_file(cache + 'index3/level', contents='3\n')
+            self.fs.create_file(cache + 'index3/shared_cpu_list',
+                                contents='0-1,4-5\n' if proc % 4 < 2 else '2-3,6-7\n')
+
+        topology = rqd.rqtopology.CpuTopology.discover(procs)
+
+        self.assertTrue(topology.isNuma())
+        self.assertEqual({0: 0b0011, 1: 0b1100}, topology.nodeMasks)
+        self.assertEqual([0b0011, 0b1100], sorted(topology.l3Masks.values()))
+        self.assertEqual(['2', '6', '3', '7'], topology.getProcs(0b1100))
+        self.assertEqual([1], topology.getNodes(topology.getMask(['6', '3'])))
+
+    def test_discoverWithoutSysfs(self):
+        procs, _, _ = makeHost(sockets=2, nodesPerSocket=1, l3PerNode=1, coresPerL3=2)
+
+        topology = rqd.rqtopology.CpuTopology.discover(procs)
+
+        # Sockets stand for NUMA nodes and L3 domains
+        self.assertEqual({0: 0b0011, 1: 0b1100}, topology.nodeMasks)
+        self.assertEqual(2, len(topology.l3Masks))
+
+
+class CoreAllocatorTests(unittest.TestCase):
+    """Tests for rqd.rqtopology.CoreAllocator."""
+
+    def setUp(self):
+        self.topology = rqd.rqtopology.CpuTopology(*makeHost())
+        self.allocator = rqd.rqtopology.CoreAllocator(self.topology)
+
+    def l3Count(self, mask):
+        return sum(1 for l3Mask in self.topology.l3Masks.values() if l3Mask & mask)
+
+    def test_packsInL3Domain(self):
+        mask = self.allocator.reserve(3)
+
+        self.assertEqual(3, rqd.rqtopology.bitCount(mask))
+        self.assertEqual(1, self.l3Count(mask))
+
+    def test_bestFit(self):
+        first = self.allocator.reserve(3)
+        # The single core left next to the first frame is the best fit
+        second = self.allocator.reserve(1)
+
+        self.assertEqual(1, self.l3Count(first | second))
+
+    def test_packsInNode(self):
+        mask = self.allocator.reserve(8)
+
+        self.assertEqual(1, len(self.topology.getNodes(mask)))
+        self.assertEqual(2, self.l3Count(mask))
+
+    def test_spansFewestNodes(self):
+        self.allocator.reserve(6)
+        mask = self.allocator.reserve(12)
+
+        self.assertEqual(12, rqd.rqtopology.bitCount(mask))
+        self.assertEqual(2, len(self.topology.getNodes(mask)))
+
+    def test_insufficientCores(self):
+        self.allocator.reserve(30)
+
+        self.assertIsNone(self.allocator.reserve(3))
+        self.assertEqual(2, self.allocator.freeCount())
+
+    def test_release(self):
+        mask = self.allocator.reserve(32)
+        self.allocator.release(mask)
+
+        self.assertEqual(32, self.allocator.freeCount())
+
+    def test_simulateFragmentation(self):
+        legacy = rqd.rqtopology.simulateFragmentation(
+            self.topology, iterations=5000, allocatorClass=LegacyAllocator)
+        packed = rqd.rqtopology.simulateFragmentation(self.topology, iterations=5000)
+
+        self.assertLess(packed['nodes_per_frame'], legacy['nodes_per_frame'])
+        self.assertLess(packed['l3_per_frame'], legacy['l3_per_frame'])
+        self.assertEqual(0, packed['avoidable_spanning_pct'])
+
+
+if __name__ == '__main__':
+    unittest.main()